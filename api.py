@@ -1,48 +1,425 @@
-from flask import Flask, request, jsonify, send_file
-import pyautogui
+from flask import Flask, Response, g, request, jsonify, send_file
+from flask_sock import Sock
+import atexit
+import base64
+import json
+import math
+import threading
 import time
 import os
 
-# Disable PyAutoGUI fail-safe for Docker container usage
-# The fail-safe is designed to prevent runaway automation on desktops
-# but is counterproductive in a controlled container environment
-pyautogui.FAILSAFE = False
+from capture import CaptureEngine, Frame
+from snapshot_encoding import EncodedFrameCache, SnapshotParams, apply_view
+from frame_stream import dirty_rects, encode_delta, mjpeg_part
+from change_detection import ChangeDetector, parse_change_args
+from frame_history import CLIP_FORMATS, FrameHistory, encode_clip
+from frame_analysis import (
+    DEFAULT_MATCH_THRESHOLD, MAX_REGIONS, TemplateStore, match_template, parse_match_args, parse_region, read_pixels,
+    region_stats
+)
+from input_backends import UnknownKeyError, create_backend
+from input_scheduler import InputScheduler
+from input_actions import (
+    SHORT_PRESS_MS, ActionError, click_action, drag_action, key_action,
+    move_action, plan_batch, run_batch
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, Registry
+from profiler import SamplingProfiler
+from displays import (
+    DISPLAY_HEADER, PATH_PREFIX, DisplayPathMiddleware, display_count, vnc_port, x_display
+)
 
 app = Flask(__name__)
+# /displays/<k>/... addresses display k (see displays.py)
+app.wsgi_app = DisplayPathMiddleware(app.wsgi_app)
+sock = Sock(app)
 
 # Configuration for desktop snapshots
 SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '/tmp/desktop_snapshot.png')
 
+# Capture mode: 'memory' grabs frames inside this process, 'file' serves the
+# PNG written by snapshot-service.sh
+CAPTURE_MODE = os.environ.get('CAPTURE_MODE', 'memory').lower()
+SNAPSHOT_INTERVAL_MS = int(os.environ.get('SNAPSHOT_INTERVAL_MS', '500'))
+# X displays served by this process (DISPLAYS, see displays.py)
+DISPLAY_COUNT = display_count()
+if DISPLAY_COUNT > 1 and CAPTURE_MODE == 'file':
+    # SNAPSHOT_PATH holds one display; capture every display in memory instead
+    print(f"CAPTURE_MODE=file supports one display; using memory mode for {DISPLAY_COUNT} displays")
+    CAPTURE_MODE = 'memory'
+# Demand-driven capture rate (memory mode): SNAPSHOT_INTERVAL_MS while clients
+# request frames, CAPTURE_ACTIVE_INTERVAL_MS while streams and long-polls are
+# attached, CAPTURE_IDLE_INTERVAL_MS once nothing was requested for
+# CAPTURE_IDLE_TIMEOUT_S. CAPTURE_ADAPTIVE=false captures at a fixed rate.
+CAPTURE_ADAPTIVE = os.environ.get('CAPTURE_ADAPTIVE', 'true').lower() in ('1', 'true', 'yes')
+CAPTURE_ACTIVE_INTERVAL_MS = int(os.environ.get('CAPTURE_ACTIVE_INTERVAL_MS', '100'))
+CAPTURE_IDLE_INTERVAL_MS = int(os.environ.get('CAPTURE_IDLE_INTERVAL_MS', '5000'))
+CAPTURE_IDLE_TIMEOUT_S = float(os.environ.get('CAPTURE_IDLE_TIMEOUT_S', '10'))
+# Skip grabs while XDamage reports no drawing on the screen
+CAPTURE_DAMAGE = os.environ.get('CAPTURE_DAMAGE', 'false').lower() in ('1', 'true', 'yes')
+# A one-off request to an idle engine waits at most this long for a fresh capture
+FRESH_FRAME_TIMEOUT_S = 2.0
+# In memory mode, optionally keep writing SNAPSHOT_PATH for file-based readers
+SNAPSHOT_FILE_OUTPUT = os.environ.get('SNAPSHOT_FILE_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+
+# Number of encoded snapshot variants (frame x format/crop/scale) kept in memory
+SNAPSHOT_CACHE_ENTRIES = int(os.environ.get('SNAPSHOT_CACHE_ENTRIES', '32'))
+
+# Streams resend the last frame after this many idle seconds so dead
+# connections are noticed even when the screen does not change
+STREAM_IDLE_RESEND_S = float(os.environ.get('STREAM_IDLE_RESEND_S', '5'))
+
+# Server worker processes (gunicorn mode). Every worker runs its own capture
+# engine and input scheduler, so one worker with many threads is recommended;
+# with more, input calls are serialized across workers through INPUT_LOCK_PATH.
+API_WORKERS = int(os.environ.get('API_WORKERS', '1'))
+INPUT_LOCK_PATH = os.environ.get('INPUT_LOCK_PATH', '/tmp/api-input.lock')
+
+# /desktop-snapshot?after_seq=N waits this long for a newer frame by default
+LONG_POLL_DEFAULT_TIMEOUT_S = float(os.environ.get('LONG_POLL_TIMEOUT_S', '10'))
+LONG_POLL_MAX_TIMEOUT_S = 60
+
 # Configuration for key press duration
 DEFAULT_KEY_DURATION_MS = int(os.environ.get('DEFAULT_KEY_DURATION_MS', '100'))
 
+# Recent frames kept in memory for /history (HISTORY_FRAMES=0 disables it).
+# delta stores XOR-against-previous frames zlib-compressed, raw stores plain
+# pixels; HISTORY_MMAP_PATH backs the buffer with a file, e.g. on /dev/shm.
+HISTORY_FRAMES = int(os.environ.get('HISTORY_FRAMES', '120'))
+HISTORY_MAX_BYTES = int(float(os.environ.get('HISTORY_MAX_MB', '128')) * 1048576)
+HISTORY_COMPRESSION = os.environ.get('HISTORY_COMPRESSION', 'delta').lower()
+HISTORY_MMAP_PATH = os.environ.get('HISTORY_MMAP_PATH') or None
+HISTORY_KEYFRAME_INTERVAL = int(os.environ.get('HISTORY_KEYFRAME_INTERVAL', '30'))
+HISTORY_CLIP_MAX_FRAMES = int(os.environ.get('HISTORY_CLIP_MAX_FRAMES', '300'))
+
+# Named templates for /probe/match, stored as PNG files so every worker sees them
+TEMPLATE_DIR = os.environ.get('TEMPLATE_DIR', '/tmp/api-templates')
+# Preprocessed ad-hoc templates (uploaded with the match request) kept for reuse
+TEMPLATE_UPLOAD_CACHE_ENTRIES = int(os.environ.get('TEMPLATE_UPLOAD_CACHE_ENTRIES', '16'))
+
+# Startup stage progress written by supervisor.py, served on /ready
+STARTUP_STATE_PATH = os.environ.get('STARTUP_STATE_PATH', '/tmp/startup-state.json')
+
+# Sampling profiler endpoints under /debug/profiler (off unless enabled)
+PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILER_INTERVAL_MS = float(os.environ.get('PROFILER_INTERVAL_MS', '10'))
+
+# Instrumentation served on /metrics. Values are per process: with
+# API_WORKERS > 1 each gunicorn worker reports its own.
+metrics = Registry()
+request_duration = metrics.histogram(
+    'api_request_duration_seconds',
+    'Time to produce a response; for streams, until the response starts',
+    ('route', 'method', 'status'))
+requests_in_flight = metrics.gauge('api_requests_in_flight', 'Requests being handled', ('route',))
+input_backend_seconds = metrics.histogram(
+    'api_input_backend_seconds', 'Time inside input backend calls, excluding deliberate sleeps', ('call',))
+input_sleep_seconds = metrics.histogram(
+    'api_input_sleep_seconds', 'Deliberate sleeps while executing input (batch delays, waits, click intervals)',
+    ('source',))
+input_batches_running = metrics.gauge('api_input_batches_running', 'Input batches currently executing')
+capture_duration = metrics.histogram('api_capture_duration_seconds', 'Time to grab one frame from the X server')
+encode_duration = metrics.histogram(
+    'api_encode_duration_seconds', 'Time to encode one frame or frame delta', ('endpoint', 'format'))
+snapshot_bytes = metrics.counter('api_snapshot_bytes_total', 'Encoded image bytes sent to clients', ('endpoint',))
+stream_frames_skipped = metrics.counter(
+    'api_stream_frames_skipped_total', 'Captured frames a stream client never received', ('endpoint',))
+probe_duration = metrics.histogram(
+    'api_probe_duration_seconds', 'Time to compute a pixel, region or template probe', ('kind',))
+
+templates = TemplateStore(TEMPLATE_DIR, max_uploads=TEMPLATE_UPLOAD_CACHE_ENTRIES)
+
+# Sleep time inside the current input call, kept apart from backend time
+_input_timing = threading.local()
+
+def _timed_sleep(seconds, source):
+    started = time.perf_counter()
+    time.sleep(seconds)
+    slept = time.perf_counter() - started
+    input_sleep_seconds.observe(slept, source=source)
+    return slept
+
+def _click_interval_sleep(seconds):
+    _input_timing.slept = getattr(_input_timing, 'slept', 0.0) + _timed_sleep(seconds, 'click_interval')
+
+def _record_input_call(name, seconds):
+    slept = getattr(_input_timing, 'slept', 0.0)
+    _input_timing.slept = 0.0
+    input_backend_seconds.observe(max(0.0, seconds - slept), call=name)
+
+class DisplayState:
+    """Capture engine, frame history, caches and input of one X display
+    
+    The process serves every display of the container (see displays.py);
+    requests choose theirs with a /displays/<k> prefix or the X-Display header.
+    """
+    
+    def __init__(self, display_id, display_name):
+        self.id = display_id
+        self.name = display_name
+        self.capture_engine = None
+        self.frame_history = None
+        self.snapshot_cache = EncodedFrameCache(max_entries=SNAPSHOT_CACHE_ENTRIES)
+        self.change_detector = ChangeDetector()
+        self.file_frame = (None, None)  # (mtime_ns, Frame) decoded from SNAPSHOT_PATH in file mode
+        
+        # Input backend: persistent XTest connection by default, pyautogui as fallback
+        self.input_backend = create_backend(display_name=display_name)
+        self.input_backend.sleep = _click_interval_sleep
+        # Owns every key-up/mouse-up deadline so holds and drags never block a request
+        lock_path = INPUT_LOCK_PATH if display_id == 0 else f'{INPUT_LOCK_PATH}.{display_id}'
+        self.input_scheduler = InputScheduler(
+            key_down=self.input_backend.key_down,
+            key_up=self.input_backend.key_up,
+            mouse_down=self.input_backend.mouse_down,
+            mouse_up=self.input_backend.mouse_up,
+            move_to=self.input_backend.move_to,
+            lock_path=lock_path if API_WORKERS > 1 else None,
+            on_call=_record_input_call
+        )
+    
+    def start_capture(self):
+        """Start the in-process capture engine when running in memory mode"""
+        if CAPTURE_MODE != 'memory' or self.capture_engine is not None:
+            return
+        if HISTORY_FRAMES > 0:
+            self.frame_history = FrameHistory(
+                max_frames=HISTORY_FRAMES,
+                max_bytes=HISTORY_MAX_BYTES,
+                compression=HISTORY_COMPRESSION,
+                mmap_path=f'{HISTORY_MMAP_PATH}.{self.id}' if HISTORY_MMAP_PATH and self.id else HISTORY_MMAP_PATH,
+                keyframe_interval=HISTORY_KEYFRAME_INTERVAL
+            )
+            atexit.register(self.frame_history.close)
+        self.capture_engine = CaptureEngine(
+            display_name=self.name,
+            interval_ms=SNAPSHOT_INTERVAL_MS,
+            file_output_path=SNAPSHOT_PATH if SNAPSHOT_FILE_OUTPUT and self.id == 0 else None,
+            on_frame=self._on_frame,
+            adaptive=CAPTURE_ADAPTIVE,
+            active_interval_ms=CAPTURE_ACTIVE_INTERVAL_MS,
+            idle_interval_ms=CAPTURE_IDLE_INTERVAL_MS,
+            idle_timeout_s=CAPTURE_IDLE_TIMEOUT_S,
+            use_damage=CAPTURE_DAMAGE
+        )
+        self.capture_engine.start()
+    
+    def _on_frame(self, frame):
+        """Capture-thread hook: record timing and keep the frame in the history"""
+        capture_duration.observe(frame.capture_ms / 1000.0)
+        if self.frame_history is not None:
+            self.frame_history.append(frame)
+    
+    def latest_frame(self):
+        """Newest in-memory frame, or None in file mode / before the first capture"""
+        if self.capture_engine is None:
+            return None
+        return self.capture_engine.latest()
+    
+    def requested_frame(self):
+        """Newest frame for a client request: counts as demand and wakes an idle engine"""
+        if self.capture_engine is None:
+            return None
+        return self.capture_engine.fresh_frame(self.capture_engine.interval_ms / 1000, timeout=FRESH_FRAME_TIMEOUT_S)
+    
+    def effective_interval_ms(self):
+        """The capture interval currently in effect (fixed in file mode)"""
+        if self.capture_engine is None:
+            return SNAPSHOT_INTERVAL_MS
+        return self.capture_engine.current_interval_ms()
+    
+    def load_file_frame(self):
+        """Decode SNAPSHOT_PATH into a Frame (file mode), reusing it until the file changes"""
+        from PIL import Image
+        import numpy as np
+        
+        file_stat = os.stat(SNAPSHOT_PATH)
+        mtime_ns, frame = self.file_frame
+        if mtime_ns != file_stat.st_mtime_ns or frame is None:
+            with Image.open(SNAPSHOT_PATH) as image:
+                pixels = np.asarray(image.convert('RGB'))
+            # The file's mtime stands in for the frame sequence number
+            frame = Frame(file_stat.st_mtime_ns // 1000000, file_stat.st_mtime, 0.0, pixels, 0.0)
+            self.file_frame = (file_stat.st_mtime_ns, frame)
+        return frame
+    
+    def encoded(self, frame, params, endpoint):
+        """snapshot_cache.get() that records the encode time of cache misses"""
+        encoded, cache_hit = self.snapshot_cache.get(frame, params)
+        if not cache_hit:
+            encode_duration.observe(encoded.encode_ms / 1000.0, endpoint=endpoint, format=params.format)
+        return encoded, cache_hit
+
+if DISPLAY_COUNT > 1:
+    # Display k is X display :k (supervisor.py starts them)
+    displays = {k: DisplayState(k, x_display(k)) for k in range(DISPLAY_COUNT)}
+else:
+    displays = {0: DisplayState(0, os.environ.get('DISPLAY', ':0'))}
+
+def start_capture():
+    """Start the capture engine of every display (memory mode)"""
+    for display in displays.values():
+        display.start_capture()
+
+def stop_capture():
+    for display in displays.values():
+        if display.capture_engine is not None:
+            display.capture_engine.stop()
+
+def current_display():
+    """The display the current request addresses (display 0 unless chosen)"""
+    return g.display
+
+@app.before_request
+def _select_display():
+    display_id = request.environ.get('api.display')
+    header = request.headers.get(DISPLAY_HEADER)
+    if display_id is None and header is not None:
+        try:
+            display_id = int(header)
+        except ValueError:
+            return jsonify({'error': f'{DISPLAY_HEADER} must be a display number'}), 400
+    g.display_chosen = display_id is not None
+    g.display = displays.get(display_id or 0)
+    if g.display is None:
+        return jsonify({'error': f'Unknown display {display_id}', 'displays': sorted(displays)}), 404
+
+def _add_snapshot_headers(response, created, size, seq=None):
+    display = current_display()
+    capture_engine = display.capture_engine
+    age_seconds = time.time() - created
+    interval_ms = display.effective_interval_ms()
+    verified_age = None
+    latest = display.latest_frame()
+    if latest is not None and seq == latest.seq:
+        # Unchanged-screen skips keep the latest frame current although it is older
+        verified_age = capture_engine.verified_age()
+    fresh_age = age_seconds if verified_age is None else verified_age
+    
+    # Add metadata headers
+    if seq is not None:
+        response.headers['X-Snapshot-Sequence'] = str(seq)
+    response.headers['X-Snapshot-Size'] = str(size)
+    response.headers['X-Snapshot-Created'] = str(created)
+    response.headers['X-Snapshot-Age-Seconds'] = str(round(age_seconds, 2))
+    response.headers['X-Snapshot-Interval-Ms'] = str(interval_ms)
+    response.headers['X-Snapshot-Is-Fresh'] = str(fresh_age < (interval_ms / 1000 * 2)).lower()
+    if capture_engine is not None:
+        response.headers['X-Snapshot-Capture-Rate'] = capture_engine.mode()
+    response.headers['X-Snapshot-Created-Time'] = time.ctime(created)
+    response.headers['X-Snapshot-Display'] = str(display.id)
+    return response
+
+def _per_display(value):
+    """Scrape-time function giving value(display) per display label, skipping None"""
+    def collect():
+        samples = {}
+        for display in displays.values():
+            result = value(display)
+            if result is not None:
+                samples[(str(display.id),)] = result
+        return samples
+    return collect
+
+def _capture_counter(name):
+    return _per_display(lambda d: getattr(d.capture_engine, name) if d.capture_engine is not None else None)
+
+def _history_stat(name):
+    return _per_display(lambda d: d.frame_history.stats()[name] if d.frame_history is not None else None)
+
+metrics.counter('api_frames_captured_total', 'Frames captured by the capture engine', ('display',),
+                function=_capture_counter('frames_captured'))
+metrics.counter('api_frames_dropped_total', 'Capture ticks missed because a capture overran the interval',
+                ('display',), function=_capture_counter('frames_dropped'))
+metrics.counter('api_capture_errors_total', 'Failed frame grabs', ('display',),
+                function=_capture_counter('capture_errors'))
+metrics.counter('api_snapshot_cache_hits_total', 'Encoded snapshot cache hits', ('display',),
+                function=_per_display(lambda d: d.snapshot_cache.hits))
+metrics.counter('api_snapshot_cache_misses_total', 'Encoded snapshot cache misses', ('display',),
+                function=_per_display(lambda d: d.snapshot_cache.misses))
+metrics.counter('api_change_tiles_computed_total', 'Region tile grids computed for /wait-for-change', ('display',),
+                function=_per_display(lambda d: d.change_detector.computed))
+metrics.counter('api_change_tiles_shared_total', 'Region tile grids reused from another waiter', ('display',),
+                function=_per_display(lambda d: d.change_detector.shared))
+metrics.gauge('api_history_frames', 'Frames held in the history buffer', ('display',),
+              function=_history_stat('frames'))
+metrics.gauge('api_history_bytes', 'Bytes of the history buffer holding frames', ('display',),
+              function=_history_stat('bytes_used'))
+metrics.counter('api_frames_unchanged_total', 'Capture ticks skipped because XDamage reported no change',
+                ('display',), function=_capture_counter('frames_unchanged'))
+metrics.gauge('api_capture_interval_seconds', 'Capture interval currently in effect', ('display',),
+              function=_per_display(lambda d: d.effective_interval_ms() / 1000.0))
+metrics.gauge('api_capture_consumers', 'Streams and long-polls holding the capture engine at its active rate',
+              ('display',), function=_per_display(lambda d: d.capture_engine.stats()['consumers']
+                                     if d.capture_engine is not None else None))
+metrics.gauge('api_change_waiters', 'Requests waiting in /wait-for-change', ('display',),
+              function=_per_display(lambda d: d.change_detector.waiters))
+metrics.gauge('api_input_actions_pending', 'Scheduled key holds and drags not yet finished', ('display',),
+              function=_per_display(lambda d: d.input_scheduler.pending_count()))
+
+def _wait_for_action(action):
+    """Block until a scheduled action has finished; raises if it did not complete"""
+    action.done.wait()
+    if action.state != 'completed':
+        raise RuntimeError(f'Action {action.id} {action.state}' + (f': {action.error}' if action.error else ''))
+
+def _schedule_action(action):
+    """Start a key hold or drag on the input scheduler and return the scheduled action"""
+    input_scheduler = current_display().input_scheduler
+    if action['type'] == 'key':
+        return input_scheduler.hold_key(action['key'], action['duration_ms'])
+    return input_scheduler.drag(action['start_x'], action['start_y'], action['end_x'], action['end_y'],
+                                action['duration'], action['button'])
+
+def _execute_action(action):
+    """Perform one validated input action, returning once it has finished"""
+    display = current_display()
+    input_scheduler, input_backend = display.input_scheduler, display.input_backend
+    kind = action['type']
+    if kind == 'key' and action['duration_ms'] < SHORT_PRESS_MS:
+        # For very short durations, use the default press method
+        input_scheduler.call(input_backend.press, action['key'])
+    elif kind in ('key', 'drag'):
+        _wait_for_action(_schedule_action(action))
+    elif kind == 'move':
+        input_scheduler.call(input_backend.move_to, action['x'], action['y'])
+    elif kind == 'click':
+        input_scheduler.call(input_backend.click, action['x'], action['y'], clicks=action['clicks'],
+                             interval=action['interval'], button=action['button'])
+    elif kind == 'wait':
+        _timed_sleep(action['duration_ms'] / 1000.0, 'wait')
+
+def _scheduled_response(action, data, fields):
+    """Response body for an endpoint that hands its work to the input scheduler
+    
+    With "wait": true in the payload the request blocks until the action has
+    finished, matching the old synchronous behaviour.
+    """
+    scheduled = _schedule_action(action)
+    if data.get('wait'):
+        _wait_for_action(scheduled)
+    body = {'status': 'success', 'action_id': scheduled.id, 'state': scheduled.state}
+    body.update({field: action[field] for field in fields})
+    return body
+
 @app.route('/send-key', methods=['POST'])
 def send_key():
+    """Press a key; holds of 50ms or more are released by the input scheduler"""
     try:
         data = request.json
-        key = data.get('key')
-        duration_ms = data.get('duration_ms', DEFAULT_KEY_DURATION_MS)
-        
-        if not key:
-            return jsonify({'error': 'Key is required'}), 400
+        action = key_action(data, DEFAULT_KEY_DURATION_MS)
         
-        if duration_ms <= 0:
-            return jsonify({'error': 'Duration must be positive'}), 400
-        
-        # For very short durations, use the default press method
-        if duration_ms < 50:
-            pyautogui.press(key)
-        else:
-            # Use keyDown/keyUp for longer durations
-            pyautogui.keyDown(key)
-            time.sleep(duration_ms / 1000.0)
-            pyautogui.keyUp(key)
+        if action['duration_ms'] < SHORT_PRESS_MS:
+            _execute_action(action)
+            return jsonify({
+                'status': 'success', 
+                'key': action['key'], 
+                'duration_ms': action['duration_ms']
+            })
         
-        return jsonify({
-            'status': 'success', 
-            'key': key, 
-            'duration_ms': duration_ms
-        })
+        return jsonify(_scheduled_response(action, data, ['key', 'duration_ms']))
+    except (ActionError, UnknownKeyError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to send key: {str(e)}'}), 500
 
@@ -51,42 +428,25 @@ def send_key_duration():
     """Endpoint specifically for key presses with custom durations"""
     try:
         data = request.json
-        key = data.get('key')
-        duration_ms = data.get('duration_ms')
-        
-        if not key:
-            return jsonify({'error': 'Key is required'}), 400
-        
-        if duration_ms is None:
-            return jsonify({'error': 'duration_ms is required'}), 400
-        
-        if duration_ms <= 0:
-            return jsonify({'error': 'Duration must be positive'}), 400
+        action = key_action(data, DEFAULT_KEY_DURATION_MS, require_duration=True)
         
         # Always use keyDown/keyUp for explicit duration control
-        pyautogui.keyDown(key)
-        time.sleep(duration_ms / 1000.0)
-        pyautogui.keyUp(key)
-        
-        return jsonify({
-            'status': 'success', 
-            'key': key, 
-            'duration_ms': duration_ms,
-            'method': 'keyDown/keyUp'
-        })
+        body = _scheduled_response(action, data, ['key', 'duration_ms'])
+        body['method'] = 'keyDown/keyUp'
+        return jsonify(body)
+    except (ActionError, UnknownKeyError) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to send key with duration: {str(e)}'}), 500
 
 @app.route('/move-mouse', methods=['POST'])
 def move_mouse():
     try:
-        data = request.json
-        x = data.get('x')
-        y = data.get('y')
-        if x is None or y is None:
-            return jsonify({'error': 'x and y are required'}), 400
-        pyautogui.moveTo(x, y)
-        return jsonify({'status': 'success', 'x': x, 'y': y})
+        action = move_action(request.json)
+        _execute_action(action)
+        return jsonify({'status': 'success', 'x': action['x'], 'y': action['y']})
+    except ActionError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to move mouse: {str(e)}'}), 500
 
@@ -94,173 +454,491 @@ def move_mouse():
 def click_mouse():
     """Mouse click with support for different buttons and click types"""
     try:
-        data = request.json
-        x = data.get('x')
-        y = data.get('y')
-        button = data.get('button', 'left')  # left, right, middle
-        clicks = data.get('clicks', 1)  # number of clicks
-        interval = data.get('interval', 0.0)  # interval between clicks
-        
-        # Validate coordinates
-        if x is None or y is None:
-            return jsonify({'error': 'x and y coordinates are required'}), 400
-        
-        # Validate button
-        valid_buttons = ['left', 'right', 'middle']
-        if button not in valid_buttons:
-            return jsonify({'error': f'Button must be one of: {valid_buttons}'}), 400
-        
-        # Validate clicks
-        if clicks < 1 or clicks > 10:
-            return jsonify({'error': 'Clicks must be between 1 and 10'}), 400
-        
-        # Validate interval
-        if interval < 0:
-            return jsonify({'error': 'Interval must be non-negative'}), 400
-        
-        # Perform the click
-        pyautogui.click(x, y, clicks=clicks, interval=interval, button=button)
+        # Validates coordinates, button (left, right, middle), clicks (1-10)
+        # and a non-negative interval between clicks
+        action = click_action(request.json)
+        _execute_action(action)
         
         return jsonify({
             'status': 'success',
-            'x': x,
-            'y': y,
-            'button': button,
-            'clicks': clicks,
-            'interval': interval
+            'x': action['x'],
+            'y': action['y'],
+            'button': action['button'],
+            'clicks': action['clicks'],
+            'interval': action['interval']
         })
+    except ActionError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to click mouse: {str(e)}'}), 500
 
 @app.route('/drag-mouse', methods=['POST'])
 def drag_mouse():
-    """Mouse drag operation from start to end coordinates"""
+    """Mouse drag from start to end coordinates, driven by the input scheduler"""
     try:
         data = request.json
-        start_x = data.get('start_x')
-        start_y = data.get('start_y')
-        end_x = data.get('end_x')
-        end_y = data.get('end_y')
-        duration = data.get('duration', 1.0)  # duration in seconds
-        button = data.get('button', 'left')  # button to hold during drag
-        
-        # Validate coordinates
-        required_coords = [start_x, start_y, end_x, end_y]
-        if any(coord is None for coord in required_coords):
-            return jsonify({'error': 'start_x, start_y, end_x, and end_y are required'}), 400
-        
-        # Validate button
-        valid_buttons = ['left', 'right', 'middle']
-        if button not in valid_buttons:
-            return jsonify({'error': f'Button must be one of: {valid_buttons}'}), 400
+        # Validates coordinates, button and a duration of up to 10 seconds
+        action = drag_action(data)
         
-        # Validate duration
-        if duration <= 0 or duration > 10:
-            return jsonify({'error': 'Duration must be between 0 and 10 seconds'}), 400
-        
-        # Perform the drag operation
-        pyautogui.drag(end_x - start_x, end_y - start_y, duration=duration, button=button)
-        
-        return jsonify({
-            'status': 'success',
-            'start_x': start_x,
-            'start_y': start_y,
-            'end_x': end_x,
-            'end_y': end_y,
-            'duration': duration,
-            'button': button
-        })
+        return jsonify(_scheduled_response(
+            action, data, ['start_x', 'start_y', 'end_x', 'end_y', 'duration', 'button']
+        ))
+    except ActionError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to drag mouse: {str(e)}'}), 500
 
+@app.route('/input-actions', methods=['GET'])
+def list_input_actions():
+    """Pending scheduled actions and currently held keys/buttons"""
+    return jsonify(current_display().input_scheduler.status())
+
+@app.route('/input-actions/<int:action_id>', methods=['GET'])
+def get_input_action(action_id):
+    """Status of one scheduled action (pending, completed, cancelled or failed)"""
+    info = current_display().input_scheduler.get(action_id)
+    if info is None:
+        return jsonify({'error': f'Unknown action id {action_id}'}), 404
+    return jsonify(info)
+
+@app.route('/release-all', methods=['POST'])
+def release_all():
+    """Cancel all scheduled actions and release every held key and button"""
+    result = current_display().input_scheduler.release_all()
+    result['status'] = 'error' if result['errors'] else 'success'
+    return jsonify(result), 500 if result['errors'] else 200
+
+@app.route('/input-batch', methods=['POST'])
+def input_batch():
+    """Run an ordered list of input actions server-side in one request
+    
+    Payload: {"actions": [{"type": "key", "key": "1", "delay_ms": 0}, ...]}
+    Types are key, move, click, drag and wait, with the same fields and
+    validation as the individual endpoints. delay_ms is the pause after the
+    previous action's scheduled end. The whole list is validated before
+    anything is executed.
+    """
+    try:
+        data = request.json
+        plan = plan_batch(data.get('actions'), DEFAULT_KEY_DURATION_MS)
+    except ActionError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': f'Invalid batch: {str(e)}'}), 400
+    
+    input_batches_running.inc()
+    try:
+        results, error = run_batch(plan, _execute_action, sleep=lambda seconds: _timed_sleep(seconds, 'batch'))
+    finally:
+        input_batches_running.dec()
+    total_ms = results[-1].get('finished_ms', results[-1]['started_ms']) if results else 0
+    response = {
+        'status': 'error' if error else 'success',
+        'actions_requested': len(plan),
+        'actions_completed': len(results) - (1 if error else 0),
+        'total_ms': total_ms,
+        'steps': results
+    }
+    if error:
+        response['error'] = f'Failed to run batch: {str(error)}'
+        return jsonify(response), 500
+    return jsonify(response)
+
+def _long_poll_args(args):
+    """Parse after_seq/timeout; returns (after_seq or None, timeout seconds)"""
+    if args.get('after_seq') is None:
+        return None, None
+    try:
+        after_seq = int(args.get('after_seq'))
+    except ValueError:
+        raise ValueError('after_seq must be an integer')
+    try:
+        wait_timeout = float(args.get('timeout', LONG_POLL_DEFAULT_TIMEOUT_S))
+    except ValueError:
+        raise ValueError('timeout must be a number')
+    if not math.isfinite(wait_timeout) or wait_timeout < 0 or wait_timeout > LONG_POLL_MAX_TIMEOUT_S:
+        raise ValueError(f'timeout must be between 0 and {LONG_POLL_MAX_TIMEOUT_S} seconds')
+    return after_seq, wait_timeout
+
 @app.route('/desktop-snapshot', methods=['GET'])
 def get_desktop_snapshot():
-    """Get the latest desktop screenshot with metadata"""
-    if not os.path.exists(SNAPSHOT_PATH):
+    """Get the latest desktop screenshot with metadata
+    
+    Optional query parameters: format (png, jpeg, webp, raw), quality (1-100),
+    crop (x,y,width,height) and scale (0-1]. Responses carry an ETag so pollers
+    can send If-None-Match and get 304 until a new frame is captured.
+    
+    after_seq=N long-polls: the request blocks until a frame newer than N is
+    captured and returns it, or returns 304 after timeout seconds.
+    """
+    try:
+        params = SnapshotParams.from_args(request.args)
+        after_seq, wait_timeout = _long_poll_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    display = current_display()
+    capture_engine = display.capture_engine
+    if after_seq is not None:
+        if capture_engine is None:
+            return _stream_unavailable()
+        with capture_engine.consumer():
+            frame = capture_engine.wait_for_frame(after_seq, timeout=wait_timeout)
+        if frame is None:
+            # Nothing newer within the timeout: describe the frame the client already has
+            frame = display.latest_frame()
+            response = app.response_class(status=304)
+            if frame is None:
+                return response
+            response.set_etag(params.etag(frame.seq))
+            return _add_snapshot_headers(response, frame.timestamp, 0, frame.seq)
+    else:
+        frame = display.requested_frame()
+    if frame is None and not os.path.exists(SNAPSHOT_PATH):
         return jsonify({'error': 'No snapshot available - snapshot service may not be running'}), 404
     
     try:
-        file_stat = os.stat(SNAPSHOT_PATH)
-        current_time = time.time()
-        age_seconds = current_time - file_stat.st_mtime
-        interval_ms = int(os.environ.get('SNAPSHOT_INTERVAL_MS', '500'))
+        if frame is None and params.is_default:
+            # Legacy file mode: stream the PNG written by snapshot-service.sh
+            file_stat = os.stat(SNAPSHOT_PATH)
+            response = send_file(
+                SNAPSHOT_PATH, 
+                mimetype='image/png',
+                as_attachment=False,
+                download_name='desktop_snapshot.png'
+            )
+            return _add_snapshot_headers(response, file_stat.st_mtime, file_stat.st_size)
         
-        # Create response with metadata in headers
-        response = send_file(
-            SNAPSHOT_PATH, 
-            mimetype='image/png',
-            as_attachment=False,
-            download_name='desktop_snapshot.png'
-        )
+        if frame is None:
+            frame = display.load_file_frame()
         
-        # Add metadata headers
-        response.headers['X-Snapshot-Size'] = str(file_stat.st_size)
-        response.headers['X-Snapshot-Created'] = str(file_stat.st_mtime)
-        response.headers['X-Snapshot-Age-Seconds'] = str(round(age_seconds, 2))
-        response.headers['X-Snapshot-Interval-Ms'] = str(interval_ms)
-        response.headers['X-Snapshot-Is-Fresh'] = str(age_seconds < (interval_ms / 1000 * 2)).lower()
-        response.headers['X-Snapshot-Created-Time'] = time.ctime(file_stat.st_mtime)
+        etag = params.etag(frame.seq)
+        if after_seq is None and etag in request.if_none_match:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return _add_snapshot_headers(response, frame.timestamp, 0, frame.seq)
         
-        return response
+        return _image_response(frame, params, 'snapshot')
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': f'Failed to serve snapshot: {str(e)}'}), 500
 
-@app.route('/snapshot-info', methods=['GET'])
-def get_snapshot_info():
-    """Health check endpoint - validates snapshot service is actively generating fresh images"""
-    if not os.path.exists(SNAPSHOT_PATH):
-        return jsonify({
-            'service_healthy': False,
-            'snapshot_available': False,
-            'message': 'No snapshot available - snapshot service may not be running'
-        }), 503
+def _image_response(frame, params, endpoint, filename='desktop_snapshot'):
+    """Encoded (cached) image of a frame with the X-Snapshot-* headers"""
+    encoded, cache_hit = current_display().encoded(frame, params, endpoint)
+    snapshot_bytes.inc(len(encoded.data), endpoint=endpoint)
+    response = app.response_class(encoded.data, mimetype=encoded.mimetype)
+    extension = 'bin' if params.format == 'raw' else params.format
+    response.headers['Content-Disposition'] = f'inline; filename={filename}.{extension}'
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Snapshot-Format'] = params.format
+    response.headers['X-Snapshot-Width'] = str(encoded.width)
+    response.headers['X-Snapshot-Height'] = str(encoded.height)
+    response.headers['X-Snapshot-Cache'] = 'hit' if cache_hit else 'miss'
+    response.set_etag(params.etag(frame.seq))
+    return _add_snapshot_headers(response, frame.timestamp, len(encoded.data), frame.seq)
+
+def _stream_unavailable():
+    return jsonify({'error': 'Streaming and long-polling require the in-process capture engine (CAPTURE_MODE=memory)'}), 409
+
+@app.route('/desktop-stream', methods=['GET'])
+def desktop_stream():
+    """Push every new frame as a multipart MJPEG stream
+    
+    Accepts the quality, crop and scale parameters of /desktop-snapshot plus
+    max_fps to cap the push rate.
+    """
+    # The generator runs outside the request context, so it keeps its own reference
+    display = current_display()
+    capture_engine = display.capture_engine
+    if capture_engine is None:
+        return _stream_unavailable()
     
     try:
-        interval_ms = int(os.environ.get('SNAPSHOT_INTERVAL_MS', '500'))
-        wait_time = (interval_ms / 1000) + 0.1  # Wait slightly longer than interval
-        
-        # Get initial file modification time
-        initial_stat = os.stat(SNAPSHOT_PATH)
-        initial_mtime = initial_stat.st_mtime
-        current_time = time.time()
-        initial_age = current_time - initial_mtime
-        
-        # If file is already very fresh, wait for next update
-        if initial_age < (interval_ms / 1000):
-            print(f"Waiting {wait_time}s for next snapshot update...")
-            time.sleep(wait_time)
+        args = request.args.to_dict()
+        args['format'] = 'jpeg'
+        params = SnapshotParams.from_args(args)
+        max_fps = float(request.args.get('max_fps', 0))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if max_fps < 0:
+        return jsonify({'error': 'max_fps must be non-negative'}), 400
+    
+    min_gap = 1.0 / max_fps if max_fps else 0.0
+    
+    def generate():
+        last_seq = 0
+        last_part = None
+        # Attached for as long as the client reads; closing the stream releases it
+        with capture_engine.consumer():
+            while True:
+                frame = capture_engine.wait_for_frame(last_seq, timeout=STREAM_IDLE_RESEND_S)
+                if frame is None:
+                    if last_part is not None:
+                        yield last_part
+                    continue
+                sent_at = time.monotonic()
+                try:
+                    encoded, _ = display.encoded(frame, params, 'mjpeg')
+                except ValueError as e:
+                    # The frame shrank below the requested crop; end the stream cleanly
+                    print(f"Ending MJPEG stream: {e}")
+                    return
+                if last_seq:
+                    stream_frames_skipped.inc(frame.seq - last_seq - 1, endpoint='mjpeg')
+                last_seq = frame.seq
+                last_part = mjpeg_part(encoded.data, frame.seq, frame.timestamp)
+                snapshot_bytes.inc(len(encoded.data), endpoint='mjpeg')
+                yield last_part
+                if min_gap:
+                    time.sleep(max(0.0, min_gap - (time.monotonic() - sent_at)))
+    
+    response = Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Snapshot-Interval-Ms'] = str(capture_engine.active_interval_ms if CAPTURE_ADAPTIVE
+                                                     else SNAPSHOT_INTERVAL_MS)
+    return response
+
+@sock.route('/desktop-stream/ws')
+def desktop_stream_ws(ws):
+    """WebSocket stream of binary frame deltas (dirty rectangles only)
+    
+    Query parameters: encoding (png, jpeg, raw), quality, crop, scale and
+    tile (diff tile size in pixels). Send the text message "keyframe" to
+    receive a full frame on the next update.
+    """
+    capture_engine = current_display().capture_engine
+    if capture_engine is None:
+        ws.close(1011, 'Streaming requires CAPTURE_MODE=memory')
+        return
+    
+    try:
+        args = request.args.to_dict()
+        args['format'] = args.pop('encoding', 'png')
+        params = SnapshotParams.from_args(args)
+        if params.format == 'webp':
+            raise ValueError('encoding must be one of: png, jpeg, raw')
+        tile = int(request.args.get('tile', 32))
+        if tile < 8 or tile > 256:
+            raise ValueError('tile must be between 8 and 256')
+    except ValueError as e:
+        ws.close(1008, str(e))
+        return
+    
+    previous = None
+    last_seq = 0
+    with capture_engine.consumer():
+        while True:
+            # Non-blocking check for client control messages
+            message = ws.receive(timeout=0)
+            if message == 'keyframe':
+                previous = None
         
-        # Check if file was updated
-        try:
-            updated_stat = os.stat(SNAPSHOT_PATH)
-            updated_mtime = updated_stat.st_mtime
-            file_was_updated = updated_mtime > initial_mtime
-        except:
-            updated_stat = initial_stat
-            updated_mtime = initial_mtime
-            file_was_updated = False
+            frame = capture_engine.wait_for_frame(last_seq, timeout=1.0)
+            if frame is None:
+                continue
+            if last_seq:
+                stream_frames_skipped.inc(frame.seq - last_seq - 1, endpoint='ws')
+            last_seq = frame.seq
         
-        # Calculate final metrics
-        final_age = time.time() - updated_mtime
-        is_fresh = final_age < (interval_ms / 1000 * 3)  # Allow 3x interval tolerance
-        service_healthy = file_was_updated or is_fresh
+            try:
+                pixels = apply_view(frame.pixels, params.crop, params.scale)
+            except ValueError as e:
+                # The frame shrank below the requested crop (e.g. a resolution change)
+                ws.close(1008, str(e))
+                return
+            keyframe = previous is None or previous.shape != pixels.shape
+            rects = dirty_rects(previous, pixels, tile)
+            if rects:
+                started = time.perf_counter()
+                delta = encode_delta(
+                    pixels, rects, frame.seq, frame.timestamp,
+                    encoding=params.format, quality=params.quality or 80, keyframe=keyframe
+                )
+                encode_duration.observe(time.perf_counter() - started, endpoint='ws', format=params.format)
+                snapshot_bytes.inc(len(delta), endpoint='ws')
+                ws.send(delta)
+            previous = pixels
+
+def _history_unavailable():
+    return jsonify({'error': 'Frame history is disabled - it needs CAPTURE_MODE=memory and HISTORY_FRAMES > 0'}), 409
+
+def _history_float(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+
+@app.route('/history', methods=['GET'])
+def get_history():
+    """Frames currently held in the history buffer and its memory use"""
+    frame_history = current_display().frame_history
+    if frame_history is None:
+        return _history_unavailable()
+    return jsonify(frame_history.stats())
+
+@app.route('/history/frame', methods=['GET'])
+def get_history_frame():
+    """One frame from the history, by seq=N or by timestamp=T
+    
+    timestamp selects the newest frame captured at or before T (Unix time).
+    Accepts the format, quality, crop and scale parameters of /desktop-snapshot.
+    """
+    frame_history = current_display().frame_history
+    if frame_history is None:
+        return _history_unavailable()
+    try:
+        params = SnapshotParams.from_args(request.args)
+        timestamp = _history_float('timestamp')
+        if request.args.get('seq') is not None:
+            frame = frame_history.get(int(request.args.get('seq')))
+        elif timestamp is not None:
+            frame = frame_history.at(timestamp)
+        else:
+            return jsonify({'error': 'Provide seq or timestamp'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if frame is None:
+        return jsonify({'error': 'Frame is not in the history', 'history': frame_history.stats()}), 404
+    
+    etag = params.etag(frame.seq)
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return _add_snapshot_headers(response, frame.timestamp, 0, frame.seq)
+    try:
+        return _image_response(frame, params, 'history', filename=f'frame-{frame.seq}')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/history/clip', methods=['GET'])
+def get_history_clip():
+    """Export a time range of the history as an animated GIF/WebP or a zip of images
+    
+    Range: start and end (Unix timestamps, either may be omitted) or seconds
+    (the last N seconds). format is gif, webp or zip (default webp);
+    frame_format (png or jpeg) selects the image type inside a zip. crop,
+    scale and quality work as for /desktop-snapshot. At most max_frames
+    frames (default and limit HISTORY_CLIP_MAX_FRAMES) are exported, evenly
+    spaced over the range.
+    """
+    frame_history = current_display().frame_history
+    if frame_history is None:
+        return _history_unavailable()
+    try:
+        fmt = request.args.get('format', 'webp').lower()
+        if fmt not in CLIP_FORMATS:
+            raise ValueError(f'format must be one of: {sorted(CLIP_FORMATS)}')
+        frame_format = request.args.get('frame_format', 'png').lower()
+        frame_format = {'jpg': 'jpeg'}.get(frame_format, frame_format)
+        if frame_format not in ('png', 'jpeg'):
+            raise ValueError('frame_format must be png or jpeg')
+        # Parse crop, scale and quality as for a lossy snapshot so quality is kept
+        params = SnapshotParams.from_args(dict(request.args.items(), format='jpeg'))
+        max_frames = int(request.args.get('max_frames', HISTORY_CLIP_MAX_FRAMES))
+        if max_frames < 1 or max_frames > HISTORY_CLIP_MAX_FRAMES:
+            raise ValueError(f'max_frames must be between 1 and {HISTORY_CLIP_MAX_FRAMES}')
+        start, end, seconds = _history_float('start'), _history_float('end'), _history_float('seconds')
+        if seconds is not None:
+            if seconds <= 0:
+                raise ValueError('seconds must be positive')
+            newest = frame_history.stats().get('newest_timestamp')
+            if newest is not None:
+                start, end = newest - seconds, newest
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    sequences = frame_history.sequences(start, end)
+    if not sequences:
+        return jsonify({'error': 'No frames in the requested range', 'history': frame_history.stats()}), 404
+    if len(sequences) > max_frames:
+        step = len(sequences) / max_frames
+        sequences = [sequences[int(i * step)] for i in range(max_frames)]
+    
+    try:
+        data, count = encode_clip(frame_history.frames(sequences), fmt, params.crop, params.scale, params.quality,
+                                  frame_format)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not count:
+        return jsonify({'error': 'The requested frames left the history while exporting'}), 404
+    snapshot_bytes.inc(len(data), endpoint='clip')
+    response = app.response_class(data, mimetype=CLIP_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=clip-{sequences[0]}-{sequences[-1]}.{fmt}'
+    response.headers['X-Clip-Frames'] = str(count)
+    response.headers['X-Clip-First-Sequence'] = str(sequences[0])
+    response.headers['X-Clip-Last-Sequence'] = str(sequences[-1])
+    return response
+
+@app.route('/snapshot-info', methods=['GET'])
+def get_snapshot_info():
+    """Health check endpoint - reports snapshot freshness without waiting
+
+    Memory mode answers from the capture engine's frame counters; file mode
+    from the snapshot file's mtime. Healthy means a frame was captured within
+    three capture intervals (the interval currently in effect, which is
+    longer while the adaptive engine idles). Polling this endpoint does not
+    count as demand, so health checks leave an idle engine idle.
+    """
+    display = current_display()
+    capture_engine = display.capture_engine
+    interval_ms = display.effective_interval_ms()
+    fresh_limit = interval_ms / 1000 * 3  # Allow 3x interval tolerance
+    
+    try:
+        if capture_engine is not None:
+            stats = capture_engine.stats()
+            if not stats['sequence']:
+                return jsonify({
+                    'service_healthy': False,
+                    'snapshot_available': False,
+                    'capture_mode': CAPTURE_MODE,
+                    'frame': stats,
+                    'message': 'No frame captured yet - waiting for the X server'
+                }), 503
+            # With XDamage skips the frame stays current after its capture time
+            age = stats['verified_age_seconds']
+            frame = display.latest_frame()
+            size = frame.pixels.nbytes
+            stats['age_seconds'] = round(stats['age_seconds'], 3)
+            stats['verified_age_seconds'] = round(age, 3)
+            stats['capture_ms'] = round(stats['capture_ms'], 2)
+        else:
+            if not os.path.exists(SNAPSHOT_PATH):
+                return jsonify({
+                    'service_healthy': False,
+                    'snapshot_available': False,
+                    'capture_mode': CAPTURE_MODE,
+                    'message': 'No snapshot available - snapshot service may not be running'
+                }), 503
+            file_stat = os.stat(SNAPSHOT_PATH)
+            age = time.time() - file_stat.st_mtime
+            size = file_stat.st_size
+            stats = None
         
-        return jsonify({
-            'service_healthy': service_healthy,
+        is_fresh = age < fresh_limit
+        info = {
+            'service_healthy': is_fresh,
             'snapshot_available': True,
-            'file_size_bytes': updated_stat.st_size,
-            'age_seconds': round(final_age, 2),
-            'configured_interval_ms': interval_ms,
-            'file_was_updated_during_check': file_was_updated,
+            'capture_mode': CAPTURE_MODE,
+            'file_size_bytes': size,
+            'age_seconds': round(age, 2),
+            'configured_interval_ms': SNAPSHOT_INTERVAL_MS,
+            'effective_interval_ms': interval_ms,
             'is_fresh': is_fresh,
-            'snapshot_path': SNAPSHOT_PATH,
-            'check_details': {
-                'initial_age_seconds': round(initial_age, 2),
-                'waited_seconds': wait_time if initial_age < (interval_ms / 1000) else 0,
-                'final_age_seconds': round(final_age, 2)
-            }
-        }), 200 if service_healthy else 503
+            'snapshot_path': SNAPSHOT_PATH
+        }
+        if stats is not None:
+            info['capture_rate'] = stats['rate_mode']
+            info['sequence'] = stats['sequence']
+            info['frame'] = stats
+        
+        return jsonify(info), 200 if is_fresh else 503
         
     except Exception as e:
         return jsonify({
@@ -268,9 +946,335 @@ def get_snapshot_info():
             'error': f'Failed to check snapshot service: {str(e)}'
         }), 500
 
-if __name__ == '__main__':
-    # Start Flask app - snapshot service runs separately
-    print("Starting Flask API server...")
+def _analysis_frame():
+    """Newest frame to analyse: the capture engine's, or the decoded snapshot file"""
+    display = current_display()
+    frame = display.requested_frame()
+    if frame is None and display.capture_engine is None and os.path.exists(SNAPSHOT_PATH):
+        frame = display.load_file_frame()
+    return frame
+
+def _probe(kind, compute):
+    """Run compute(frame) on the newest frame and wrap its result with the frame identity"""
+    try:
+        frame = _analysis_frame()
+    except Exception as e:
+        return jsonify({'error': f'Failed to load snapshot: {str(e)}'}), 500
+    if frame is None:
+        return jsonify({'error': 'No snapshot available - snapshot service may not be running'}), 404
+    
+    started = time.perf_counter()
+    try:
+        result = compute(frame)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    elapsed = time.perf_counter() - started
+    probe_duration.observe(elapsed, kind=kind)
+    result.update({
+        'sequence': frame.seq,
+        'timestamp': frame.timestamp,
+        'compute_ms': round(elapsed * 1000.0, 3),
+    })
+    return jsonify(result)
+
+@app.route('/probe/pixels', methods=['POST'])
+def probe_pixels():
+    """Read pixels of the newest frame
+    
+    Payload: {"points": [[x, y], ...]}, optionally with "expect": [[r, g, b], ...]
+    (one per point) and "tolerance" (per channel) to get a match flag per point.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    return _probe('pixels', lambda frame: read_pixels(
+        frame.pixels, data.get('points'), data.get('expect'), data.get('tolerance', 0)))
+
+@app.route('/probe/region', methods=['POST'])
+def probe_region():
+    """Colour statistics for regions of the newest frame
+    
+    Payload: {"regions": [{"region": [x, y, width, height], "color": [r, g, b],
+    "tolerance": 10}, ...]}. Each result has per-channel mean, std, min and max;
+    with color also match_fraction, the share of pixels within tolerance of it.
+    """
+    data = request.get_json(silent=True)
+    specs = data.get('regions') if isinstance(data, dict) else None
+    if not isinstance(specs, list) or not specs or not all(isinstance(spec, dict) for spec in specs):
+        return jsonify({'error': 'regions must be a non-empty list of objects'}), 400
+    if len(specs) > MAX_REGIONS:
+        return jsonify({'error': f'At most {MAX_REGIONS} regions per request'}), 400
+    
+    def compute(frame):
+        return {'regions': [
+            region_stats(frame.pixels, parse_region(spec.get('region'), frame.width, frame.height),
+                         spec.get('color'), spec.get('tolerance', 0))
+            for spec in specs
+        ]}
+    return _probe('region', compute)
+
+@app.route('/probe/match', methods=['POST'])
+def probe_match():
+    """Find a template in the newest frame
+    
+    Payload: {"template": "name"} for a template registered with PUT
+    /templates/<name>, or {"template_image": "<base64 PNG>"} for a one-off
+    template, plus optional "region" [x, y, width, height] to search in,
+    "threshold" (normalized cross-correlation, default 0.9) and "max_matches"
+    (default 1). Searching a small region is much cheaper than the whole frame.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        threshold, max_matches = parse_match_args(data.get('threshold', DEFAULT_MATCH_THRESHOLD),
+                                                  data.get('max_matches', 1))
+        if data.get('template') is not None:
+            if not isinstance(data['template'], str):
+                raise ValueError('template must be a template name (string)')
+            template = templates.get(data['template'])
+            if template is None:
+                return jsonify({'error': f"Unknown template: {data['template']}"}), 404
+        elif data.get('template_image'):
+            if not isinstance(data['template_image'], str):
+                raise ValueError('template_image must be a base64 string')
+            template = templates.from_upload(base64.b64decode(data['template_image'], validate=True))
+        else:
+            return jsonify({'error': 'Provide template (a registered name) or template_image (base64)'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def compute(frame):
+        result = match_template(frame.pixels, template, parse_region(data.get('region'), frame.width, frame.height),
+                                threshold, max_matches)
+        result['template'] = template.describe()
+        return result
+    return _probe('match', compute)
+
+@app.route('/wait-for-change', methods=['GET'])
+def wait_for_change():
+    """Long-poll until a region of the screen changes
+    
+    Query parameters: region (x,y,width,height, default the whole frame),
+    tile (tile size in pixels, default 16), min_delta (change of a tile's mean
+    colour on any channel, 0-255, default 12), threshold (fraction of tiles
+    that must change, default 0.05) and timeout (seconds).
+    
+    The baseline is the newest frame when the request arrives, or frame
+    baseline_seq from the history, so a client can wait for changes since the
+    frame it last looked at without missing one in between. Returns as soon as
+    a newer frame crosses the threshold, or with changed=false after timeout.
+    """
+    try:
+        tile, min_delta, threshold = parse_change_args(request.args)
+        wait_timeout = float(request.args.get('timeout', LONG_POLL_DEFAULT_TIMEOUT_S))
+        if not math.isfinite(wait_timeout) or wait_timeout < 0 or wait_timeout > LONG_POLL_MAX_TIMEOUT_S:
+            raise ValueError(f'timeout must be between 0 and {LONG_POLL_MAX_TIMEOUT_S} seconds')
+        region = request.args.get('region')
+        region = region.split(',') if region else None
+        baseline_seq = request.args.get('baseline_seq')
+        baseline_seq = int(baseline_seq) if baseline_seq is not None else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    display = current_display()
+    capture_engine, frame_history = display.capture_engine, display.frame_history
+    if capture_engine is None:
+        return _stream_unavailable()
+    
+    started = time.monotonic()
+    baseline = display.requested_frame() or capture_engine.wait_for_frame(0, timeout=wait_timeout)
+    if baseline is None:
+        return jsonify({'error': 'No frame captured yet'}), 503
+    if baseline_seq is not None and baseline_seq != baseline.seq:
+        baseline = frame_history.get(baseline_seq) if frame_history is not None else None
+        if baseline is None:
+            return jsonify({'error': f'Frame {baseline_seq} is not in the history'}), 404
+    try:
+        region = parse_region(region, baseline.width, baseline.height)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    remaining = max(0.0, wait_timeout - (time.monotonic() - started))
+    with capture_engine.consumer():
+        frame, result = display.change_detector.wait(capture_engine, baseline, region, tile, min_delta, threshold, remaining)
+    result.update({
+        'sequence': frame.seq,
+        'timestamp': frame.timestamp,
+        'baseline_sequence': baseline.seq,
+        'region': list(region),
+        'threshold': threshold,
+        'waited_ms': round((time.monotonic() - started) * 1000.0, 1),
+    })
+    return jsonify(result)
+
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    """Names of the registered templates"""
+    return jsonify({'templates': templates.names()})
+
+@app.route('/templates/<name>', methods=['GET', 'PUT', 'DELETE'])
+def template_resource(name):
+    """Register (PUT with the image as the request body), describe or delete a template"""
+    try:
+        if request.method == 'PUT':
+            template = templates.register(name, request.get_data())
+            return jsonify(template.describe()), 201
+        if request.method == 'DELETE':
+            if not templates.remove(name):
+                return jsonify({'error': f'Unknown template: {name}'}), 404
+            return jsonify({'status': 'success', 'removed': name})
+        template = templates.get(name)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        return jsonify({'error': f'Failed to store template: {str(e)}'}), 500
+    if template is None:
+        return jsonify({'error': f'Unknown template: {name}'}), 404
+    return jsonify(template.describe())
+
+@app.route('/ready', methods=['GET'])
+def get_ready():
+    """Readiness for orchestrators - 200 once startup has finished
+    
+    Ready means every startup stage completed (see supervisor.py) and a
+    desktop frame has been captured. With scope=input, 200 as soon as input
+    and snapshots work, even while the client overlay or Wine prefix are
+    still being prepared.
+    
+    With several displays every one of them must have a frame, unless the
+    request addresses a single display.
+    """
+    scope = request.args.get('scope', 'all')
+    if scope not in ('all', 'input'):
+        return jsonify({'error': 'scope must be all or input'}), 400
+    
+    checked = [current_display()] if g.display_chosen else list(displays.values())
+    sequences = {}
+    for display in checked:
+        if display.capture_engine is not None:
+            sequences[str(display.id)] = display.capture_engine.stats()['sequence']
+    if sequences:
+        sequence = sequences.get(str(current_display().id))
+        input_ready = all(seq > 0 for seq in sequences.values())
+    else:
+        sequence = None
+        input_ready = os.path.exists(SNAPSHOT_PATH)
+    
+    try:
+        with open(STARTUP_STATE_PATH) as f:
+            startup = json.load(f)
+    except FileNotFoundError:
+        # Not started by the supervisor (e.g. the development server)
+        startup = None
+    except (OSError, ValueError) as e:
+        startup = {'ok': False, 'error': f'Unreadable startup state: {e}'}
+    
+    ready = input_ready and (startup is None or startup.get('ok', False))
+    body = {
+        'ready': ready,
+        'input_ready': input_ready,
+        'frame_sequence': sequence,
+        'startup': startup,
+    }
+    if len(sequences) > 1:
+        body['display_frame_sequences'] = sequences
+    ok = input_ready if scope == 'input' else ready
+    return jsonify(body), 200 if ok else 503
+
+@app.route('/displays', methods=['GET'])
+def list_displays():
+    """The displays this container runs, with their VNC ports and capture state"""
+    result = []
+    for display in displays.values():
+        info = {
+            'id': display.id,
+            'x_display': display.name,
+            'vnc_port': vnc_port(display.id),
+            'path_prefix': f'{PATH_PREFIX}{display.id}',
+            'input_backend': display.input_backend.name,
+        }
+        if display.capture_engine is not None:
+            stats = display.capture_engine.stats()
+            info['sequence'] = stats['sequence']
+            info['capture_rate'] = stats['rate_mode']
+        result.append(info)
+    return jsonify({'displays': result, 'count': len(result), 'header': DISPLAY_HEADER})
+
+@app.before_request
+def _start_request_metrics():
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    requests_in_flight.inc(route=g.metrics_route)
+
+@app.after_request
+def _record_request_metrics(response):
+    if 'metrics_started' in g:
+        request_duration.observe(time.perf_counter() - g.metrics_started, route=g.metrics_route,
+                                 method=request.method, status=response.status_code)
+        g.metrics_recorded = True
+    return response
+
+@app.teardown_request
+def _finish_request_metrics(error):
+    if 'metrics_started' not in g:
+        return
+    requests_in_flight.dec(route=g.metrics_route)
+    if 'metrics_recorded' not in g:
+        # Unhandled exception: after_request never ran
+        request_duration.observe(time.perf_counter() - g.metrics_started, route=g.metrics_route,
+                                 method=request.method, status=500)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of the request, input and capture metrics"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+profiler = SamplingProfiler(PROFILER_INTERVAL_MS) if PROFILER_ENABLED else None
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def debug_profiler():
+    """Sampling profiler control (PROFILER_ENABLED=true)
+    
+    POST {"action": "start", "interval_ms": 5} or {"action": "stop"}.
+    GET returns the collapsed stacks gathered so far (flamegraph input);
+    GET ?format=json returns the profiler status instead.
+    """
+    if profiler is None:
+        return jsonify({'error': 'Profiler is disabled - set PROFILER_ENABLED=true'}), 404
+    if request.method == 'GET':
+        if request.args.get('format') == 'json':
+            return jsonify(profiler.status())
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action == 'start':
+        interval_ms = data.get('interval_ms')
+        if interval_ms is not None and (isinstance(interval_ms, bool) or not isinstance(interval_ms, (int, float))
+                                        or not 1 <= interval_ms <= 1000):
+            return jsonify({'error': 'interval_ms must be a number between 1 and 1000'}), 400
+        if not profiler.start(interval_ms):
+            return jsonify({'error': 'Profiler is already running'}), 409
+    elif action == 'stop':
+        if not profiler.stop():
+            return jsonify({'error': 'Profiler is not running'}), 409
+    else:
+        return jsonify({'error': 'action must be start or stop'}), 400
+    return jsonify(profiler.status())
+
+def log_startup(server):
+    print(f"Starting Flask API server ({server})...")
+    print(f"Capture mode: {CAPTURE_MODE}")
     print(f"Configured snapshot path: {SNAPSHOT_PATH}")
     print(f"Default key duration: {DEFAULT_KEY_DURATION_MS}ms")
-    app.run(host='0.0.0.0', port=5000)
+    for display in displays.values():
+        print(f"Display {display.id} ({display.name}): input backend {display.input_backend.name}")
+    if profiler is not None:
+        print(f"Sampling profiler available at /debug/profiler ({PROFILER_INTERVAL_MS}ms interval)")
+
+if __name__ == '__main__':
+    # Development server; the container runs gunicorn via gunicorn.conf.py
+    log_startup('development')
+    # In file mode the snapshot service runs separately
+    start_capture()
+    app.run(host='0.0.0.0', port=5000, threaded=True)
@@ -0,0 +1,418 @@
+"""Python client for the control API served by api.py.
+
+ApiClient (requests) and AsyncApiClient (asyncio, aiohttp) wrap the input
+and snapshot endpoints over pooled keep-alive connections, with a timeout
+and retries per call:
+
+    client = ApiClient('http://localhost:5000')
+    client.send_key('w')
+    snapshot = client.snapshot(format='jpeg', scale=0.5)
+    print(snapshot.sequence, snapshot.age_seconds, len(snapshot.data))
+
+    async with AsyncApiClient('http://localhost:5001') as client:
+        await client.click_mouse(400, 300)
+
+MultiClient and AsyncMultiClient address many instances by instance id
+(ports as laid out by fleet.py) and call them concurrently; results come
+back as {instance_id: result}, with the exception in place of the result
+for instances that failed.
+
+Retries: failures to connect (refused, connect timeout) are retried for
+every call, since nothing was sent. Everything that can happen after the
+request went out (a reset or closed connection, a read timeout, a 502/504
+answer) is retried only for GET requests: an input request may already
+have been executed, and is never sent twice.
+
+Snapshot bytes are exposed as a memoryview over the response body, and
+raw-format frames as a NumPy view of it, so nothing is copied after the
+body has been read. aiohttp is only needed for the asyncio classes.
+"""
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+from fleet import api_port, parse_instance_ids
+
+DEFAULT_TIMEOUT_S = 5.0
+DEFAULT_RETRIES = 2
+# Delay before retry n is RETRY_BACKOFF_S * 2 ** (n - 1)
+RETRY_BACKOFF_S = 0.05
+DEFAULT_POOL_SIZE = 10
+RETRY_STATUSES = (502, 504)
+
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class ApiError(Exception):
+    """A call failed: an error answer from the API (status set) or a transport failure (status None)"""
+
+    def __init__(self, message, status=None, body=None):
+        super().__init__(f'{status}: {message}' if status else message)
+        self.status = status
+        self.message = message
+        self.body = body
+
+
+def _encode(payload):
+    """Compact JSON body; None values are left out so the server applies its defaults"""
+    return json.dumps({k: v for k, v in payload.items() if v is not None}, separators=(',', ':')).encode()
+
+
+def _parse_json(status, headers, body):
+    return json.loads(body) if body else None
+
+
+def _error_message(body):
+    try:
+        return json.loads(body).get('error') or body.decode(errors='replace')
+    except (ValueError, AttributeError):
+        return body.decode(errors='replace')[:200]
+
+
+class Snapshot:
+    """A /desktop-snapshot answer: the image bytes and the parsed X-Snapshot-* headers
+
+    data is a memoryview over the response body (empty when not_modified).
+    """
+
+    def __init__(self, status, headers, body):
+        self.not_modified = status == 304
+        self.data = memoryview(body)
+        self.etag = headers.get('ETag')
+        self.content_type = headers.get('Content-Type')
+        self.sequence = _header(headers, 'X-Snapshot-Sequence', int)
+        self.size = _header(headers, 'X-Snapshot-Size', int)
+        self.created = _header(headers, 'X-Snapshot-Created', float)
+        self.age_seconds = _header(headers, 'X-Snapshot-Age-Seconds', float)
+        self.interval_ms = _header(headers, 'X-Snapshot-Interval-Ms', int)
+        self.is_fresh = _header(headers, 'X-Snapshot-Is-Fresh', lambda value: value == 'true')
+        self.capture_rate = headers.get('X-Snapshot-Capture-Rate')
+        self.display = _header(headers, 'X-Snapshot-Display', int)
+        self.format = headers.get('X-Snapshot-Format')
+        self.width = _header(headers, 'X-Snapshot-Width', int)
+        self.height = _header(headers, 'X-Snapshot-Height', int)
+        self.cache = headers.get('X-Snapshot-Cache')
+
+    def pixels(self):
+        """Height x width x 3 uint8 array viewing the body of a format=raw snapshot (read-only, no copy)"""
+        import numpy as np
+
+        if self.format != 'raw':
+            raise ValueError(f'pixels() needs a raw snapshot, got {self.format}')
+        return np.frombuffer(self.data, dtype=np.uint8).reshape(self.height, self.width, 3)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.data)
+
+    def __repr__(self):
+        return (f'<Snapshot seq={self.sequence} format={self.format} {self.width}x{self.height} '
+                f'{len(self.data)} bytes{" not modified" if self.not_modified else ""}>')
+
+
+def _header(headers, name, convert):
+    value = headers.get(name)
+    return convert(value) if value is not None else None
+
+
+def _snapshot_params(format, quality, crop, scale, after_seq, wait_timeout):
+    params = {'format': format, 'quality': quality, 'scale': scale, 'after_seq': after_seq, 'timeout': wait_timeout}
+    if crop is not None:
+        params['crop'] = crop if isinstance(crop, str) else ','.join(str(int(value)) for value in crop)
+    return {k: v for k, v in params.items() if v is not None}
+
+
+class _Endpoints:
+    """The API calls, shared by the sync and asyncio clients
+
+    Each method returns what _call returns: the result for ApiClient, an
+    awaitable of it for AsyncApiClient. Every method accepts timeout= and
+    retries= to override the client defaults for that call.
+    """
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT_S, retries=DEFAULT_RETRIES, display=None):
+        self.base_url = base_url.rstrip('/')
+        # Several displays per container (see displays.py): address one of them
+        if display is not None:
+            self.base_url += f'/displays/{int(display)}'
+        self.timeout = timeout
+        self.retries = retries
+
+    def send_key(self, key, duration_ms=None, wait=None, **options):
+        return self._call('POST', '/send-key', _encode({'key': key, 'duration_ms': duration_ms, 'wait': wait}),
+                          **options)
+
+    def send_key_duration(self, key, duration_ms, wait=None, **options):
+        return self._call('POST', '/send-key-duration',
+                          _encode({'key': key, 'duration_ms': duration_ms, 'wait': wait}), **options)
+
+    def move_mouse(self, x, y, **options):
+        return self._call('POST', '/move-mouse', _encode({'x': x, 'y': y}), **options)
+
+    def click_mouse(self, x, y, button=None, clicks=None, interval=None, **options):
+        return self._call('POST', '/click-mouse', _encode({
+            'x': x, 'y': y, 'button': button, 'clicks': clicks, 'interval': interval,
+        }), **options)
+
+    def drag_mouse(self, start_x, start_y, end_x, end_y, duration=None, button=None, wait=None, **options):
+        return self._call('POST', '/drag-mouse', _encode({
+            'start_x': start_x, 'start_y': start_y, 'end_x': end_x, 'end_y': end_y,
+            'duration': duration, 'button': button, 'wait': wait,
+        }), **options)
+
+    def input_batch(self, actions, **options):
+        """Run a list of actions server-side in one round trip (see /input-batch)"""
+        return self._call('POST', '/input-batch', _encode({'actions': actions}), **options)
+
+    def snapshot(self, format=None, quality=None, crop=None, scale=None, after_seq=None, wait_timeout=None,
+                 if_none_match=None, **options):
+        """GET /desktop-snapshot as a Snapshot
+
+        crop is (x, y, width, height). after_seq long-polls for a newer frame
+        for up to wait_timeout seconds (the call timeout is extended by it).
+        With if_none_match (a previous Snapshot.etag) or an after_seq that
+        times out, an unchanged frame comes back with not_modified set.
+        """
+        params = _snapshot_params(format, quality, crop, scale, after_seq, wait_timeout)
+        headers = {'If-None-Match': if_none_match} if if_none_match else None
+        if after_seq is not None and options.get('timeout') is None:
+            options['timeout'] = self.timeout + (wait_timeout if wait_timeout is not None else 10)
+        return self._call('GET', '/desktop-snapshot', params=params, headers=headers, expect=(200, 304),
+                          parse=Snapshot, **options)
+
+    def snapshot_info(self, **options):
+        """GET /snapshot-info; the body is returned for unhealthy (503) answers too"""
+        return self._call('GET', '/snapshot-info', expect=(200, 503), **options)
+
+    def _retry_delay(self, attempt):
+        return RETRY_BACKOFF_S * 2 ** attempt
+
+
+class ApiClient(_Endpoints):
+    """Blocking client over a pooled requests.Session (thread-safe)
+
+    Pass session= to share one connection pool between clients, as
+    MultiClient does.
+    """
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT_S, retries=DEFAULT_RETRIES, display=None,
+                 pool_size=DEFAULT_POOL_SIZE, session=None):
+        super().__init__(base_url, timeout, retries, display)
+        self._owns_session = session is None
+        self.session = session or _pooled_session(1, pool_size)
+
+    def _call(self, method, path, body=None, params=None, headers=None, expect=(200,), parse=_parse_json,
+              timeout=None, retries=None):
+        url = self.base_url + path
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        if body is not None:
+            headers = dict(headers or {}, **_JSON_HEADERS)
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            try:
+                response = self.session.request(method, url, data=body, params=params, headers=headers,
+                                                timeout=timeout)
+            except requests.exceptions.ConnectionError as e:
+                if last or (method != 'GET' and not _before_send(e)):
+                    raise ApiError(f'{method} {url} failed: {e}')
+            except requests.exceptions.Timeout:
+                if last or method != 'GET':
+                    raise ApiError(f'{method} {url} timed out after {timeout}s')
+            else:
+                if response.status_code in expect:
+                    return parse(response.status_code, response.headers, response.content)
+                if last or method != 'GET' or response.status_code not in RETRY_STATUSES:
+                    raise ApiError(_error_message(response.content), response.status_code, response.content)
+            time.sleep(self._retry_delay(attempt))
+
+    def close(self):
+        if self._owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _before_send(error):
+    """True when a requests ConnectionError happened while connecting, before anything was sent"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError; NewConnectionError (refused, DNS) is a ConnectTimeoutError
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def _pooled_session(hosts, pool_size):
+    session = requests.Session()
+    # Retries are handled per call so input requests are never replayed once sent
+    adapter = HTTPAdapter(pool_connections=max(hosts, 1), pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class AsyncApiClient(_Endpoints):
+    """asyncio client over a pooled aiohttp session; use inside a running event loop
+
+    Methods are coroutines. Close with await client.close(), or use the
+    client as an async context manager. Pass session= to share a pool.
+    """
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT_S, retries=DEFAULT_RETRIES, display=None,
+                 pool_size=DEFAULT_POOL_SIZE, session=None):
+        super().__init__(base_url, timeout, retries, display)
+        self.pool_size = pool_size
+        self._owns_session = session is None
+        self.session = session
+
+    async def _call(self, method, path, body=None, params=None, headers=None, expect=(200,), parse=_parse_json,
+                    timeout=None, retries=None):
+        import aiohttp
+
+        if self.session is None:
+            self.session = _pooled_aiohttp_session(1, self.pool_size)
+        url = self.base_url + path
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        if body is not None:
+            headers = dict(headers or {}, **_JSON_HEADERS)
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            try:
+                async with self.session.request(method, url, data=body, params=params, headers=headers,
+                                                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    content = await response.read()
+                    if response.status in expect:
+                        return parse(response.status, response.headers, content)
+                    if last or method != 'GET' or response.status not in RETRY_STATUSES:
+                        raise ApiError(_error_message(content), response.status, content)
+            except asyncio.TimeoutError:
+                if last or method != 'GET':
+                    raise ApiError(f'{method} {url} timed out after {timeout}s')
+            except aiohttp.ClientError as e:
+                # ClientConnectorError: the connection was never established
+                if last or (method != 'GET' and not isinstance(e, aiohttp.ClientConnectorError)):
+                    raise ApiError(f'{method} {url} failed: {e or type(e).__name__}')
+            await asyncio.sleep(self._retry_delay(attempt))
+
+    async def close(self):
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def _pooled_aiohttp_session(hosts, pool_size):
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(limit=max(hosts, 1) * pool_size, limit_per_host=pool_size,
+                                     keepalive_timeout=60)
+    return aiohttp.ClientSession(connector=connector)
+
+
+def _instance_urls(instances, host):
+    """{id: url} from '1-5,8', an iterable of ids, or an {id: url} mapping"""
+    if isinstance(instances, dict):
+        return dict(instances)
+    ids = parse_instance_ids(instances) if isinstance(instances, str) else sorted(instances)
+    return {i: f"http://{host}:{api_port(i)}" for i in ids}
+
+
+class _Multi:
+    def __init__(self, urls, session, client_class, options):
+        self.session = session
+        self.clients = {i: client_class(url, session=session, **options) for i, url in sorted(urls.items())}
+
+    def _select(self, instances):
+        if instances is None:
+            return self.clients
+        ids = parse_instance_ids(instances) if isinstance(instances, str) else instances
+        unknown = sorted(set(ids) - set(self.clients))
+        if unknown:
+            raise ValueError(f'Unknown instances: {unknown}')
+        return {i: self.clients[i] for i in sorted(ids)}
+
+
+class MultiClient(_Multi):
+    """ApiClients for many instances sharing one connection pool, called concurrently from threads
+
+        fleet = MultiClient('1-40')
+        fleet.call('send_key', 'space')                        # every instance
+        fleet.call('snapshot', format='jpeg', instances=[1, 2])
+    """
+
+    def __init__(self, instances, host='localhost', pool_size=4, max_workers=32, **options):
+        urls = _instance_urls(instances, host)
+        super().__init__(urls, _pooled_session(len(urls), pool_size), ApiClient, options)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+
+    def map(self, function, instances=None):
+        """{instance_id: function(client)} for the selected instances, run concurrently"""
+        selected = self._select(instances)
+        futures = {i: self._pool.submit(function, client) for i, client in selected.items()}
+        results = {}
+        for i, future in futures.items():
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                results[i] = e
+        return results
+
+    def call(self, name, *args, instances=None, **kwargs):
+        """Call one client method (send_key, snapshot, ...) on every selected instance"""
+        return self.map(lambda client: getattr(client, name)(*args, **kwargs), instances)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncMultiClient(_Multi):
+    """AsyncApiClients for many instances sharing one aiohttp session, called with asyncio.gather
+
+    Create it inside a running event loop:
+
+        async with AsyncMultiClient('1-40') as fleet:
+            snapshots = await fleet.call('snapshot', format='jpeg', scale=0.25)
+    """
+
+    def __init__(self, instances, host='localhost', pool_size=4, **options):
+        urls = _instance_urls(instances, host)
+        super().__init__(urls, _pooled_aiohttp_session(len(urls), pool_size), AsyncApiClient, options)
+
+    async def map(self, function, instances=None):
+        """{instance_id: await function(client)} for the selected instances, run concurrently"""
+        selected = self._select(instances)
+        results = await asyncio.gather(*(function(client) for client in selected.values()), return_exceptions=True)
+        return dict(zip(selected, results))
+
+    async def call(self, name, *args, instances=None, **kwargs):
+        return await self.map(lambda client: getattr(client, name)(*args, **kwargs), instances)
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""Load benchmark for the control API against a headless Xvfb display.
+
+Starts a private Xvfb server and api.py under gunicorn (no Wine or game
+needed), then drives concurrent load against one endpoint at a time:
+
+  key        POST /send-key (short press)
+  move       POST /move-mouse
+  batch      POST /input-batch with --batch-size clicks
+  snapshot   GET /desktop-snapshot (--snapshot-format, --snapshot-scale)
+
+Every scenario reports throughput, p50/p95/p99/max latency and errors;
+snapshot scenarios also report bytes per frame. Results can be written as
+JSON together with the git commit and settings, and --compare prints the
+change against an earlier JSON run.
+
+Usage:
+  python3 bench_api.py [--concurrency 8] [--duration 10] [--json out.json]
+  python3 bench_api.py --scenarios snapshot --snapshot-format jpeg --compare before.json
+  python3 bench_api.py --url http://localhost:5000   # benchmark a running server
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from bench_input_backends import percentile, start_xvfb
+
+SCENARIOS = ('key', 'move', 'batch', 'snapshot')
+
+
+def start_api(display, port, interval_ms, server):
+    """Launch api.py against display; returns the process once the first frame exists"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DISPLAY=display, API_PORT=str(port), CAPTURE_MODE='memory',
+               SNAPSHOT_INTERVAL_MS=str(interval_ms), CAPTURE_ADAPTIVE='false')
+    if server == 'dev':
+        command = [sys.executable, os.path.join(here, 'api.py')]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(here, 'gunicorn.conf.py'), 'api:app']
+    process = subprocess.Popen(command, cwd=here, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'api.py exited with status {process.returncode} during startup')
+        try:
+            if requests.get(f'{url}/snapshot-info', timeout=1).status_code == 200:
+                return process, url
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    sys.exit('api.py did not report a fresh frame within 30s')
+
+
+def scenario_request(name, args):
+    """(method, path, kwargs) for one request of a scenario"""
+    if name == 'key':
+        return 'POST', '/send-key', {'json': {'key': 'a', 'duration_ms': 10}}
+    if name == 'move':
+        return 'POST', '/move-mouse', {'json': {'x': 200, 'y': 200}}
+    if name == 'batch':
+        actions = [{'type': 'click', 'x': 100 + n, 'y': 100} for n in range(args.batch_size)]
+        return 'POST', '/input-batch', {'json': {'actions': actions}}
+    params = {'format': args.snapshot_format, 'scale': args.snapshot_scale}
+    return 'GET', '/desktop-snapshot', {'params': params}
+
+
+def run_scenario(url, name, args):
+    """Hammer one endpoint from --concurrency threads for --duration seconds"""
+    method, path, kwargs = scenario_request(name, args)
+    latencies, sizes, errors = [], [], []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(args.concurrency + 1)
+    stop_at = [0.0]
+
+    def worker():
+        # One keep-alive session per client thread, like a real poller
+        session = requests.Session()
+        try:
+            session.request(method, f'{url}{path}', timeout=args.timeout, **kwargs)  # warm up the connection
+        except requests.exceptions.RequestException:
+            pass  # counted as an error in the timed loop
+        local_latencies, local_sizes, local_errors = [], [], []
+        start_barrier.wait()
+        while time.monotonic() < stop_at[0]:
+            started = time.perf_counter()
+            try:
+                response = session.request(method, f'{url}{path}', timeout=args.timeout, **kwargs)
+                elapsed = time.perf_counter() - started
+                if response.status_code != 200:
+                    local_errors.append(f'HTTP {response.status_code}')
+                    continue
+            except requests.exceptions.RequestException as e:
+                local_errors.append(type(e).__name__)
+                continue
+            local_latencies.append(elapsed * 1000.0)
+            if name == 'snapshot':
+                local_sizes.append(len(response.content))
+        session.close()
+        with lock:
+            latencies.extend(local_latencies)
+            sizes.extend(local_sizes)
+            errors.extend(local_errors)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.monotonic()
+    stop_at[0] = started + args.duration
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    result = {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+    if latencies:
+        result.update({
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+            'max_ms': round(max(latencies), 3),
+        })
+    if name == 'batch':
+        result['actions_per_second'] = round(result['throughput_rps'] * args.batch_size, 1)
+    if sizes:
+        result['bytes_per_frame'] = round(sum(sizes) / len(sizes))
+    if errors:
+        result['error_samples'] = sorted(set(errors))[:5]
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'scenario':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'errors':>7} {'bytes/frame':>12}")
+    for name, stats in results.items():
+        print(f"{name:<10} {stats['throughput_rps']:>9.1f} {stats.get('p50_ms', 0):>9.3f} "
+              f"{stats.get('p95_ms', 0):>9.3f} {stats.get('p99_ms', 0):>9.3f} {stats.get('max_ms', 0):>9.3f} "
+              f"{stats['errors']:>7} {stats.get('bytes_per_frame', ''):>12}")
+
+
+def print_comparison(results, settings, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange against {baseline_path} (commit {baseline.get('commit')}):")
+    differing = sorted(key for key, value in settings.items()
+                       if key in baseline.get('settings', {}) and baseline['settings'][key] != value)
+    if differing:
+        print(f"Note: settings differ from the baseline: {', '.join(differing)}")
+    print(f"{'scenario':<10} {'metric':<15} {'before':>10} {'after':>10} {'change':>9}")
+    for name, stats in results.items():
+        before = baseline.get('results', {}).get(name)
+        if not before:
+            continue
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'bytes_per_frame'):
+            if metric not in stats or not before.get(metric):
+                continue
+            change = (stats[metric] - before[metric]) / before[metric] * 100.0
+            print(f"{name:<10} {metric:<15} {before[metric]:>10} {stats[metric]:>10} {change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'comma-separated scenarios to run (default: {",".join(SCENARIOS)})')
+    parser.add_argument('--concurrency', type=int, default=8, help='client threads per scenario (default: 8)')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario (default: 10)')
+    parser.add_argument('--timeout', type=float, default=10, help='per-request timeout in seconds (default: 10)')
+    parser.add_argument('--batch-size', type=int, default=10, help='clicks per /input-batch request (default: 10)')
+    parser.add_argument('--snapshot-format', default='png', help='snapshot format (default: png)')
+    parser.add_argument('--snapshot-scale', type=float, default=1.0, help='snapshot scale (default: 1.0)')
+    parser.add_argument('--interval-ms', type=int, default=100,
+                        help='SNAPSHOT_INTERVAL_MS for the started server (default: 100)')
+    parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn',
+                        help='how to start api.py (default: gunicorn; dev always listens on port 5000)')
+    parser.add_argument('--port', type=int, default=5097, help='port for the started server (default: 5097)')
+    parser.add_argument('--display', help='use an existing X display instead of starting Xvfb')
+    parser.add_argument('--url', help='benchmark an already running API instead of starting one')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = sorted(set(scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(unknown)}')
+
+    xvfb = api = None
+    url = args.url
+    display = args.display
+    try:
+        if not url:
+            if not display:
+                display = ':96'
+                xvfb = start_xvfb(display)
+            port = 5000 if args.server == 'dev' else args.port
+            api, url = start_api(display, port, args.interval_ms, args.server)
+
+        results = {}
+        for name in scenarios:
+            print(f"Running {name} with {args.concurrency} clients for {args.duration:g}s...")
+            results[name] = run_scenario(url, name, args)
+    finally:
+        if api is not None:
+            api.terminate()
+            api.wait()
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    settings = {
+        'url': args.url, 'server': None if args.url else args.server, 'display': display,
+        'concurrency': args.concurrency, 'duration_s': args.duration, 'batch_size': args.batch_size,
+        'snapshot_format': args.snapshot_format, 'snapshot_scale': args.snapshot_scale,
+        'interval_ms': None if args.url else args.interval_ms,
+    }
+    print()
+    print_results(results)
+    if args.compare:
+        print_comparison(results, settings, args.compare)
+
+    if args.json:
+        report = {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'settings': settings,
+            'results': results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Per-call overhead of api_client.py against naive requests usage.
+
+Starts a private Xvfb server and api.py under gunicorn (like bench_api.py),
+or uses a running API with --url, then times the same calls made three ways,
+one after another from a single caller:
+
+  naive    requests.post(url, json=...) / requests.get(url).content, a new
+           connection and JSON encoding per call (what test_api.py does)
+  client   ApiClient: pooled keep-alive session, precompacted JSON bodies
+  async    AsyncApiClient awaited call by call on one event loop
+
+for a short key press (POST /send-key), a mouse move and a small JPEG
+snapshot. Reports p50/p95/mean latency per call and the time the client
+saves per call against the naive way. Results can be written as JSON.
+Over loopback a new connection costs well under a millisecond; against a
+remote host every naive call also pays an extra network round trip.
+
+Usage:
+  python3 bench_client.py [--calls 500] [--json out.json]
+  python3 bench_client.py --url http://localhost:5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+
+import requests
+
+from api_client import ApiClient, AsyncApiClient
+from bench_api import git_commit, start_api
+from bench_input_backends import percentile, start_xvfb
+
+CALLS = ('key', 'move', 'snapshot')
+MODES = ('naive', 'client', 'async')
+SNAPSHOT_PARAMS = {'format': 'jpeg', 'scale': 0.25, 'quality': 60}
+
+
+def naive_call(url, name, timeout):
+    if name == 'key':
+        response = requests.post(f'{url}/send-key', json={'key': 'a', 'duration_ms': 10}, timeout=timeout)
+    elif name == 'move':
+        response = requests.post(f'{url}/move-mouse', json={'x': 200, 'y': 200}, timeout=timeout)
+    else:
+        response = requests.get(f'{url}/desktop-snapshot', params=SNAPSHOT_PARAMS, timeout=timeout)
+        response.content
+    response.raise_for_status()
+
+
+def client_call(client, name):
+    """client.<call>(); a coroutine for AsyncApiClient"""
+    if name == 'key':
+        return client.send_key('a', duration_ms=10)
+    if name == 'move':
+        return client.move_mouse(200, 200)
+    return client.snapshot(**SNAPSHOT_PARAMS)
+
+
+def summarize(samples):
+    return {
+        'calls': len(samples),
+        'mean_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': round(percentile(samples, 0.50), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+    }
+
+
+def time_sync(call, calls, warmup):
+    for _ in range(warmup):
+        call()
+    samples = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return summarize(samples)
+
+
+async def time_async(url, name, calls, warmup, timeout):
+    async with AsyncApiClient(url, timeout=timeout) as client:
+        for _ in range(warmup):
+            await client_call(client, name)
+        samples = []
+        for _ in range(calls):
+            started = time.perf_counter()
+            await client_call(client, name)
+            samples.append((time.perf_counter() - started) * 1000.0)
+    return summarize(samples)
+
+
+def run(url, args):
+    results = {}
+    with ApiClient(url, timeout=args.timeout) as client:
+        for name in CALLS:
+            print(f"Timing {name} ({args.calls} calls per mode)...")
+            results[name] = {
+                'naive': time_sync(lambda: naive_call(url, name, args.timeout), args.calls, args.warmup),
+                'client': time_sync(lambda: client_call(client, name), args.calls, args.warmup),
+                'async': asyncio.run(time_async(url, name, args.calls, args.warmup, args.timeout)),
+            }
+            naive_mean = results[name]['naive']['mean_ms']
+            for mode in ('client', 'async'):
+                results[name][mode]['saved_ms_per_call'] = round(naive_mean - results[name][mode]['mean_ms'], 3)
+    return results
+
+
+def print_results(results):
+    print(f"{'call':<9} {'mode':<7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'saved ms/call':>14}")
+    for name, modes in results.items():
+        for mode in MODES:
+            stats = modes[mode]
+            saved = stats.get('saved_ms_per_call')
+            print(f"{name:<9} {mode:<7} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+                  f"{'' if saved is None else f'{saved:.3f}':>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500, help='timed calls per call type and mode (default: 500)')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed calls before each run (default: 20)')
+    parser.add_argument('--timeout', type=float, default=10, help='per-call timeout in seconds (default: 10)')
+    parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn',
+                        help='how to start api.py (default: gunicorn; dev always listens on port 5000)')
+    parser.add_argument('--port', type=int, default=5098, help='port for the started server (default: 5098)')
+    parser.add_argument('--display', help='use an existing X display instead of starting Xvfb')
+    parser.add_argument('--url', help='benchmark an already running API instead of starting one')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    xvfb = api = None
+    url = args.url
+    display = args.display
+    try:
+        if not url:
+            if not display:
+                display = ':95'
+                xvfb = start_xvfb(display)
+            port = 5000 if args.server == 'dev' else args.port
+            api, url = start_api(display, port, 100, args.server)
+        results = run(url, args)
+    finally:
+        if api is not None:
+            api.terminate()
+            api.wait()
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    print()
+    print_results(results)
+
+    if args.json:
+        report = {
+            'commit': git_commit(),
+            'timestamp': time.time(),
+            'host': {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count()},
+            'settings': {'url': args.url, 'server': None if args.url else args.server, 'calls': args.calls,
+                         'warmup': args.warmup, 'snapshot': SNAPSHOT_PARAMS},
+            'results': results,
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Compare per-event latency of the input backends against an Xvfb display.
+
+Starts a private Xvfb server (unless --display is given), then times key
+presses, pointer moves and clicks through each backend:
+
+  xtest              persistent XTEST connection (the API default)
+  pyautogui          pyautogui with its per-call PAUSE disabled
+  pyautogui-legacy   pyautogui with its stock 100ms PAUSE, as api.py used it
+
+Usage:
+  python3 bench_input_backends.py [--iterations 200] [--display :99] [--json out.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from input_backends import PyAutoGUIBackend, XTestBackend
+
+
+def start_xvfb(display, geometry='1280x800x24'):
+    if not shutil.which('Xvfb'):
+        sys.exit('Xvfb not found; install it or pass --display of a running X server')
+    process = subprocess.Popen(
+        ['Xvfb', display, '-screen', '0', geometry, '-nolisten', 'tcp'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    socket_path = f'/tmp/.X11-unix/X{display.lstrip(":")}'
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            sys.exit(f'Xvfb failed to start on {display}')
+        time.sleep(0.05)
+    return process
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def time_calls(func, iterations):
+    samples = []
+    for n in range(iterations):
+        started = time.perf_counter()
+        func(n)
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
+
+
+def bench_backend(backend, iterations):
+    operations = {
+        'key_press': lambda n: backend.press('a'),
+        'move': lambda n: backend.move_to(100 + n % 500, 100 + n % 300),
+        'click': lambda n: backend.click(200, 200),
+        'click_x10': lambda n: backend.click(200, 200, clicks=10),
+    }
+    results = {}
+    for name, func in operations.items():
+        func(0)  # warm up key/keycode caches and the connection
+        backend.sync()
+        samples = time_calls(func, iterations)
+        backend.sync()
+        results[name] = {
+            'iterations': iterations,
+            'mean_ms': round(statistics.mean(samples), 3),
+            'p50_ms': round(percentile(samples, 0.50), 3),
+            'p95_ms': round(percentile(samples, 0.95), 3),
+            'max_ms': round(max(samples), 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200, help='events per operation (default: 200)')
+    parser.add_argument('--legacy-iterations', type=int, default=10,
+                        help='events per operation for pyautogui-legacy, which sleeps 100ms per call (default: 10)')
+    parser.add_argument('--display', help='use an existing X display instead of starting Xvfb')
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    xvfb = None
+    display = args.display
+    if not display:
+        display = ':97'
+        xvfb = start_xvfb(display)
+    os.environ['DISPLAY'] = display
+
+    try:
+        results = {}
+        results['xtest'] = bench_backend(XTestBackend(display), args.iterations)
+        results['pyautogui'] = bench_backend(PyAutoGUIBackend(), args.iterations)
+        results['pyautogui-legacy'] = bench_backend(PyAutoGUIBackend(pause=0.1), args.legacy_iterations)
+    finally:
+        if xvfb is not None:
+            xvfb.terminate()
+            xvfb.wait()
+
+    print(f"{'backend':<18} {'operation':<10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for backend, operations in results.items():
+        for operation, stats in operations.items():
+            print(f"{backend:<18} {operation:<10} {stats['mean_ms']:>9.3f} {stats['p50_ms']:>9.3f} "
+                  f"{stats['p95_ms']:>9.3f} {stats['max_ms']:>9.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'display': display, 'results': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,730 @@
+"""In-process desktop capture engine.
+
+Keeps one persistent Xlib connection open and grabs the root window through
+MIT-SHM (XShmGetImage) into a shared-memory segment that is reused for every
+frame. When the extension is not available (remote display, no shared IPC
+namespace) it falls back to XGetSubImage into a reusable client-side buffer.
+The newest frame is kept in memory as an RGB NumPy array together with a
+monotonically increasing sequence number, so the API can serve it without
+going through the filesystem.
+
+The capture rate follows demand: the configured interval while clients
+request frames, a faster interval while streams or long-polls are attached,
+and a slow idle interval once nobody has asked for a frame for a while. A
+one-off request against an idle engine wakes it for an immediate capture.
+Optionally an XDamage monitor skips grabs while the screen is unchanged.
+"""
+import contextlib
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+# Xlib constants
+ZPIXMAP = 2
+LSB_FIRST = 0
+ALL_PLANES = ctypes.c_ulong(~0 & 0xFFFFFFFFFFFFFFFF).value
+
+# SysV IPC constants
+IPC_PRIVATE = 0
+IPC_CREAT = 0o1000
+IPC_RMID = 0
+
+
+class CaptureError(Exception):
+    """Raised when the X server cannot be reached or a grab fails"""
+
+
+class _XImage(ctypes.Structure):
+    # Only the leading fields of XImage are declared; the structure is
+    # always accessed through a pointer owned by Xlib.
+    _fields_ = [
+        ('width', ctypes.c_int),
+        ('height', ctypes.c_int),
+        ('xoffset', ctypes.c_int),
+        ('format', ctypes.c_int),
+        ('data', ctypes.c_void_p),
+        ('byte_order', ctypes.c_int),
+        ('bitmap_unit', ctypes.c_int),
+        ('bitmap_bit_order', ctypes.c_int),
+        ('bitmap_pad', ctypes.c_int),
+        ('depth', ctypes.c_int),
+        ('bytes_per_line', ctypes.c_int),
+        ('bits_per_pixel', ctypes.c_int),
+        ('red_mask', ctypes.c_ulong),
+        ('green_mask', ctypes.c_ulong),
+        ('blue_mask', ctypes.c_ulong),
+    ]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = [
+        ('shmseg', ctypes.c_ulong),
+        ('shmid', ctypes.c_int),
+        ('shmaddr', ctypes.c_void_p),
+        ('readOnly', ctypes.c_int),
+    ]
+
+
+class _XErrorEvent(ctypes.Structure):
+    _fields_ = [
+        ('type', ctypes.c_int),
+        ('display', ctypes.c_void_p),
+        ('resourceid', ctypes.c_ulong),
+        ('serial', ctypes.c_ulong),
+        ('error_code', ctypes.c_ubyte),
+        ('request_code', ctypes.c_ubyte),
+        ('minor_code', ctypes.c_ubyte),
+    ]
+
+
+_XErrorHandler = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(_XErrorEvent))
+
+_xlib = None
+_xext = None
+_libc = None
+_last_x_error = threading.local()
+
+
+@_XErrorHandler
+def _on_x_error(display, event):
+    # The default Xlib handler terminates the process; record the error instead
+    # so the grab that caused it can fail and reconnect.
+    _last_x_error.code = event.contents.error_code
+    return 0
+
+
+def _load_libraries():
+    global _xlib, _xext, _libc
+    if _xlib is not None:
+        return
+
+    xlib_path = ctypes.util.find_library('X11')
+    xext_path = ctypes.util.find_library('Xext')
+    if not xlib_path:
+        raise CaptureError('libX11 not found')
+
+    xlib = ctypes.CDLL(xlib_path)
+    xext = ctypes.CDLL(xext_path) if xext_path else None
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+    xlib.XInitThreads.restype = ctypes.c_int
+    xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    xlib.XOpenDisplay.restype = ctypes.c_void_p
+    xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    xlib.XDefaultScreen.argtypes = [ctypes.c_void_p]
+    xlib.XDefaultScreen.restype = ctypes.c_int
+    xlib.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    xlib.XRootWindow.restype = ctypes.c_ulong
+    xlib.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    xlib.XDefaultVisual.restype = ctypes.c_void_p
+    xlib.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    xlib.XDefaultDepth.restype = ctypes.c_int
+    xlib.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    xlib.XDisplayWidth.restype = ctypes.c_int
+    xlib.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    xlib.XDisplayHeight.restype = ctypes.c_int
+    xlib.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    xlib.XFree.argtypes = [ctypes.c_void_p]
+    xlib.XSetErrorHandler.argtypes = [_XErrorHandler]
+    xlib.XSetErrorHandler.restype = ctypes.c_void_p
+    xlib.XCreateImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_int,
+        ctypes.c_void_p, ctypes.c_uint, ctypes.c_uint, ctypes.c_int, ctypes.c_int,
+    ]
+    xlib.XCreateImage.restype = ctypes.POINTER(_XImage)
+    xlib.XGetSubImage.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+        ctypes.c_uint, ctypes.c_ulong, ctypes.c_int, ctypes.POINTER(_XImage),
+        ctypes.c_int, ctypes.c_int,
+    ]
+    xlib.XGetSubImage.restype = ctypes.POINTER(_XImage)
+
+    if xext is not None:
+        xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+        xext.XShmQueryExtension.restype = ctypes.c_int
+        xext.XShmCreateImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+            ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo), ctypes.c_uint, ctypes.c_uint,
+        ]
+        xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+        xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmAttach.restype = ctypes.c_int
+        xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+        xext.XShmDetach.restype = ctypes.c_int
+        xext.XShmGetImage.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+            ctypes.c_int, ctypes.c_int, ctypes.c_ulong,
+        ]
+        xext.XShmGetImage.restype = ctypes.c_int
+
+    libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+    libc.shmget.restype = ctypes.c_int
+    libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    libc.shmat.restype = ctypes.c_void_p
+    libc.shmdt.argtypes = [ctypes.c_void_p]
+    libc.shmdt.restype = ctypes.c_int
+    libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+    libc.shmctl.restype = ctypes.c_int
+
+    xlib.XInitThreads()
+    xlib.XSetErrorHandler(_on_x_error)
+    _xlib, _xext, _libc = xlib, xext, libc
+
+
+class X11Grabber:
+    """Grabs the root window of one X display into a reusable buffer"""
+
+    def __init__(self, display_name=None):
+        self.display_name = display_name or os.environ.get('DISPLAY', ':0')
+        self.use_shm = False
+        self.width = 0
+        self.height = 0
+        self._display = None
+        self._root = None
+        self._image = None
+        self._shminfo = None
+        self._buffer = None
+        self._view = None
+
+    def open(self):
+        _load_libraries()
+        display = _xlib.XOpenDisplay(self.display_name.encode())
+        if not display:
+            raise CaptureError(f'Cannot open X display {self.display_name}')
+
+        self._display = display
+        screen = _xlib.XDefaultScreen(display)
+        self._root = _xlib.XRootWindow(display, screen)
+        visual = _xlib.XDefaultVisual(display, screen)
+        depth = _xlib.XDefaultDepth(display, screen)
+        self.width = _xlib.XDisplayWidth(display, screen)
+        self.height = _xlib.XDisplayHeight(display, screen)
+
+        if os.environ.get('CAPTURE_DISABLE_SHM', '').lower() not in ('1', 'true', 'yes'):
+            self.use_shm = self._attach_shm(visual, depth)
+        if not self.use_shm:
+            self._create_client_image(visual, depth)
+
+        image = self._image.contents
+        if image.bits_per_pixel not in (16, 32):
+            self.close()
+            raise CaptureError(f'Unsupported pixel format: {image.bits_per_pixel} bits per pixel')
+
+        size = image.bytes_per_line * image.height
+        raw = (ctypes.c_ubyte * size).from_address(image.data)
+        self._view = np.frombuffer(raw, dtype=np.uint8).reshape(image.height, image.bytes_per_line)
+
+    def _attach_shm(self, visual, depth):
+        if _xext is None or not _xext.XShmQueryExtension(self._display):
+            return False
+
+        shminfo = _XShmSegmentInfo()
+        image = _xext.XShmCreateImage(
+            self._display, visual, depth, ZPIXMAP, None, ctypes.byref(shminfo),
+            self.width, self.height,
+        )
+        if not image:
+            return False
+
+        size = image.contents.bytes_per_line * image.contents.height
+        shmid = _libc.shmget(IPC_PRIVATE, size, IPC_CREAT | 0o600)
+        if shmid < 0:
+            _xlib.XFree(image)
+            return False
+
+        addr = _libc.shmat(shmid, None, 0)
+        if addr is None or addr == ctypes.c_void_p(-1).value:
+            _libc.shmctl(shmid, IPC_RMID, None)
+            _xlib.XFree(image)
+            return False
+
+        shminfo.shmid = shmid
+        shminfo.shmaddr = addr
+        shminfo.readOnly = 0
+        image.contents.data = addr
+
+        _last_x_error.code = 0
+        attached = _xext.XShmAttach(self._display, ctypes.byref(shminfo))
+        _xlib.XSync(self._display, 0)
+        # Mark the segment for removal now; it stays alive while attached
+        _libc.shmctl(shmid, IPC_RMID, None)
+
+        if not attached or getattr(_last_x_error, 'code', 0):
+            _libc.shmdt(addr)
+            image.contents.data = None
+            _xlib.XFree(image)
+            return False
+
+        self._image = image
+        self._shminfo = shminfo
+        return True
+
+    def _create_client_image(self, visual, depth):
+        image = _xlib.XCreateImage(
+            self._display, visual, depth, ZPIXMAP, 0, None, self.width, self.height, 32, 0,
+        )
+        if not image:
+            raise CaptureError('XCreateImage failed')
+        self._buffer = ctypes.create_string_buffer(image.contents.bytes_per_line * self.height)
+        image.contents.data = ctypes.addressof(self._buffer)
+        self._image = image
+
+    def grab(self):
+        """Capture the root window and return it as a new HxWx3 RGB array"""
+        if self._display is None:
+            raise CaptureError('Grabber is not open')
+
+        _last_x_error.code = 0
+        if self.use_shm:
+            ok = _xext.XShmGetImage(self._display, self._root, self._image, 0, 0, ALL_PLANES)
+        else:
+            ok = bool(_xlib.XGetSubImage(
+                self._display, self._root, 0, 0, self.width, self.height,
+                ALL_PLANES, ZPIXMAP, self._image, 0, 0,
+            ))
+        if not ok or getattr(_last_x_error, 'code', 0):
+            raise CaptureError(f'Screen grab failed (X error {getattr(_last_x_error, "code", 0)})')
+
+        return self._to_rgb()
+
+    def _to_rgb(self):
+        image = self._image.contents
+        width, height = self.width, self.height
+
+        if (image.bits_per_pixel == 32 and image.byte_order == LSB_FIRST
+                and image.red_mask == 0xFF0000 and image.green_mask == 0xFF00
+                and image.blue_mask == 0xFF):
+            # Common TigerVNC/Xvfb layout: B, G, R, X bytes per pixel
+            pixels = self._view[:, :width * 4].reshape(height, width, 4)
+            return pixels[:, :, [2, 1, 0]]
+
+        dtype = np.dtype('<u4' if image.bits_per_pixel == 32 else '<u2')
+        if image.byte_order != LSB_FIRST:
+            dtype = dtype.newbyteorder('>')
+        row_bytes = width * dtype.itemsize
+        values = self._view[:, :row_bytes].copy().view(dtype).reshape(height, width).astype(np.uint32)
+
+        rgb = np.empty((height, width, 3), dtype=np.uint8)
+        for channel, mask in enumerate((image.red_mask, image.green_mask, image.blue_mask)):
+            shift = (mask & -mask).bit_length() - 1
+            max_value = mask >> shift
+            component = (values & mask) >> shift
+            rgb[:, :, channel] = (component * 255 // max_value).astype(np.uint8)
+        return rgb
+
+    def close(self):
+        if self._display is None:
+            return
+        if self.use_shm and self._shminfo is not None:
+            _xext.XShmDetach(self._display, ctypes.byref(self._shminfo))
+            _xlib.XSync(self._display, 0)
+            _libc.shmdt(self._shminfo.shmaddr)
+        if self._image:
+            # The pixel memory belongs to us (shm segment or Python buffer)
+            self._image.contents.data = None
+            _xlib.XFree(self._image)
+        _xlib.XCloseDisplay(self._display)
+        self._display = None
+        self._image = None
+        self._shminfo = None
+        self._buffer = None
+        self._view = None
+        self.use_shm = False
+
+
+PR_SET_NAME = 15
+# OS-level name of the capture thread, so per-thread CPU in /proc (top -H,
+# footprint.py) can be told apart from the API's request threads
+CAPTURE_THREAD_NAME = 'capture'
+
+
+def _set_os_thread_name(name):
+    """Name the calling thread in /proc/<pid>/task/<tid>/comm (Linux only, best effort)"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.prctl(PR_SET_NAME, ctypes.c_char_p(name.encode()[:15]), 0, 0, 0)
+    except (OSError, AttributeError):
+        pass
+
+
+class DamageMonitor:
+    """Reports whether the screen changed since the last check, via XDamage
+
+    Uses its own python-xlib connection so it never touches the grabber's
+    Xlib display from another thread. A NonEmpty damage object sends one
+    event when the damaged region becomes non-empty; changed() drains the
+    events and subtracts the damage to re-arm it. Damage that arrives after
+    the subtract triggers a new event, so no change is lost.
+    """
+
+    def __init__(self, display_name):
+        self.display_name = display_name
+        self._display = None
+        self._damage = None
+        self._notify_type = None
+
+    def open(self):
+        try:
+            from Xlib import display as xdisplay, error as xerror
+            from Xlib.ext import damage
+        except ImportError:
+            raise CaptureError('python-xlib is not installed')
+        try:
+            self._display = xdisplay.Display(self.display_name)
+            if not self._display.has_extension(damage.extname):
+                raise CaptureError('X server has no DAMAGE extension')
+            self._display.damage_query_version()
+            root = self._display.screen().root
+            self._damage = self._display.damage_create(root, damage.DamageReportNonEmpty)
+            self._notify_type = self._display.extension_event.DamageNotify
+            self._display.flush()
+        except (xerror.DisplayError, xerror.XError, OSError) as e:
+            self.close()
+            raise CaptureError(f'Cannot set up XDamage on {self.display_name}: {e}')
+
+    def changed(self):
+        """True if anything was drawn since the previous call (or the check failed)"""
+        try:
+            dirty = False
+            while self._display.pending_events():
+                event = self._display.next_event()
+                if event.type == self._notify_type:
+                    dirty = True
+            if dirty:
+                self._display.damage_subtract(self._damage, 0, 0)
+                self._display.flush()
+            return dirty
+        except Exception:
+            # Never let a monitor failure freeze the picture
+            return True
+
+    def close(self):
+        if self._display is not None:
+            try:
+                self._display.close()
+            except Exception:
+                pass
+            self._display = None
+
+
+class Frame:
+    """One captured desktop frame"""
+
+    __slots__ = ('seq', 'timestamp', 'monotonic', 'pixels', 'capture_ms')
+
+    def __init__(self, seq, timestamp, monotonic, pixels, capture_ms):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.monotonic = monotonic
+        self.pixels = pixels
+        self.capture_ms = capture_ms
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    def age_seconds(self):
+        return time.time() - self.timestamp
+
+
+def encode_png(pixels, compress_level=1):
+    """Encode an RGB array as PNG bytes"""
+    import io
+    buffer = io.BytesIO()
+    # Low zlib effort: PNG output is only used for compatibility paths and the
+    # extra compression is not worth the CPU on every frame
+    Image.fromarray(pixels, 'RGB').save(buffer, format='PNG', compress_level=compress_level)
+    return buffer.getvalue()
+
+
+class CaptureEngine:
+    """Background thread that keeps the newest desktop frame in memory"""
+
+    def __init__(self, display_name=None, interval_ms=500, file_output_path=None, on_frame=None,
+                 adaptive=False, active_interval_ms=None, idle_interval_ms=5000, idle_timeout_s=10.0,
+                 use_damage=False):
+        self.display_name = display_name or os.environ.get('DISPLAY', ':0')
+        self.interval_ms = interval_ms
+        self.file_output_path = file_output_path
+        # Called with each new Frame from the capture thread (metrics)
+        self.on_frame = on_frame
+        # Demand-driven rate: active while consumers are attached, interval_ms
+        # while frames were requested within idle_timeout_s, idle otherwise
+        self.adaptive = adaptive
+        self.active_interval_ms = min(active_interval_ms or interval_ms, interval_ms)
+        self.idle_interval_ms = max(idle_interval_ms, interval_ms)
+        self.idle_timeout_s = idle_timeout_s
+        self.use_damage = use_damage
+        self.frames_captured = 0
+        # Interval ticks missed because a capture cycle overran the interval
+        self.frames_dropped = 0
+        # Grabs skipped because XDamage reported no change
+        self.frames_unchanged = 0
+        self.capture_errors = 0
+        self.last_error = None
+        self._grabber = None
+        self._damage = None
+        self._latest = None
+        self._seq = 0
+        # When the latest frame was last known to match the screen (a grab, or no damage since)
+        self._verified = None
+        self._consumers = 0
+        self._last_demand = time.monotonic()
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='capture-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def latest(self):
+        """Return the newest Frame, or None if nothing has been captured yet"""
+        return self._latest
+
+    # Demand ------------------------------------------------------------------
+
+    def touch(self):
+        """Record that a client wants frames; wakes an idle engine"""
+        idle = self.mode() == 'idle'
+        self._last_demand = time.monotonic()
+        if idle:
+            self._wake.set()
+
+    @contextlib.contextmanager
+    def consumer(self):
+        """Context for a stream or long-poll: captures at the active rate while inside"""
+        with self._lock:
+            self._consumers += 1
+        self.touch()
+        if self.adaptive:
+            self._wake.set()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._consumers -= 1
+            self._last_demand = time.monotonic()
+
+    def mode(self):
+        """'active' (consumers attached), 'demand' (recent requests) or 'idle'"""
+        if not self.adaptive:
+            return 'fixed'
+        if self._consumers:
+            return 'active'
+        if time.monotonic() - self._last_demand < self.idle_timeout_s:
+            return 'demand'
+        return 'idle'
+
+    def current_interval_ms(self):
+        """The capture interval in effect right now"""
+        mode = self.mode()
+        if mode == 'active':
+            return self.active_interval_ms
+        if mode == 'idle':
+            return self.idle_interval_ms
+        return self.interval_ms
+
+    def verified_age(self):
+        """Seconds since the latest frame was last known to match the screen"""
+        verified = self._verified
+        return None if verified is None else time.monotonic() - verified
+
+    def fresh_frame(self, max_age, timeout=2.0):
+        """A frame at most max_age seconds old, capturing one now if the engine is idle
+
+        Returns the latest frame (possibly older) if no capture completes
+        within timeout.
+        """
+        self.touch()
+        age = self.verified_age()
+        if not self.adaptive or (age is not None and age <= max_age):
+            return self._latest
+        requested = time.monotonic()
+        self._wake.set()
+        with self._new_frame:
+            self._new_frame.wait_for(lambda: self._verified is not None and self._verified >= requested,
+                                     timeout=timeout)
+            return self._latest
+
+    def wait_for_frame(self, after_seq, timeout=None):
+        """Block until a frame newer than after_seq exists; returns it or None on timeout"""
+        with self._new_frame:
+            self._new_frame.wait_for(
+                lambda: self._latest is not None and self._latest.seq > after_seq,
+                timeout=timeout,
+            )
+            frame = self._latest
+        if frame is None or frame.seq <= after_seq:
+            return None
+        return frame
+
+    def stats(self):
+        """Counters for health checks, read without touching the X server"""
+        with self._lock:
+            frame = self._latest
+            stats = {
+                'sequence': frame.seq if frame else 0,
+                'frames_captured': self.frames_captured,
+                'frames_dropped': self.frames_dropped,
+                'capture_errors': self.capture_errors,
+                'last_error': self.last_error,
+                'connected': self.connected,
+                'shm': self.uses_shm,
+                'rate_mode': self.mode(),
+                'effective_interval_ms': self.current_interval_ms(),
+                'consumers': self._consumers,
+                'damage': self._damage is not None,
+                'frames_unchanged': self.frames_unchanged,
+            }
+        if frame is not None:
+            stats.update({
+                'timestamp': frame.timestamp,
+                'age_seconds': time.monotonic() - frame.monotonic,
+                'verified_age_seconds': self.verified_age(),
+                'width': frame.width,
+                'height': frame.height,
+                'capture_ms': frame.capture_ms,
+            })
+        return stats
+
+    @property
+    def connected(self):
+        return self._grabber is not None
+
+    @property
+    def uses_shm(self):
+        grabber = self._grabber
+        return bool(grabber and grabber.use_shm)
+
+    def _connect(self):
+        grabber = X11Grabber(self.display_name)
+        grabber.open()
+        self._grabber = grabber
+        print(f"Capture engine connected to {self.display_name} "
+              f"({grabber.width}x{grabber.height}, {'MIT-SHM' if grabber.use_shm else 'XGetImage'})")
+        if self.use_damage:
+            monitor = DamageMonitor(self.display_name)
+            try:
+                monitor.open()
+                self._damage = monitor
+                print("Capture engine skips unchanged frames (XDamage)")
+            except CaptureError as e:
+                print(f"Warning: XDamage unavailable, capturing every interval: {e}")
+
+    def _disconnect(self):
+        if self._grabber is not None:
+            self._grabber.close()
+            self._grabber = None
+        if self._damage is not None:
+            self._damage.close()
+            self._damage = None
+
+    def _unchanged(self, now):
+        """True if the damage monitor saw no drawing since the last grab
+
+        A real grab still happens at least once per idle interval, as a
+        safety net against drawing the damage extension does not report.
+        """
+        frame = self._latest
+        if self._damage is None or frame is None:
+            return False
+        if now - frame.monotonic >= self.idle_interval_ms / 1000.0:
+            self._damage.changed()
+            return False
+        return not self._damage.changed()
+
+    def _run(self):
+        _set_os_thread_name(CAPTURE_THREAD_NAME)
+        interval = self.interval_ms / 1000.0
+        while not self._stop.is_set():
+            if self._grabber is None:
+                try:
+                    self._connect()
+                except CaptureError as e:
+                    print(f"Waiting for X server on display {self.display_name}: {e}")
+                    self._stop.wait(1.0)
+                    continue
+
+            started = time.monotonic()
+            self._wake.clear()
+            if self._unchanged(started):
+                # Nothing was drawn since the last grab: the latest frame is still current
+                self.frames_unchanged += 1
+                with self._lock:
+                    self._verified = started
+                    self._new_frame.notify_all()
+            else:
+                try:
+                    pixels = self._grabber.grab()
+                except CaptureError as e:
+                    self.capture_errors += 1
+                    self.last_error = str(e)
+                    print(f"Warning: Screenshot capture failed at {time.ctime()}: {e}")
+                    self._disconnect()
+                    self._stop.wait(interval)
+                    continue
+
+                captured = time.monotonic()
+                self._publish(pixels, started, captured)
+
+                if self.file_output_path:
+                    self._write_file(pixels)
+
+            interval = self.current_interval_ms() / 1000.0
+            elapsed = time.monotonic() - started
+            if elapsed > interval:
+                self.frames_dropped += int(elapsed // interval)
+            # Demand changes (a consumer attaching, a request to an idle engine) cut the wait short
+            self._wake.wait(max(0.0, interval - elapsed))
+
+        self._disconnect()
+
+    def _publish(self, pixels, started, captured):
+        pixels.flags.writeable = False
+        with self._lock:
+            self._seq += 1
+            # The grab started before any pixel was read, so that is when the frame was current
+            self._verified = started
+            self._latest = Frame(
+                seq=self._seq,
+                timestamp=time.time(),
+                monotonic=captured,
+                pixels=pixels,
+                capture_ms=(captured - started) * 1000.0,
+            )
+            self.frames_captured += 1
+            frame = self._latest
+            self._new_frame.notify_all()
+        if self.on_frame is not None:
+            self.on_frame(frame)
+
+    def _write_file(self, pixels):
+        # Compatibility mode: keep SNAPSHOT_PATH updated for file-based readers
+        temp_path = f"{self.file_output_path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(encode_png(pixels))
+            os.replace(temp_path, self.file_output_path)
+        except OSError as e:
+            print(f"Warning: Failed to write snapshot file {self.file_output_path}: {e}")
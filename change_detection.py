@@ -0,0 +1,166 @@
+"""Region change detection for the /wait-for-change long-poll.
+
+A waiter registers a region of the screen and a threshold. Each newly
+captured frame is reduced to a grid of tile means over that region (a
+vectorized block average, so the comparison is cheap and insensitive to
+single-pixel noise), and the grid is compared with the grid of the baseline
+frame. The score is the fraction of tiles whose mean colour moved by more
+than min_delta on any channel.
+
+The tile reduction is the expensive part and does not depend on the
+waiter, so ChangeDetector computes it once per (frame, region, tile size)
+and shares it between every waiter on the same region, with single-flight
+computation like the encoded-frame cache.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+DEFAULT_TILE = 16
+DEFAULT_MIN_DELTA = 12
+DEFAULT_THRESHOLD = 0.05
+
+
+def parse_change_args(args):
+    """Parse tile, min_delta and threshold; raises ValueError with a client-facing message"""
+    try:
+        tile = int(args.get('tile', DEFAULT_TILE))
+    except ValueError:
+        raise ValueError('tile must be an integer')
+    if tile < 1 or tile > 256:
+        raise ValueError('tile must be between 1 and 256')
+    try:
+        min_delta = float(args.get('min_delta', DEFAULT_MIN_DELTA))
+    except ValueError:
+        raise ValueError('min_delta must be a number')
+    if not math.isfinite(min_delta) or min_delta < 0 or min_delta > 255:
+        raise ValueError('min_delta must be between 0 and 255')
+    try:
+        threshold = float(args.get('threshold', DEFAULT_THRESHOLD))
+    except ValueError:
+        raise ValueError('threshold must be a number')
+    if not math.isfinite(threshold) or threshold <= 0 or threshold > 1:
+        raise ValueError('threshold must be greater than 0 and at most 1 (fraction of tiles)')
+    return tile, min_delta, threshold
+
+
+def tile_means(pixels, region, tile):
+    """Mean RGB of every tile x tile block of region; edge tiles may be smaller"""
+    x, y, width, height = region
+    view = pixels[y:y + height, x:x + width]
+    row_starts = np.arange(0, height, tile)
+    col_starts = np.arange(0, width, tile)
+    sums = np.add.reduceat(np.add.reduceat(view, row_starts, axis=0, dtype=np.uint32), col_starts, axis=1)
+    rows = np.minimum(tile, height - row_starts)
+    cols = np.minimum(tile, width - col_starts)
+    return sums / (rows[:, None, None] * cols[None, :, None])
+
+
+def compare(baseline, current, region, tile, min_delta):
+    """Diff score between two tile grids of the same region"""
+    x, y, width, height = region
+    total = baseline.shape[0] * baseline.shape[1]
+    if baseline.shape != current.shape:
+        # The screen was resized; everything changed
+        return {'score': 1.0, 'changed_tiles': total, 'total_tiles': total, 'mean_delta': None,
+                'max_delta': None, 'changed_region': [x, y, width, height]}
+
+    delta = np.abs(current - baseline).max(axis=2)
+    changed = delta > min_delta
+    changed_tiles = int(changed.sum())
+    result = {
+        'score': round(changed_tiles / total, 4),
+        'changed_tiles': changed_tiles,
+        'total_tiles': total,
+        'mean_delta': round(float(delta.mean()), 2),
+        'max_delta': round(float(delta.max()), 2),
+        'changed_region': None,
+    }
+    if changed_tiles:
+        rows = np.flatnonzero(changed.any(axis=1))
+        cols = np.flatnonzero(changed.any(axis=0))
+        left, top = x + cols[0] * tile, y + rows[0] * tile
+        right = min(x + (cols[-1] + 1) * tile, x + width)
+        bottom = min(y + (rows[-1] + 1) * tile, y + height)
+        result['changed_region'] = [int(left), int(top), int(right - left), int(bottom - top)]
+    return result
+
+
+class ChangeDetector:
+    """Thread-safe LRU of tile grids keyed by (frame sequence, region, tile size)"""
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.computed = 0
+        self.shared = 0
+        self.waiters = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def tiles(self, frame, region, tile):
+        """Tile grid of region in frame, computed once however many waiters ask"""
+        key = (frame.seq, region, tile)
+        while True:
+            with self._lock:
+                cached = self._entries.get(key)
+                if cached is not None:
+                    self._entries.move_to_end(key)
+                    self.shared += 1
+                    return cached
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Another waiter is reducing this frame; use its result
+            pending.wait()
+
+        try:
+            grid = tile_means(frame.pixels, region, tile)
+        except BaseException:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+            raise
+
+        with self._lock:
+            self.computed += 1
+            self._entries[key] = grid
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            del self._pending[key]
+        pending.set()
+        return grid
+
+    def wait(self, engine, baseline, region, tile, min_delta, threshold, timeout):
+        """Block until a frame newer than baseline differs by at least threshold
+
+        Returns (frame, result) for the first frame whose score crosses the
+        threshold, or for the last frame compared when timeout expires
+        (frame is the baseline itself if no new frame arrived).
+        """
+        deadline = time.monotonic() + timeout
+        baseline_grid = self.tiles(baseline, region, tile)
+        frame, result = baseline, compare(baseline_grid, baseline_grid, region, tile, min_delta)
+        with self._lock:
+            self.waiters += 1
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                newer = engine.wait_for_frame(frame.seq, timeout=remaining)
+                if newer is None:
+                    break
+                frame = newer
+                result = compare(baseline_grid, self.tiles(frame, region, tile), region, tile, min_delta)
+                if result['score'] >= threshold:
+                    break
+        finally:
+            with self._lock:
+                self.waiters -= 1
+        result['changed'] = result['score'] >= threshold
+        return frame, result
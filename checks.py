@@ -0,0 +1,35 @@
+"""Check helpers shared by the test scripts that run without Docker or X.
+
+Test functions take no arguments and call check() for every expectation.
+check() prints a ✓/✗ line and raises AssertionError when the expectation
+fails, so the same files run under pytest and as scripts: run_tests() runs
+a list of test functions, prints the summary and returns the exit status.
+"""
+import traceback
+
+
+def check(ok, message, failure=None):
+    """Print ✓ message, or ✗ failure (default: message) and fail the test"""
+    if ok:
+        print(f"✓ {message}")
+        return
+    print(f"✗ {failure or message}")
+    raise AssertionError(failure or message)
+
+
+def run_tests(title, tests, noun='tests'):
+    """Run test functions as a script; returns 0 when all passed, 1 otherwise"""
+    print(title)
+    print("=" * 40)
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError:
+            pass
+        except Exception:
+            print(f"✗ {test.__name__} raised:")
+            traceback.print_exc()
+    print(f"\n{passed}/{len(tests)} {noun} passed")
+    return 0 if passed == len(tests) else 1
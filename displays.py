@@ -0,0 +1,83 @@
+"""Layout of the X displays inside one container.
+
+A container runs DISPLAYS independent X displays (default 1). Display k is
+X display :k with its VNC server on port 5900 + k, its own client directory
+and Wine prefix, and its own capture engine and input backend inside the one
+api.py process.
+
+API requests choose a display with a /displays/<k> path prefix
+(/displays/1/desktop-snapshot) or an X-Display: <k> header; requests with
+neither go to display 0, so single-display clients keep working unchanged.
+
+With one display the paths are the historical ones (/root/Desktop/Client,
+/root/.wine). With several, the data and Wine volumes are mounted one level
+up and every display gets a numbered subdirectory.
+"""
+import os
+import re
+
+VNC_BASE_PORT = 5900
+DISPLAY_HEADER = 'X-Display'
+PATH_PREFIX = '/displays/'
+_PREFIX_PATTERN = re.compile(r'^/displays/(\d+)(/.*)?$')
+
+SINGLE_CLIENT_DIR = '/root/Desktop/Client'
+SINGLE_WINE_PREFIX = '/root/.wine'
+# Volume mount points when a container runs several displays
+CLIENTS_ROOT = '/root/Desktop/Clients'
+WINE_PREFIXES_ROOT = '/root/.wine-displays'
+
+
+def display_count():
+    """Number of displays this container runs (DISPLAYS, default 1)"""
+    value = os.environ.get('DISPLAYS', '1')
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError(f'DISPLAYS must be a positive integer, got {value!r}')
+    if count < 1:
+        raise ValueError(f'DISPLAYS must be a positive integer, got {value!r}')
+    return count
+
+
+def x_display(display_id):
+    return f':{display_id}'
+
+
+def vnc_port(display_id):
+    return VNC_BASE_PORT + display_id
+
+
+def client_dir(display_id, count):
+    return SINGLE_CLIENT_DIR if count == 1 else f'{CLIENTS_ROOT}/{display_id}'
+
+
+def wine_prefix(display_id, count):
+    return SINGLE_WINE_PREFIX if count == 1 else f'{WINE_PREFIXES_ROOT}/{display_id}'
+
+
+def split_path(path):
+    """('/displays/2/desktop-snapshot') -> (2, '/desktop-snapshot'); (None, path) without a prefix"""
+    match = _PREFIX_PATTERN.match(path)
+    if not match:
+        return None, path
+    return int(match.group(1)), match.group(2) or '/'
+
+
+class DisplayPathMiddleware:
+    """WSGI middleware moving a /displays/<k> path prefix into environ['api.display']
+
+    Runs before routing, so every route (WebSocket routes included) is
+    reachable under the prefix without being registered twice.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        display_id, path = split_path(environ.get('PATH_INFO', ''))
+        if display_id is not None:
+            environ['api.display'] = display_id
+            environ['PATH_INFO'] = path
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + f'{PATH_PREFIX}{display_id}'
+        return self.app(environ, start_response)
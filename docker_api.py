@@ -0,0 +1,182 @@
+"""Minimal Docker Engine API client over the local socket.
+
+Uses only the standard library so the management tools run on any host with
+Python 3. Talks to DOCKER_HOST (unix:///path or tcp://host:port), defaulting
+to /var/run/docker.sock. Each thread keeps its own persistent connection.
+"""
+import http.client
+import json
+import os
+import socket
+import threading
+from urllib.parse import quote, urlencode
+
+DEFAULT_DOCKER_HOST = 'unix:///var/run/docker.sock'
+
+
+class DockerAPIError(Exception):
+    """Non-2xx answer from the Docker Engine API"""
+
+    def __init__(self, status, message, method=None, path=None):
+        super().__init__(f'{method} {path}: {status} {message}' if method else f'{status} {message}')
+        self.status = status
+        self.message = message
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerClient:
+    """Thread-safe Docker Engine API client (one keep-alive connection per thread)"""
+
+    def __init__(self, base_url=None, timeout=60):
+        self.base_url = base_url or os.environ.get('DOCKER_HOST') or DEFAULT_DOCKER_HOST
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _new_connection(self):
+        if self.base_url.startswith('unix://'):
+            return _UnixHTTPConnection(self.base_url[len('unix://'):], self.timeout)
+        if self.base_url.startswith(('tcp://', 'http://')):
+            address = self.base_url.split('://', 1)[1].rstrip('/')
+            host, _, port = address.partition(':')
+            return http.client.HTTPConnection(host, int(port or 2375), timeout=self.timeout)
+        raise ValueError(f'Unsupported DOCKER_HOST {self.base_url!r}')
+
+    def request(self, method, path, params=None, body=None, timeout=None):
+        """Send one API request; returns the decoded JSON body (or None)"""
+        if params:
+            path = f'{path}?{urlencode(params)}'
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        for attempt in (1, 2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = self._new_connection()
+            connection.timeout = timeout or self.timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(connection.timeout)
+            try:
+                connection.request(method, path, body=payload, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                # The daemon closed an idle keep-alive connection; retry once on a fresh one
+                connection.close()
+                self._local.connection = None
+                if attempt == 2:
+                    raise
+
+        if response.status >= 400:
+            try:
+                message = json.loads(data).get('message', '')
+            except ValueError:
+                message = data.decode(errors='replace')
+            raise DockerAPIError(response.status, message, method, path)
+        if not data:
+            return None
+        if response.getheader('Content-Type', '').startswith('application/json'):
+            return json.loads(data)
+        return data
+
+    # Containers ----------------------------------------------------------
+
+    def list_containers(self, name_filter=None, all=True):
+        params = {'all': '1' if all else '0'}
+        if name_filter:
+            params['filters'] = json.dumps({'name': [name_filter]})
+        return self.request('GET', '/containers/json', params)
+
+    def inspect_container(self, name):
+        return self.request('GET', f'/containers/{quote(name)}/json')
+
+    def create_container(self, name, config):
+        return self.request('POST', '/containers/create', {'name': name}, body=config)
+
+    def start_container(self, name):
+        try:
+            self.request('POST', f'/containers/{quote(name)}/start')
+        except DockerAPIError as e:
+            if e.status != 304:  # already running
+                raise
+
+    def stop_container(self, name, timeout=10):
+        try:
+            self.request('POST', f'/containers/{quote(name)}/stop', {'t': timeout}, timeout=timeout + self.timeout)
+        except DockerAPIError as e:
+            if e.status != 304:  # already stopped
+                raise
+
+    def remove_container(self, name, force=False):
+        self.request('DELETE', f'/containers/{quote(name)}', {'force': '1' if force else '0'})
+
+    def container_stats(self, name):
+        return self.request('GET', f'/containers/{quote(name)}/stats', {'stream': '0'})
+
+    def exec_run(self, name, command, timeout=None):
+        """Run command in a running container; returns (exit_code, output bytes)"""
+        created = self.request('POST', f'/containers/{quote(name)}/exec', body={
+            'Cmd': command, 'AttachStdout': True, 'AttachStderr': True, 'Tty': True,
+        })
+        # With a TTY the output arrives as one raw stream (no stdout/stderr framing)
+        output = self.request('POST', f"/exec/{created['Id']}/start", body={'Detach': False, 'Tty': True},
+                              timeout=timeout)
+        if isinstance(output, (dict, list)):
+            output = json.dumps(output).encode()
+        details = self.request('GET', f"/exec/{created['Id']}/json")
+        return details.get('ExitCode'), output or b''
+
+    def stream_container_stats(self, name, stop_event=None):
+        """Yield stats samples (about one per second) over a dedicated connection
+
+        Stops when the container stops, the generator is closed, or
+        stop_event is set (checked after each sample).
+        """
+        connection = self._new_connection()
+        connection.timeout = None
+        try:
+            connection.request('GET', f'/containers/{quote(name)}/stats?stream=1')
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise DockerAPIError(response.status, response.read().decode(errors='replace'),
+                                     'GET', f'/containers/{name}/stats')
+            while stop_event is None or not stop_event.is_set():
+                line = response.readline()
+                if not line:
+                    return
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+    # Images, networks and volumes -----------------------------------------
+
+    def inspect_image(self, name):
+        return self.request('GET', f'/images/{quote(name)}/json')
+
+    def ensure_network(self, name):
+        try:
+            return self.request('GET', f'/networks/{quote(name)}')
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+        try:
+            return self.request('POST', '/networks/create', body={'Name': name, 'CheckDuplicate': True})
+        except DockerAPIError as e:
+            if e.status != 409:  # created concurrently
+                raise
+
+    def list_volumes(self, name_filter=None):
+        params = {'filters': json.dumps({'name': [name_filter]})} if name_filter else None
+        return (self.request('GET', '/volumes', params) or {}).get('Volumes') or []
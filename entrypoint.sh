@@ -12,22 +12,31 @@ mkdir -p /tmp/.X11-unix
 touch /root/.Xresources
 [ -f /root/.Xauthority ] || touch /root/.Xauthority
 
-# Initialize D-Bus system service (but not session bus yet - that's handled in xstartup)
-mkdir -p /var/run/dbus
-rm -f /var/run/dbus/pid /run/dbus/pid 2>/dev/null || true
-dbus-daemon --system --fork || true
-
-# Create LXDE config directories early to prevent session issues
-mkdir -p /root/.config/lxsession/LXDE
-mkdir -p /root/.cache/lxsession/LXDE
-
 # Set VNC password
 VNC_PASSWD=${VNC_PASSWD:-password}
 echo "$VNC_PASSWD" | vncpasswd -f > /root/.vnc/passwd
 chmod 600 /root/.vnc/passwd
 
-# Create xstartup script for LXDE
-cat > /root/.vnc/xstartup <<EOF
+# Session profile: what runs on the X display besides the game
+#   lxde     full LXDE desktop (lxsession, lxpanel, D-Bus buses, themes)
+#   openbox  bare openbox window manager; no panel, desktop or session bus
+#   none     no window manager; Wine draws into a fixed-size virtual desktop
+export SESSION_PROFILE=${SESSION_PROFILE:-lxde}
+echo "Session profile: $SESSION_PROFILE"
+
+case "$SESSION_PROFILE" in
+lxde)
+    # Initialize D-Bus system service (but not session bus yet - that's handled in xstartup)
+    mkdir -p /var/run/dbus
+    rm -f /var/run/dbus/pid /run/dbus/pid 2>/dev/null || true
+    dbus-daemon --system --fork || true
+
+    # Create LXDE config directories early to prevent session issues
+    mkdir -p /root/.config/lxsession/LXDE
+    mkdir -p /root/.cache/lxsession/LXDE
+
+    # Create xstartup script for LXDE
+    cat > /root/.vnc/xstartup <<EOF
 #!/bin/bash
 # Fix for "No session for pid" error - properly configure session environment
 unset SESSION_MANAGER
@@ -84,86 +93,49 @@ else
     exec xterm
 fi
 EOF
+    ;;
+openbox)
+    # Just the window manager: no session manager, panel, desktop or D-Bus
+    cat > /root/.vnc/xstartup <<EOF
+#!/bin/bash
+unset SESSION_MANAGER
+unset DBUS_SESSION_BUS_ADDRESS
+xrdb \$HOME/.Xresources
+xsetroot -solid grey
+exec openbox
+EOF
+    ;;
+none)
+    # No window manager; init-wine.sh puts Wine into a virtual desktop of VNC_GEOMETRY
+    cat > /root/.vnc/xstartup <<EOF
+#!/bin/bash
+unset SESSION_MANAGER
+unset DBUS_SESSION_BUS_ADDRESS
+xrdb \$HOME/.Xresources
+xsetroot -solid black
+# Keep the session open for as long as the X server runs
+exec sleep infinity
+EOF
+    ;;
+*)
+    echo "Unknown SESSION_PROFILE '$SESSION_PROFILE' (expected lxde, openbox or none)"
+    exit 1
+    ;;
+esac
 chmod +x /root/.vnc/xstartup
 
 # Initialize Lutris configuration if needed
 mkdir -p /root/.local/share/lutris
 mkdir -p /root/.config/lutris
 
-# Set up overlay filesystem for WoW client files
-echo "Setting up overlay filesystem..."
-/opt/setup-overlay.sh
-
-# Initialize Wine environment with Mono and Gecko
-echo "Initializing Wine environment..."
-/opt/init-wine.sh
-
-# Set Wine and OpenGL environment variables
+# Set Wine and OpenGL environment variables (inherited by the X session)
 export WINEARCH=win64
 export WINEPREFIX=/root/.wine
 export __GL_SHADER_DISK_CACHE=1
 export __GL_SHADER_DISK_CACHE_PATH=/root/Desktop/Client
 
-# Check WoW client existence after overlay setup
-if [ ! -f "/root/Desktop/Client/Wow.exe" ]; then
-    echo "WARNING: World of Warcraft client not found in /root/Desktop/Client/"
-    echo "Please make sure your WoW client files are in the ./wow-client directory"
-    echo "The container will continue to run, but WoW may not launch properly"
-else
-    echo "WoW client detected in /root/Desktop/Client/"
-fi
-
-# Start desktop snapshot service in background
-echo "Starting desktop snapshot service..."
-/opt/snapshot-service.sh &
-
-echo "Starting TigerVNC server..."
-# Don't use Xvfb, let TigerVNC create its own X server
-VNC_GEOMETRY=${VNC_GEOMETRY:-1280x800}
-VNC_DEPTH=${VNC_DEPTH:-24}
-
-# Kill any existing VNC servers on display :0
-vncserver -kill :0 2>/dev/null || true
-sleep 2
-
-# Start VNC server with better configuration for LXDE
-tigervncserver :0 \
-    -geometry $VNC_GEOMETRY \
-    -depth $VNC_DEPTH \
-    -localhost no \
-    -SecurityTypes VncAuth \
-    -passwd /root/.vnc/passwd \
-    -xstartup /root/.vnc/xstartup \
-    -verbose
-
-# Wait a moment for the server to start
-sleep 5
-
-echo "TigerVNC server started"
-
-# Verify the VNC server is running
-ps aux | grep Xtigervnc || ps aux | grep vnc
-
-echo "Starting API server..."
-export DISPLAY=:0
-python3 /opt/api.py &
-API_PID=$!
-
-echo "All services started. Entering wait loop..."
-# Keep the container running - tail the VNC log file
-# The log file format is hostname:port.log, so we need to find it dynamically
-VNC_LOG_FILE=$(ls /root/.vnc/*.log 2>/dev/null | head -1)
-if [ -n "$VNC_LOG_FILE" ]; then
-    echo "Following VNC log file: $VNC_LOG_FILE"
-    tail -f "$VNC_LOG_FILE"
-else
-    echo "No VNC log file found, keeping container alive with sleep"
-    while true; do
-        sleep 30
-        # Check if VNC server is still running
-        if ! pgrep -f "Xtigervnc.*:0" > /dev/null; then
-            echo "VNC server has stopped, exiting..."
-            exit 1
-        fi
-    done
-fi
+# Overlay setup, Wine init and X/VNC start concurrently; the API server
+# starts as soon as X accepts connections. Stage progress and durations are
+# served on the API's /ready endpoint.
+echo "Starting services..."
+exec python3 -u /opt/supervisor.py
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""Fleet controller for WoW client containers.
+
+Reconciles the desired set of instance ids against the containers that
+actually exist, by instance id rather than by count, and applies the
+difference in parallel through the Docker Engine API:
+
+  - missing instances are created and started
+  - stopped instances are started again, keeping their container and volumes
+  - instances outside the desired set are stopped (or removed with --remove;
+    their volumes are always kept)
+
+Usage:
+  python3 fleet.py start 10            # make sure instances 1-10 are running
+  python3 fleet.py scale 5             # exactly instances 1-5 running
+  python3 fleet.py apply 1-3,7         # exactly instances 1, 2, 3 and 7 running
+  python3 fleet.py stop [1-3,7]        # stop all (or the given) instances
+  python3 fleet.py plan scale 5        # show what scale 5 would do
+
+Options: --concurrency N (FLEET_CONCURRENCY, default 8), --remove, --json,
+--wait (block until started instances report ready on /ready), --displays K
+(DISPLAYS_PER_INSTANCE, default 1: X displays per container, see displays.py).
+
+Instance N serves its API on 5000 + N - 1. Its displays use VNC ports
+5900 + (N - 1) * K up to 5900 + N * K - 1; with one display per container
+that is 5900 + N - 1, as before. Since that layout only works when every
+container has the same K, plans refuse to mix display counts: pass the
+--displays the existing containers were created with, or --remove to
+recreate them.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from displays import CLIENTS_ROOT, SINGLE_CLIENT_DIR, SINGLE_WINE_PREFIX, WINE_PREFIXES_ROOT, vnc_port
+from docker_api import DockerAPIError, DockerClient
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Same naming and port layout as manage-clients-dynamic.sh
+PROJECT_NAME = 'wow-clients'
+BASE_VNC_PORT = 5900
+BASE_API_PORT = 5000
+NETWORK_NAME = f'{PROJECT_NAME}_wow-network'
+# Shared by every instance; holds the golden Wine prefix templates (init-wine.sh)
+WINE_TEMPLATE_VOLUME = f'{PROJECT_NAME}-wine-template'
+IMAGE = os.environ.get('FLEET_IMAGE', 'wow-client:latest')
+MAX_INSTANCES = int(os.environ.get('MAX_INSTANCES', '50'))
+DEFAULT_CONCURRENCY = int(os.environ.get('FLEET_CONCURRENCY', '8'))
+# X displays per container. Changing it for existing instances needs their
+# containers removed (--remove), since ports and mounts are fixed at creation.
+DISPLAYS_PER_INSTANCE = int(os.environ.get('DISPLAYS_PER_INSTANCE', '1'))
+
+_NAME_PATTERN = re.compile(rf'^/?{re.escape(PROJECT_NAME)}-client-(\d+)$')
+
+# Container states that count as "up" and are left alone
+RUNNING_STATES = ('running', 'restarting', 'paused')
+
+# --wait polls each started instance's /ready this often, up to the timeout
+READY_POLL_INTERVAL_S = 0.5
+DEFAULT_READY_TIMEOUT_S = float(os.environ.get('FLEET_READY_TIMEOUT_S', '600'))
+
+
+def container_name(instance_id):
+    return f'{PROJECT_NAME}-client-{instance_id}'
+
+
+def api_port(instance_id):
+    """Host port of an instance's API, which does not depend on its display count"""
+    return BASE_API_PORT + instance_id - 1
+
+
+def instance_ports(instance_id, displays=None):
+    """Host ports of an instance; 'vnc' is its first display, 'vnc_displays' lists all when several"""
+    displays = displays or DISPLAYS_PER_INSTANCE
+    first_vnc = BASE_VNC_PORT + (instance_id - 1) * displays
+    ports = {'vnc': first_vnc, 'api': api_port(instance_id)}
+    if displays > 1:
+        ports['vnc_displays'] = [first_vnc + k for k in range(displays)]
+    return ports
+
+
+def volume_names(instance_id):
+    prefix = container_name(instance_id)
+    return {
+        'data': f'{prefix}-data',
+        'lutris': f'{prefix}-lutris',
+        'wine': f'{prefix}-wine',
+    }
+
+
+def parse_instance_ids(spec):
+    """Parse '1-3,7' into a sorted list of instance ids"""
+    ids = set()
+    for part in str(spec).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = re.fullmatch(r'(\d+)(?:-(\d+))?', part)
+        if not match:
+            raise ValueError(f'Invalid instance id or range: {part!r}')
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if first < 1 or last < first:
+            raise ValueError(f'Invalid instance id or range: {part!r}')
+        ids.update(range(first, last + 1))
+    if not ids:
+        raise ValueError('No instance ids given')
+    if max(ids) > MAX_INSTANCES:
+        raise ValueError(f'Instance {max(ids)} exceeds maximum allowed ({MAX_INSTANCES}); '
+                         'set MAX_INSTANCES to increase the limit')
+    return sorted(ids)
+
+
+def container_env(instance_id, displays=None):
+    """Environment passed to each instance, with the management script's defaults"""
+    env = os.environ.get
+    return [
+        f'INSTANCE_ID={instance_id}',
+        f'DISPLAYS={displays or DISPLAYS_PER_INSTANCE}',
+        f"VNC_PASSWD={env('VNC_PASSWD', 'password')}",
+        f"VNC_GEOMETRY={env('VNC_GEOMETRY', '1280x800')}",
+        f"VNC_DEPTH={env('VNC_DEPTH', '24')}",
+        'SNAPSHOT_PATH=/tmp/desktop_snapshot.png',
+        f"SNAPSHOT_INTERVAL_MS={env('SNAPSHOT_INTERVAL_MS', '500')}",
+        f"SESSION_PROFILE={env('SESSION_PROFILE', 'lxde')}",
+        f"CAPTURE_MODE={env('CAPTURE_MODE', 'memory')}",
+        f"API_SERVER={env('API_SERVER', 'gunicorn')}",
+        f"API_WORKERS={env('API_WORKERS', '1')}",
+        f"API_THREADS={env('API_THREADS', '32')}",
+        f"CLIENT_OVERLAY_MODE={env('CLIENT_OVERLAY_MODE', 'symlink')}",
+        f"WINE_TEMPLATE_CLONE={env('WINE_TEMPLATE_CLONE', 'reflink')}",
+    ]
+
+
+def overlay_host_config():
+    """Extra HostConfig the overlay client modes need to mount inside the container"""
+    mode = os.environ.get('CLIENT_OVERLAY_MODE', 'symlink')
+    if mode == 'symlink':
+        return {}
+    config = {'CapAdd': ['SYS_ADMIN'], 'SecurityOpt': ['apparmor=unconfined']}
+    if mode in ('fuse-overlayfs', 'auto'):
+        config['Devices'] = [{'PathOnHost': '/dev/fuse', 'PathInContainer': '/dev/fuse',
+                              'CgroupPermissions': 'rwm'}]
+    return config
+
+
+def container_config(instance_id, image=IMAGE, client_dir=None, displays=None):
+    """Docker Engine API create body equivalent to the script's docker run"""
+    client_dir = client_dir or os.path.join(SCRIPT_DIR, 'wow-client')
+    displays = displays or DISPLAYS_PER_INSTANCE
+    ports = instance_ports(instance_id, displays)
+    volumes = volume_names(instance_id)
+    # Display k listens on 5900 + k inside the container
+    port_bindings = {f'{vnc_port(k)}/tcp': [{'HostPort': str(ports['vnc'] + k)}] for k in range(displays)}
+    port_bindings['5000/tcp'] = [{'HostPort': str(ports['api'])}]
+    # Several displays keep one numbered client directory and Wine prefix each inside the volumes
+    data_mount, wine_mount = ((SINGLE_CLIENT_DIR, SINGLE_WINE_PREFIX) if displays == 1
+                              else (CLIENTS_ROOT, WINE_PREFIXES_ROOT))
+    return {
+        'Image': image,
+        'Env': container_env(instance_id, displays),
+        'ExposedPorts': {port: {} for port in port_bindings},
+        'Labels': {'wow-clients.instance': str(instance_id), 'wow-clients.displays': str(displays)},
+        'HostConfig': {
+            'NetworkMode': NETWORK_NAME,
+            'PortBindings': port_bindings,
+            'Binds': [
+                f'{client_dir}:/mnt/wow-client:ro',
+                f"{volumes['data']}:{data_mount}",
+                f"{volumes['lutris']}:/root/.local/share/lutris",
+                f"{volumes['wine']}:{wine_mount}",
+                f'{WINE_TEMPLATE_VOLUME}:/opt/wine-template',
+            ],
+            'Tmpfs': {'/tmp': ''},
+            'RestartPolicy': {'Name': 'unless-stopped'},
+            **overlay_host_config(),
+        },
+    }
+
+
+def check_ready(url, scope='all', timeout=2):
+    """GET <url>/ready; returns (ready, body) where body is the JSON answer or None"""
+    try:
+        with urllib.request.urlopen(f'{url}/ready?scope={scope}', timeout=timeout) as response:
+            return True, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            return False, json.loads(e.read())
+        except ValueError:
+            return False, None
+    except (OSError, ValueError):
+        return False, None
+
+
+class FleetController:
+    """Diff-based, parallel reconciliation of instance containers"""
+
+    def __init__(self, client=None, image=IMAGE, client_dir=None,
+                 concurrency=DEFAULT_CONCURRENCY, stop_timeout=10, displays=None):
+        self.client = client or DockerClient()
+        self.image = image
+        self.client_dir = client_dir
+        self.displays = displays or DISPLAYS_PER_INSTANCE
+        self.concurrency = max(1, concurrency)
+        self.stop_timeout = stop_timeout
+
+    def actual_state(self):
+        """{instance_id: {'name', 'state', 'status', 'container_id', 'displays'}} for every existing container
+
+        'displays' comes from the container's wow-clients.displays label, or is
+        None for containers created without one (manage-clients-dynamic.sh).
+        """
+        instances = {}
+        for container in self.client.list_containers(name_filter=f'{PROJECT_NAME}-client-'):
+            for name in container.get('Names', []):
+                match = _NAME_PATTERN.match(name)
+                if match:
+                    displays = (container.get('Labels') or {}).get('wow-clients.displays')
+                    instances[int(match.group(1))] = {
+                        'name': name.lstrip('/'),
+                        'state': container.get('State', ''),
+                        'status': container.get('Status', ''),
+                        'container_id': container.get('Id', ''),
+                        'displays': int(displays) if displays and displays.isdigit() else None,
+                    }
+                    break
+        return instances
+
+    def _layout_differs(self, info):
+        return info.get('displays') not in (None, self.displays)
+
+    def plan(self, desired_ids, exclusive=True, remove=False, actual=None):
+        """List of (instance_id, action) turning the actual state into desired_ids
+
+        With exclusive=False instances outside desired_ids are left alone.
+        Actions: create, start, recreate (dead container, or one created with
+        another display count when remove is set), stop, remove.
+
+        Raises ValueError when a container that would keep running has a
+        different display count than self.displays, since its VNC ports would
+        overlap those of the containers created now.
+        """
+        actual = self.actual_state() if actual is None else actual
+        desired = set(desired_ids)
+        steps = []
+        mismatched = []
+        for instance_id in sorted(desired):
+            current = actual.get(instance_id)
+            if current is None:
+                steps.append((instance_id, 'create'))
+            elif current['state'] == 'dead':
+                steps.append((instance_id, 'recreate'))
+            elif self._layout_differs(current):
+                if remove:
+                    steps.append((instance_id, 'recreate'))
+                else:
+                    mismatched.append(instance_id)
+            elif current['state'] not in RUNNING_STATES:
+                steps.append((instance_id, 'start'))
+        for instance_id in sorted(set(actual) - desired):
+            running = actual[instance_id]['state'] in RUNNING_STATES
+            if exclusive and remove:
+                steps.append((instance_id, 'remove'))
+            elif exclusive and running:
+                steps.append((instance_id, 'stop'))
+            elif running and self._layout_differs(actual[instance_id]):
+                mismatched.append(instance_id)
+        if mismatched:
+            counts = ', '.join(f"{i} ({actual[i]['displays']} displays)" for i in sorted(mismatched))
+            raise ValueError(f'Instances {counts} were created with another display count than {self.displays}; '
+                             'pass their --displays, or --remove to recreate them')
+        return steps
+
+    def plan_stop(self, instance_ids=None, remove=False, actual=None):
+        """Steps stopping (or removing) the given instances, or all of them"""
+        actual = self.actual_state() if actual is None else actual
+        targets = sorted(actual) if instance_ids is None else sorted(set(instance_ids) & set(actual))
+        if remove:
+            return [(instance_id, 'remove') for instance_id in targets]
+        return [(instance_id, 'stop') for instance_id in targets if actual[instance_id]['state'] in RUNNING_STATES]
+
+    def _create_and_start(self, instance_id):
+        name = container_name(instance_id)
+        try:
+            self.client.create_container(name, container_config(instance_id, self.image, self.client_dir,
+                                                                   self.displays))
+        except DockerAPIError as e:
+            if e.status != 409:
+                raise
+            # Created by someone else since we listed; reuse it
+        self.client.start_container(name)
+
+    def _run_step(self, instance_id, action):
+        name = container_name(instance_id)
+        started = time.monotonic()
+        result = {'instance': instance_id, 'container': name, 'action': action}
+        try:
+            if action == 'create':
+                self._create_and_start(instance_id)
+            elif action == 'recreate':
+                self.client.remove_container(name, force=True)
+                self._create_and_start(instance_id)
+            elif action == 'start':
+                self.client.start_container(name)
+            elif action == 'stop':
+                self.client.stop_container(name, self.stop_timeout)
+            elif action == 'remove':
+                self.client.stop_container(name, self.stop_timeout)
+                self.client.remove_container(name)
+            result['ok'] = True
+        except Exception as e:
+            result['ok'] = False
+            result['error'] = str(e)
+        result['seconds'] = round(time.monotonic() - started, 3)
+        if action in ('create', 'recreate', 'start'):
+            result['ports'] = instance_ports(instance_id, self.displays)
+        return result
+
+    def _preflight(self, steps):
+        """Check the image and network once before any container is created"""
+        if not any(action in ('create', 'recreate') for _, action in steps):
+            return None
+        try:
+            self.client.inspect_image(self.image)
+        except DockerAPIError as e:
+            if e.status == 404:
+                return f'Image {self.image} not found; build it with: docker build -t {self.image} .'
+            return str(e)
+        self.client.ensure_network(NETWORK_NAME)
+        return None
+
+    def apply(self, steps):
+        """Run planned steps in parallel, at most `concurrency` at a time"""
+        started = time.monotonic()
+        results = []
+        error = self._preflight(steps)
+        if error:
+            # Nothing can be created; still start, stop and remove what we can
+            results = [
+                {'instance': i, 'container': container_name(i), 'action': action,
+                 'ok': False, 'error': error, 'seconds': 0.0}
+                for i, action in steps if action in ('create', 'recreate')
+            ]
+            steps = [step for step in steps if step[1] not in ('create', 'recreate')]
+
+        if steps:
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(steps))) as pool:
+                results.extend(pool.map(lambda step: self._run_step(*step), steps))
+
+        results.sort(key=lambda result: result['instance'])
+        counts = {}
+        for result in results:
+            key = result['action'] if result['ok'] else 'failed'
+            counts[key] = counts.get(key, 0) + 1
+        return {
+            'results': results,
+            'counts': counts,
+            'failed': counts.get('failed', 0),
+            'seconds': round(time.monotonic() - started, 3),
+            'concurrency': self.concurrency,
+        }
+
+    def reconcile(self, desired_ids, exclusive=True, remove=False):
+        return self.apply(self.plan(desired_ids, exclusive=exclusive, remove=remove))
+
+    def _wait_one(self, instance_id, host, scope, deadline):
+        url = f"http://{host}:{instance_ports(instance_id, self.displays)['api']}"
+        started = time.monotonic()
+        body = None
+        while True:
+            ready, body = check_ready(url, scope)
+            if ready or time.monotonic() > deadline:
+                break
+            time.sleep(READY_POLL_INTERVAL_S)
+        result = {'instance': instance_id, 'ready': ready, 'seconds': round(time.monotonic() - started, 3)}
+        stages = ((body or {}).get('startup') or {}).get('stages')
+        if stages:
+            result['stages'] = {name: stage.get('seconds', stage['state']) for name, stage in stages.items()}
+        if not ready:
+            failed = [f"{name}: {stage.get('error', stage['state'])}" for name, stage in (stages or {}).items()
+                      if stage['state'] in ('failed', 'skipped')]
+            result['error'] = '; '.join(failed) or ('API not reachable' if body is None else 'not ready in time')
+        return result
+
+    def wait_ready(self, instance_ids, timeout=DEFAULT_READY_TIMEOUT_S, scope='all', host='localhost'):
+        """Poll every instance's /ready in parallel until all are ready or timeout passes"""
+        deadline = time.monotonic() + timeout
+        instance_ids = sorted(instance_ids)
+        if not instance_ids:
+            return []
+        with ThreadPoolExecutor(max_workers=min(32, len(instance_ids))) as pool:
+            return list(pool.map(lambda i: self._wait_one(i, host, scope, deadline), instance_ids))
+
+
+_PAST_TENSE = {'create': 'created', 'recreate': 'recreated', 'start': 'started', 'stop': 'stopped', 'remove': 'removed'}
+
+
+def print_report(report):
+    for result in report['results']:
+        line = f"  Instance {result['instance']}: "
+        if result['ok']:
+            line += f"{_PAST_TENSE[result['action']]} in {result['seconds']:.2f}s"
+            if 'ports' in result:
+                vnc = result['ports'].get('vnc_displays')
+                vnc = f"{vnc[0]}-{vnc[-1]}" if vnc else result['ports']['vnc']
+                line += f" (VNC=localhost:{vnc}, API=localhost:{result['ports']['api']})"
+        else:
+            line += f"{result['action']} FAILED after {result['seconds']:.2f}s: {result['error']}"
+        print(line)
+    if not report['results']:
+        print("  Nothing to do, fleet already matches the desired state.")
+    summary = ', '.join(f'{count} {_PAST_TENSE.get(action, action)}' for action, count in sorted(report['counts'].items())) or 'no changes'
+    print(f"Done in {report['seconds']:.2f}s with concurrency {report['concurrency']}: {summary}")
+
+
+def print_readiness(results):
+    for result in results:
+        stages = ', '.join(f'{name} {value:.1f}s' if isinstance(value, (int, float)) else f'{name} {value}'
+                           for name, value in result.get('stages', {}).items())
+        if result['ready']:
+            line = f"  Instance {result['instance']}: ready after {result['seconds']:.1f}s"
+        else:
+            line = f"  Instance {result['instance']}: NOT READY after {result['seconds']:.1f}s: {result['error']}"
+        print(line + (f" ({stages})" if stages else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f'parallel Docker operations (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--remove', action='store_true',
+                        help='remove containers outside the desired set instead of stopping them (volumes are kept)')
+    parser.add_argument('--image', default=IMAGE, help=f'image for new containers (default: {IMAGE})')
+    parser.add_argument('--client-dir', help='shared client directory (default: ./wow-client next to this script)')
+    parser.add_argument('--displays', type=int, default=DISPLAYS_PER_INSTANCE,
+                        help=f'X displays per new container (DISPLAYS_PER_INSTANCE, default: {DISPLAYS_PER_INSTANCE})')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--wait', action='store_true', help='wait until started instances report ready on /ready')
+    parser.add_argument('--wait-for', choices=['all', 'input'], default='all',
+                        help='readiness to wait for: all startup stages, or just input and snapshots (default: all)')
+    parser.add_argument('--ready-timeout', type=float, default=DEFAULT_READY_TIMEOUT_S,
+                        help=f'seconds to wait for readiness (FLEET_READY_TIMEOUT_S, default: {DEFAULT_READY_TIMEOUT_S:g})')
+    parser.add_argument('command', choices=['start', 'scale', 'apply', 'stop', 'plan'])
+    parser.add_argument('args', nargs='*')
+    args = parser.parse_intermixed_args(argv)
+
+    if args.displays < 1:
+        parser.error('--displays must be at least 1')
+    controller = FleetController(image=args.image, client_dir=args.client_dir, concurrency=args.concurrency,
+                                 displays=args.displays)
+    command, rest = args.command, list(args.args)
+    dry_run = command == 'plan'
+    if dry_run:
+        if not rest:
+            parser.error('plan needs a command, e.g. plan scale 5')
+        command = rest.pop(0)
+
+    try:
+        if command in ('start', 'scale'):
+            desired = parse_instance_ids(f'1-{int(rest[0])}')
+        elif command == 'apply':
+            desired = parse_instance_ids(rest[0])
+        elif command == 'stop':
+            targets = parse_instance_ids(rest[0]) if rest else None
+        else:
+            parser.error(f'unknown command {command!r}')
+    except IndexError:
+        parser.error(f'{command} needs an argument')
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        if command == 'stop':
+            steps = controller.plan_stop(targets, remove=args.remove)
+        else:
+            steps = controller.plan(desired, exclusive=command != 'start', remove=args.remove)
+
+        if dry_run:
+            if args.json:
+                print(json.dumps([{'instance': i, 'action': action} for i, action in steps], indent=2))
+            else:
+                for instance_id, action in steps:
+                    print(f"  Instance {instance_id}: would {action}")
+                if not steps:
+                    print("  Nothing to do, fleet already matches the desired state.")
+            return 0
+
+        report = controller.apply(steps)
+    except (OSError, DockerAPIError) as e:
+        print(f"Error: cannot talk to Docker ({controller.client.base_url}): {e}", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+
+    if not args.json:
+        print_report(report)
+    if args.wait:
+        started_ids = [result['instance'] for result in report['results']
+                       if result['ok'] and result['action'] in ('create', 'recreate', 'start')]
+        if not args.json and started_ids:
+            print(f"Waiting for {len(started_ids)} instance(s) to report ready...")
+        report['readiness'] = controller.wait_ready(started_ids, args.ready_timeout, args.wait_for)
+        if not args.json:
+            print_readiness(report['readiness'])
+    if args.json:
+        print(json.dumps(report, indent=2))
+    not_ready = sum(1 for result in report.get('readiness', []) if not result['ready'])
+    return 1 if report['failed'] or not_ready else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
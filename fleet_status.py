@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""Cached fleet status: container state, resource usage and API health.
+
+One bulk Docker query lists every instance container; CPU and memory come
+from one long-lived stats stream per running container, so samples arrive
+incrementally instead of through repeated `docker stats --no-stream` calls.
+Each instance's /snapshot-info is fetched concurrently and merged in. The
+combined result is cached for STATUS_TTL_S seconds, and concurrent callers
+share a single refresh.
+
+Usage:
+  python3 fleet_status.py                  # table (uses the daemon if one is running)
+  python3 fleet_status.py --json
+  python3 fleet_status.py serve [--port 8001]
+
+Daemon routes:
+  GET /status              JSON
+  GET /status?format=table plain-text table
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from docker_api import DockerAPIError, DockerClient
+from fleet import FleetController, RUNNING_STATES, api_port, instance_ports
+
+STATUS_PORT = int(os.environ.get('STATUS_PORT', '8001'))
+STATUS_TTL_S = float(os.environ.get('STATUS_TTL_S', '2'))
+HEALTH_TIMEOUT_S = float(os.environ.get('STATUS_HEALTH_TIMEOUT_S', '2'))
+HEALTH_CONCURRENCY = int(os.environ.get('STATUS_HEALTH_CONCURRENCY', '32'))
+# One-shot runs without a daemon wait this long for the first CPU samples
+FIRST_SAMPLE_WAIT_S = 2.5
+
+
+def cpu_percent(sample):
+    """CPU usage from one stats sample, as `docker stats` computes it"""
+    cpu = sample.get('cpu_stats') or {}
+    precpu = sample.get('precpu_stats') or {}
+    cpu_delta = (cpu.get('cpu_usage') or {}).get('total_usage', 0) - \
+        (precpu.get('cpu_usage') or {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+    if cpu_delta <= 0 or system_delta <= 0 or not precpu.get('system_cpu_usage'):
+        return None
+    online = cpu.get('online_cpus') or len((cpu.get('cpu_usage') or {}).get('percpu_usage') or []) or 1
+    return cpu_delta / system_delta * online * 100.0
+
+
+def memory_usage(sample):
+    """(used_bytes, limit_bytes) excluding page cache, as `docker stats` reports it"""
+    memory = sample.get('memory_stats') or {}
+    usage = memory.get('usage')
+    if usage is None:
+        return None, None
+    details = memory.get('stats') or {}
+    cache = details.get('inactive_file', details.get('total_inactive_file', details.get('cache', 0)))
+    return max(0, usage - cache), memory.get('limit')
+
+
+class StatsWatcher:
+    """Follows one container's stats stream in a background thread"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.latest = None
+        self.cpu_percent = None
+        self.updated = None
+        self.error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'stats-{name}', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for sample in self.client.stream_container_stats(self.name, self._stop):
+                cpu = cpu_percent(sample)
+                if cpu is not None:
+                    self.cpu_percent = cpu
+                self.latest = sample
+                self.updated = time.monotonic()
+        except (OSError, DockerAPIError, ValueError) as e:
+            self.error = str(e)
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self):
+        info = {'cpu_percent': round(self.cpu_percent, 1) if self.cpu_percent is not None else None}
+        if self.latest is not None:
+            used, limit = memory_usage(self.latest)
+            info['memory_bytes'] = used
+            info['memory_limit_bytes'] = limit
+            info['stats_age_seconds'] = round(time.monotonic() - self.updated, 1)
+        if self.error:
+            info['stats_error'] = self.error
+        return info
+
+
+def fetch_health(url, timeout=HEALTH_TIMEOUT_S):
+    """GET <url>/snapshot-info; returns a compact health dict"""
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(f'{url}/snapshot-info', timeout=timeout) as response:
+            info = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            info = json.loads(e.read())
+        except ValueError:
+            return {'reachable': True, 'healthy': False, 'error': f'HTTP {e.code}'}
+    except (OSError, ValueError) as e:
+        return {'reachable': False, 'healthy': False, 'error': str(getattr(e, 'reason', e))}
+    return {
+        'reachable': True,
+        'healthy': bool(info.get('service_healthy')),
+        'frame_age_seconds': info.get('age_seconds'),
+        'sequence': info.get('sequence'),
+        'capture_mode': info.get('capture_mode'),
+        'response_ms': round((time.monotonic() - started) * 1000.0, 1),
+    }
+
+
+class StatusCollector:
+    """Builds and caches the fleet status"""
+
+    def __init__(self, client=None, ttl=STATUS_TTL_S, host='localhost', health_url=None):
+        self.client = client or DockerClient()
+        self.controller = FleetController(client=self.client)
+        self.ttl = ttl
+        self.health_url = health_url or (lambda i: f"http://{host}:{api_port(i)}")
+        self.docker_queries = 0
+        self.refreshes = 0
+        self._watchers = {}
+        self._cached = None
+        self._cached_at = 0.0
+        self._lock = threading.Lock()
+        self._health_pool = ThreadPoolExecutor(max_workers=HEALTH_CONCURRENCY)
+
+    def _sync_watchers(self, actual):
+        running = {info['name'] for info in actual.values() if info['state'] in RUNNING_STATES}
+        for name in list(self._watchers):
+            if name not in running or not self._watchers[name].alive:
+                self._watchers.pop(name).stop()
+        for name in running:
+            if name not in self._watchers:
+                self._watchers[name] = StatsWatcher(self.client, name)
+
+    def wait_for_samples(self, timeout=FIRST_SAMPLE_WAIT_S):
+        """Give freshly started stats streams time to deliver a CPU figure"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(w.cpu_percent is not None or not w.alive for w in self._watchers.values()):
+                return
+            time.sleep(0.1)
+
+    def _collect(self):
+        actual = self.controller.actual_state()
+        self.docker_queries += 1
+        self._sync_watchers(actual)
+
+        running = sorted(i for i, info in actual.items() if info['state'] in RUNNING_STATES)
+        health = dict(zip(running, self._health_pool.map(
+            lambda i: fetch_health(self.health_url(i)), running
+        )))
+
+        instances = []
+        for instance_id, info in sorted(actual.items()):
+            entry = {
+                'instance': instance_id,
+                'container': info['name'],
+                'state': info['state'],
+                'status': info['status'],
+                'ports': instance_ports(instance_id, info['displays']),
+            }
+            watcher = self._watchers.get(info['name'])
+            if watcher is not None:
+                entry.update(watcher.snapshot())
+            if instance_id in health:
+                entry['health'] = health[instance_id]
+            instances.append(entry)
+
+        return {
+            'generated_at': time.time(),
+            'ttl_seconds': self.ttl,
+            'summary': {
+                'instances': len(instances),
+                'running': len(running),
+                'stopped': len(instances) - len(running),
+                'healthy': sum(1 for h in health.values() if h['healthy']),
+            },
+            'docker_queries': self.docker_queries,
+            'instances': instances,
+        }
+
+    def status(self, force=False):
+        """Cached status; at most one refresh per TTL however many callers poll"""
+        with self._lock:
+            if force or self._cached is None or time.monotonic() - self._cached_at >= self.ttl:
+                self._cached = self._collect()
+                self._cached_at = time.monotonic()
+                self.refreshes += 1
+            status = dict(self._cached)
+        status['age_seconds'] = round(time.monotonic() - self._cached_at, 2)
+        return status
+
+    def close(self):
+        for watcher in self._watchers.values():
+            watcher.stop()
+        self._health_pool.shutdown(wait=False)
+
+
+def _format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024 or unit == 'GiB':
+            return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.1f}{unit}'
+        value /= 1024.0
+
+
+def _format_vnc_ports(ports):
+    """'5900', or '5900-5903' for an instance running several displays"""
+    displays = ports.get('vnc_displays')
+    return f'{displays[0]}-{displays[-1]}' if displays else str(ports['vnc'])
+
+
+def format_table(status):
+    rows = [('INSTANCE', 'STATE', 'VNC', 'API', 'CPU %', 'MEMORY', 'HEALTH', 'FRAME AGE', 'SEQ')]
+    for entry in status['instances']:
+        health = entry.get('health') or {}
+        if not health:
+            health_text = '-'
+        elif not health['reachable']:
+            health_text = 'unreachable'
+        else:
+            health_text = 'healthy' if health['healthy'] else 'unhealthy'
+        cpu = entry.get('cpu_percent')
+        age = health.get('frame_age_seconds')
+        rows.append((
+            str(entry['instance']),
+            entry['state'],
+            _format_vnc_ports(entry['ports']),
+            str(entry['ports']['api']),
+            f'{cpu:.1f}' if cpu is not None else '-',
+            _format_bytes(entry.get('memory_bytes')),
+            health_text,
+            f'{age}s' if age is not None else '-',
+            str(health.get('sequence') or '-'),
+        ))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    summary = status['summary']
+    lines.append('')
+    lines.append(f"{summary['instances']} instance(s): {summary['running']} running, "
+                 f"{summary['stopped']} stopped, {summary['healthy']} healthy "
+                 f"(data age {status.get('age_seconds', 0)}s)")
+    return '\n'.join(lines)
+
+
+def serve(collector, port):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path not in ('/status', '/'):
+                return self._reply(404, 'application/json', json.dumps({'error': 'Not found'}))
+            try:
+                status = collector.status()
+            except (OSError, DockerAPIError) as e:
+                return self._reply(503, 'application/json', json.dumps({'error': f'Docker unavailable: {e}'}))
+            if parse_qs(url.query).get('format') == ['table']:
+                return self._reply(200, 'text/plain; charset=utf-8', format_table(status) + '\n')
+            self._reply(200, 'application/json', json.dumps(status))
+
+        def _reply(self, code, content_type, text):
+            data = text.encode()
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    try:
+        # Start the stats streams now so the first poll already has CPU figures
+        collector.status()
+    except (OSError, DockerAPIError) as e:
+        print(f"Warning: Docker not reachable yet: {e}")
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    print(f"Fleet status daemon listening on port {port} (TTL {collector.ttl}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.close()
+
+
+def _from_daemon(url, table):
+    """Fetch status from a running daemon; None if there is none"""
+    query = '?format=table' if table else ''
+    try:
+        with urllib.request.urlopen(f'{url}/status{query}', timeout=5) as response:
+            return response.read().decode()
+    except (OSError, ValueError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', choices=['show', 'serve'], default='show')
+    parser.add_argument('--json', action='store_true', help='print JSON instead of a table')
+    parser.add_argument('--port', type=int, default=STATUS_PORT, help=f'daemon port (default: {STATUS_PORT})')
+    parser.add_argument('--ttl', type=float, default=STATUS_TTL_S, help=f'cache TTL in seconds (default: {STATUS_TTL_S})')
+    parser.add_argument('--host', default='localhost', help='host the instance API ports are published on')
+    parser.add_argument('--no-daemon', action='store_true', help='collect directly even if a daemon is running')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        serve(StatusCollector(ttl=args.ttl, host=args.host), args.port)
+        return 0
+
+    if not args.no_daemon:
+        text = _from_daemon(f'http://localhost:{args.port}', table=not args.json)
+        if text is not None:
+            print(text.rstrip())
+            return 0
+
+    collector = StatusCollector(ttl=args.ttl, host=args.host)
+    try:
+        collector.status()
+        collector.wait_for_samples()
+        # Collect again now that the stats streams have CPU samples
+        status = collector.status(force=True)
+    except (OSError, DockerAPIError) as e:
+        print(f"Error: cannot talk to Docker ({collector.client.base_url}): {e}", file=sys.stderr)
+        return 2
+    finally:
+        collector.close()
+
+    if args.json:
+        print(json.dumps(status, indent=2))
+    elif not status['instances']:
+        print("No instances found.")
+    else:
+        print(format_table(status))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""Per-instance resource footprint by component, and across session profiles.
+
+`measure` runs inside a container. It samples /proc for a while and reports
+steady-state memory (RSS, and PSS where the kernel provides it) and CPU for
+each component:
+
+  x           Xtigervnc (X server and VNC)
+  session     whatever SESSION_PROFILE starts: LXDE, openbox, D-Bus, ...
+  api         the API server (gunicorn or api.py), capture thread excluded
+  capture     the API's capture thread (CPU only; its frames count in api's memory)
+  supervisor  supervisor.py and its log follower
+  wine        wineserver and Windows processes (the game, once launched)
+  other       everything else
+
+PSS splits shared library pages between the processes mapping them, so the
+PSS total is the container's real memory; the RSS total counts shared pages
+once per process.
+
+`compare` runs on the Docker host. It starts one container per session
+profile in turn, waits for it to become ready, lets it settle, runs
+`measure` inside it, removes it again and prints the per-instance footprint
+and how many instances fit on the host with each profile.
+
+Usage:
+  python3 footprint.py measure [--duration 30] [--warmup 5] [--json]
+  python3 footprint.py compare [--profiles lxde,openbox,none] [--settle 30] [--game-mb 1500] [--json]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+COMPONENTS = ('x', 'session', 'api', 'capture', 'supervisor', 'wine', 'other')
+PROFILES = ('lxde', 'openbox', 'none')
+
+_X_NAMES = {'Xtigervnc', 'Xvnc', 'Xvfb', 'Xorg'}
+_SESSION_NAMES = {
+    'startlxde', 'lxsession', 'lxpanel', 'lxpolkit', 'lxclipboard', 'pcmanfm', 'openbox', 'xterm',
+    'dbus-daemon', 'dbus-launch', 'menu-cached', 'ssh-agent', 'xstartup', 'sleep', 'xscreensaver',
+    'at-spi-bus-laun', 'at-spi2-registr', 'gvfsd', 'gvfsd-fuse', 'gvfs-udisks2-vo', 'vncconfig',
+}
+_WINE_NAMES = {'wineserver', 'wine', 'wine64', 'wine-preloader', 'wine64-preloader'}
+
+CAPTURE_THREAD_NAME = 'capture'  # set by capture.py on its thread
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def classify(comm, args):
+    """Component a process belongs to, from its name and argument list"""
+    names = [os.path.basename(arg) for arg in args[:3]]
+    if comm in _X_NAMES:
+        return 'x'
+    if 'gunicorn' in names or 'api.py' in names or 'api:app' in args:
+        return 'api'
+    if 'supervisor.py' in names or comm == 'tail':
+        return 'supervisor'
+    if comm in _WINE_NAMES or comm.lower().endswith('.exe') or names[0].startswith('wine'):
+        return 'wine'
+    if comm in _SESSION_NAMES or comm.startswith(('lx', 'openbox')):
+        return 'session'
+    return 'other'
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _cpu_ticks(stat):
+    # comm may contain spaces and parentheses; the fields after it are fixed
+    fields = stat[stat.rindex(b')') + 2:].split()
+    return int(fields[11]) + int(fields[12])  # utime + stime
+
+
+def _pss_bytes(pid):
+    try:
+        for line in _read(f'/proc/{pid}/smaps_rollup').splitlines():
+            if line.startswith(b'Pss:'):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def sample_processes(own_pid=None):
+    """{pid: {'component', 'comm', 'ticks', 'rss', 'pss', 'capture_ticks'}} for every process"""
+    processes = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == own_pid:
+            continue
+        pid = int(entry)
+        try:
+            comm = _read(f'/proc/{pid}/comm').decode(errors='replace').strip()
+            args = _read(f'/proc/{pid}/cmdline').decode(errors='replace').split('\0')[:-1]
+            ticks = _cpu_ticks(_read(f'/proc/{pid}/stat'))
+            rss = int(_read(f'/proc/{pid}/statm').split()[1]) * PAGE_SIZE
+        except (OSError, ValueError, IndexError):
+            continue  # exited while we looked, or a kernel thread
+        if not args:
+            continue
+        info = {'component': classify(comm, args), 'comm': comm, 'ticks': ticks, 'rss': rss,
+                'pss': _pss_bytes(pid), 'capture_ticks': 0}
+        if info['component'] == 'api':
+            try:
+                for tid in os.listdir(f'/proc/{pid}/task'):
+                    if _read(f'/proc/{pid}/task/{tid}/comm').strip() == CAPTURE_THREAD_NAME.encode():
+                        info['capture_ticks'] += _cpu_ticks(_read(f'/proc/{pid}/task/{tid}/stat'))
+            except OSError:
+                pass
+        processes[pid] = info
+    return processes
+
+
+def measure(duration=30.0, interval=1.0, warmup=5.0):
+    """Sample for duration seconds (after warmup); returns the per-component footprint"""
+    own_pid = os.getpid()
+    time.sleep(warmup)
+    previous = sample_processes(own_pid)
+    started = time.monotonic()
+    ticks = {name: 0 for name in COMPONENTS}
+    memory = {name: {'rss': [], 'pss': []} for name in COMPONENTS}
+    processes = {name: set() for name in COMPONENTS}
+    samples = 0
+    while time.monotonic() - started < duration:
+        time.sleep(interval)
+        current = sample_processes(own_pid)
+        rss = dict.fromkeys(COMPONENTS, 0)
+        pss = dict.fromkeys(COMPONENTS, 0)
+        for pid, info in current.items():
+            component = info['component']
+            processes[component].add(info['comm'])
+            rss[component] += info['rss']
+            pss[component] += info['pss'] if info['pss'] is not None else info['rss']
+            before = previous.get(pid)
+            if before is not None and before['component'] == component:
+                capture = info['capture_ticks'] - before['capture_ticks']
+                ticks[component] += info['ticks'] - before['ticks'] - max(0, capture)
+                ticks['capture'] += max(0, capture)
+        for component in COMPONENTS:
+            memory[component]['rss'].append(rss[component])
+            memory[component]['pss'].append(pss[component])
+        previous = current
+        samples += 1
+    elapsed = time.monotonic() - started
+
+    mb = 1024 * 1024
+    components = {}
+    for component in COMPONENTS:
+        rss, pss = memory[component]['rss'], memory[component]['pss']
+        if not processes[component] and not ticks[component]:
+            continue
+        components[component] = {
+            'processes': sorted(processes[component]),
+            'rss_mb': round(sum(rss) / len(rss) / mb, 1) if rss else 0.0,
+            'rss_max_mb': round(max(rss) / mb, 1) if rss else 0.0,
+            'pss_mb': round(sum(pss) / len(pss) / mb, 1) if pss else 0.0,
+            'cpu_percent': round(ticks[component] / CLOCK_TICKS / elapsed * 100.0, 2),
+        }
+    totals = {key: round(sum(c[key] for c in components.values()), 1 if key != 'cpu_percent' else 2)
+              for key in ('rss_mb', 'pss_mb', 'cpu_percent')}
+    return {
+        'session_profile': os.environ.get('SESSION_PROFILE', 'lxde'),
+        'duration_seconds': round(elapsed, 1),
+        'samples': samples,
+        'components': components,
+        'total': totals,
+    }
+
+
+def print_footprint(result):
+    print(f"Session profile {result['session_profile']}: {result['samples']} samples over "
+          f"{result['duration_seconds']}s")
+    print(f"  {'component':<11} {'RSS MB':>8} {'max':>8} {'PSS MB':>8} {'CPU %':>7}  processes")
+    for name, component in result['components'].items():
+        print(f"  {name:<11} {component['rss_mb']:>8.1f} {component['rss_max_mb']:>8.1f} "
+              f"{component['pss_mb']:>8.1f} {component['cpu_percent']:>7.2f}  {', '.join(component['processes'])}")
+    total = result['total']
+    print(f"  {'total':<11} {total['rss_mb']:>8.1f} {'':>8} {total['pss_mb']:>8.1f} {total['cpu_percent']:>7.2f}")
+
+
+# Host side ----------------------------------------------------------------
+
+def host_memory_mb():
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1]) / 1024
+    raise OSError('MemTotal missing from /proc/meminfo')
+
+
+def container_memory_mb(stats):
+    """Container memory as `docker stats` shows it (usage minus page cache)"""
+    memory = stats.get('memory_stats') or {}
+    usage = memory.get('usage')
+    if usage is None:
+        return None
+    details = memory.get('stats') or {}
+    cache = details.get('inactive_file', details.get('total_inactive_file', details.get('cache', 0)))
+    return round((usage - cache) / (1024 * 1024), 1)
+
+
+def compare_profiles(profiles, instance_id, image, client_dir, settle, duration, ready_timeout):
+    """Start one container per profile in turn and measure it; returns {profile: footprint}"""
+    from docker_api import DockerAPIError, DockerClient
+    from fleet import NETWORK_NAME, PROJECT_NAME, check_ready, container_config, instance_ports
+
+    client = DockerClient()
+    client.ensure_network(NETWORK_NAME)
+    url = f"http://localhost:{instance_ports(instance_id)['api']}"
+    results = {}
+    for profile in profiles:
+        name = f'{PROJECT_NAME}-footprint-{profile}'
+        config = container_config(instance_id, image, client_dir)
+        config['Env'] = [item for item in config['Env'] if not item.startswith('SESSION_PROFILE=')]
+        config['Env'].append(f'SESSION_PROFILE={profile}')
+        config['HostConfig']['RestartPolicy'] = {'Name': 'no'}
+        print(f"[{profile}] starting {name}...", file=sys.stderr)
+        try:
+            client.remove_container(name, force=True)
+        except DockerAPIError as e:
+            if e.status != 404:
+                raise
+        client.create_container(name, config)
+        try:
+            client.start_container(name)
+            deadline = time.monotonic() + ready_timeout
+            while not check_ready(url)[0]:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'{name} not ready after {ready_timeout:g}s')
+                time.sleep(1)
+            print(f"[{profile}] ready, settling for {settle:g}s and measuring for {duration:g}s...", file=sys.stderr)
+            time.sleep(settle)
+            exit_code, output = client.exec_run(
+                name, ['python3', '/opt/footprint.py', 'measure', '--duration', str(duration), '--warmup', '0',
+                       '--json'], timeout=duration + 60)
+            if exit_code != 0:
+                raise RuntimeError(f'measure failed in {name}: {output.decode(errors="replace").strip()}')
+            result = json.loads(output)
+            result['container_memory_mb'] = container_memory_mb(client.container_stats(name))
+            results[profile] = result
+        finally:
+            client.remove_container(name, force=True)
+    return results
+
+
+def density(results, host_mb, reserve, game_mb):
+    """Instances per host for each profile, with the gain over the first profile"""
+    rows = {}
+    baseline = None
+    usable = host_mb * (1 - reserve)
+    for profile, result in results.items():
+        per_instance = result['total']['pss_mb'] + game_mb
+        instances = math.floor(usable / per_instance) if per_instance > 0 else 0
+        if baseline is None:
+            baseline = instances
+        rows[profile] = {
+            'overhead_mb': result['total']['pss_mb'],
+            'per_instance_mb': round(per_instance, 1),
+            'instances_per_host': instances,
+            'gain_percent': round((instances - baseline) / baseline * 100.0, 1) if baseline else None,
+        }
+    return rows
+
+
+def print_comparison(results, rows, host_mb, game_mb):
+    for result in results.values():
+        print_footprint(result)
+        if result.get('container_memory_mb') is not None:
+            print(f"  container memory (docker stats): {result['container_memory_mb']:.1f} MB")
+        print()
+    print(f"Density on {host_mb / 1024:.1f} GB with {game_mb:g} MB per game client:")
+    for profile, row in rows.items():
+        gain = f" ({row['gain_percent']:+.1f}%)" if row['gain_percent'] else ''
+        print(f"  {profile:<8} {row['overhead_mb']:>7.1f} MB overhead -> {row['instances_per_host']} instances{gain}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['measure', 'compare'])
+    parser.add_argument('--duration', type=float, default=30, help='seconds to sample (default: 30)')
+    parser.add_argument('--interval', type=float, default=1, help='seconds between samples (default: 1)')
+    parser.add_argument('--warmup', type=float, default=5, help='measure: seconds to wait before sampling (default: 5)')
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help=f"compare: session profiles, first is the baseline (default: {','.join(PROFILES)})")
+    parser.add_argument('--instance', type=int, default=None,
+                        help='compare: instance id whose ports and volumes to use (default: MAX_INSTANCES)')
+    parser.add_argument('--image', default=None, help='compare: image to start (default: FLEET_IMAGE)')
+    parser.add_argument('--client-dir', help='compare: shared client directory (default: ./wow-client)')
+    parser.add_argument('--settle', type=float, default=30, help='compare: seconds after ready before measuring (default: 30)')
+    parser.add_argument('--ready-timeout', type=float, default=600, help='compare: seconds to wait for /ready (default: 600)')
+    parser.add_argument('--host-memory-mb', type=float, default=None,
+                        help='compare: host memory for the density estimate (default: this host)')
+    parser.add_argument('--reserve', type=float, default=0.1,
+                        help='compare: fraction of host memory kept free (default: 0.1)')
+    parser.add_argument('--game-mb', type=float, default=1500,
+                        help='compare: memory of one running game client, which is not started here (default: 1500)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'measure':
+        result = measure(args.duration, args.interval, args.warmup)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print_footprint(result)
+        return 0
+
+    from docker_api import DockerAPIError
+    from fleet import IMAGE, MAX_INSTANCES
+    profiles = [profile.strip() for profile in args.profiles.split(',') if profile.strip()]
+    unknown = [profile for profile in profiles if profile not in PROFILES]
+    if unknown or not profiles:
+        parser.error(f"profiles must be among {', '.join(PROFILES)}")
+    try:
+        results = compare_profiles(profiles, args.instance or MAX_INSTANCES, args.image or IMAGE,
+                                   args.client_dir, args.settle, args.duration, args.ready_timeout)
+    except (OSError, DockerAPIError) as e:
+        print(f"Error: cannot talk to Docker: {e}", file=sys.stderr)
+        return 2
+    except RuntimeError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    host_mb = args.host_memory_mb or host_memory_mb()
+    rows = density(results, host_mb, args.reserve, args.game_mb)
+    if args.json:
+        print(json.dumps({'profiles': results, 'density': rows, 'host_memory_mb': round(host_mb),
+                          'game_mb': args.game_mb}, indent=2))
+    else:
+        print_comparison(results, rows, host_mb, args.game_mb)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,389 @@
+"""Server-side analysis of the latest frame: pixel probes, region statistics
+and template matching.
+
+Bots usually need a handful of numbers from a frame (the colour of a few
+pixels, whether a region is mostly red, where a known UI element is), not
+the frame itself. These helpers answer such questions directly on the RGB
+array held in memory, with vectorized NumPy, so a decision costs a few
+hundred bytes of JSON instead of a full PNG download and decode.
+
+Template matching uses normalized cross-correlation on luma. The image/
+template correlation is computed with FFTs and the per-window sums with
+integral images, so the cost grows with the search region, not with the
+template size. Templates are preprocessed once (zero-mean luma, norm and
+FFT spectra per search size) and kept in a TemplateStore. Named templates
+are also written to a directory, so every gunicorn worker sees them.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+# Upper bounds on a single request
+MAX_POINTS = 4096
+MAX_REGIONS = 256
+MAX_MATCHES = 100
+
+DEFAULT_MATCH_THRESHOLD = 0.9
+
+# ITU-R BT.601 luma weights
+_LUMA = np.array([0.299, 0.587, 0.114])
+
+_TEMPLATE_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# FFT spectra kept per template, one per distinct search region size
+_SPECTRA_PER_TEMPLATE = 8
+
+
+def parse_region(value, frame_width, frame_height):
+    """Validate [x, y, width, height] and clip it to the frame; None means the whole frame"""
+    if value is None:
+        return 0, 0, frame_width, frame_height
+    try:
+        x, y, width, height = (int(v) for v in value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('region must be [x, y, width, height]')
+    if x < 0 or y < 0 or width <= 0 or height <= 0:
+        raise ValueError('region origin must be non-negative and size positive')
+    if x >= frame_width or y >= frame_height:
+        raise ValueError(f'region origin is outside the {frame_width}x{frame_height} frame')
+    return x, y, min(width, frame_width - x), min(height, frame_height - y)
+
+
+def _parse_color(value, name='color'):
+    try:
+        color = [int(v) for v in value]
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'{name} must be [r, g, b]')
+    if len(color) != 3 or not all(0 <= v <= 255 for v in color):
+        raise ValueError(f'{name} must be [r, g, b] with values 0-255')
+    return color
+
+
+def _parse_tolerance(value):
+    try:
+        tolerance = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('tolerance must be an integer')
+    if tolerance < 0 or tolerance > 255:
+        raise ValueError('tolerance must be between 0 and 255')
+    return tolerance
+
+
+def read_pixels(pixels, points, expect=None, tolerance=0):
+    """RGB values at a list of [x, y] points, optionally compared to expected colours
+
+    Returns {'pixels': [[r, g, b], ...]} plus 'matches' (one bool per point,
+    true when every channel is within tolerance) and 'all_match' when expect
+    is given.
+    """
+    if not isinstance(points, list) or not points:
+        raise ValueError('points must be a non-empty list of [x, y]')
+    if len(points) > MAX_POINTS:
+        raise ValueError(f'at most {MAX_POINTS} points per request')
+    height, width = pixels.shape[:2]
+    for point in points:
+        # Checked before the int64 conversion, which would truncate floats and overflow on huge values
+        if (not isinstance(point, list) or len(point) != 2
+                or not all(isinstance(v, int) and not isinstance(v, bool) for v in point)):
+            raise ValueError('points must be a list of [x, y] integers')
+        x, y = point
+        if not (0 <= x < width and 0 <= y < height):
+            raise ValueError(f'point ({x}, {y}) is outside the {width}x{height} frame')
+    coords = np.array(points, dtype=np.int64)
+
+    values = pixels[coords[:, 1], coords[:, 0]]
+    result = {'pixels': values.tolist()}
+    if expect is not None:
+        if not isinstance(expect, list) or len(expect) != len(points):
+            raise ValueError('expect must have one [r, g, b] per point')
+        expected = np.array([_parse_color(color, 'expect') for color in expect], dtype=np.int16)
+        tolerance = _parse_tolerance(tolerance)
+        matches = np.all(np.abs(values.astype(np.int16) - expected) <= tolerance, axis=1)
+        result['matches'] = matches.tolist()
+        result['all_match'] = bool(matches.all())
+    return result
+
+
+def region_stats(pixels, region, color=None, tolerance=0):
+    """Per-channel mean/std/min/max of a region (already clipped by parse_region)
+
+    With color, also the fraction of pixels within tolerance of it on every channel.
+    """
+    x, y, width, height = region
+    view = pixels[y:y + height, x:x + width].reshape(-1, 3)
+    result = {
+        'region': [x, y, width, height],
+        'mean': np.round(view.mean(axis=0), 2).tolist(),
+        'std': np.round(view.std(axis=0), 2).tolist(),
+        'min': view.min(axis=0).tolist(),
+        'max': view.max(axis=0).tolist(),
+    }
+    if color is not None:
+        target = np.array(_parse_color(color), dtype=np.int16)
+        tolerance = _parse_tolerance(tolerance)
+        close = np.all(np.abs(view.astype(np.int16) - target) <= tolerance, axis=1)
+        result['match_fraction'] = round(float(close.mean()), 4)
+    return result
+
+
+def luma(pixels):
+    return pixels @ _LUMA
+
+
+def _fast_len(n):
+    """Smallest 2/3/5-smooth integer >= n (sizes pocketfft transforms quickly)"""
+    best = 1 << max(0, (n - 1).bit_length())
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p235 = p35
+            while p235 < n:
+                p235 *= 2
+            best = min(best, p235)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def _window_sums(values, height, width):
+    """Sum of every height x width window, via an integral image"""
+    integral = np.zeros((values.shape[0] + 1, values.shape[1] + 1))
+    np.cumsum(values, axis=0, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    return (integral[height:, width:] - integral[:-height, width:]
+            - integral[height:, :-width] + integral[:-height, :-width])
+
+
+class Template:
+    """A template image with the data matching needs precomputed"""
+
+    def __init__(self, name, pixels, digest):
+        height, width = pixels.shape[:2]
+        if width < 2 or height < 2:
+            raise ValueError('template must be at least 2x2 pixels')
+        self.name = name
+        self.pixels = pixels
+        self.digest = digest
+        self.width = width
+        self.height = height
+        gray = luma(pixels)
+        self.zero_mean = gray - gray.mean()
+        self.norm = float(np.sqrt(np.square(self.zero_mean).sum()))
+        if self.norm < 1e-6:
+            raise ValueError('template has a single colour; use /probe/region with color instead')
+        self._spectra = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, name, data):
+        """Decode an uploaded PNG/JPEG/WebP image"""
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                pixels = np.asarray(image.convert('RGB'))
+        except Exception:
+            raise ValueError('template is not a readable PNG, JPEG or WebP image')
+        return cls(name, pixels, hashlib.sha1(data).hexdigest())
+
+    def spectrum(self, shape):
+        """FFT of the flipped zero-mean template, padded to shape (cached per shape)"""
+        with self._lock:
+            spectrum = self._spectra.get(shape)
+            if spectrum is not None:
+                self._spectra.move_to_end(shape)
+                return spectrum
+        spectrum = np.fft.rfft2(self.zero_mean[::-1, ::-1], shape)
+        with self._lock:
+            self._spectra[shape] = spectrum
+            while len(self._spectra) > _SPECTRA_PER_TEMPLATE:
+                self._spectra.popitem(last=False)
+        return spectrum
+
+    def describe(self):
+        return {'name': self.name, 'width': self.width, 'height': self.height, 'sha1': self.digest}
+
+
+def match_scores(gray, template):
+    """Normalized cross-correlation of template at every position in gray
+
+    Returns an array of shape (H - h + 1, W - w + 1) with scores in [-1, 1];
+    windows without any contrast score 0.
+    """
+    height, width = gray.shape
+    t_height, t_width = template.height, template.width
+    shape = (_fast_len(height + t_height - 1), _fast_len(width + t_width - 1))
+    correlation = np.fft.irfft2(np.fft.rfft2(gray, shape) * template.spectrum(shape), shape)
+    numerator = correlation[t_height - 1:height, t_width - 1:width]
+
+    count = t_height * t_width
+    sums = _window_sums(gray, t_height, t_width)
+    variance = _window_sums(np.square(gray), t_height, t_width) - np.square(sums) / count
+    denominator = np.sqrt(np.maximum(variance, 0.0)) * template.norm
+    scores = np.zeros_like(numerator)
+    # Flat windows (denominator ~ 0) cannot correlate with a textured template
+    np.divide(numerator, denominator, out=scores, where=denominator > 1e-3 * template.norm)
+    return np.clip(scores, -1.0, 1.0, out=scores)
+
+
+def parse_match_args(threshold=DEFAULT_MATCH_THRESHOLD, max_matches=1):
+    """Validate JSON threshold and max_matches values; returns (float, int)"""
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+        raise ValueError('threshold must be a number')
+    if isinstance(max_matches, bool) or not isinstance(max_matches, int):
+        raise ValueError('max_matches must be an integer')
+    threshold = float(threshold)
+    if not -1.0 <= threshold <= 1.0:
+        raise ValueError('threshold must be between -1 and 1')
+    if max_matches < 1 or max_matches > MAX_MATCHES:
+        raise ValueError(f'max_matches must be between 1 and {MAX_MATCHES}')
+    return threshold, max_matches
+
+
+def match_template(pixels, template, region, threshold=DEFAULT_MATCH_THRESHOLD, max_matches=1):
+    """Find template in region (already clipped by parse_region)
+
+    Returns the best position and up to max_matches non-overlapping matches
+    scoring at least threshold, in frame coordinates.
+    """
+    try:
+        threshold = float(threshold)
+        max_matches = int(max_matches)
+    except (TypeError, ValueError):
+        raise ValueError('threshold must be a number and max_matches an integer')
+    if not -1.0 <= threshold <= 1.0:
+        raise ValueError('threshold must be between -1 and 1')
+    if max_matches < 1 or max_matches > MAX_MATCHES:
+        raise ValueError(f'max_matches must be between 1 and {MAX_MATCHES}')
+    x, y, width, height = region
+    if template.width > width or template.height > height:
+        raise ValueError(f'template ({template.width}x{template.height}) is larger than the '
+                         f'search region ({width}x{height})')
+
+    scores = match_scores(luma(pixels[y:y + height, x:x + width]), template)
+    best_y, best_x = np.unravel_index(np.argmax(scores), scores.shape)
+    best = {'x': x + int(best_x), 'y': y + int(best_y), 'score': round(float(scores[best_y, best_x]), 4)}
+
+    matches = []
+    candidates = np.flatnonzero(scores >= threshold)
+    if candidates.size:
+        # Greedy non-maximum suppression over the strongest candidates
+        candidates = candidates[np.argsort(scores.flat[candidates])[::-1]]
+        for index in candidates[:max_matches * 64]:
+            cy, cx = divmod(int(index), scores.shape[1])
+            if any(abs(cx - mx) < template.width and abs(cy - my) < template.height for mx, my, _ in matches):
+                continue
+            matches.append((cx, cy, float(scores.flat[index])))
+            if len(matches) == max_matches:
+                break
+
+    return {
+        'found': bool(matches),
+        'best': best,
+        'matches': [{'x': x + mx, 'y': y + my, 'width': template.width, 'height': template.height,
+                     'score': round(score, 4)} for mx, my, score in matches],
+        'region': [x, y, width, height],
+        'threshold': threshold,
+    }
+
+
+class TemplateStore:
+    """Named templates plus an LRU of recently uploaded ad-hoc templates
+
+    Named templates are saved as PNG files in directory (when set) and loaded
+    from there on demand, so templates registered through one worker process
+    are visible to all of them and survive restarts.
+    """
+
+    def __init__(self, directory=None, max_uploads=16):
+        self.directory = directory
+        self.max_uploads = max_uploads
+        self._named = {}  # name -> (file mtime_ns or None, Template)
+        self._uploads = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def check_name(name):
+        if not isinstance(name, str) or not _TEMPLATE_NAME.match(name):
+            raise ValueError('template names are 1-64 characters of letters, digits, ".", "_" and "-"')
+
+    def _path(self, name):
+        return os.path.join(self.directory, f'{name}.png')
+
+    def register(self, name, data):
+        """Store an encoded image under name, replacing any previous template"""
+        self.check_name(name)
+        template = Template.from_bytes(name, data)
+        mtime_ns = None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(name)
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            Image.fromarray(template.pixels, 'RGB').save(temp_path, format='PNG')
+            os.replace(temp_path, path)
+            mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            self._named[name] = (mtime_ns, template)
+        return template
+
+    def get(self, name):
+        """The named template, reloaded if its file changed; None if unknown"""
+        self.check_name(name)
+        with self._lock:
+            mtime_ns, template = self._named.get(name, (None, None))
+        if not self.directory:
+            return template
+        try:
+            file_mtime_ns = os.stat(self._path(name)).st_mtime_ns
+        except FileNotFoundError:
+            # Deleted through another worker
+            with self._lock:
+                self._named.pop(name, None)
+            return None
+        if template is None or file_mtime_ns != mtime_ns:
+            with open(self._path(name), 'rb') as f:
+                data = f.read()
+            template = Template.from_bytes(name, data)
+            with self._lock:
+                self._named[name] = (file_mtime_ns, template)
+        return template
+
+    def remove(self, name):
+        self.check_name(name)
+        with self._lock:
+            removed = self._named.pop(name, None) is not None
+        if self.directory:
+            try:
+                os.unlink(self._path(name))
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def names(self):
+        names = set()
+        with self._lock:
+            names.update(self._named)
+        if self.directory and os.path.isdir(self.directory):
+            names.update(entry[:-4] for entry in os.listdir(self.directory) if entry.endswith('.png'))
+        return sorted(names)
+
+    def from_upload(self, data):
+        """Template for uploaded image bytes, reusing the preprocessing of identical uploads"""
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            template = self._uploads.get(digest)
+            if template is not None:
+                self._uploads.move_to_end(digest)
+                return template
+        template = Template.from_bytes(None, data)
+        with self._lock:
+            self._uploads[digest] = template
+            while len(self._uploads) > self.max_uploads:
+                self._uploads.popitem(last=False)
+        return template
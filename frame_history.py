@@ -0,0 +1,336 @@
+"""Bounded in-memory history of recent frames.
+
+The capture engine only keeps the newest frame. FrameHistory records every
+captured frame into one buffer allocated up front, capped both by frame
+count and by bytes, so the last seconds before a bot misbehaved can be
+fetched or exported afterwards without writing files per frame.
+
+Two storage modes:
+
+  raw     fixed slots holding the RGB pixels (one memcpy per frame, fastest
+          to record and read; memory cap / frame size frames fit)
+  delta   a circular byte log of zlib-compressed frames. Every
+          keyframe_interval-th frame is stored whole, the others as the XOR
+          against the previous frame, limited to the band of rows that
+          changed. While the screen is mostly static a delta is a few KB
+          and costs a few milliseconds to record. Reading a frame replays
+          the deltas from the nearest keyframe.
+
+The buffer can be backed by a file on tmpfs (mmap_path, e.g. /dev/shm), so
+it shows up as shared memory instead of process heap and can be inspected
+from outside the process. Each process gets its own file.
+"""
+import io
+import os
+import threading
+import time
+import zipfile
+import zlib
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+from capture import Frame
+from snapshot_encoding import apply_view, encode_image
+
+COMPRESSION_MODES = ('raw', 'delta')
+CLIP_FORMATS = {
+    'gif': 'image/gif',
+    'webp': 'image/webp',
+    'zip': 'application/zip',
+}
+
+
+class _Entry:
+    __slots__ = ('seq', 'timestamp', 'monotonic', 'capture_ms', 'offset', 'length', 'keyframe', 'shape', 'rows')
+
+    def __init__(self, frame, offset, length, keyframe, rows=None):
+        self.seq = frame.seq
+        self.timestamp = frame.timestamp
+        self.monotonic = frame.monotonic
+        self.capture_ms = frame.capture_ms
+        self.offset = offset
+        self.length = length
+        self.keyframe = keyframe
+        self.shape = frame.pixels.shape
+        self.rows = rows  # delta mode: (first, stop) rows the delta covers
+
+
+class FrameHistory:
+    """Ring buffer of the last max_frames frames within max_bytes"""
+
+    def __init__(self, max_frames=120, max_bytes=128 << 20, compression='delta', mmap_path=None,
+                 keyframe_interval=30):
+        if compression not in COMPRESSION_MODES:
+            raise ValueError(f'compression must be one of: {", ".join(COMPRESSION_MODES)}')
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.mmap_path = f'{mmap_path}.{os.getpid()}' if mmap_path else None
+        # A keyframe's deltas are evicted with it, so chains must be short next to max_frames
+        self.keyframe_interval = max(1, min(keyframe_interval, max_frames // 2))
+        self.frames_recorded = 0
+        self.frames_skipped = 0
+        self.append_ms = 0.0
+        self._buffer = None
+        self._slots = 0  # raw mode: frames that fit in the buffer
+        self._entries = deque()
+        self._head = 0  # delta mode: next write offset
+        self._previous = None  # pixels of the last recorded frame (delta base)
+        self._since_keyframe = 0
+        self._decoded = None  # (seq, pixels) of the last frame rebuilt from deltas
+        self._lock = threading.Lock()
+        if compression == 'delta':
+            self._buffer = self._allocate(max_bytes)
+
+    def _allocate(self, nbytes):
+        if self.mmap_path:
+            return np.memmap(self.mmap_path, dtype=np.uint8, mode='w+', shape=(nbytes,))
+        return np.empty(nbytes, dtype=np.uint8)
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._buffer = None
+        if self.mmap_path:
+            try:
+                os.unlink(self.mmap_path)
+            except FileNotFoundError:
+                pass
+
+    # Recording -------------------------------------------------------------
+
+    def append(self, frame):
+        """Record a frame (called from the capture thread for every new frame)"""
+        started = time.perf_counter()
+        if self.compression == 'raw':
+            self._append_raw(frame)
+        else:
+            self._append_delta(frame)
+        self.append_ms = (time.perf_counter() - started) * 1000.0
+
+    def _append_raw(self, frame):
+        pixels = frame.pixels
+        with self._lock:
+            if not self._entries or self._entries[-1].shape != pixels.shape or self._buffer is None:
+                # First frame or the screen was resized: size the slots for this frame
+                self._entries.clear()
+                self._slots = min(self.max_frames, self.max_bytes // pixels.nbytes)
+                self._buffer = self._allocate(self._slots * pixels.nbytes) if self._slots else None
+                self._head = 0
+            if not self._slots:
+                self.frames_skipped += 1
+                return
+            if len(self._entries) == self._slots:
+                self._entries.popleft()
+            offset = self._head * pixels.nbytes
+            self._buffer[offset:offset + pixels.nbytes] = pixels.reshape(-1)
+            self._entries.append(_Entry(frame, offset, pixels.nbytes, True))
+            self._head = (self._head + 1) % self._slots
+            self.frames_recorded += 1
+
+    def _append_delta(self, frame):
+        pixels = frame.pixels
+        previous = self._previous
+        keyframe = (previous is None or previous.shape != pixels.shape
+                    or self._since_keyframe + 1 >= self.keyframe_interval)
+        if keyframe:
+            source, rows = pixels, (0, pixels.shape[0])
+        else:
+            diff = np.bitwise_xor(pixels, previous)
+            changed = np.flatnonzero(diff.reshape(diff.shape[0], -1).any(axis=1))
+            rows = (int(changed[0]), int(changed[-1]) + 1) if changed.size else (0, 0)
+            source = diff[rows[0]:rows[1]]
+        blob = zlib.compress(source.data if source.flags.c_contiguous else source.tobytes(), 1)
+
+        with self._lock:
+            offset = self._reserve(len(blob), keyframe)
+            if offset is None:
+                # Larger than the whole buffer; the next frame must be a keyframe
+                self._previous = None
+                self.frames_skipped += 1
+                return
+            self._buffer[offset:offset + len(blob)] = np.frombuffer(blob, dtype=np.uint8)
+            self._entries.append(_Entry(frame, offset, len(blob), keyframe, rows))
+            self._head = offset + len(blob)
+            while len(self._entries) > self.max_frames:
+                self._evict()
+            self._previous = pixels
+            self._since_keyframe = 0 if keyframe else self._since_keyframe + 1
+            self.frames_recorded += 1
+
+    def _evict(self):
+        """Drop the oldest entry, and the deltas that depended on it if it was a keyframe"""
+        entry = self._entries.popleft()
+        if entry.keyframe:
+            while self._entries and not self._entries[0].keyframe:
+                self._entries.popleft()
+        if not self._entries:
+            self._head = 0
+            self._previous = None
+
+    def _reserve(self, length, keyframe):
+        """Offset for length bytes in the circular log, evicting the oldest entries as needed"""
+        if length >= self.max_bytes:
+            return None
+        while True:
+            if not self._entries:
+                self._head = 0
+                return 0
+            tail = self._entries[0].offset
+            if self._head > tail:
+                # Live data is [tail, head): append after it, or wrap to the start
+                if self._head + length <= self.max_bytes:
+                    return self._head
+                if length < tail:
+                    return 0
+            elif self._head + length < tail:
+                # Wrapped: live data is [tail, end) + [0, head)
+                return self._head
+            self._evict()
+            if self._previous is None and not keyframe:
+                # The base of this delta was evicted; the next frame starts over with a keyframe
+                return None
+
+    # Reading ---------------------------------------------------------------
+
+    def _index(self, seq):
+        entries = self._entries
+        if not entries or seq < entries[0].seq or seq > entries[-1].seq:
+            return None
+        # Sequence numbers are consecutive unless frames were skipped
+        index = min(seq - entries[0].seq, len(entries) - 1)
+        while entries[index].seq > seq:
+            index -= 1
+        return index if entries[index].seq == seq else None
+
+    def _copy(self, entry):
+        return self._buffer[entry.offset:entry.offset + entry.length].copy()
+
+    def _decode_locked(self, index):
+        """Copy out what is needed to rebuild entry index; returns a function that decodes it"""
+        entry = self._entries[index]
+        if self.compression == 'raw':
+            data = self._copy(entry)
+            return lambda: data.reshape(entry.shape)
+
+        start = index
+        while not self._entries[start].keyframe:
+            start -= 1
+        base = None
+        decoded = self._decoded
+        if decoded is not None and self._entries[start].seq <= decoded[0] <= entry.seq:
+            # Continue from the last rebuilt frame instead of the keyframe
+            base = decoded[1]
+            start = self._index(decoded[0]) + 1
+        chain = [(self._entries[i], self._copy(self._entries[i])) for i in range(start, index + 1)]
+
+        def decode():
+            # One private copy, then every delta is applied in place
+            pixels = None if base is None else base.copy()
+            for item, blob in chain:
+                data = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+                if item.keyframe:
+                    pixels = data.reshape(item.shape).copy()
+                else:
+                    first, stop = item.rows
+                    band = pixels[first:stop]
+                    np.bitwise_xor(band, data.reshape(band.shape), out=band)
+            self._decoded = (entry.seq, pixels)
+            return pixels
+        return decode
+
+    def get(self, seq):
+        """The recorded frame with this sequence number, or None"""
+        with self._lock:
+            index = self._index(seq)
+            if index is None:
+                return None
+            entry = self._entries[index]
+            decode = self._decode_locked(index)
+        pixels = decode()
+        pixels.flags.writeable = False
+        return Frame(entry.seq, entry.timestamp, entry.monotonic, pixels, entry.capture_ms)
+
+    def at(self, timestamp):
+        """The newest recorded frame captured at or before timestamp, or None"""
+        with self._lock:
+            candidates = [entry.seq for entry in self._entries if entry.timestamp <= timestamp]
+        return self.get(candidates[-1]) if candidates else None
+
+    def sequences(self, start=None, end=None):
+        """Sequence numbers of recorded frames with start <= timestamp <= end"""
+        with self._lock:
+            return [entry.seq for entry in self._entries
+                    if (start is None or entry.timestamp >= start) and (end is None or entry.timestamp <= end)]
+
+    def frames(self, sequences):
+        """Yield the frames for sequences in order, skipping any evicted meanwhile"""
+        for seq in sequences:
+            frame = self.get(seq)
+            if frame is not None:
+                yield frame
+
+    def stats(self):
+        with self._lock:
+            entries = list(self._entries)
+            capacity = self._slots if self.compression == 'raw' else self.max_frames
+        used = sum(entry.length for entry in entries)
+        stats = {
+            'compression': self.compression,
+            'frames': len(entries),
+            'max_frames': self.max_frames,
+            'capacity_frames': capacity,
+            'bytes_used': used,
+            'max_bytes': self.max_bytes,
+            'mmap_path': self.mmap_path,
+            'frames_recorded': self.frames_recorded,
+            'frames_skipped': self.frames_skipped,
+            'append_ms': round(self.append_ms, 3),
+        }
+        if entries:
+            stats.update({
+                'oldest_sequence': entries[0].seq,
+                'oldest_timestamp': entries[0].timestamp,
+                'newest_sequence': entries[-1].seq,
+                'newest_timestamp': entries[-1].timestamp,
+                'seconds': round(entries[-1].timestamp - entries[0].timestamp, 3),
+                'bytes_per_frame': round(used / len(entries)),
+            })
+            if self.compression == 'delta':
+                stats['keyframes'] = sum(1 for entry in entries if entry.keyframe)
+        return stats
+
+
+def encode_clip(frames, fmt, crop=None, scale=1.0, quality=80, frame_format='png'):
+    """Encode frames as an animated GIF/WebP or a zip of images named by sequence
+
+    Animation frame durations follow the capture timestamps.
+    """
+    if fmt not in CLIP_FORMATS:
+        raise ValueError(f'format must be one of: {sorted(CLIP_FORMATS)}')
+    buffer = io.BytesIO()
+    count = 0
+    if fmt == 'zip':
+        extension = 'jpg' if frame_format == 'jpeg' else frame_format
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for frame in frames:
+                data = encode_image(np.ascontiguousarray(apply_view(frame.pixels, crop, scale)), frame_format, quality)
+                archive.writestr(f'{frame.seq:010d}-{frame.timestamp:.3f}.{extension}', data)
+                count += 1
+        return buffer.getvalue(), count
+
+    images, timestamps = [], []
+    for frame in frames:
+        images.append(Image.fromarray(np.ascontiguousarray(apply_view(frame.pixels, crop, scale)), 'RGB'))
+        timestamps.append(frame.timestamp)
+    if not images:
+        return b'', 0
+    durations = [max(20, round((later - earlier) * 1000)) for earlier, later in zip(timestamps, timestamps[1:])]
+    durations.append(durations[-1] if durations else 100)
+    options = {'save_all': True, 'append_images': images[1:], 'duration': durations, 'loop': 0}
+    if fmt == 'webp':
+        options.update(quality=quality, method=0)
+    images[0].save(buffer, format=fmt.upper(), **options)
+    return buffer.getvalue(), len(images)
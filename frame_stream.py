@@ -0,0 +1,133 @@
+"""Frame streaming helpers: multipart MJPEG parts and tile-diff delta messages.
+
+Delta messages carry only the rectangles that changed since the previous
+frame sent on the same stream. Changes are found with a vectorized tile diff
+over the RGB frames, which works for any X server (including the TigerVNC
+framebuffer) without relying on the XDamage extension.
+
+WebSocket binary message layout (little endian):
+
+    header:  magic b'KSDF', version u8, flags u8, rect_count u16,
+             seq u32, timestamp f64, frame_width u16, frame_height u16
+    rect:    x u16, y u16, width u16, height u16, encoding u8, length u32,
+             followed by `length` bytes of payload
+
+flags bit 0 marks a keyframe (a single rect covering the whole frame).
+Encodings: 0 = raw RGB, 1 = PNG, 2 = JPEG.
+"""
+import struct
+
+import numpy as np
+
+from snapshot_encoding import encode_image
+
+MAGIC = b'KSDF'
+VERSION = 1
+FLAG_KEYFRAME = 0x01
+ENCODINGS = {'raw': 0, 'png': 1, 'jpeg': 2}
+
+_HEADER = struct.Struct('<4sBBHIdHH')
+_RECT = struct.Struct('<HHHHBI')
+
+
+def mjpeg_part(data, seq, timestamp, boundary='frame'):
+    """One part of a multipart/x-mixed-replace MJPEG stream"""
+    header = (
+        f'--{boundary}\r\n'
+        'Content-Type: image/jpeg\r\n'
+        f'Content-Length: {len(data)}\r\n'
+        f'X-Snapshot-Sequence: {seq}\r\n'
+        f'X-Snapshot-Created: {timestamp}\r\n'
+        '\r\n'
+    ).encode()
+    return header + data + b'\r\n'
+
+
+def dirty_rects(previous, current, tile=32):
+    """Rectangles (x, y, w, h) covering every tile that differs between frames
+
+    Adjacent dirty tiles in a tile row are merged into one run, and runs with
+    the same horizontal span in consecutive rows are merged vertically.
+    """
+    height, width = current.shape[:2]
+    if previous is None or previous.shape != current.shape:
+        return [(0, 0, width, height)]
+
+    changed = np.any(previous != current, axis=2)
+    rows = -(-height // tile)
+    cols = -(-width // tile)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:height, :width] = changed
+    tiles = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    rects = []
+    open_runs = {}  # (col_start, col_end) -> index in rects, for the previous tile row
+    for row in range(rows):
+        row_runs = {}
+        dirty_cols = np.flatnonzero(tiles[row])
+        if dirty_cols.size:
+            # Split the dirty column indices into contiguous runs
+            breaks = np.flatnonzero(np.diff(dirty_cols) > 1) + 1
+            for run in np.split(dirty_cols, breaks):
+                span = (int(run[0]), int(run[-1]) + 1)
+                if span in open_runs:
+                    index = open_runs[span]
+                    x, y, w, h = rects[index]
+                    rects[index] = (x, y, w, h + tile)
+                else:
+                    index = len(rects)
+                    rects.append((span[0] * tile, row * tile, (span[1] - span[0]) * tile, tile))
+                row_runs[span] = index
+        open_runs = row_runs
+
+    # Clip rectangles that extend past the frame edge
+    return [
+        (x, y, min(w, width - x), min(h, height - y))
+        for x, y, w, h in rects
+    ]
+
+
+def encode_delta(pixels, rects, seq, timestamp, encoding='png', quality=80, keyframe=False):
+    """Build one binary delta message for the given rectangles"""
+    height, width = pixels.shape[:2]
+    code = ENCODINGS[encoding]
+    parts = [_HEADER.pack(
+        MAGIC, VERSION, FLAG_KEYFRAME if keyframe else 0, len(rects),
+        seq & 0xFFFFFFFF, timestamp, width, height,
+    )]
+    for x, y, w, h in rects:
+        region = pixels[y:y + h, x:x + w]
+        if encoding == 'raw':
+            payload = region.tobytes()
+        else:
+            payload = encode_image(np.ascontiguousarray(region), encoding, quality)
+        parts.append(_RECT.pack(x, y, w, h, code, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_delta(message):
+    """Parse a delta message into (header dict, [(x, y, w, h, encoding, payload)])
+
+    Used by test_frame_stream.py and Python consumers of the WebSocket stream.
+    """
+    magic, version, flags, count, seq, timestamp, width, height = _HEADER.unpack_from(message, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a delta frame message')
+    offset = _HEADER.size
+    names = {code: name for name, code in ENCODINGS.items()}
+    rects = []
+    for _ in range(count):
+        x, y, w, h, code, length = _RECT.unpack_from(message, offset)
+        offset += _RECT.size
+        rects.append((x, y, w, h, names[code], message[offset:offset + length]))
+        offset += length
+    header = {
+        'version': version,
+        'keyframe': bool(flags & FLAG_KEYFRAME),
+        'seq': seq,
+        'timestamp': timestamp,
+        'width': width,
+        'height': height,
+    }
+    return header, rects
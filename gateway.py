@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Fan-out gateway in front of every instance's api.py.
+
+Broadcasts input to all instances (or a chosen subset) and gathers
+snapshots and /snapshot-info concurrently, instead of looping over
+BASE_API_PORT + i - 1 one request at a time. Uses asyncio with one pooled
+keep-alive aiohttp session, so a fleet-wide key press costs roughly one
+round trip, and every instance gets its own result and timeout.
+
+Routes:
+  GET  /instances                          instance -> API URL map
+  POST /broadcast/<endpoint>               send the JSON body to every instance
+  POST /instances/<ids>/<endpoint>         send it to some instances, e.g. 3 or 1-5,8
+  GET  /gather/snapshot-info               /snapshot-info from every instance
+  GET  /gather/desktop-snapshot            snapshots (base64) from every instance
+  GET  /mosaic                             JPEG of every instance's latest frame (mosaic.py)
+  GET  /mosaic/info                        mosaic layout and per-tile health
+
+Input endpoints: send-key, send-key-duration, move-mouse, click-mouse,
+drag-mouse, input-batch, release-all. Gather routes also accept ?instances=.
+Input and gather routes accept ?timeout=<seconds> (default GATEWAY_TIMEOUT_S)
+and ?display=<k> to address display k of instances running several displays
+(default: display 0). The mosaic shows display 0 of every instance.
+
+Usage:
+  python3 gateway.py [--instances 1-40] [--host localhost] [--port 8000]
+                     [--mosaic-tile 320x214] [--mosaic-interval-ms 1000]
+
+Without --instances the running instances are discovered from Docker.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+from fleet import FleetController, RUNNING_STATES, api_port, parse_instance_ids
+from mosaic import MOSAIC_INTERVAL_MS, MOSAIC_TILE_HEIGHT, MOSAIC_TILE_WIDTH, Mosaic, MosaicCanvas, parse_tile_size
+
+INPUT_ENDPOINTS = (
+    'send-key', 'send-key-duration', 'move-mouse', 'click-mouse',
+    'drag-mouse', 'input-batch', 'release-all',
+)
+GATHER_ENDPOINTS = ('snapshot-info', 'desktop-snapshot')
+
+GATEWAY_PORT = int(os.environ.get('GATEWAY_PORT', '8000'))
+DEFAULT_TIMEOUT_S = float(os.environ.get('GATEWAY_TIMEOUT_S', '5'))
+MAX_TIMEOUT_S = 120
+# Keep-alive connections kept per instance; enough for a broadcast plus a gather
+CONNECTIONS_PER_INSTANCE = int(os.environ.get('GATEWAY_CONNECTIONS_PER_INSTANCE', '4'))
+DISCOVERY_INTERVAL_S = float(os.environ.get('GATEWAY_DISCOVERY_INTERVAL_S', '10'))
+
+
+class InstanceRegistry:
+    """Instance id -> base URL, fixed or discovered from Docker"""
+
+    def __init__(self, urls=None, host='localhost', discover=False):
+        self.host = host
+        self.discover = discover
+        self.urls = dict(urls or {})
+        self._refreshed = 0.0
+
+    @classmethod
+    def from_ids(cls, instance_ids, host='localhost'):
+        return cls({i: f"http://{host}:{api_port(i)}" for i in instance_ids}, host)
+
+    async def refresh(self):
+        if not self.discover or time.monotonic() - self._refreshed < DISCOVERY_INTERVAL_S:
+            return
+        self._refreshed = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            actual = await loop.run_in_executor(None, FleetController().actual_state)
+        except Exception as e:
+            print(f"Warning: instance discovery failed, keeping {len(self.urls)} known instances: {e}")
+            return
+        self.urls = {
+            i: f"http://{self.host}:{api_port(i)}"
+            for i, info in sorted(actual.items()) if info['state'] in RUNNING_STATES
+        }
+
+    async def select(self, spec=None):
+        """{id: url} for all instances, or for an id spec like '1-5,8'"""
+        await self.refresh()
+        if not spec:
+            return dict(self.urls)
+        wanted = parse_instance_ids(spec)
+        unknown = [i for i in wanted if i not in self.urls]
+        if unknown:
+            raise ValueError(f'Unknown instance(s): {unknown}')
+        return {i: self.urls[i] for i in wanted}
+
+
+class FanOut:
+    """Concurrent requests to many instances over one pooled session"""
+
+    def __init__(self, connections_per_instance=CONNECTIONS_PER_INSTANCE):
+        self.connections_per_instance = connections_per_instance
+        self.session = None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=0,
+            limit_per_host=self.connections_per_instance,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _one(self, instance_id, url, method, path, started, timeout, json_body, params, binary):
+        sent_ms = (time.monotonic() - started) * 1000.0
+        result = {'instance': instance_id, 'url': url}
+        try:
+            async with self.session.request(
+                method, url + path, json=json_body, params=params,
+                timeout=aiohttp.ClientTimeout(total=timeout),
+            ) as response:
+                result['status'] = response.status
+                if binary and response.status == 200:
+                    data = await response.read()
+                    result['content_type'] = response.content_type
+                    result['headers'] = {k: v for k, v in response.headers.items() if k.startswith('X-Snapshot-')}
+                    result['data'] = base64.b64encode(data).decode()
+                elif response.content_type == 'application/json':
+                    result['response'] = await response.json()
+                else:
+                    result['response'] = (await response.text())[:500]
+                result['ok'] = response.status < 400 or (path.endswith('/snapshot-info') and response.status == 503)
+        except asyncio.TimeoutError:
+            result.update({'ok': False, 'error': f'timeout after {timeout}s'})
+        except aiohttp.ClientError as e:
+            result.update({'ok': False, 'error': str(e) or type(e).__name__})
+        result['sent_ms'] = round(sent_ms, 2)
+        result['elapsed_ms'] = round((time.monotonic() - started) * 1000.0 - sent_ms, 2)
+        return result
+
+    async def request_all(self, targets, method, path, timeout, json_body=None, params=None, binary=False):
+        """Send one request to every target concurrently; returns the summary dict"""
+        started = time.monotonic()
+        results = await asyncio.gather(*(
+            self._one(instance_id, url, method, path, started, timeout, json_body, params, binary)
+            for instance_id, url in sorted(targets.items())
+        ))
+        succeeded = sum(1 for result in results if result['ok'])
+        return {
+            'endpoint': path,
+            'instances': len(results),
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'elapsed_ms': round((time.monotonic() - started) * 1000.0, 2),
+            'results': results,
+        }
+
+
+# Application state shared by the handlers
+REGISTRY_KEY = web.AppKey('registry', InstanceRegistry)
+FANOUT_KEY = web.AppKey('fanout', FanOut)
+MOSAIC_KEY = web.AppKey('mosaic', Mosaic)
+
+
+def _timeout(request):
+    try:
+        timeout = float(request.query.get('timeout', DEFAULT_TIMEOUT_S))
+    except ValueError:
+        raise ValueError('timeout must be a number')
+    if timeout <= 0 or timeout > MAX_TIMEOUT_S:
+        raise ValueError(f'timeout must be greater than 0 and at most {MAX_TIMEOUT_S} seconds')
+    return timeout
+
+
+def _instance_path(request, endpoint):
+    """Path of endpoint on the instance API, under /displays/<k> when ?display=k is given"""
+    display = request.query.get('display')
+    if display is None:
+        return f'/{endpoint}'
+    if not display.isdigit():
+        raise ValueError('display must be a display number')
+    return f'/displays/{int(display)}/{endpoint}'
+
+
+def _summary_response(summary):
+    # 502 only when no instance answered; partial failures are listed per instance
+    status = 502 if summary['instances'] and not summary['succeeded'] else 200
+    return web.json_response(summary, status=status)
+
+
+async def _send_input(request, spec):
+    endpoint = request.match_info['endpoint']
+    if endpoint not in INPUT_ENDPOINTS:
+        return web.json_response({'error': f'endpoint must be one of: {list(INPUT_ENDPOINTS)}'}, status=404)
+    try:
+        timeout = _timeout(request)
+        path = _instance_path(request, endpoint)
+        targets = await request.app[REGISTRY_KEY].select(spec)
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    try:
+        body = await request.json() if request.can_read_body else {}
+    except ValueError:
+        return web.json_response({'error': 'Request body must be JSON'}, status=400)
+    if not targets:
+        return web.json_response({'error': 'No instances available'}, status=503)
+    summary = await request.app[FANOUT_KEY].request_all(targets, 'POST', path, timeout, json_body=body)
+    return _summary_response(summary)
+
+
+async def broadcast(request):
+    return await _send_input(request, request.query.get('instances'))
+
+
+async def targeted(request):
+    return await _send_input(request, request.match_info['ids'])
+
+
+async def gather(request):
+    endpoint = request.match_info['endpoint']
+    if endpoint not in GATHER_ENDPOINTS:
+        return web.json_response({'error': f'endpoint must be one of: {list(GATHER_ENDPOINTS)}'}, status=404)
+    try:
+        timeout = _timeout(request)
+        path = _instance_path(request, endpoint)
+        targets = await request.app[REGISTRY_KEY].select(request.query.get('instances'))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    if not targets:
+        return web.json_response({'error': 'No instances available'}, status=503)
+    # Everything else (format, scale, crop, after_seq, ...) is passed through
+    params = {k: v for k, v in request.query.items() if k not in ('instances', 'timeout', 'display')}
+    summary = await request.app[FANOUT_KEY].request_all(
+        targets, 'GET', path, timeout, params=params, binary=endpoint == 'desktop-snapshot'
+    )
+    return _summary_response(summary)
+
+
+async def mosaic_image(request):
+    if not await request.app[REGISTRY_KEY].select():
+        return web.json_response({'error': 'No instances available'}, status=503)
+    mosaic = request.app[MOSAIC_KEY]
+    data, version = await mosaic.jpeg()
+    etag = f'"mosaic-{version}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'X-Mosaic-Version': str(version),
+        'X-Mosaic-Instances': str(len(mosaic.tiles)),
+        'X-Mosaic-Refreshed-At': str(mosaic.refreshed_at),
+    }
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=data, content_type='image/jpeg', headers=headers)
+
+
+async def mosaic_info(request):
+    return web.json_response(request.app[MOSAIC_KEY].info())
+
+
+async def list_instances(request):
+    targets = await request.app[REGISTRY_KEY].select()
+    return web.json_response({'instances': [{'instance': i, 'url': url} for i, url in sorted(targets.items())]})
+
+
+def create_app(registry, fanout=None, mosaic_options=None):
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app[REGISTRY_KEY] = registry
+    app[FANOUT_KEY] = fanout or FanOut()
+    # Shares the fan-out session, and idles until /mosaic is requested
+    app[MOSAIC_KEY] = Mosaic(registry, app[FANOUT_KEY], **(mosaic_options or {}))
+
+    async def on_startup(app):
+        await app[FANOUT_KEY].start()
+        app[MOSAIC_KEY].start()
+
+    async def on_cleanup(app):
+        await app[MOSAIC_KEY].close()
+        await app[FANOUT_KEY].close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_get('/instances', list_instances)
+    app.router.add_post('/broadcast/{endpoint}', broadcast)
+    app.router.add_post('/instances/{ids}/{endpoint}', targeted)
+    app.router.add_get('/gather/{endpoint}', gather)
+    app.router.add_get('/mosaic', mosaic_image)
+    app.router.add_get('/mosaic/info', mosaic_info)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', help='instance ids, e.g. 1-40 (default: discover running instances from Docker)')
+    parser.add_argument('--host', default=os.environ.get('GATEWAY_INSTANCE_HOST', 'localhost'),
+                        help='host the instance API ports are published on (default: localhost)')
+    parser.add_argument('--port', type=int, default=GATEWAY_PORT, help=f'gateway port (default: {GATEWAY_PORT})')
+    parser.add_argument('--mosaic-tile', default=f'{MOSAIC_TILE_WIDTH}x{MOSAIC_TILE_HEIGHT}',
+                        help=f'mosaic tile size including its label (default: {MOSAIC_TILE_WIDTH}x{MOSAIC_TILE_HEIGHT})')
+    parser.add_argument('--mosaic-interval-ms', type=int, default=MOSAIC_INTERVAL_MS,
+                        help=f'mosaic refresh interval while it is watched (default: {MOSAIC_INTERVAL_MS})')
+    args = parser.parse_args()
+    try:
+        tile_width, tile_height = parse_tile_size(args.mosaic_tile)
+    except ValueError as e:
+        parser.error(str(e))
+    mosaic_options = {'canvas': MosaicCanvas(tile_width, tile_height), 'interval_ms': args.mosaic_interval_ms}
+
+    if args.instances:
+        registry = InstanceRegistry.from_ids(parse_instance_ids(args.instances), args.host)
+    else:
+        registry = InstanceRegistry(host=args.host, discover=True)
+
+    print(f"Starting fan-out gateway on port {args.port}")
+    print(f"Instances: {args.instances or 'discovered from Docker'} on {args.host}")
+    web.run_app(create_app(registry, mosaic_options=mosaic_options), host='0.0.0.0', port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -48,6 +48,7 @@ EOF
       - VNC_DEPTH=\${VNC_DEPTH:-24}
       - SNAPSHOT_PATH=/tmp/desktop_snapshot.png
       - SNAPSHOT_INTERVAL_MS=\${SNAPSHOT_INTERVAL_MS:-500}
+      - SESSION_PROFILE=\${SESSION_PROFILE:-lxde}
     tmpfs:
       - /tmp
     restart: unless-stopped
@@ -0,0 +1,41 @@
+"""Gunicorn settings for serving api.py in the container.
+
+Run with: gunicorn -c /opt/gunicorn.conf.py api:app
+
+Uses threaded (gthread) workers so long-lived streams, long-polls and
+scheduled input do not block other requests, and keeps client connections
+alive between polls. Capture and input state live in each worker process,
+so the default is a single worker with many threads.
+"""
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.environ.get('API_PORT', '5000')}"
+
+worker_class = 'gthread'
+workers = int(os.environ.get('API_WORKERS', '1'))
+# Each open MJPEG/WebSocket stream occupies one thread for its lifetime
+threads = int(os.environ.get('API_THREADS', '32'))
+# Maximum simultaneous client connections per worker, idle keep-alive ones included
+worker_connections = int(os.environ.get('API_MAX_CONNECTIONS', '1000'))
+
+# Seconds an idle client connection is kept open for the next request
+keepalive = int(os.environ.get('API_KEEPALIVE_S', '75'))
+timeout = 120
+# Streams never finish on their own; do not hold up restarts for them
+graceful_timeout = 5
+
+accesslog = os.environ.get('API_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    # Threads do not survive fork, so the capture thread starts inside each worker
+    import api
+    api.log_startup(f'gunicorn gthread, {workers} worker(s) x {threads} threads, pid {worker.pid}')
+    api.start_capture()
+
+
+def worker_exit(server, worker):
+    import api
+    api.stop_capture()
@@ -1,7 +1,9 @@
 #!/bin/bash
 
 # Wine initialization script for WoW
-# This script sets up Wine environment and installs necessary components
+# This script sets up Wine environment and installs necessary components.
+# The configured prefix is built once per set of inputs into a shared
+# template (WINE_TEMPLATE_DIR) and cloned into each new instance prefix.
 
 set -e
 
@@ -9,87 +11,140 @@ echo "Initializing Wine environment for WoW..."
 
 # Set Wine environment variables
 export WINEARCH=win64
-export WINEPREFIX=/root/.wine
+# One prefix per display; supervisor.py sets WINEPREFIX and DISPLAY when a
+# container runs several
+export WINEPREFIX=${WINEPREFIX:-/root/.wine}
 export WINEDLLOVERRIDES="mscoree,mshtml=disabled"
-export DISPLAY=:0
+export WINE_WINDOWS_VERSION=${WINE_WINDOWS_VERSION:-win10}
+export DISPLAY=${DISPLAY:-:0}
 
-# Ensure Wine prefix directory exists
-mkdir -p "$WINEPREFIX"
+# Shared template storage; set WINE_TEMPLATE=false to build every prefix in place
+WINE_TEMPLATE=${WINE_TEMPLATE:-true}
+export WINE_TEMPLATE_DIR=${WINE_TEMPLATE_DIR:-/opt/wine-template}
+
+# Build a configured prefix (wineboot, Mono, Gecko, Windows version, registry)
+# in the directory given as $1
+build_prefix() {
+    local WINEPREFIX="$1"
+    export WINEPREFIX
+    mkdir -p "$WINEPREFIX"
 
-# Initialize Wine if not already done
-if [ ! -f "$WINEPREFIX/system.reg" ]; then
-    echo "Creating new Wine prefix..."
-    
     # Initialize Wine with no GUI prompts
     export WINEDEBUG=-all
-    
+
     # Create the prefix and install necessary components
     wineboot --init 2>/dev/null || true
-    
+
     # Wait for wineserver to finish
     wineserver -w
-    
+
     echo "Installing Wine Mono..."
     # Install Mono silently
     if [ -f "/usr/share/wine/mono/wine-mono-7.4.0-x86.msi" ]; then
         wine msiexec /i /usr/share/wine/mono/wine-mono-7.4.0-x86.msi /quiet /norestart 2>/dev/null || true
         wineserver -w
     fi
-    
+
     echo "Installing Wine Gecko..."
     # Install Gecko silently
     if [ -f "/usr/share/wine/gecko/wine-gecko-2.47.3-x86.msi" ]; then
         wine msiexec /i /usr/share/wine/gecko/wine-gecko-2.47.3-x86.msi /quiet /norestart 2>/dev/null || true
         wineserver -w
     fi
-    
+
     if [ -f "/usr/share/wine/gecko/wine-gecko-2.47.3-x86_64.msi" ]; then
         wine msiexec /i /usr/share/wine/gecko/wine-gecko-2.47.3-x86_64.msi /quiet /norestart 2>/dev/null || true
         wineserver -w
     fi
-    
+
     # Set Windows version to Windows 10
-    echo "Setting Windows version to Windows 10..."
-    wine winecfg /v win10 2>/dev/null || true
+    echo "Setting Windows version to $WINE_WINDOWS_VERSION..."
+    wine winecfg /v "$WINE_WINDOWS_VERSION" 2>/dev/null || true
     wineserver -w
-    
+
     # Install Visual C++ Redistributables for better compatibility
     echo "Installing vcrun2019 for better game compatibility..."
     # This would typically use winetricks, but we'll configure manually
-    
-    # Configure Wine for gaming
+
+    # Configure Wine for gaming (settings live in /opt/wine-prefix.reg)
     echo "Configuring Wine registry for gaming..."
-    cat > /tmp/wow-wine-config.reg << 'EOF'
-Windows Registry Editor Version 5.00
-
-[HKEY_CURRENT_USER\Software\Wine\DirectSound]
-"HelBuflen"="512"
-"SndQueueMax"="28"
-
-[HKEY_CURRENT_USER\Software\Wine\Direct3D]
-"VideoMemorySize"="2048"
-"OffscreenRenderingMode"="pbuffer"
-"RenderTargetLockMode"="readtex"
-"UseGLSL"="enabled"
-
-[HKEY_CURRENT_USER\Software\Wine\AppDefaults\Wow.exe\Direct3D]
-"VideoMemorySize"="2048"
-"OffscreenRenderingMode"="pbuffer"
-"UseGLSL"="enabled"
-"DirectDrawRenderer"="opengl"
-
-[HKEY_CURRENT_USER\Software\Wine\AppDefaults\Wow.exe\DirectSound]
-"DefaultBitsPerSample"="16"
-"DefaultSampleRate"="44100"
-EOF
-    
-    wine regedit /tmp/wow-wine-config.reg 2>/dev/null || true
+    wine regedit /opt/wine-prefix.reg 2>/dev/null || true
     wineserver -w
-    rm -f /tmp/wow-wine-config.reg
-    
+}
+
+# Make sure the template for the current inputs exists, building it if needed.
+# Instances starting together wait on one lock so only one of them builds.
+ensure_template() {
+    local key="$1"
+    local template="$WINE_TEMPLATE_DIR/$key"
+
+    exec 9>"$WINE_TEMPLATE_DIR/.lock"
+    echo "Waiting for the Wine template lock..."
+    flock 9
+    if [ ! -f "$template/.template-complete" ]; then
+        echo "Building Wine prefix template $key (inputs changed or first start)..."
+        local started=$(date +%s)
+        rm -rf "$template.build"
+        build_prefix "$template.build"
+        touch "$template.build/.template-complete"
+        rm -rf "$template"
+        mv "$template.build" "$template"
+        echo "Wine template $key built in $(( $(date +%s) - started ))s"
+        python3 /opt/wine_template.py prune "$key" --template-dir "$WINE_TEMPLATE_DIR"
+    fi
+    flock -u 9
+    exec 9>&-
+}
+
+# Ensure Wine prefix directory exists
+mkdir -p "$WINEPREFIX"
+
+# Initialize Wine if not already done
+if [ ! -f "$WINEPREFIX/system.reg" ]; then
+    echo "Creating new Wine prefix..."
+
+    if [ "$WINE_TEMPLATE" = "true" ] && mkdir -p "$WINE_TEMPLATE_DIR" 2>/dev/null && [ -w "$WINE_TEMPLATE_DIR" ]; then
+        TEMPLATE_KEY=$(python3 /opt/wine_template.py key)
+        ensure_template "$TEMPLATE_KEY"
+        echo "Cloning Wine prefix from template $TEMPLATE_KEY..."
+        python3 /opt/wine_template.py clone "$WINE_TEMPLATE_DIR/$TEMPLATE_KEY" "$WINEPREFIX"
+    else
+        echo "Wine template storage unavailable, building the prefix in place..."
+        build_prefix "$WINEPREFIX"
+    fi
+
     echo "Wine initialization completed successfully!"
 else
     echo "Wine prefix already exists, skipping initialization..."
+    if [ -f "$WINEPREFIX/.template-key" ] && [ "$WINE_TEMPLATE" = "true" ]; then
+        CURRENT_KEY=$(python3 /opt/wine_template.py key)
+        if [ "$(cat "$WINEPREFIX/.template-key")" != "$CURRENT_KEY" ]; then
+            echo "Note: this prefix was cloned from an older template; remove the instance's wine volume to pick up template $CURRENT_KEY"
+        fi
+    fi
+fi
+
+# Without a window manager (SESSION_PROFILE=none) the game runs inside a Wine
+# virtual desktop of fixed size; WINE_VIRTUAL_DESKTOP=WIDTHxHEIGHT overrides
+# it, "off" disables it. Only rewritten when the setting changes.
+if [ -z "${WINE_VIRTUAL_DESKTOP+x}" ]; then
+    if [ "${SESSION_PROFILE:-lxde}" = "none" ]; then
+        WINE_VIRTUAL_DESKTOP=${VNC_GEOMETRY:-1280x800}
+    else
+        WINE_VIRTUAL_DESKTOP=off
+    fi
+fi
+if [ "$(cat "$WINEPREFIX/.virtual-desktop" 2>/dev/null || echo off)" != "$WINE_VIRTUAL_DESKTOP" ]; then
+    if [ "$WINE_VIRTUAL_DESKTOP" = "off" ]; then
+        echo "Disabling the Wine virtual desktop..."
+        wine reg delete 'HKCU\Software\Wine\Explorer' /v Desktop /f 2>/dev/null || true
+    else
+        echo "Setting the Wine virtual desktop to $WINE_VIRTUAL_DESKTOP..."
+        wine reg add 'HKCU\Software\Wine\Explorer' /v Desktop /d Default /f 2>/dev/null || true
+        wine reg add 'HKCU\Software\Wine\Explorer\Desktops' /v Default /d "$WINE_VIRTUAL_DESKTOP" /f 2>/dev/null || true
+    fi
+    wineserver -w
+    echo "$WINE_VIRTUAL_DESKTOP" > "$WINEPREFIX/.virtual-desktop"
 fi
 
 # Verify Wine is working
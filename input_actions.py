@@ -0,0 +1,204 @@
+"""Validation and scheduling of input actions.
+
+Each parser turns a request payload into a normalized action dict or raises
+ActionError with the same message the individual endpoints return, so
+/send-key, /click-mouse etc. and /input-batch share one set of rules.
+"""
+import math
+import time
+
+VALID_BUTTONS = ['left', 'right', 'middle']
+
+# Keys held for less than this are sent as a single press
+SHORT_PRESS_MS = 50
+
+MAX_BATCH_STEPS = 200
+MAX_BATCH_DURATION_MS = 60000
+
+
+class ActionError(ValueError):
+    """Invalid action payload; the message is returned to the client"""
+
+
+def _number(value, name):
+    # JSON NaN and Infinity parse as floats but are no usable coordinate or duration
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ActionError(f'{name} must be a number')
+    return value
+
+
+def key_action(data, default_duration_ms, require_duration=False):
+    key = data.get('key')
+    duration_ms = data.get('duration_ms')
+
+    if not key:
+        raise ActionError('Key is required')
+
+    if duration_ms is None:
+        if require_duration:
+            raise ActionError('duration_ms is required')
+        duration_ms = default_duration_ms
+
+    if _number(duration_ms, 'duration_ms') <= 0:
+        raise ActionError('Duration must be positive')
+    if duration_ms > MAX_BATCH_DURATION_MS:
+        raise ActionError(f'duration_ms must be at most {MAX_BATCH_DURATION_MS}')
+
+    return {'type': 'key', 'key': key, 'duration_ms': duration_ms}
+
+
+def move_action(data, coordinates_message='x and y are required'):
+    x = data.get('x')
+    y = data.get('y')
+    if x is None or y is None:
+        raise ActionError(coordinates_message)
+    return {'type': 'move', 'x': _number(x, 'x'), 'y': _number(y, 'y')}
+
+
+def _button(data):
+    button = data.get('button', 'left')
+    if button not in VALID_BUTTONS:
+        raise ActionError(f'Button must be one of: {VALID_BUTTONS}')
+    return button
+
+
+def click_action(data):
+    action = move_action(data, 'x and y coordinates are required')
+    button = _button(data)
+    clicks = _number(data.get('clicks', 1), 'clicks')
+    interval = _number(data.get('interval', 0.0), 'interval')
+
+    if clicks < 1 or clicks > 10:
+        raise ActionError('Clicks must be between 1 and 10')
+
+    if interval < 0:
+        raise ActionError('Interval must be non-negative')
+
+    action.update({'type': 'click', 'button': button, 'clicks': clicks, 'interval': interval})
+    return action
+
+
+def drag_action(data):
+    coords = [data.get(name) for name in ('start_x', 'start_y', 'end_x', 'end_y')]
+    if any(coord is None for coord in coords):
+        raise ActionError('start_x, start_y, end_x, and end_y are required')
+
+    button = _button(data)
+    duration = _number(data.get('duration', 1.0), 'duration')
+    if duration <= 0 or duration > 10:
+        raise ActionError('Duration must be between 0 and 10 seconds')
+
+    start_x, start_y, end_x, end_y = (_number(v, 'coordinates') for v in coords)
+    return {
+        'type': 'drag',
+        'start_x': start_x,
+        'start_y': start_y,
+        'end_x': end_x,
+        'end_y': end_y,
+        'duration': duration,
+        'button': button,
+    }
+
+
+def wait_action(data):
+    duration_ms = data.get('duration_ms')
+    if duration_ms is None:
+        raise ActionError('duration_ms is required')
+    if _number(duration_ms, 'duration_ms') <= 0:
+        raise ActionError('Duration must be positive')
+    return {'type': 'wait', 'duration_ms': duration_ms}
+
+
+def nominal_duration_ms(action):
+    """How long an action is expected to take when executed"""
+    kind = action['type']
+    if kind == 'key':
+        return action['duration_ms'] if action['duration_ms'] >= SHORT_PRESS_MS else 0
+    if kind == 'click':
+        return action['interval'] * 1000.0 * (action['clicks'] - 1)
+    if kind == 'drag':
+        return action['duration'] * 1000.0
+    if kind == 'wait':
+        return action['duration_ms']
+    return 0
+
+
+def plan_batch(steps, default_duration_ms):
+    """Validate a whole batch up front and assign each step its start offset
+
+    Each step may carry delay_ms: the pause between the scheduled end of the
+    previous step and the start of this one. Returns [(offset_ms, action)].
+    """
+    if not isinstance(steps, list) or not steps:
+        raise ActionError('actions must be a non-empty list')
+    if len(steps) > MAX_BATCH_STEPS:
+        raise ActionError(f'A batch may contain at most {MAX_BATCH_STEPS} actions')
+
+    parsers = {
+        'key': lambda data: key_action(data, default_duration_ms),
+        'move': move_action,
+        'click': click_action,
+        'drag': drag_action,
+        'wait': wait_action,
+    }
+
+    plan = []
+    offset_ms = 0.0
+    for index, step in enumerate(steps):
+        try:
+            if not isinstance(step, dict):
+                raise ActionError('action must be an object')
+            parser = parsers.get(step.get('type'))
+            if parser is None:
+                raise ActionError(f'type must be one of: {sorted(parsers)}')
+            delay_ms = _number(step.get('delay_ms', 0), 'delay_ms')
+            if delay_ms < 0:
+                raise ActionError('delay_ms must be non-negative')
+            action = parser(step)
+        except ActionError as e:
+            raise ActionError(f'Action {index}: {e}')
+
+        offset_ms += delay_ms
+        plan.append((offset_ms, action))
+        offset_ms += nominal_duration_ms(action)
+
+    if offset_ms > MAX_BATCH_DURATION_MS:
+        raise ActionError(f'Batch would run for {offset_ms:.0f}ms, limit is {MAX_BATCH_DURATION_MS}ms')
+
+    return plan
+
+
+def run_batch(plan, execute, sleep=time.sleep):
+    """Run a planned batch against the monotonic clock
+
+    execute(action) performs one action and sleep(seconds) waits for the
+    next step. Step start times are absolute offsets from the batch start,
+    so sleep overshoot does not accumulate.
+    Returns (results, error) where error is the exception that stopped the
+    batch, if any.
+    """
+    results = []
+    started = time.monotonic()
+    for index, (offset_ms, action) in enumerate(plan):
+        deadline = started + offset_ms / 1000.0
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            sleep(remaining)
+
+        step_started = time.monotonic()
+        result = {
+            'index': index,
+            'type': action['type'],
+            'scheduled_ms': round(offset_ms, 2),
+            'started_ms': round((step_started - started) * 1000.0, 2),
+            'lag_ms': round((step_started - deadline) * 1000.0, 2),
+        }
+        try:
+            execute(action)
+        except Exception as e:
+            result['error'] = str(e)
+            results.append(result)
+            return results, e
+        result['finished_ms'] = round((time.monotonic() - started) * 1000.0, 2)
+        results.append(result)
+    return results, None
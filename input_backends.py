@@ -0,0 +1,282 @@
+"""Pluggable input backends for the control API.
+
+XTestBackend keeps one Xlib connection open and injects events with the
+XTEST extension, resolving key names to keycodes once and caching them.
+PyAutoGUIBackend wraps pyautogui and is kept as a fallback.
+
+Select with INPUT_BACKEND=xtest (default) or INPUT_BACKEND=pyautogui.
+"""
+import os
+import threading
+import time
+
+# pyautogui key names that differ from X keysym names
+KEY_ALIASES = {
+    'enter': 'Return', 'return': 'Return', '\n': 'Return', '\r': 'Return',
+    'esc': 'Escape', 'escape': 'Escape',
+    'tab': 'Tab', '\t': 'Tab',
+    'space': 'space', ' ': 'space',
+    'backspace': 'BackSpace',
+    'delete': 'Delete', 'del': 'Delete',
+    'insert': 'Insert',
+    'home': 'Home', 'end': 'End',
+    'pageup': 'Prior', 'pgup': 'Prior',
+    'pagedown': 'Next', 'pgdn': 'Next',
+    'up': 'Up', 'down': 'Down', 'left': 'Left', 'right': 'Right',
+    'shift': 'Shift_L', 'shiftleft': 'Shift_L', 'shiftright': 'Shift_R',
+    'ctrl': 'Control_L', 'ctrlleft': 'Control_L', 'ctrlright': 'Control_R',
+    'alt': 'Alt_L', 'altleft': 'Alt_L', 'altright': 'Alt_R',
+    'win': 'Super_L', 'winleft': 'Super_L', 'winright': 'Super_R', 'super': 'Super_L',
+    'capslock': 'Caps_Lock', 'numlock': 'Num_Lock', 'scrolllock': 'Scroll_Lock',
+    'printscreen': 'Print', 'prtsc': 'Print', 'print': 'Print',
+    'pause': 'Pause', 'menu': 'Menu', 'apps': 'Menu',
+    'add': 'KP_Add', 'subtract': 'KP_Subtract', 'multiply': 'KP_Multiply',
+    'divide': 'KP_Divide', 'decimal': 'KP_Decimal',
+}
+KEY_ALIASES.update({f'num{digit}': f'KP_{digit}' for digit in range(10)})
+KEY_ALIASES.update({f'f{n}': f'F{n}' for n in range(1, 25)})
+
+# Names that may prefix a key with '-' ('shift-w', 'ctrl-alt-delete') as well as '+'
+MODIFIER_NAMES = {
+    'shift', 'shiftleft', 'shiftright', 'ctrl', 'ctrlleft', 'ctrlright',
+    'alt', 'altleft', 'altright', 'win', 'winleft', 'winright', 'super',
+}
+
+BUTTONS = {'left': 1, 'middle': 2, 'right': 3}
+
+
+class UnknownKeyError(ValueError):
+    """The key name cannot be mapped to a key on this display"""
+
+
+def split_combo(key):
+    """Key names of a combo: 'ctrl+1' and 'shift-w' -> two keys; '-' and '+' alone stay keys"""
+    if len(key) > 1 and '+' in key.strip('+'):
+        return key.split('+')
+    if len(key) > 1 and '-' in key.strip('-'):
+        names = key.split('-')
+        if names[-1] and all(name.lower() in MODIFIER_NAMES for name in names[:-1]):
+            return names
+    return [key]
+
+
+class InputBackend:
+    """Interface shared by all input backends"""
+
+    name = 'base'
+    # Used for the pause between repeated clicks; replaceable for instrumentation
+    sleep = staticmethod(time.sleep)
+
+    def key_down(self, key):
+        raise NotImplementedError
+
+    def key_up(self, key):
+        raise NotImplementedError
+
+    def press(self, key):
+        self.key_down(key)
+        self.key_up(key)
+
+    def move_to(self, x, y):
+        raise NotImplementedError
+
+    def mouse_down(self, button):
+        raise NotImplementedError
+
+    def mouse_up(self, button):
+        raise NotImplementedError
+
+    def click(self, x, y, clicks=1, interval=0.0, button='left'):
+        self.move_to(x, y)
+        for n in range(clicks):
+            if n and interval:
+                self.sleep(interval)
+            self.mouse_down(button)
+            self.mouse_up(button)
+
+    def sync(self):
+        """Wait until the display has processed every event sent so far"""
+
+
+class XTestBackend(InputBackend):
+    """Sends events over one persistent XTEST connection"""
+
+    name = 'xtest'
+
+    def __init__(self, display_name=None):
+        from Xlib import X, XK
+        from Xlib.display import Display
+        from Xlib.ext import xtest
+        from Xlib.error import ConnectionClosedError
+
+        self._X = X
+        self._XK = XK
+        self._xtest = xtest
+        self._Display = Display
+        self._connection_errors = (ConnectionClosedError, OSError)
+        self.display_name = display_name or os.environ.get('DISPLAY', ':0')
+        self._display = None
+        self._keycodes = {}
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        if self._display is None:
+            display = self._Display(self.display_name)
+            if not display.has_extension('XTEST'):
+                display.close()
+                raise RuntimeError(f'XTEST extension not available on {self.display_name}')
+            self._display = display
+            self._keycodes = {}
+        return self._display
+
+    def _send(self, events):
+        """Send (event_type, detail, x, y) tuples, reconnecting once if the connection dropped"""
+        with self._lock:
+            for attempt in (1, 2):
+                display = self._connect()
+                try:
+                    for event_type, detail, x, y in events:
+                        self._xtest.fake_input(display, event_type, detail, x=x, y=y)
+                    display.flush()
+                    return
+                except self._connection_errors:
+                    self._display = None
+                    if attempt == 2:
+                        raise
+
+    def _resolve(self, key):
+        """Map a key name to [(keycode, needs_shift)], one entry per key in a combo"""
+        cached = self._keycodes.get(key)
+        if cached is not None:
+            return cached
+
+        names = split_combo(key)
+        with self._lock:
+            display = self._connect()
+            resolved = []
+            for name in names:
+                keysym_name = KEY_ALIASES.get(name.lower() if len(name) > 1 else name, name)
+                keysym = self._XK.string_to_keysym(keysym_name)
+                if not keysym and len(name) == 1:
+                    # Latin-1 keysyms equal their code points
+                    keysym = ord(name)
+                keycode = display.keysym_to_keycode(keysym) if keysym else 0
+                if not keycode:
+                    raise UnknownKeyError(f'Unknown key: {key}')
+                needs_shift = display.keycode_to_keysym(keycode, 0) != keysym and \
+                    display.keycode_to_keysym(keycode, 1) == keysym
+                resolved.append((keycode, needs_shift))
+
+            self._keycodes[key] = resolved
+        return resolved
+
+    def _shift_keycode(self):
+        return self._resolve('shift')[0][0]
+
+    def _key_events(self, key, down):
+        X = self._X
+        events = []
+        resolved = self._resolve(key)
+        for keycode, needs_shift in (resolved if down else reversed(resolved)):
+            if needs_shift and down:
+                events.append((X.KeyPress, self._shift_keycode(), 0, 0))
+            events.append((X.KeyPress if down else X.KeyRelease, keycode, 0, 0))
+            if needs_shift and not down:
+                events.append((X.KeyRelease, self._shift_keycode(), 0, 0))
+        return events
+
+    def key_down(self, key):
+        self._send(self._key_events(key, True))
+
+    def key_up(self, key):
+        self._send(self._key_events(key, False))
+
+    def press(self, key):
+        self._send(self._key_events(key, True) + self._key_events(key, False))
+
+    def move_to(self, x, y):
+        self._send([(self._X.MotionNotify, 0, int(x), int(y))])
+
+    def mouse_down(self, button):
+        self._send([(self._X.ButtonPress, BUTTONS[button], 0, 0)])
+
+    def mouse_up(self, button):
+        self._send([(self._X.ButtonRelease, BUTTONS[button], 0, 0)])
+
+    def click(self, x, y, clicks=1, interval=0.0, button='left'):
+        X = self._X
+        if interval:
+            super().click(x, y, clicks, interval, button)
+            return
+        # Without an interval the whole click sequence goes out in one flush
+        events = [(X.MotionNotify, 0, int(x), int(y))]
+        for _ in range(clicks):
+            events.append((X.ButtonPress, BUTTONS[button], 0, 0))
+            events.append((X.ButtonRelease, BUTTONS[button], 0, 0))
+        self._send(events)
+
+    def sync(self):
+        with self._lock:
+            self._connect().sync()
+
+
+class PyAutoGUIBackend(InputBackend):
+    """Fallback backend built on pyautogui
+
+    pause=None skips pyautogui's per-call PAUSE sleep; pass a number of
+    seconds to reproduce pyautogui's stock behaviour.
+    """
+
+    name = 'pyautogui'
+
+    def __init__(self, pause=None):
+        import pyautogui
+        # Disable PyAutoGUI fail-safe for Docker container usage
+        # The fail-safe is designed to prevent runaway automation on desktops
+        # but is counterproductive in a controlled container environment
+        pyautogui.FAILSAFE = False
+        if pause is not None:
+            pyautogui.PAUSE = pause
+        self._pyautogui = pyautogui
+        self._pause = pause is not None
+
+    def key_down(self, key):
+        self._pyautogui.keyDown(key, _pause=self._pause)
+
+    def key_up(self, key):
+        self._pyautogui.keyUp(key, _pause=self._pause)
+
+    def press(self, key):
+        self._pyautogui.press(key, _pause=self._pause)
+
+    def move_to(self, x, y):
+        self._pyautogui.moveTo(x, y, _pause=self._pause)
+
+    def mouse_down(self, button):
+        self._pyautogui.mouseDown(button=button, _pause=self._pause)
+
+    def mouse_up(self, button):
+        self._pyautogui.mouseUp(button=button, _pause=self._pause)
+
+    def click(self, x, y, clicks=1, interval=0.0, button='left'):
+        self._pyautogui.click(x, y, clicks=clicks, interval=interval, button=button, _pause=self._pause)
+
+
+def create_backend(name=None, display_name=None):
+    """Build the configured backend, falling back to pyautogui if XTEST is unusable"""
+    name = (name or os.environ.get('INPUT_BACKEND', 'xtest')).lower()
+    # pyautogui binds to $DISPLAY when imported, so it cannot drive other displays
+    pyautogui_usable = display_name in (None, os.environ.get('DISPLAY'))
+    if name == 'pyautogui':
+        if not pyautogui_usable:
+            raise ValueError(f'INPUT_BACKEND=pyautogui can only drive $DISPLAY, not {display_name}; use xtest')
+        return PyAutoGUIBackend()
+    if name != 'xtest':
+        raise ValueError(f'Unknown INPUT_BACKEND {name!r}; use xtest or pyautogui')
+    try:
+        return XTestBackend(display_name)
+    except ImportError as e:
+        if not pyautogui_usable:
+            raise ValueError(f'XTest backend unavailable for {display_name} ({e})')
+        print(f"Warning: XTest backend unavailable ({e}), falling back to pyautogui")
+        return PyAutoGUIBackend()
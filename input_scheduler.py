@@ -0,0 +1,299 @@
+"""Non-blocking input scheduler.
+
+A single heap-based timer thread owns every key-up, mouse-move and mouse-up
+deadline, so endpoints can press a key or start a drag and return at once
+with an action id. Holds of different keys overlap freely. A new hold of a
+key that is already down presses it again (key-up, then key-down), so quick
+consecutive presses of one key are not merged, and the key stays down until
+the last hold expires.
+
+All calls into the input primitives run under one lock so events reach the
+X display in a well-defined order no matter which thread issued them. When
+several server worker processes share a display, an optional lock file
+extends that ordering across processes.
+"""
+import fcntl
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# How often a scheduled drag moves the pointer
+DRAG_STEPS_PER_SECOND = 60
+
+# Finished actions remembered for status queries
+ACTION_HISTORY = 256
+
+
+class ScheduledAction:
+    """One asynchronous input action (key hold or drag)"""
+
+    def __init__(self, action_id, kind, details, duration_ms):
+        self.id = action_id
+        self.kind = kind
+        self.details = details
+        self.created = time.time()
+        self.due = time.monotonic() + duration_ms / 1000.0
+        self.state = 'pending'
+        self.error = None
+        # Cleanup run by the scheduler thread when a scheduled step fails
+        self.on_fail = None
+        self.done = threading.Event()
+
+    def finish(self, state, error=None):
+        if self.state != 'pending':
+            return
+        self.state = state
+        self.error = error
+        self.done.set()
+
+    def to_dict(self):
+        info = {
+            'action_id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'created': self.created,
+        }
+        info.update(self.details)
+        if self.state == 'pending':
+            info['remaining_ms'] = round(max(0.0, self.due - time.monotonic()) * 1000.0, 1)
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class InputScheduler:
+    """Timer thread that owns key-up and mouse-up deadlines"""
+
+    def __init__(self, key_down, key_up, mouse_down, mouse_up, move_to, lock_path=None, on_call=None):
+        self._key_down = key_down
+        self._key_up = key_up
+        self._mouse_down = mouse_down
+        self._mouse_up = mouse_up
+        self._move_to = move_to
+
+        # Serializes every call into the input primitives
+        self.input_lock = threading.RLock()
+        # Cross-process lock for multi-worker servers; taken by the outermost call only
+        self._lock_file = open(lock_path, 'a') if lock_path else None
+        self._lock_depth = 0
+        # on_call(name, seconds) is told how long each primitive took, lock wait excluded
+        self._on_call = on_call
+
+        self._state = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._finished = OrderedDict()
+        self._held_keys = {}     # key -> set of action ids holding it
+        self._held_buttons = {}  # button -> action id holding it
+        self._thread = threading.Thread(target=self._run, name='input-scheduler', daemon=True)
+        self._thread.start()
+
+    def call(self, func, *args, **kwargs):
+        """Run an input primitive under the input lock"""
+        with self.input_lock:
+            if self._lock_file is None:
+                return self._timed(func, args, kwargs)
+            if self._lock_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                return self._timed(func, args, kwargs)
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _timed(self, func, args, kwargs):
+        if self._on_call is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._on_call(func.__name__, time.perf_counter() - started)
+
+    # Scheduling ----------------------------------------------------------
+
+    def _new_action(self, kind, details, duration_ms):
+        action = ScheduledAction(next(self._ids), kind, details, duration_ms)
+        self._pending[action.id] = action
+        return action
+
+    def _schedule(self, deadline, action, callback):
+        heapq.heappush(self._heap, (deadline, next(self._counter), action, callback))
+        self._state.notify()
+
+    def _complete(self, action, state='completed', error=None):
+        action.finish(state, error)
+        self._pending.pop(action.id, None)
+        self._finished[action.id] = action
+        while len(self._finished) > ACTION_HISTORY:
+            self._finished.popitem(last=False)
+
+    def _run(self):
+        # The only thread that sends key-ups and mouse-ups, so nothing may stop it
+        while True:
+            try:
+                self._run_next()
+            except Exception as e:
+                print(f"Warning: input scheduler error: {e}")
+
+    def _run_next(self):
+        with self._state:
+            while not self._heap or self._heap[0][0] > time.monotonic():
+                timeout = None
+                if self._heap:
+                    timeout = min(self._heap[0][0] - time.monotonic(), threading.TIMEOUT_MAX)
+                self._state.wait(timeout)
+            _, _, action, callback = heapq.heappop(self._heap)
+            if action.state != 'pending':
+                return
+            try:
+                callback()
+            except Exception as e:
+                print(f"Warning: scheduled input for action {action.id} failed: {e}")
+                self._complete(action, 'failed', str(e))
+                if action.on_fail is not None:
+                    try:
+                        action.on_fail()
+                    except Exception as e:
+                        print(f"Warning: cleanup after action {action.id} failed: {e}")
+
+    # Key holds -----------------------------------------------------------
+
+    def hold_key(self, key, duration_ms):
+        """Press key now and release it after duration_ms; returns the action"""
+        with self._state:
+            action = self._new_action('key', {'key': key, 'duration_ms': duration_ms}, duration_ms)
+            tracked = key in self._held_keys
+            holders = self._held_keys.setdefault(key, set())
+            try:
+                if holders:
+                    # Already down for an earlier hold: make this a press of its own
+                    self.call(self._key_up, key)
+                self.call(self._key_down, key)
+            except Exception as e:
+                if not tracked:
+                    del self._held_keys[key]
+                self._complete(action, 'failed', str(e))
+                raise
+            holders.add(action.id)
+            self._schedule(action.due, action, lambda: self._release_key(key, action))
+        return action
+
+    def _release_key(self, key, action):
+        # Called with the state lock held
+        holders = self._held_keys.get(key, set())
+        holders.discard(action.id)
+        if not holders:
+            # Stays tracked if key_up fails, so /release-all can still release it
+            self.call(self._key_up, key)
+            self._held_keys.pop(key, None)
+        self._complete(action)
+
+    # Drags ---------------------------------------------------------------
+
+    def drag(self, start_x, start_y, end_x, end_y, duration, button):
+        """Press button at the start point and move to the end point over duration seconds"""
+        duration_ms = duration * 1000.0
+        details = {
+            'start_x': start_x, 'start_y': start_y, 'end_x': end_x, 'end_y': end_y,
+            'duration': duration, 'button': button,
+        }
+        with self._state:
+            if button in self._held_buttons:
+                raise RuntimeError(f'{button} button is already held by action {self._held_buttons[button]}')
+            action = self._new_action('drag', details, duration_ms)
+            try:
+                # Plan every move before the button goes down, so nothing can fail while it is held
+                steps = max(1, int(duration * DRAG_STEPS_PER_SECOND))
+                moves = []
+                for step in range(1, steps):
+                    fraction = step / steps
+                    moves.append((duration * fraction,
+                                  round(start_x + (end_x - start_x) * fraction),
+                                  round(start_y + (end_y - start_y) * fraction)))
+                self.call(self._move_to, start_x, start_y)
+                self.call(self._mouse_down, button)
+            except Exception as e:
+                self._complete(action, 'failed', str(e))
+                raise
+            self._held_buttons[button] = action.id
+            action.on_fail = lambda: self._release_button(button, action)
+
+            started = time.monotonic()
+            for offset, x, y in moves:
+                self._schedule(started + offset, action, lambda x=x, y=y: self.call(self._move_to, x, y))
+            self._schedule(action.due, action, lambda: self._finish_drag(end_x, end_y, button, action))
+        return action
+
+    def _finish_drag(self, end_x, end_y, button, action):
+        # Called with the state lock held
+        try:
+            self.call(self._move_to, end_x, end_y)
+        finally:
+            self._release_button(button, action)
+        self._complete(action)
+
+    def _release_button(self, button, action):
+        # Called with the state lock held; a button held by a newer action is left alone
+        if self._held_buttons.get(button) != action.id:
+            return
+        self.call(self._mouse_up, button)
+        self._held_buttons.pop(button, None)
+
+    # Status and release --------------------------------------------------
+
+    def get(self, action_id):
+        with self._state:
+            action = self._pending.get(action_id) or self._finished.get(action_id)
+            return action.to_dict() if action else None
+
+    def pending_count(self):
+        """Number of scheduled actions (holds and drags) not yet finished"""
+        with self._state:
+            return len(self._pending)
+
+    def status(self):
+        with self._state:
+            return {
+                'pending': [action.to_dict() for action in self._pending.values()],
+                'held_keys': sorted(self._held_keys),
+                'held_buttons': sorted(self._held_buttons),
+            }
+
+    def release_all(self):
+        """Cancel every pending action and release all held keys and buttons"""
+        with self._state:
+            cancelled = list(self._pending.values())
+            keys = sorted(self._held_keys)
+            buttons = sorted(self._held_buttons)
+            self._heap.clear()
+            errors = []
+            # Keys and buttons whose release fails stay tracked for the next attempt
+            for key in keys:
+                try:
+                    self.call(self._key_up, key)
+                    del self._held_keys[key]
+                except Exception as e:
+                    self._held_keys[key] = set()
+                    errors.append(f'{key}: {e}')
+            for button in buttons:
+                try:
+                    self.call(self._mouse_up, button)
+                    del self._held_buttons[button]
+                except Exception as e:
+                    self._held_buttons[button] = None
+                    errors.append(f'{button}: {e}')
+            for action in cancelled:
+                self._complete(action, 'cancelled')
+        return {
+            'cancelled_actions': [action.id for action in cancelled],
+            'released_keys': keys,
+            'released_buttons': buttons,
+            'errors': errors,
+        }
@@ -11,6 +11,8 @@ MAX_INSTANCES=${MAX_INSTANCES:-50}  # Default max, can be overridden
 BASE_VNC_PORT=5900
 BASE_API_PORT=5000
 PROJECT_NAME="wow-clients"
+# X displays per container (see displays.py); read by fleet.py as well
+export DISPLAYS_PER_INSTANCE=${DISPLAYS_PER_INSTANCE:-1}
 
 function show_usage() {
     echo "Usage: $0 [start|stop|status|setup|scale|clean-volumes|clean-stopped|clean-all] [number_of_instances]"
@@ -18,7 +20,7 @@ function show_usage() {
     echo "Commands:"
     echo "  start <N>         - Start N instances of WoW clients (1-$MAX_INSTANCES)"
     echo "  stop              - Stop all running WoW client instances"
-    echo "  status            - Show status of all instances"
+    echo "  status [--json]   - Show status, resource usage and API health of all instances"
     echo "  setup             - Create shared wow-client directory"
     echo "  scale <N>         - Scale to exactly N instances (start/stop as needed)"
     echo "  clean-volumes [N] - Clean volumes for specific instance(s) or all if no number given"
@@ -38,10 +40,17 @@ function show_usage() {
     echo "  $0 clean-all       # Nuclear option - clean everything"
     echo ""
     echo "Port mapping (dynamic):"
-    echo "  Instance N: VNC=localhost:$((BASE_VNC_PORT + N - 1)), API=localhost:$((BASE_API_PORT + N - 1))"
+    if [ "$DISPLAYS_PER_INSTANCE" -gt 1 ]; then
+        echo "  Instance N, display K: VNC=localhost:$BASE_VNC_PORT+(N-1)*$DISPLAYS_PER_INSTANCE+K, API=localhost:$BASE_API_PORT+N-1"
+        echo "  Display K is addressed on the API as /displays/K/... or with an X-Display: K header"
+    else
+        echo "  Instance N: VNC=localhost:$((BASE_VNC_PORT + N - 1)), API=localhost:$((BASE_API_PORT + N - 1))"
+    fi
     echo ""
     echo "Environment variables:"
     echo "  MAX_INSTANCES=$MAX_INSTANCES (override with export MAX_INSTANCES=100)"
+    echo "  FLEET_CONCURRENCY=${FLEET_CONCURRENCY:-8} (parallel container operations)"
+    echo "  DISPLAYS_PER_INSTANCE=$DISPLAYS_PER_INSTANCE (X displays per container; remove containers with clean-all before changing it)"
     echo ""
     echo "Shared Client Files:"
     echo "  All instances share read-only client files from ./wow-client"
@@ -105,76 +114,16 @@ function start_instances() {
     # Build the image first
     build_image
     
-    # Start instances using docker run with dynamic parameters
-    for i in $(seq 1 $num_instances); do
-        local container_name="${PROJECT_NAME}-client-$i"
-        local vnc_port=$((BASE_VNC_PORT + i - 1))
-        local api_port=$((BASE_API_PORT + i - 1))
-        
-        # Check if container already exists and is running
-        if [ -n "$(docker ps -q -f name="^${container_name}$" 2>/dev/null)" ]; then
-            echo "  Instance $i: Already running on VNC=$vnc_port, API=$api_port"
-            continue
-        fi
-        
-        # Remove existing stopped container if it exists
-        docker rm "$container_name" >/dev/null 2>&1 || true
-        
-        # Create volume names
-        local data_volume="${PROJECT_NAME}-client-$i-data"
-        local lutris_volume="${PROJECT_NAME}-client-$i-lutris"
-        local wine_volume="${PROJECT_NAME}-client-$i-wine"
-        
-        echo "  Starting Instance $i: VNC=$vnc_port, API=$api_port"
-        
-        # Start the container
-        docker run -d \
-            --name "$container_name" \
-            --network "${PROJECT_NAME}_wow-network" \
-            -p "$vnc_port:5900" \
-            -p "$api_port:5000" \
-            -v "$(pwd)/wow-client:/mnt/wow-client:ro" \
-            -v "$data_volume:/root/Desktop/Client" \
-            -v "$lutris_volume:/root/.local/share/lutris" \
-            -v "$wine_volume:/root/.wine" \
-            --tmpfs /tmp \
-            -e "INSTANCE_ID=$i" \
-            -e "VNC_PASSWD=${VNC_PASSWD:-password}" \
-            -e "VNC_GEOMETRY=${VNC_GEOMETRY:-1280x800}" \
-            -e "VNC_DEPTH=${VNC_DEPTH:-24}" \
-            -e "SNAPSHOT_PATH=/tmp/desktop_snapshot.png" \
-            -e "SNAPSHOT_INTERVAL_MS=${SNAPSHOT_INTERVAL_MS:-500}" \
-            --restart unless-stopped \
-            wow-client:latest
-    done
-    
-    # Create network if it doesn't exist
-    docker network create "${PROJECT_NAME}_wow-network" >/dev/null 2>&1 || true
-    
-    echo ""
-    echo "Instances started! Access them via:"
-    for i in $(seq 1 $num_instances); do
-        local vnc_port=$((BASE_VNC_PORT + i - 1))
-        local api_port=$((BASE_API_PORT + i - 1))
-        echo "  Instance $i: VNC=localhost:$vnc_port, API=localhost:$api_port"
-    done
+    # Create missing instances and restart stopped ones in parallel;
+    # instances above N are left alone
+    python3 "$SCRIPT_DIR/fleet.py" start "$num_instances"
 }
 
 function stop_instances() {
     echo "Stopping all WoW client instances..."
     
-    # Find all containers with our naming pattern
-    local containers=$(docker ps -q -f name="${PROJECT_NAME}-client-")
-    
-    if [ -z "$containers" ]; then
-        echo "No running instances found."
-        return
-    fi
-    
-    # Stop all containers
-    echo "$containers" | xargs docker stop
-    
-    echo "All instances stopped."
+    # Containers are kept so the next start reuses them
+    python3 "$SCRIPT_DIR/fleet.py" stop
 }
 
 function scale_instances() {
@@ -184,78 +133,12 @@ function scale_instances() {
     
     echo "Scaling to $target_instances instances..."
     
-    # Get currently running instances
-    local running_containers=$(docker ps -q -f name="${PROJECT_NAME}-client-")
-    local current_count=0
-    if [ -n "$running_containers" ]; then
-        current_count=$(echo "$running_containers" | wc -l)
-    fi
-    
-    echo "Current instances: $current_count, Target: $target_instances"
+    # Build image if needed
+    build_image
     
-    if [ "$current_count" -eq "$target_instances" ]; then
-        echo "Already at target scale of $target_instances instances."
-        return
-    elif [ "$current_count" -lt "$target_instances" ]; then
-        # Need to start more instances
-        local start_from=$((current_count + 1))
-        echo "Starting additional instances from $start_from to $target_instances..."
-        
-        # Build image if needed
-        build_image
-        
-        for i in $(seq $start_from $target_instances); do
-            local container_name="${PROJECT_NAME}-client-$i"
-            local vnc_port=$((BASE_VNC_PORT + i - 1))
-            local api_port=$((BASE_API_PORT + i - 1))
-            
-            # Remove existing stopped container if it exists
-            docker rm "$container_name" >/dev/null 2>&1 || true
-            
-            # Create volume names
-            local data_volume="${PROJECT_NAME}-client-$i-data"
-            local lutris_volume="${PROJECT_NAME}-client-$i-lutris"
-            local wine_volume="${PROJECT_NAME}-client-$i-wine"
-            
-            echo "  Starting Instance $i: VNC=$vnc_port, API=$api_port"
-            
-            # Ensure network exists
-            docker network create "${PROJECT_NAME}_wow-network" >/dev/null 2>&1 || true
-            
-            # Start the container
-            docker run -d \
-                --name "$container_name" \
-                --network "${PROJECT_NAME}_wow-network" \
-                -p "$vnc_port:5900" \
-                -p "$api_port:5000" \
-                -v "$(pwd)/wow-client:/mnt/wow-client:ro" \
-                -v "$data_volume:/root/Desktop/Client" \
-                -v "$lutris_volume:/root/.local/share/lutris" \
-                -v "$wine_volume:/root/.wine" \
-                --tmpfs /tmp \
-                -e "INSTANCE_ID=$i" \
-                -e "VNC_PASSWD=${VNC_PASSWD:-password}" \
-                -e "VNC_GEOMETRY=${VNC_GEOMETRY:-1280x800}" \
-                -e "VNC_DEPTH=${VNC_DEPTH:-24}" \
-                -e "SNAPSHOT_PATH=/tmp/desktop_snapshot.png" \
-                -e "SNAPSHOT_INTERVAL_MS=${SNAPSHOT_INTERVAL_MS:-500}" \
-                --restart unless-stopped \
-                wow-client:latest
-        done
-    else
-        # Need to stop some instances
-        echo "Stopping excess instances (keeping first $target_instances)..."
-        
-        # Only run seq if we have valid numbers and current_count > target_instances
-        if [ "$current_count" -gt "$target_instances" ]; then
-            for i in $(seq $((target_instances + 1)) $current_count); do
-                local container_name="${PROJECT_NAME}-client-$i"
-                echo "  Stopping Instance $i"
-                docker stop "$container_name" 2>/dev/null || true
-                docker rm "$container_name" 2>/dev/null || true
-            done
-        fi
-    fi
+    # Reconcile by instance id: exactly instances 1..N end up running,
+    # whichever of them had died, and the rest are stopped
+    python3 "$SCRIPT_DIR/fleet.py" scale "$target_instances"
     
     echo "Scaling complete!"
 }
@@ -264,43 +147,9 @@ function show_status() {
     echo "WoW Client Instance Status:"
     echo "=========================="
     
-    # Get list of all containers (running and stopped) with our naming pattern
-    local all_containers=$(docker ps -a -f name="${PROJECT_NAME}-client-" --format "{{.Names}}" | sort -V)
-    
-    if [ -z "$all_containers" ]; then
-        echo "No instances found."
-        return
-    fi
-    
-    for container_name in $all_containers; do
-        # Extract instance number from container name
-        local instance_num=$(echo "$container_name" | sed "s/${PROJECT_NAME}-client-//")
-        local vnc_port=$((BASE_VNC_PORT + instance_num - 1))
-        local api_port=$((BASE_API_PORT + instance_num - 1))
-        
-        local status=$(docker ps -f name="^${container_name}$" --format "{{.Status}}" 2>/dev/null)
-        
-        if [ -n "$status" ]; then
-            echo "  Instance $instance_num: RUNNING ($status)"
-            echo "    VNC: localhost:$vnc_port"
-            echo "    API: localhost:$api_port"
-        else
-            echo "  Instance $instance_num: STOPPED"
-        fi
-    done
-    
-    echo ""
-    echo "Active containers:"
-    docker ps -f name="${PROJECT_NAME}-client-" --format "table {{.Names}}\t{{.Status}}\t{{.Ports}}"
-    
-    echo ""
-    echo "Resource usage:"
-    local running_containers=$(docker ps -q -f name="${PROJECT_NAME}-client-")
-    if [ -n "$running_containers" ]; then
-        docker stats --no-stream --format "table {{.Name}}\t{{.CPUPerc}}\t{{.MemUsage}}" $running_containers
-    else
-        echo "No running containers to show stats for"
-    fi
+    # One bulk Docker query plus streamed stats and each instance's
+    # /snapshot-info; served from the status daemon's cache if it is running
+    python3 "$SCRIPT_DIR/fleet_status.py" "$@"
 }
 
 function clean_volumes() {
@@ -442,6 +291,7 @@ function clean_all() {
     
     echo "Removing all volumes..."
     docker volume ls -q --filter "name=${PROJECT_NAME}-client-" | xargs -r docker volume rm
+    docker volume rm "${PROJECT_NAME}-wine-template" 2>/dev/null || true
     
     echo "Removing networks..."
     docker network ls --filter "name=${PROJECT_NAME}_wow-network" -q | xargs -r docker network rm 2>/dev/null || true
@@ -469,7 +319,8 @@ case "$1" in
         stop_instances
         ;;
     "status")
-        show_status
+        shift
+        show_status "$@"
         ;;
     "scale")
         if [ -z "$2" ]; then
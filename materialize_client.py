@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""Materialize the shared WoW client into an instance's client directory.
+
+Replaces the per-file find/ln/cp forks of setup-overlay.sh with one
+process. Modes:
+
+  symlink          read-only files (MPQs, executables, ...) become symlinks to
+                   /mnt/wow-client; configs (*.wtf, *.lua, *.txt, *.cfg, *.log)
+                   and the WTF, Logs, Interface/AddOns and Screenshots trees
+                   are copied so the game can modify them
+  overlay          kernel overlayfs with the client as the lower layer and
+                   the instance volume as the upper layer (needs CAP_SYS_ADMIN)
+  fuse-overlayfs   the same through fuse-overlayfs (needs /dev/fuse)
+  auto             overlay, then fuse-overlayfs, then symlink
+
+In symlink mode the scanned tree is kept as a manifest in the client
+directory. The next run re-stats only directories and writable files,
+reuses the cached listing of every directory whose mtime is unchanged, and
+patches just the differences. Copies the instance has modified are never
+overwritten or removed.
+
+Usage:
+  python3 materialize_client.py [--mode symlink] [--source /mnt/wow-client] [--target /root/Desktop/Client]
+  python3 materialize_client.py --bench [--source DIR]   # time every available mode
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SOURCE_DIR = os.environ.get('CLIENT_SOURCE_DIR', '/mnt/wow-client')
+CLIENT_DIR = os.environ.get('CLIENT_DIR', '/root/Desktop/Client')
+DEFAULT_MODE = os.environ.get('CLIENT_OVERLAY_MODE', 'symlink')
+MODES = ('symlink', 'overlay', 'fuse-overlayfs', 'auto')
+
+MANIFEST_NAME = '.client-manifest.json'
+MANIFEST_VERSION = 1
+# Upper and work directories of the overlay modes, inside the instance volume
+OVERLAY_STATE_DIR = '.overlay'
+
+# Files the game may modify are copied; everything else is symlinked
+COPY_SUFFIXES = ('.wtf', '.lua', '.txt', '.cfg', '.log')
+WRITABLE_DIRS = ('WTF', 'Logs', 'Interface/AddOns', 'Screenshots')
+
+
+class MaterializeError(Exception):
+    """A mode cannot be used on this host"""
+
+
+def _is_writable_path(rel):
+    return any(rel == d or rel.startswith(d + '/') for d in WRITABLE_DIRS)
+
+
+def file_kind(rel):
+    """'copy' for files the game may write, 'link' for everything else"""
+    if _is_writable_path(rel) or rel.lower().endswith(COPY_SUFFIXES):
+        return 'copy'
+    return 'link'
+
+
+# Manifest -----------------------------------------------------------------
+
+def scan(source, cached=None):
+    """Walk source once and return {dir rel path: {mtime_ns, subdirs, files}}
+
+    files maps name -> [kind, size, mtime_ns]. A directory whose mtime matches
+    the cached manifest has the same entries, so its listing is reused and
+    only its copied files are re-stat'ed (a replaced symlinked file needs no
+    action). Returns (dirs, stats) where stats counts rescanned directories.
+    """
+    cached_dirs = (cached or {}).get('dirs', {})
+    dirs = {}
+    stats = {'dirs_scanned': 0, 'dirs_reused': 0}
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        path = os.path.join(source, rel) if rel else source
+        mtime_ns = os.stat(path).st_mtime_ns
+        previous = cached_dirs.get(rel)
+        if previous is not None and previous['mtime_ns'] == mtime_ns:
+            stats['dirs_reused'] += 1
+            files = {}
+            for name, entry in previous['files'].items():
+                if entry[0] == 'copy':
+                    try:
+                        st = os.stat(os.path.join(path, name))
+                    except FileNotFoundError:
+                        continue
+                    entry = ['copy', st.st_size, st.st_mtime_ns]
+                files[name] = entry
+            subdirs = previous['subdirs']
+        else:
+            stats['dirs_scanned'] += 1
+            files, subdirs = {}, []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    child = f'{rel}/{entry.name}' if rel else entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                        continue
+                    kind = file_kind(child)
+                    if kind == 'copy' and not entry.is_symlink():
+                        st = entry.stat()
+                        files[entry.name] = [kind, st.st_size, st.st_mtime_ns]
+                    else:
+                        # Symlinked files (and links in the source) need no size or mtime
+                        files[entry.name] = ['link', 0, 0]
+            subdirs.sort()
+        dirs[rel] = {'mtime_ns': mtime_ns, 'subdirs': subdirs, 'files': files}
+        stack.extend(f'{rel}/{name}' if rel else name for name in subdirs)
+    return dirs, stats
+
+
+def load_manifest(target):
+    try:
+        with open(os.path.join(target, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('rules') != _rules_id():
+        return None
+    return manifest
+
+
+def save_manifest(target, source, dirs):
+    manifest = {'version': MANIFEST_VERSION, 'rules': _rules_id(), 'source': source, 'dirs': dirs}
+    path = os.path.join(target, MANIFEST_NAME)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(f'{path}.tmp', path)
+
+
+def _rules_id():
+    # Changing the rules invalidates manifests written under the old ones
+    return '|'.join(COPY_SUFFIXES + WRITABLE_DIRS)
+
+
+# Symlink mode -------------------------------------------------------------
+
+def _place_link(source_path, target_path, counts):
+    try:
+        os.symlink(source_path, target_path)
+        counts['linked'] += 1
+        return
+    except FileExistsError:
+        pass
+    if os.path.islink(target_path):
+        if os.readlink(target_path) == source_path:
+            return
+        os.unlink(target_path)
+        os.symlink(source_path, target_path)
+        counts['linked'] += 1
+    else:
+        # The instance put its own file here; leave it
+        counts['kept'] += 1
+
+
+def _place_copy(source_path, target_path, applied_entry, counts):
+    try:
+        st = os.lstat(target_path)
+    except FileNotFoundError:
+        shutil.copy2(source_path, target_path)
+        counts['copied'] += 1
+        return
+    if os.path.islink(target_path):
+        # A file that used to be read-only now has to be writable
+        os.unlink(target_path)
+        shutil.copy2(source_path, target_path)
+        counts['copied'] += 1
+        return
+    if applied_entry and applied_entry[0] == 'copy' and [st.st_size, st.st_mtime_ns] == applied_entry[1:]:
+        # Unmodified since our last copy: take the new version from the client
+        shutil.copy2(source_path, target_path)
+        counts['updated'] += 1
+    else:
+        counts['kept'] += 1
+
+
+def _remove_file(target_path, source_path, applied_entry, counts):
+    try:
+        st = os.lstat(target_path)
+    except FileNotFoundError:
+        return
+    if os.path.islink(target_path):
+        if os.readlink(target_path) != source_path:
+            return
+    elif applied_entry[0] != 'copy' or [st.st_size, st.st_mtime_ns] != applied_entry[1:]:
+        counts['kept'] += 1
+        return
+    os.unlink(target_path)
+    counts['removed'] += 1
+
+
+def apply_symlinks(source, target, dirs, applied=None):
+    """Bring target in line with the scanned tree; returns operation counts
+
+    Directories whose listing matches the applied manifest are skipped
+    without touching the filesystem. Without a manifest (first run, or a
+    volume set up by the old script) every entry is checked and existing
+    files are kept.
+    """
+    applied_dirs = (applied or {}).get('dirs', {})
+    counts = {'dirs_created': 0, 'linked': 0, 'copied': 0, 'updated': 0, 'removed': 0, 'kept': 0,
+              'dirs_unchanged': 0}
+    for rel in sorted(dirs):
+        listing = dirs[rel]
+        previous = applied_dirs.get(rel)
+        if previous is not None and previous['files'] == listing['files'] and previous['subdirs'] == listing['subdirs']:
+            counts['dirs_unchanged'] += 1
+            continue
+        target_dir = os.path.join(target, rel) if rel else target
+        source_dir = os.path.join(source, rel) if rel else source
+        if previous is None and not os.path.isdir(target_dir):
+            os.makedirs(target_dir, exist_ok=True)
+            counts['dirs_created'] += 1
+        previous_files = previous['files'] if previous else {}
+        for name, entry in listing['files'].items():
+            if previous_files.get(name) == entry:
+                continue
+            source_path = os.path.join(source_dir, name)
+            target_path = os.path.join(target_dir, name)
+            if entry[0] == 'link':
+                _place_link(source_path, target_path, counts)
+            else:
+                _place_copy(source_path, target_path, previous_files.get(name), counts)
+        for name in previous_files.keys() - listing['files'].keys():
+            _remove_file(os.path.join(target_dir, name), os.path.join(source_dir, name), previous_files[name], counts)
+
+    # Directories that disappeared from the client, deepest first; kept if the instance left files there
+    for rel in sorted(applied_dirs.keys() - dirs.keys(), reverse=True):
+        for name, entry in applied_dirs[rel]['files'].items():
+            _remove_file(os.path.join(target, rel, name), os.path.join(source, rel, name), entry, counts)
+        try:
+            os.rmdir(os.path.join(target, rel))
+        except OSError:
+            pass
+    return counts
+
+
+def materialize_symlinks(source, target):
+    started = time.monotonic()
+    os.makedirs(target, exist_ok=True)
+    applied = load_manifest(target)
+    dirs, scan_stats = scan(source, cached=applied)
+    scanned = time.monotonic()
+    counts = apply_symlinks(source, target, dirs, applied)
+    save_manifest(target, source, dirs)
+    finished = time.monotonic()
+    result = {'mode': 'symlink', 'manifest': 'reused' if applied else 'built',
+              'scan_seconds': round(scanned - started, 3), 'apply_seconds': round(finished - scanned, 3),
+              'seconds': round(finished - started, 3), 'files': sum(len(d['files']) for d in dirs.values()),
+              'dirs': len(dirs)}
+    result.update(scan_stats)
+    result.update(counts)
+    return result
+
+
+# Overlay modes ------------------------------------------------------------
+
+def mount_overlay(source, target, fuse=False):
+    """Mount source read-only under a copy-on-write layer kept in target/.overlay"""
+    mode = 'fuse-overlayfs' if fuse else 'overlay'
+    started = time.monotonic()
+    if os.path.ismount(target):
+        return {'mode': mode, 'seconds': 0.0, 'already_mounted': True}
+    if fuse and not shutil.which('fuse-overlayfs'):
+        raise MaterializeError('fuse-overlayfs is not installed')
+    if fuse and not os.path.exists('/dev/fuse'):
+        raise MaterializeError('/dev/fuse is not available (run the container with --device /dev/fuse)')
+    upper = os.path.join(target, OVERLAY_STATE_DIR, 'upper')
+    work = os.path.join(target, OVERLAY_STATE_DIR, 'work')
+    os.makedirs(upper, exist_ok=True)
+    os.makedirs(work, exist_ok=True)
+    # The kernel resolves the layer paths before the mount hides them
+    options = f'lowerdir={source},upperdir={upper},workdir={work}'
+    if fuse:
+        command = ['fuse-overlayfs', '-o', options, target]
+    else:
+        command = ['mount', '-t', 'overlay', 'overlay', '-o', options, target]
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = (getattr(e, 'stderr', None) or str(e)).strip()
+        raise MaterializeError(f'{mode} mount failed: {detail}')
+    return {'mode': mode, 'seconds': round(time.monotonic() - started, 3)}
+
+
+def materialize(source, target, mode):
+    """Run one mode ('auto' falls back through the others); returns a timing report"""
+    if mode == 'symlink':
+        return materialize_symlinks(source, target)
+    if mode in ('overlay', 'fuse-overlayfs'):
+        return mount_overlay(source, target, fuse=mode == 'fuse-overlayfs')
+    skipped = []
+    for candidate in ('overlay', 'fuse-overlayfs'):
+        try:
+            result = mount_overlay(source, target, fuse=candidate == 'fuse-overlayfs')
+            result['skipped'] = skipped
+            return result
+        except MaterializeError as e:
+            skipped.append(f'{candidate}: {e}')
+    result = materialize_symlinks(source, target)
+    result['skipped'] = skipped
+    return result
+
+
+# Benchmark ----------------------------------------------------------------
+
+def _legacy_script(source, target):
+    # The per-file find/ln/cp sequence setup-overlay.sh used before this module
+    return f'''
+cd "{source}"
+find . -type d -exec mkdir -p "{target}/{{}}" \\; 2>/dev/null || true
+find . -type f \\( -name "*.exe" -o -name "*.dll" -o -name "*.MPQ" -o -name "*.mpq" \\) \\
+    -exec ln -sf "{source}/{{}}" "{target}/{{}}" \\; 2>/dev/null || true
+find . -type f \\( -name "*.wtf" -o -name "*.lua" -o -name "*.txt" -o -name "*.cfg" -o -name "*.log" \\) \\
+    -exec cp "{source}/{{}}" "{target}/{{}}" \\; 2>/dev/null || true
+for dir in {' '.join(f'"{d}"' for d in WRITABLE_DIRS)}; do
+    if [ -d "{source}/$dir" ]; then
+        rm -rf "{target}/$dir"; cp -r "{source}/$dir" "{target}/$dir"
+    fi
+done
+'''
+
+
+def bench(source, scratch=None):
+    """Time every mode available here against fresh scratch directories"""
+    results = {}
+    with tempfile.TemporaryDirectory(dir=scratch, prefix='materialize-bench-') as root:
+        target = os.path.join(root, 'legacy')
+        os.makedirs(target)
+        started = time.monotonic()
+        subprocess.run(['bash', '-c', _legacy_script(source, target)], check=True)
+        results['legacy-find'] = {'seconds': round(time.monotonic() - started, 3)}
+
+        target = os.path.join(root, 'symlink')
+        results['symlink-fresh'] = materialize_symlinks(source, target)
+        results['symlink-unchanged'] = materialize_symlinks(source, target)
+
+        for mode in ('overlay', 'fuse-overlayfs'):
+            target = os.path.join(root, mode)
+            os.makedirs(target)
+            try:
+                results[mode] = mount_overlay(source, target, fuse=mode == 'fuse-overlayfs')
+            except MaterializeError as e:
+                results[mode] = {'unavailable': str(e)}
+                continue
+            unmount = ['fusermount', '-u', target] if mode == 'fuse-overlayfs' else ['umount', target]
+            subprocess.run(unmount, check=False, capture_output=True)
+    return results
+
+
+def print_result(result):
+    if 'unavailable' in result:
+        print(f"  unavailable: {result['unavailable']}")
+        return
+    line = f"  {result['seconds']:.3f}s"
+    if result.get('mode') == 'symlink':
+        line += (f" (manifest {result['manifest']}, scan {result['scan_seconds']:.3f}s, "
+                 f"{result['dirs_scanned']} dirs scanned, {result['dirs_reused']} reused): "
+                 f"{result['dirs_created']} dirs, {result['linked']} links, {result['copied']} copies, "
+                 f"{result['updated']} updated, {result['removed']} removed, {result['kept']} kept")
+    elif result.get('already_mounted'):
+        line += ' (already mounted)'
+    print(line)
+    for reason in result.get('skipped', []):
+        print(f"  skipped {reason}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=MODES, default=DEFAULT_MODE,
+                        help=f'materialization mode (CLIENT_OVERLAY_MODE, default: {DEFAULT_MODE})')
+    parser.add_argument('--source', default=SOURCE_DIR, help=f'shared client tree (default: {SOURCE_DIR})')
+    parser.add_argument('--target', default=CLIENT_DIR, help=f'instance client directory (default: {CLIENT_DIR})')
+    parser.add_argument('--bench', action='store_true', help='time every available mode in scratch directories')
+    parser.add_argument('--scratch', help='parent directory for --bench scratch copies (default: system temp)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source):
+        sys.exit(f'Client directory {args.source} not found')
+    # Symlinks point at the source, so it must be absolute
+    args.source = os.path.abspath(args.source)
+    args.target = os.path.abspath(args.target)
+
+    if args.bench:
+        results = bench(args.source, args.scratch)
+        if args.json:
+            print(json.dumps(results, indent=2))
+            return
+        for mode, result in results.items():
+            print(f"{mode}:")
+            print_result(result)
+        return
+
+    try:
+        result = materialize(args.source, args.target, args.mode)
+    except MaterializeError as e:
+        sys.exit(f'ERROR: {e}')
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"Client materialized in {result['mode']} mode:")
+    print_result(result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,413 @@
+"""Fleet mosaic: the latest frame of every instance tiled into one JPEG.
+
+Served by gateway.py on GET /mosaic. Every refresh asks each instance for
+/snapshot-info (one small JSON answer, which does not wake an idle capture
+engine), and only instances whose frame sequence changed since their tile
+was drawn are fetched again. Frames are requested already scaled close to
+the tile size (raw RGB by default, so nothing is decoded), then resampled
+into their cell of one preallocated canvas with precomputed index maps.
+
+Each tile carries a label strip with the instance id and its health:
+
+  healthy   fresh frame (/snapshot-info answered 200)
+  stale     the instance answered but its frame is old (503)
+  waiting   the instance has not captured a frame yet
+  down      no answer; the last image is kept, dimmed
+
+The JPEG is encoded once per changed canvas and served with an ETag, so
+pollers of an unchanged fleet get 304 answers. Refreshing only runs while
+someone has asked for the mosaic within MOSAIC_IDLE_TIMEOUT_S.
+"""
+import asyncio
+import io
+import math
+import os
+import time
+
+import aiohttp
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from snapshot_encoding import encode_image
+
+MOSAIC_INTERVAL_MS = int(os.environ.get('MOSAIC_INTERVAL_MS', '1000'))
+MOSAIC_TILE_WIDTH = int(os.environ.get('MOSAIC_TILE_WIDTH', '320'))
+MOSAIC_TILE_HEIGHT = int(os.environ.get('MOSAIC_TILE_HEIGHT', '214'))
+MOSAIC_COLUMNS = int(os.environ.get('MOSAIC_COLUMNS', '0'))  # 0: square-ish grid
+MOSAIC_QUALITY = int(os.environ.get('MOSAIC_QUALITY', '70'))
+MOSAIC_FETCH_FORMAT = os.environ.get('MOSAIC_FETCH_FORMAT', 'raw')
+MOSAIC_TIMEOUT_S = float(os.environ.get('MOSAIC_TIMEOUT_S', '2'))
+MOSAIC_IDLE_TIMEOUT_S = float(os.environ.get('MOSAIC_IDLE_TIMEOUT_S', '30'))
+FETCH_FORMATS = ('raw', 'jpeg', 'png')
+
+LABEL_HEIGHT = 14
+GAP = 2
+BACKGROUND = (24, 24, 24)
+STATUS_COLORS = {
+    'healthy': (46, 125, 50),
+    'stale': (200, 140, 20),
+    'waiting': (97, 97, 97),
+    'down': (198, 40, 40),
+}
+
+
+def parse_tile_size(value):
+    """'320x214' -> (320, 214)"""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(f'tile size must look like 320x214, got {value!r}')
+    if width < 16 or height < LABEL_HEIGHT + 8:
+        raise ValueError(f'tile size must be at least 16x{LABEL_HEIGHT + 8}, got {value!r}')
+    return width, height
+
+
+def fit(source_width, source_height, box_width, box_height):
+    """Largest (width, height) with the source aspect ratio inside the box"""
+    factor = min(box_width / source_width, box_height / source_height)
+    return max(1, min(box_width, round(source_width * factor))), max(1, min(box_height, round(source_height * factor)))
+
+
+class MosaicCanvas:
+    """Preallocated RGB canvas of equally sized tiles, one per instance
+
+    A cell is tile_width x tile_height pixels: a label strip on top and the
+    frame, fitted with its aspect ratio kept, below it.
+    """
+
+    def __init__(self, tile_width=MOSAIC_TILE_WIDTH, tile_height=MOSAIC_TILE_HEIGHT, columns=MOSAIC_COLUMNS):
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.columns_setting = columns
+        self.columns = self.rows = 0
+        self.slots = {}  # instance id -> cell index
+        self.pixels = np.zeros((0, 0, 3), dtype=np.uint8)
+        self._index_maps = {}
+        self._labels = {}
+        self._font = ImageFont.load_default()
+
+    @property
+    def image_height(self):
+        return self.tile_height - LABEL_HEIGHT
+
+    def origin(self, instance_id):
+        """Top-left pixel of an instance's cell"""
+        row, column = divmod(self.slots[instance_id], self.columns)
+        return column * (self.tile_width + GAP), row * (self.tile_height + GAP)
+
+    def layout(self, instance_ids):
+        """Arrange cells for instance_ids (sorted); returns True when the layout changed
+
+        Tiles of instances that stay are copied to their new cells, so a
+        changed instance set does not force every frame to be fetched again.
+        """
+        instance_ids = sorted(instance_ids)
+        if instance_ids == sorted(self.slots, key=self.slots.get):
+            return False
+        count = max(1, len(instance_ids))
+        columns = min(count, self.columns_setting or math.ceil(math.sqrt(count)))
+        rows = math.ceil(count / columns)
+        pixels = np.empty((rows * self.tile_height + (rows - 1) * GAP,
+                           columns * self.tile_width + (columns - 1) * GAP, 3), dtype=np.uint8)
+        pixels[:] = BACKGROUND
+
+        old_pixels, old_origins = self.pixels, {i: self.origin(i) for i in self.slots}
+        self.pixels, self.columns, self.rows = pixels, columns, rows
+        self.slots = {instance_id: n for n, instance_id in enumerate(instance_ids)}
+        for instance_id, (old_x, old_y) in old_origins.items():
+            if instance_id in self.slots:
+                x, y = self.origin(instance_id)
+                pixels[y:y + self.tile_height, x:x + self.tile_width] = \
+                    old_pixels[old_y:old_y + self.tile_height, old_x:old_x + self.tile_width]
+        return True
+
+    def _index_map(self, source_height, source_width, height, width):
+        key = (source_height, source_width, height, width)
+        indices = self._index_maps.get(key)
+        if indices is None:
+            # Sample the centre of every destination pixel's source footprint
+            rows = ((np.arange(height) + 0.5) * source_height / height).astype(np.intp)
+            columns = ((np.arange(width) + 0.5) * source_width / width).astype(np.intp)
+            indices = self._index_maps[key] = (rows[:, None], columns[None, :])
+        return indices
+
+    def draw_frame(self, instance_id, frame):
+        """Resample an RGB frame (height, width, 3) into the instance's cell"""
+        x, y = self.origin(instance_id)
+        y += LABEL_HEIGHT
+        source_height, source_width = frame.shape[:2]
+        width, height = fit(source_width, source_height, self.tile_width, self.image_height)
+        area = self.pixels[y:y + self.image_height, x:x + self.tile_width]
+        left, top = (self.tile_width - width) // 2, (self.image_height - height) // 2
+        if width != self.tile_width or height != self.image_height:
+            area[:] = BACKGROUND
+        target = area[top:top + height, left:left + width]
+        if (source_height, source_width) == (height, width):
+            target[:] = frame
+        else:
+            rows, columns = self._index_map(source_height, source_width, height, width)
+            target[:] = frame[rows, columns]
+
+    def dim(self, instance_id):
+        """Darken an instance's image in place (shown while it does not answer)"""
+        x, y = self.origin(instance_id)
+        area = self.pixels[y + LABEL_HEIGHT:y + self.tile_height, x:x + self.tile_width]
+        np.right_shift(area, 2, out=area)
+
+    def draw_label(self, instance_id, text, status):
+        key = (text, status)
+        strip = self._labels.get(key)
+        if strip is None:
+            image = Image.new('RGB', (self.tile_width, LABEL_HEIGHT), STATUS_COLORS[status])
+            ImageDraw.Draw(image).text((4, 1), text, fill=(255, 255, 255), font=self._font)
+            strip = self._labels[key] = np.asarray(image)
+        x, y = self.origin(instance_id)
+        self.pixels[y:y + LABEL_HEIGHT, x:x + self.tile_width] = strip
+
+
+class Tile:
+    """What the mosaic knows about one instance"""
+
+    __slots__ = ('instance', 'status', 'sequence', 'etag', 'source_size', 'age_seconds', 'error',
+                 'fetched_at', 'label')
+
+    def __init__(self, instance_id):
+        self.instance = instance_id
+        self.status = 'waiting'
+        self.sequence = None  # sequence of the frame drawn in the tile
+        self.etag = None
+        self.source_size = None  # full frame (width, height) on the instance
+        self.age_seconds = None
+        self.error = None
+        self.fetched_at = None
+        self.label = None
+
+    def to_dict(self):
+        return {
+            'instance': self.instance,
+            'status': self.status,
+            'sequence': self.sequence,
+            'age_seconds': self.age_seconds,
+            'error': self.error,
+            'fetched_at': self.fetched_at,
+        }
+
+
+class Mosaic:
+    """Keeps a MosaicCanvas of the fleet current and encodes it as JPEG"""
+
+    def __init__(self, registry, fanout, canvas=None, interval_ms=MOSAIC_INTERVAL_MS, quality=MOSAIC_QUALITY,
+                 fetch_format=MOSAIC_FETCH_FORMAT, timeout=MOSAIC_TIMEOUT_S, idle_timeout=MOSAIC_IDLE_TIMEOUT_S):
+        if fetch_format not in FETCH_FORMATS:
+            raise ValueError(f'fetch format must be one of: {list(FETCH_FORMATS)}')
+        self.registry = registry
+        self.fanout = fanout
+        self.canvas = canvas or MosaicCanvas()
+        self.interval = interval_ms / 1000.0
+        self.quality = quality
+        self.fetch_format = fetch_format
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.tiles = {}
+        self.version = 0
+        self.refreshes = 0
+        self.refreshed_at = None
+        self.last_refresh = {}
+        self._refreshed_monotonic = None
+        self._requested = None
+        self._jpeg = None
+        # Created in start(): before Python 3.10 a lock binds to the loop current at creation
+        self._lock = None
+        self._task = None
+
+    def start(self):
+        self._lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._requested is None or time.monotonic() - self._requested > self.idle_timeout:
+                continue
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Warning: mosaic refresh failed: {e}")
+
+    async def jpeg(self):
+        """(JPEG bytes, version) of the current mosaic, refreshed first if it is out of date"""
+        self._requested = time.monotonic()
+        if self._refreshed_monotonic is None or time.monotonic() - self._refreshed_monotonic > 2 * self.interval:
+            # Nobody was watching, so the background loop was idle
+            await self.refresh()
+        async with self._lock:
+            # Encoding holds the lock so no refresh draws into the canvas meanwhile
+            if self._jpeg is None or self._jpeg[1] != self.version:
+                data = await asyncio.get_running_loop().run_in_executor(
+                    None, encode_image, self.canvas.pixels, 'jpeg', self.quality)
+                self._jpeg = (data, self.version)
+            return self._jpeg
+
+    def info(self):
+        canvas = self.canvas
+        tiles = []
+        for instance_id, tile in sorted(self.tiles.items()):
+            entry = tile.to_dict()
+            x, y = canvas.origin(instance_id)
+            entry['cell'] = [x, y, canvas.tile_width, canvas.tile_height]
+            tiles.append(entry)
+        return {
+            'version': self.version,
+            'refreshes': self.refreshes,
+            'refreshed_at': self.refreshed_at,
+            'last_refresh': self.last_refresh,
+            'interval_ms': round(self.interval * 1000),
+            'width': canvas.pixels.shape[1],
+            'height': canvas.pixels.shape[0],
+            'columns': canvas.columns,
+            'rows': canvas.rows,
+            'tile_width': canvas.tile_width,
+            'tile_height': canvas.tile_height,
+            'fetch_format': self.fetch_format,
+            'tiles': tiles,
+        }
+
+    async def refresh(self):
+        if self._lock.locked():
+            # A refresh is already running; its result is as new as ours would be
+            async with self._lock:
+                return
+        async with self._lock:
+            await self._refresh()
+
+    async def _refresh(self):
+        started = time.monotonic()
+        targets = await self.registry.select()
+        changed = self.canvas.layout(targets)
+        self.tiles = {i: self.tiles.get(i) or Tile(i) for i in targets}
+
+        infos = await asyncio.gather(*(self._get_info(url) for _, url in sorted(targets.items())))
+        wanted = []
+        for (instance_id, url), (status, info) in zip(sorted(targets.items()), infos):
+            tile = self.tiles[instance_id]
+            if status is None:
+                if tile.status != 'down' and tile.fetched_at is not None:
+                    self.canvas.dim(instance_id)
+                    changed = True
+                tile.status, tile.error, tile.age_seconds = 'down', info, None
+                # Fetch again once it answers, even if its frame did not change
+                tile.sequence = tile.etag = None
+                continue
+            tile.error = None
+            tile.age_seconds = info.get('age_seconds')
+            if not info.get('snapshot_available', status == 200):
+                tile.status = 'waiting'
+                continue
+            tile.status = 'healthy' if status == 200 else 'stale'
+            frame = info.get('frame') or {}
+            if frame.get('width') and frame.get('height'):
+                tile.source_size = (frame['width'], frame['height'])
+            sequence = info.get('sequence')
+            if sequence is None or sequence != tile.sequence:
+                wanted.append((tile, url, sequence))
+
+        fetched = await asyncio.gather(*(self._fetch(tile, url, sequence) for tile, url, sequence in wanted))
+        received = 0
+        for (tile, _, _), frame in zip(wanted, fetched):
+            if frame is not None:
+                self.canvas.draw_frame(tile.instance, frame)
+                tile.fetched_at = time.time()
+                received += 1
+                changed = True
+
+        for instance_id, tile in self.tiles.items():
+            label = f'{instance_id}  {tile.status}'
+            if label != tile.label:
+                self.canvas.draw_label(instance_id, label, tile.status)
+                tile.label = label
+                changed = True
+
+        if changed:
+            self.version += 1
+        self.refreshes += 1
+        self.refreshed_at = time.time()
+        self._refreshed_monotonic = time.monotonic()
+        self.last_refresh = {
+            'instances': len(targets),
+            'requested': len(wanted),
+            'fetched': received,
+            'elapsed_ms': round((time.monotonic() - started) * 1000.0, 2),
+        }
+
+    async def _get_info(self, url):
+        """(status, /snapshot-info body), or (None, error) when the instance did not answer"""
+        try:
+            async with self.fanout.session.get(
+                f'{url}/snapshot-info', timeout=aiohttp.ClientTimeout(total=self.timeout),
+            ) as response:
+                if response.status not in (200, 503) or response.content_type != 'application/json':
+                    return None, f'snapshot-info answered {response.status}'
+                return response.status, await response.json()
+        except asyncio.TimeoutError:
+            return None, f'timeout after {self.timeout}s'
+        except aiohttp.ClientError as e:
+            return None, str(e) or type(e).__name__
+
+    def _scale(self, tile):
+        """Server-side scale bringing the frame close to the tile size (1 while the size is unknown)"""
+        if tile.source_size is None:
+            return 1.0
+        source_width, source_height = tile.source_size
+        width, height = fit(source_width, source_height, self.canvas.tile_width, self.canvas.image_height)
+        # Round up so the server never returns fewer pixels than the tile shows
+        return min(1.0, math.ceil(max(width / source_width, height / source_height) * 1000) / 1000)
+
+    async def _fetch(self, tile, url, sequence):
+        """Newest frame of an instance as an RGB array, None if unchanged or failed
+
+        Records the sequence of the frame now shown in the tile.
+        """
+        scale = self._scale(tile)
+        params = {'format': self.fetch_format, 'scale': f'{scale:g}'}
+        headers = {'If-None-Match': tile.etag} if tile.etag else None
+        try:
+            async with self.fanout.session.get(
+                f'{url}/desktop-snapshot', params=params, headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            ) as response:
+                if response.status == 304:
+                    tile.sequence = sequence
+                    return None
+                if response.status != 200:
+                    tile.error = f'desktop-snapshot answered {response.status}'
+                    return None
+                body = await response.read()
+                tile.etag = response.headers.get('ETag')
+                header = response.headers.get('X-Snapshot-Sequence')
+                tile.sequence = int(header) if header else sequence
+                width = int(response.headers.get('X-Snapshot-Width', 0))
+                height = int(response.headers.get('X-Snapshot-Height', 0))
+        except asyncio.TimeoutError:
+            tile.error = f'snapshot timeout after {self.timeout}s'
+            return None
+        except aiohttp.ClientError as e:
+            tile.error = str(e) or type(e).__name__
+            return None
+
+        if self.fetch_format == 'raw':
+            frame = np.frombuffer(body, dtype=np.uint8).reshape(height, width, 3)
+        else:
+            frame = np.asarray(Image.open(io.BytesIO(body)).convert('RGB'))
+            height, width = frame.shape[:2]
+        if tile.source_size is None and scale == 1.0:
+            # File mode reports no frame size in /snapshot-info; learn it from the first full frame
+            tile.source_size = (width, height)
+        return frame
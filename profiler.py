@@ -0,0 +1,95 @@
+"""Sampling profiler for deep dives into a running API server.
+
+A background thread snapshots every other thread's Python stack with
+sys._current_frames() at a fixed interval and counts identical stacks. The
+result is in collapsed-stack format ("outer;inner;leaf count" per line),
+which flamegraph.pl, speedscope and inferno read directly. Nothing is
+traced between samples, so the overhead is bounded by the sample rate.
+"""
+import sys
+import threading
+import time
+from collections import Counter
+
+DEFAULT_INTERVAL_MS = 10
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename.rsplit('/', 1)[-1]
+    return f'{code.co_name} ({filename}:{frame.f_lineno})'
+
+
+class SamplingProfiler:
+    """Start/stop stack sampler aggregating collapsed stacks per thread name"""
+
+    def __init__(self, interval_ms=DEFAULT_INTERVAL_MS):
+        self.interval_ms = interval_ms
+        self.samples = 0
+        self.started = None
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval_ms=None):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval_ms:
+                self.interval_ms = interval_ms
+            self._stacks.clear()
+            self.samples = 0
+            self.started = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return False
+        self._stop.set()
+        thread.join(timeout=5)
+        return True
+
+    def _run(self):
+        interval = self.interval_ms / 1000.0
+        own_id = threading.get_ident()
+        while not self._stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            sampled = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                sampled.append(';'.join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(sampled)
+                self.samples += 1
+
+    def collapsed(self):
+        """Collapsed stacks, most frequent first"""
+        with self._lock:
+            items = self._stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in items)
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self._thread is not None,
+                'interval_ms': self.interval_ms,
+                'samples': self.samples,
+                'distinct_stacks': len(self._stacks),
+                'started': self.started,
+            }
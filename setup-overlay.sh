@@ -2,10 +2,13 @@
 
 # Overlay filesystem setup script for WoW client
 # This script sets up a copy-on-write overlay so that the read-only client files
-# from /mnt/wow-client appear in /root/Desktop/Client with writable overlay
+# from /mnt/wow-client appear in CLIENT_DIR (default /root/Desktop/Client) with
+# writable overlay. Containers running several displays call it once per display.
 
 set -e
 
+CLIENT_DIR=${CLIENT_DIR:-/root/Desktop/Client}
+
 echo "Setting up overlay filesystem for WoW client..."
 
 # Check if the read-only client files exist
@@ -23,61 +26,36 @@ if [ ! -f "/mnt/wow-client/Wow.exe" ]; then
 fi
 
 # Create the client directory if it doesn't exist
-mkdir -p /root/Desktop/Client
+mkdir -p "$CLIENT_DIR"
 
-# If Client directory is empty or doesn't have game files, set up the overlay
-if [ ! -f "/root/Desktop/Client/Wow.exe" ]; then
-    echo "Setting up client file overlay using bind mounts and symlinks..."
-    
-    # Create bind mounts for read-only files and symlinks for writable files
-    # First, copy structure but use symlinks for executable and data files
-    
-    # Copy directory structure relative to the wow-client directory
-    cd /mnt/wow-client
-    find . -type d -exec mkdir -p "/root/Desktop/Client/{}" \; 2>/dev/null || true
-    
-    # Create symlinks for read-only files (executables, data files)
-    find . -type f \( -name "*.exe" -o -name "*.dll" -o -name "*.MPQ" -o -name "*.mpq" \) \
-        -exec ln -sf "/mnt/wow-client/{}" "/root/Desktop/Client/{}" \; 2>/dev/null || true
-    
-    # Copy (not symlink) writable files and directories
-    # These are files that the game might modify
-    find . -type f \( -name "*.wtf" -o -name "*.lua" -o -name "*.txt" -o -name "*.cfg" -o -name "*.log" \) \
-        -exec cp "/mnt/wow-client/{}" "/root/Desktop/Client/{}" \; 2>/dev/null || true
-    
-    cd /
-    
-    # Handle special directories that need to be writable
-    for dir in "WTF" "Logs" "Interface/AddOns" "Screenshots"; do
-        if [ -d "/mnt/wow-client/$dir" ]; then
-            rm -rf "/root/Desktop/Client/$dir" 2>/dev/null || true
-            cp -r "/mnt/wow-client/$dir" "/root/Desktop/Client/$dir" 2>/dev/null || true
-        fi
-    done
-    
-    echo "Client overlay setup using symlinks and selective copying completed!"
-else
-    echo "Client files already present in /root/Desktop/Client"
-fi
+# Link read-only files, copy writable ones and patch only what changed since
+# the last start (see materialize_client.py). CLIENT_OVERLAY_MODE=overlay,
+# fuse-overlayfs or auto mounts a real copy-on-write overlay instead.
+CLIENT_OVERLAY_MODE=${CLIENT_OVERLAY_MODE:-symlink}
+echo "Materializing client files (mode: $CLIENT_OVERLAY_MODE)..."
+python3 /opt/materialize_client.py --mode "$CLIENT_OVERLAY_MODE" \
+    --source /mnt/wow-client --target "$CLIENT_DIR"
 
 echo "Overlay filesystem setup complete!"
 echo "Read-only client files: /mnt/wow-client"
-echo "Writable overlay: /root/Desktop/Client"
-echo "Symlinked read-only files, copied writable configs"
+echo "Writable overlay: $CLIENT_DIR"
+if [ "$CLIENT_OVERLAY_MODE" = "symlink" ]; then
+    echo "Symlinked read-only files, copied writable configs"
+fi
 
 # Verify the setup
-if [ -f "/root/Desktop/Client/Wow.exe" ]; then
+if [ -f "$CLIENT_DIR/Wow.exe" ]; then
     echo "SUCCESS: Wow.exe found in client directory"
-    ls -la /root/Desktop/Client/Wow.exe
+    ls -la "$CLIENT_DIR/Wow.exe"
 else
     echo "WARNING: Wow.exe not found in client directory"
 fi
 
 # List some files to verify the overlay is working
 echo "Files in client directory:"
-ls -la /root/Desktop/Client/ | head -10
+ls -la "$CLIENT_DIR/" | head -10
 
 # Show disk usage
 echo "Disk usage comparison:"
 echo "Original client size: $(du -sh /mnt/wow-client 2>/dev/null | cut -f1)"
-echo "Overlay client size: $(du -sh /root/Desktop/Client 2>/dev/null | cut -f1)"
+echo "Overlay client size: $(du -sh "$CLIENT_DIR" 2>/dev/null | cut -f1)"
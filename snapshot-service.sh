@@ -22,7 +22,7 @@ mkdir -p "$(dirname "$SNAPSHOT_PATH")"
 # Wait for X server to be ready
 while ! xdpyinfo -display "$DISPLAY" >/dev/null 2>&1; do
     echo "Waiting for X server on display $DISPLAY..."
-    sleep 1
+    sleep 0.2
 done
 
 echo "X server ready, starting capture loop..."
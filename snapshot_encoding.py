@@ -0,0 +1,204 @@
+"""Snapshot rendering options and the encoded-frame cache.
+
+Turns an in-memory frame into the representation a client asked for
+(format, quality, crop rectangle, scale) and keeps recently encoded outputs
+in a small LRU cache keyed by frame sequence and parameters, so many pollers
+requesting the same view pay for a single encode.
+"""
+import io
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+FORMATS = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'raw': 'application/octet-stream',
+}
+FORMAT_ALIASES = {'jpg': 'jpeg', 'rgb': 'raw'}
+DEFAULT_QUALITY = 80
+
+
+class SnapshotParams:
+    """Validated rendering parameters for one snapshot request"""
+
+    __slots__ = ('format', 'quality', 'crop', 'scale')
+
+    def __init__(self, format='png', quality=DEFAULT_QUALITY, crop=None, scale=1.0):
+        self.format = format
+        self.quality = quality
+        self.crop = crop
+        self.scale = scale
+
+    @classmethod
+    def from_args(cls, args):
+        """Parse query parameters; raises ValueError with a client-facing message"""
+        fmt = args.get('format', 'png').lower()
+        fmt = FORMAT_ALIASES.get(fmt, fmt)
+        if fmt not in FORMATS:
+            raise ValueError(f'format must be one of: {sorted(FORMATS)}')
+
+        try:
+            quality = int(args.get('quality', DEFAULT_QUALITY))
+        except ValueError:
+            raise ValueError('quality must be an integer')
+        if quality < 1 or quality > 100:
+            raise ValueError('quality must be between 1 and 100')
+
+        crop = None
+        if args.get('crop'):
+            try:
+                crop = tuple(int(v) for v in args.get('crop').split(','))
+            except ValueError:
+                raise ValueError('crop must be x,y,width,height')
+            if len(crop) != 4:
+                raise ValueError('crop must be x,y,width,height')
+            if crop[0] < 0 or crop[1] < 0 or crop[2] <= 0 or crop[3] <= 0:
+                raise ValueError('crop origin must be non-negative and size positive')
+
+        try:
+            scale = float(args.get('scale', 1.0))
+        except ValueError:
+            raise ValueError('scale must be a number')
+        if not math.isfinite(scale) or scale <= 0 or scale > 1:
+            raise ValueError('scale must be greater than 0 and at most 1')
+
+        # Quality only affects lossy formats; normalize it so PNG/raw
+        # requests share cache entries regardless of the value passed
+        if fmt not in ('jpeg', 'webp'):
+            quality = 0
+
+        return cls(fmt, quality, crop, scale)
+
+    @property
+    def is_default(self):
+        return self.format == 'png' and self.crop is None and self.scale == 1.0
+
+    @property
+    def mimetype(self):
+        return FORMATS[self.format]
+
+    def key(self):
+        return (self.format, self.quality, self.crop, self.scale)
+
+    def etag(self, seq):
+        """Strong validator for this view of a given frame"""
+        parts = [str(seq), self.format]
+        if self.quality:
+            parts.append(f'q{self.quality}')
+        if self.crop:
+            parts.append('c' + 'x'.join(str(v) for v in self.crop))
+        if self.scale != 1.0:
+            parts.append(f's{self.scale:g}')
+        return '-'.join(parts)
+
+
+class EncodedFrame:
+    """Encoded bytes for one (frame, params) combination"""
+
+    __slots__ = ('data', 'mimetype', 'width', 'height', 'encode_ms')
+
+    def __init__(self, data, mimetype, width, height, encode_ms):
+        self.data = data
+        self.mimetype = mimetype
+        self.width = width
+        self.height = height
+        self.encode_ms = encode_ms
+
+
+def encode_image(pixels, fmt, quality=DEFAULT_QUALITY):
+    """Encode an RGB array as PNG, JPEG or WebP bytes"""
+    image = Image.fromarray(pixels, 'RGB')
+    buffer = io.BytesIO()
+    if fmt == 'png':
+        image.save(buffer, format='PNG', compress_level=1)
+    elif fmt == 'jpeg':
+        image.save(buffer, format='JPEG', quality=quality)
+    elif fmt == 'webp':
+        image.save(buffer, format='WEBP', quality=quality, method=0)
+    else:
+        raise ValueError(f'Cannot encode format {fmt}')
+    return buffer.getvalue()
+
+
+def apply_view(pixels, crop=None, scale=1.0):
+    """Return the cropped and downscaled RGB array for a frame"""
+    if crop is not None:
+        x, y, w, h = crop
+        frame_h, frame_w = pixels.shape[:2]
+        if x >= frame_w or y >= frame_h:
+            raise ValueError(f'crop origin is outside the {frame_w}x{frame_h} frame')
+        pixels = pixels[y:min(y + h, frame_h), x:min(x + w, frame_w)]
+
+    if scale != 1.0:
+        height, width = pixels.shape[:2]
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        pixels = np.asarray(Image.fromarray(pixels, 'RGB').resize(size, Image.BILINEAR))
+    return pixels
+
+
+def render(pixels, params):
+    """Crop, scale and encode an RGB array according to params"""
+    started = time.perf_counter()
+
+    pixels = apply_view(pixels, params.crop, params.scale)
+    height, width = pixels.shape[:2]
+    if params.format == 'raw':
+        # Raw RGB needs no encoder at all
+        data = pixels.tobytes()
+    else:
+        data = encode_image(pixels, params.format, params.quality)
+
+    encode_ms = (time.perf_counter() - started) * 1000.0
+    return EncodedFrame(data, params.mimetype, width, height, encode_ms)
+
+
+class EncodedFrameCache:
+    """Thread-safe LRU of encoded frames with single-flight encoding"""
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, frame, params):
+        """Return (EncodedFrame, cache_hit) for a frame and rendering params"""
+        key = (frame.seq,) + params.key()
+        while True:
+            with self._lock:
+                cached = self._entries.get(key)
+                if cached is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cached, True
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Another request is already encoding this view; share its result
+            pending.wait()
+
+        try:
+            encoded = render(frame.pixels, params)
+        except BaseException:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+            raise
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = encoded
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            del self._pending[key]
+        pending.set()
+        return encoded, False
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Container startup supervisor.
+
+Runs the startup stages as a small dependency graph instead of one long
+shell sequence. Independent stages (client overlay, Wine prefix, X/VNC)
+start at once; the API server starts as soon as X is up. Each stage
+finishes on a real readiness condition rather than a fixed sleep:
+
+  overlay    setup-overlay.sh exited
+  wine       init-wine.sh exited
+  x          the X server accepts connections on /tmp/.X11-unix/X0
+  snapshot   (CAPTURE_MODE=file) snapshot-service.sh wrote its first frame
+  api        the API port accepts connections and /snapshot-info reports a
+             captured frame (on every display)
+
+With DISPLAYS=K (see displays.py) the overlay, wine and x stages run once per
+display, named overlay-1, wine-1, x-1 and so on for displays after the first;
+the single API server waits for all X servers.
+
+Stage states and durations are written to STARTUP_STATE_PATH as JSON, which
+api.py serves on /ready. After startup the supervisor follows the VNC log
+and exits when an X server stops, like the old entrypoint loop.
+"""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from displays import client_dir, display_count, wine_prefix, x_display
+
+STATE_PATH = os.environ.get('STARTUP_STATE_PATH', '/tmp/startup-state.json')
+DISPLAY_COUNT = display_count()
+API_PORT = int(os.environ.get('API_PORT', '5000'))
+CAPTURE_MODE = os.environ.get('CAPTURE_MODE', 'memory').lower()
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '/tmp/desktop_snapshot.png')
+
+# Upper bounds for readiness waits; stages normally finish far sooner
+X_TIMEOUT_S = float(os.environ.get('STARTUP_X_TIMEOUT_S', '30'))
+API_TIMEOUT_S = float(os.environ.get('STARTUP_API_TIMEOUT_S', '60'))
+POLL_INTERVAL_S = 0.05
+
+
+class StageError(Exception):
+    """A stage failed or its readiness condition was not met in time"""
+
+
+def wait_until(condition, timeout, description):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise StageError(f'{description} not ready after {timeout:g}s')
+        time.sleep(POLL_INTERVAL_S)
+
+
+def x_socket(display_number):
+    return f'/tmp/.X11-unix/X{display_number}'
+
+
+def x_accepting(display_number=0):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(x_socket(display_number))
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def port_open(port):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+
+def first_frame_captured(display_number=0):
+    path = '/snapshot-info' if DISPLAY_COUNT == 1 else f'/displays/{display_number}/snapshot-info'
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{API_PORT}{path}', timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+class Stage:
+    def __init__(self, name, run, after=()):
+        self.name = name
+        self.run = run
+        self.after = after
+        self.state = 'pending'
+        self.started = None
+        self.started_monotonic = None
+        self.seconds = None
+        self.error = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        info = {'state': self.state, 'after': list(self.after)}
+        if self.started is not None:
+            info['started'] = self.started
+        if self.seconds is not None:
+            info['seconds'] = round(self.seconds, 3)
+        if self.error:
+            info['error'] = self.error
+        return info
+
+
+class Supervisor:
+    def __init__(self, state_path=STATE_PATH):
+        self.state_path = state_path
+        self.stages = {}
+        self.processes = []  # long-running children, stopped on shutdown
+        self.started = time.time()
+        self._started_monotonic = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, name, run, after=()):
+        self.stages[name] = Stage(name, run, after)
+
+    def spawn(self, command, **kwargs):
+        process = subprocess.Popen(command, **kwargs)
+        self.processes.append(process)
+        return process
+
+    def _write_state(self):
+        stages = {name: stage.to_dict() for name, stage in self.stages.items()}
+        finished = all(stage.done.is_set() for stage in self.stages.values())
+        state = {
+            'started': self.started,
+            'elapsed_seconds': round(time.monotonic() - self._started_monotonic, 3),
+            'complete': finished,
+            'ok': finished and all(stage.state == 'completed' for stage in self.stages.values()),
+            'stages': stages,
+        }
+        temp_path = f'{self.state_path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def _set(self, stage, state, error=None):
+        with self._lock:
+            stage.state = state
+            if state == 'running':
+                stage.started = time.time()
+                stage.started_monotonic = time.monotonic()
+            elif state in ('completed', 'failed'):
+                stage.seconds = time.monotonic() - stage.started_monotonic
+            stage.error = error
+            if state in ('completed', 'failed', 'skipped'):
+                stage.done.set()
+            self._write_state()
+
+    def _run_stage(self, stage):
+        for name in stage.after:
+            dependency = self.stages[name]
+            dependency.done.wait()
+            if dependency.state != 'completed':
+                print(f"[startup] {stage.name}: skipped, {name} {dependency.state}")
+                self._set(stage, 'skipped', f'{name} {dependency.state}')
+                return
+        self._set(stage, 'running')
+        print(f"[startup] {stage.name}: started")
+        try:
+            stage.run()
+        except Exception as e:
+            print(f"[startup] {stage.name}: FAILED after {time.monotonic() - stage.started_monotonic:.2f}s: {e}")
+            self._set(stage, 'failed', str(e))
+            return
+        self._set(stage, 'completed')
+        print(f"[startup] {stage.name}: ready in {stage.seconds:.2f}s")
+
+    def run(self):
+        """Run every stage concurrently (respecting dependencies); returns True if all completed"""
+        with self._lock:
+            self._write_state()
+        threads = [threading.Thread(target=self._run_stage, args=(stage,), name=f'stage-{stage.name}', daemon=True)
+                   for stage in self.stages.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - self._started_monotonic
+        summary = ', '.join(
+            f'{stage.name} {stage.seconds:.2f}s' if stage.seconds is not None else f'{stage.name} {stage.state}'
+            for stage in self.stages.values())
+        print(f"[startup] Finished in {elapsed:.2f}s: {summary}")
+        return all(stage.state == 'completed' for stage in self.stages.values())
+
+    def shutdown(self, status=0):
+        print("[startup] Shutting down...")
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        for display_number in range(DISPLAY_COUNT):
+            subprocess.run(['vncserver', '-kill', x_display(display_number)], capture_output=True)
+        sys.exit(status)
+
+
+# Stages -------------------------------------------------------------------
+
+def run_script(path, env=None):
+    result = subprocess.run([path], env=dict(os.environ, **env) if env else None)
+    if result.returncode != 0:
+        raise StageError(f'{path} exited with status {result.returncode}')
+
+
+def start_x(display_number=0):
+    # Stop a VNC server left from a previous run and wait until its socket is gone
+    subprocess.run(['vncserver', '-kill', x_display(display_number)], capture_output=True)
+    wait_until(lambda: not x_accepting(display_number), 10, 'previous X server shutdown')
+    for stale in (f'/tmp/.X{display_number}-lock', x_socket(display_number)):
+        try:
+            os.unlink(stale)
+        except FileNotFoundError:
+            pass
+
+    geometry = os.environ.get('VNC_GEOMETRY', '1280x800')
+    depth = os.environ.get('VNC_DEPTH', '24')
+    # Don't use Xvfb, let TigerVNC create its own X server
+    # The X session (and the game started from it) uses this display's Wine prefix
+    env = dict(os.environ, WINEPREFIX=wine_prefix(display_number, DISPLAY_COUNT))
+    result = subprocess.run([
+        'tigervncserver', x_display(display_number),
+        '-geometry', geometry,
+        '-depth', depth,
+        '-localhost', 'no',
+        '-SecurityTypes', 'VncAuth',
+        '-passwd', '/root/.vnc/passwd',
+        '-xstartup', '/root/.vnc/xstartup',
+        '-verbose',
+    ], env=env)
+    if result.returncode != 0:
+        raise StageError(f'tigervncserver exited with status {result.returncode}')
+    wait_until(lambda: x_accepting(display_number), X_TIMEOUT_S, f'X server on {x_socket(display_number)}')
+
+
+def start_api(supervisor):
+    env = dict(os.environ, DISPLAY=x_display(0))
+    # gunicorn (threaded workers, keep-alive) unless API_SERVER=dev selects the Flask development server
+    if os.environ.get('API_SERVER', 'gunicorn') == 'dev':
+        command = ['python3', '/opt/api.py']
+    else:
+        command = ['gunicorn', '-c', '/opt/gunicorn.conf.py', 'api:app']
+    process = supervisor.spawn(command, env=env)
+
+    def check(condition):
+        if process.poll() is not None:
+            raise StageError(f'API server exited with status {process.returncode}')
+        return condition()
+
+    wait_until(lambda: check(lambda: port_open(API_PORT)), API_TIMEOUT_S, f'API port {API_PORT}')
+    for display_number in range(DISPLAY_COUNT):
+        wait_until(lambda: check(lambda: first_frame_captured(display_number)), API_TIMEOUT_S,
+                   f'first desktop frame on {x_display(display_number)}')
+
+
+def start_snapshot_service(supervisor):
+    # Legacy file mode: the API serves the PNG this service writes
+    supervisor.spawn(['/opt/snapshot-service.sh'], env=dict(os.environ, DISPLAY=x_display(0)))
+    wait_until(lambda: os.path.exists(SNAPSHOT_PATH), X_TIMEOUT_S, 'first snapshot file')
+
+
+def check_client(path):
+    if not os.path.isfile(os.path.join(path, 'Wow.exe')):
+        print(f"WARNING: World of Warcraft client not found in {path}/")
+        print("Please make sure your WoW client files are in the ./wow-client directory")
+        print("The container will continue to run, but WoW may not launch properly")
+    else:
+        print(f"WoW client detected in {path}/")
+
+
+def follow_vnc(supervisor):
+    """Keep the container alive while the X servers run, echoing the VNC logs"""
+    vnc_logs = sorted(name for name in os.listdir('/root/.vnc') if name.endswith('.log'))
+    for log_name in vnc_logs[:DISPLAY_COUNT]:
+        log_path = os.path.join('/root/.vnc', log_name)
+        print(f"Following VNC log file: {log_path}")
+        supervisor.spawn(['tail', '-F', '-n', '0', log_path])
+    while all(x_accepting(display_number) for display_number in range(DISPLAY_COUNT)):
+        time.sleep(5)
+    print("VNC server has stopped, exiting...")
+    supervisor.shutdown(1)
+
+
+def main():
+    supervisor = Supervisor()
+    signal.signal(signal.SIGTERM, lambda *_: supervisor.shutdown())
+    signal.signal(signal.SIGINT, lambda *_: supervisor.shutdown())
+
+    def overlay(display_number):
+        path = client_dir(display_number, DISPLAY_COUNT)
+        run_script('/opt/setup-overlay.sh', {'CLIENT_DIR': path})
+        check_client(path)
+
+    def wine(display_number):
+        run_script('/opt/init-wine.sh', {'WINEPREFIX': wine_prefix(display_number, DISPLAY_COUNT),
+                                         'DISPLAY': x_display(display_number)})
+
+    x_stages = []
+    for display_number in range(DISPLAY_COUNT):
+        suffix = f'-{display_number}' if display_number else ''
+        supervisor.add(f'overlay{suffix}', lambda n=display_number: overlay(n))
+        supervisor.add(f'wine{suffix}', lambda n=display_number: wine(n))
+        supervisor.add(f'x{suffix}', lambda n=display_number: start_x(n))
+        x_stages.append(f'x{suffix}')
+    if CAPTURE_MODE == 'file' and DISPLAY_COUNT == 1:
+        supervisor.add('snapshot', lambda: start_snapshot_service(supervisor), after=('x',))
+        supervisor.add('api', lambda: start_api(supervisor), after=('snapshot',))
+    else:
+        print(f"Desktop snapshots captured in-process by the API server (CAPTURE_MODE={CAPTURE_MODE}, "
+              f"{DISPLAY_COUNT} display(s))")
+        supervisor.add('api', lambda: start_api(supervisor), after=tuple(x_stages))
+
+    supervisor.run()
+    if any(supervisor.stages[name].state != 'completed' for name in x_stages):
+        print("X server did not start, exiting...")
+        supervisor.shutdown(1)
+    follow_vnc(supervisor)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import requests
+import threading
 import time
 
 BASE_URL = "http://localhost:5000"
@@ -67,6 +68,29 @@ def test_send_key_duration():
     else:
         print("✗ Invalid duration error test failed:", response.text)
 
+def test_scheduled_key_holds():
+    print("\nTesting overlapping key holds through the input scheduler...")
+    forward = requests.post(f"{BASE_URL}/send-key-duration", json={"key": "w", "duration_ms": 1500})
+    strafe = requests.post(f"{BASE_URL}/send-key-duration", json={"key": "d", "duration_ms": 500})
+    if forward.status_code == 200 and strafe.status_code == 200:
+        print("✓ Both holds scheduled:", forward.json().get('action_id'), strafe.json().get('action_id'))
+    else:
+        print("✗ Scheduling key holds failed:", forward.text, strafe.text)
+        return
+    
+    status = requests.get(f"{BASE_URL}/input-actions").json()
+    print(f"✓ Held keys: {status.get('held_keys')}, pending actions: {len(status.get('pending', []))}")
+    
+    response = requests.post(f"{BASE_URL}/release-all")
+    if response.status_code == 200:
+        print("✓ Release all passed:", response.json())
+    else:
+        print("✗ Release all failed:", response.text)
+    
+    action_id = strafe.json().get('action_id')
+    response = requests.get(f"{BASE_URL}/input-actions/{action_id}")
+    print(f"Action {action_id} state: {response.json().get('state')}")
+
 def test_move_mouse():
     print("Testing /move-mouse endpoint...")
     response = requests.post(f"{BASE_URL}/move-mouse", json={"x": 100, "y": 200})
@@ -205,6 +229,33 @@ def test_drag_mouse():
     else:
         print("✗ Invalid button error test failed:", response.text)
 
+def test_input_batch():
+    """Test batched input execution and up-front validation"""
+    print("\n=== Testing Input Batch ===")
+    
+    actions = [
+        {"type": "key", "key": "1"},
+        {"type": "key", "key": "2", "delay_ms": 100},
+        {"type": "move", "x": 200, "y": 200, "delay_ms": 50},
+        {"type": "click", "x": 200, "y": 200, "button": "right"}
+    ]
+    response = requests.post(f"{BASE_URL}/input-batch", json={"actions": actions})
+    if response.status_code == 200:
+        result = response.json()
+        print(f"✓ Batch of {len(actions)} actions completed in {result['total_ms']}ms")
+        for step in result['steps']:
+            print(f"  {step['index']}: {step['type']} scheduled={step['scheduled_ms']}ms lag={step['lag_ms']}ms")
+    else:
+        print("✗ Input batch test failed:", response.text)
+    
+    print("Testing batch with invalid step (should fail before running anything)...")
+    actions.append({"type": "click", "x": 200, "y": 200, "clicks": 20})
+    response = requests.post(f"{BASE_URL}/input-batch", json={"actions": actions})
+    if response.status_code == 400:
+        print("✓ Invalid batch error test passed:", response.json())
+    else:
+        print("✗ Invalid batch error test failed:", response.text)
+
 def test_desktop_snapshot():
     """Test desktop snapshot endpoint with metadata"""
     print("\n=== Testing Desktop Snapshot ===")
@@ -229,6 +280,7 @@ def test_desktop_snapshot():
             print(f"  Created: {response.headers.get('X-Snapshot-Created-Time')}")
             print(f"  Interval: {response.headers.get('X-Snapshot-Interval-Ms')}ms")
             print(f"  Fresh: {response.headers.get('X-Snapshot-Is-Fresh')}")
+            print(f"  Sequence: {response.headers.get('X-Snapshot-Sequence', 'n/a (file mode)')}")
             
             return True
         else:
@@ -239,30 +291,356 @@ def test_desktop_snapshot():
         print(f"✗ Failed to download snapshot: {e}")
         return False
 
+def test_desktop_snapshot_variants():
+    """Test snapshot format, crop and scale parameters and ETag revalidation"""
+    print("\n=== Testing Desktop Snapshot Variants ===")
+    
+    try:
+        params = {"format": "jpeg", "quality": 60, "crop": "0,0,200,200", "scale": 0.5}
+        response = requests.get(f"{BASE_URL}/desktop-snapshot", params=params, timeout=10)
+        if response.status_code == 200:
+            print(f"✓ Cropped half-size JPEG: {len(response.content)} bytes, "
+                  f"{response.headers.get('X-Snapshot-Width')}x{response.headers.get('X-Snapshot-Height')}")
+        else:
+            print(f"✗ Snapshot variant test failed: {response.text}")
+            return False
+        
+        etag = response.headers.get('ETag')
+        response = requests.get(f"{BASE_URL}/desktop-snapshot", params=params,
+                                headers={"If-None-Match": etag}, timeout=10)
+        if response.status_code in [200, 304]:
+            print(f"✓ Revalidation with {etag} returned {response.status_code}")
+        else:
+            print(f"✗ Revalidation failed with status {response.status_code}")
+        
+        print("Testing invalid format (should fail)...")
+        response = requests.get(f"{BASE_URL}/desktop-snapshot", params={"format": "gif"}, timeout=10)
+        if response.status_code == 400:
+            print("✓ Invalid format error test passed:", response.json())
+        else:
+            print("✗ Invalid format error test failed:", response.text)
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to download snapshot variant: {e}")
+        return False
+
+def test_desktop_stream():
+    """Test that the MJPEG stream delivers at least one frame"""
+    print("\n=== Testing Desktop Stream ===")
+    
+    try:
+        with requests.get(f"{BASE_URL}/desktop-stream", params={"scale": 0.25}, stream=True, timeout=10) as response:
+            if response.status_code != 200:
+                print(f"✗ Stream request failed with status {response.status_code}: {response.text}")
+                return False
+            chunk = next(response.iter_content(chunk_size=4096))
+            if chunk.startswith(b"--frame"):
+                print(f"✓ MJPEG stream started ({response.headers.get('Content-Type')})")
+                return True
+            print("✗ Unexpected stream content")
+            return False
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to open desktop stream: {e}")
+        return False
+
+def test_snapshot_long_poll():
+    """Test that after_seq returns the next frame as soon as it is captured"""
+    print("\n=== Testing Snapshot Long-Poll ===")
+    
+    try:
+        response = requests.get(f"{BASE_URL}/desktop-snapshot", params={"scale": 0.25}, timeout=10)
+        seq = response.headers.get('X-Snapshot-Sequence')
+        if response.status_code != 200 or seq is None:
+            print("✗ Long-poll needs the in-process capture engine (CAPTURE_MODE=memory), skipping")
+            return False
+        
+        started = time.time()
+        response = requests.get(f"{BASE_URL}/desktop-snapshot",
+                                params={"scale": 0.25, "after_seq": seq, "timeout": 5}, timeout=10)
+        waited = time.time() - started
+        next_seq = response.headers.get('X-Snapshot-Sequence')
+        if response.status_code == 200 and int(next_seq) > int(seq):
+            print(f"✓ Frame {next_seq} arrived {waited:.3f}s after asking for frames newer than {seq}")
+            return True
+        print(f"✗ Long-poll returned status {response.status_code} (sequence {next_seq}) after {waited:.3f}s")
+        return False
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to long-poll for a snapshot: {e}")
+        return False
+
+def test_metrics():
+    """Test that /metrics exposes request and input instrumentation"""
+    print("\n=== Testing Metrics ===")
+    
+    try:
+        requests.post(f"{BASE_URL}/send-key", json={"key": "space"}, timeout=5)
+        response = requests.get(f"{BASE_URL}/metrics", timeout=5)
+        if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('text/plain'):
+            print(f"✗ /metrics returned status {response.status_code}")
+            return False
+        
+        body = response.text
+        expected = [
+            'api_request_duration_seconds_bucket{route="/send-key"',
+            'api_input_backend_seconds_count{call="press"}',
+            'api_input_actions_pending',
+        ]
+        missing = [name for name in expected if name not in body]
+        if missing:
+            print(f"✗ Missing metrics: {missing}")
+            return False
+        print(f"✓ /metrics returned {len(body.splitlines())} lines including request and input timings")
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to fetch metrics: {e}")
+        return False
+
+def test_probes():
+    """Test pixel probes, region statistics and template matching against a frame crop"""
+    print("\n=== Testing Probes ===")
+    
+    try:
+        response = requests.post(f"{BASE_URL}/probe/pixels", json={"points": [[10, 10], [100, 100]]}, timeout=5)
+        if response.status_code != 200 or len(response.json().get('pixels', [])) != 2:
+            print(f"✗ /probe/pixels returned status {response.status_code}: {response.text}")
+            return False
+        print(f"✓ Pixels at frame {response.json()['sequence']}: {response.json()['pixels']}")
+        
+        response = requests.post(f"{BASE_URL}/probe/region",
+                                 json={"regions": [{"region": [0, 0, 100, 100], "color": [0, 0, 0], "tolerance": 10}]},
+                                 timeout=5)
+        if response.status_code != 200:
+            print(f"✗ /probe/region returned status {response.status_code}: {response.text}")
+            return False
+        stats = response.json()['regions'][0]
+        print(f"✓ Region mean {stats['mean']}, {stats['match_fraction']:.0%} near black")
+        
+        # Use a crop of the current frame as the template, so it must be found where it was cut
+        crop = requests.get(f"{BASE_URL}/desktop-snapshot", params={"crop": "200,150,48,32"}, timeout=10)
+        if crop.status_code != 200:
+            print(f"✗ Could not fetch a frame crop for the template: {crop.status_code}")
+            return False
+        response = requests.put(f"{BASE_URL}/templates/test-crop", data=crop.content, timeout=5)
+        if response.status_code == 400:
+            print(f"- Skipping template matching: {response.json().get('error')}")
+            return True
+        response = requests.post(f"{BASE_URL}/probe/match",
+                                 json={"template": "test-crop", "region": [100, 100, 300, 200]}, timeout=10)
+        requests.delete(f"{BASE_URL}/templates/test-crop", timeout=5)
+        if response.status_code != 200:
+            print(f"✗ /probe/match returned status {response.status_code}: {response.text}")
+            return False
+        best = response.json()['best']
+        print(f"Best match at ({best['x']}, {best['y']}) score {best['score']} in {response.json()['compute_ms']}ms")
+        if response.json()['found']:
+            print("✓ Template found in the frame")
+        else:
+            print("- Template not found (the screen may have changed between requests)")
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to run probes: {e}")
+        return False
+
+def test_wait_for_change():
+    """Test that /wait-for-change reports a change caused by moving the mouse"""
+    print("\n=== Testing Wait for Change ===")
+    
+    try:
+        # An unchanging region must time out with changed=false
+        response = requests.get(f"{BASE_URL}/wait-for-change",
+                                params={"region": "0,0,64,64", "threshold": 1.0, "timeout": 1}, timeout=10)
+        if response.status_code == 409:
+            print("- Skipping: /wait-for-change requires CAPTURE_MODE=memory")
+            return True
+        if response.status_code != 200:
+            print(f"✗ /wait-for-change returned status {response.status_code}: {response.text}")
+            return False
+        info = response.json()
+        print(f"Timed out after {info['waited_ms']}ms with score {info['score']} (changed: {info['changed']})")
+        
+        # Move the pointer back and forth over a region while waiting on it
+        result = {}
+        def wait():
+            result['response'] = requests.get(f"{BASE_URL}/wait-for-change",
+                                              params={"region": "300,300,200,200", "threshold": 0.01,
+                                                      "min_delta": 4, "tile": 8, "timeout": 5}, timeout=15)
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        time.sleep(0.5)
+        for x in (350, 450, 350):
+            requests.post(f"{BASE_URL}/move-mouse", json={"x": x, "y": 400}, timeout=5)
+            time.sleep(0.3)
+        waiter.join()
+        info = result['response'].json()
+        if info.get('changed'):
+            print(f"✓ Change detected at frame {info['sequence']} (baseline {info['baseline_sequence']}), "
+                  f"score {info['score']}, region {info['changed_region']}")
+        else:
+            print("- No change detected (the pointer may not be drawn into the captured frame)")
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to wait for change: {e}")
+        return False
+
+def test_history():
+    """Test fetching a past frame and exporting a clip from the frame history"""
+    print("\n=== Testing Frame History ===")
+    
+    try:
+        response = requests.get(f"{BASE_URL}/history", timeout=5)
+        if response.status_code == 409:
+            print("- Skipping: frame history is disabled")
+            return True
+        info = response.json()
+        if response.status_code != 200 or not info.get('frames'):
+            print(f"✗ /history returned status {response.status_code}: {info}")
+            return False
+        print(f"History: {info['frames']} frames over {info['seconds']}s, "
+              f"{info['bytes_used'] / 1048576:.1f} MB ({info['compression']})")
+        
+        seq = info['oldest_sequence']
+        response = requests.get(f"{BASE_URL}/history/frame", params={"seq": seq, "format": "jpeg"}, timeout=10)
+        if response.status_code != 200 or response.headers.get('X-Snapshot-Sequence') != str(seq):
+            print(f"✗ /history/frame?seq={seq} returned status {response.status_code}")
+            return False
+        print(f"✓ Oldest frame {seq}: {len(response.content)} bytes")
+        
+        response = requests.get(f"{BASE_URL}/history/clip", params={"seconds": 2, "scale": 0.25}, timeout=30)
+        if response.status_code != 200 or response.headers.get('Content-Type') != 'image/webp':
+            print(f"✗ /history/clip returned status {response.status_code}")
+            return False
+        print(f"✓ Clip of the last 2s: {response.headers.get('X-Clip-Frames')} frames, {len(response.content)} bytes")
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to read the frame history: {e}")
+        return False
+
+def test_ready():
+    """Test the readiness endpoint and its startup stage report"""
+    print("\n=== Testing Readiness ===")
+    
+    try:
+        response = requests.get(f"{BASE_URL}/ready", timeout=5)
+        if response.status_code not in [200, 503]:
+            print(f"✗ /ready returned status {response.status_code}")
+            return False
+        
+        info = response.json()
+        print(f"Ready: {info.get('ready')} (input ready: {info.get('input_ready')})")
+        startup = info.get('startup')
+        if startup:
+            for name, stage in startup.get('stages', {}).items():
+                seconds = f" in {stage['seconds']}s" if 'seconds' in stage else ''
+                print(f"  {name}: {stage['state']}{seconds}")
+        
+        response = requests.get(f"{BASE_URL}/ready", params={"scope": "input"}, timeout=5)
+        if response.status_code != (200 if info.get('input_ready') else 503):
+            print(f"✗ /ready?scope=input returned status {response.status_code}")
+            return False
+        print(f"✓ /ready returned {'200' if info.get('ready') else '503'}")
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to check readiness: {e}")
+        return False
+
+def test_adaptive_capture_rate():
+    """Test that a snapshot request is served fresh and reports the effective rate"""
+    print("\n=== Testing Adaptive Capture Rate ===")
+    
+    try:
+        info = requests.get(f"{BASE_URL}/snapshot-info", timeout=5).json()
+        if 'capture_rate' not in info:
+            print("✓ Adaptive capture rate not in use (file mode)")
+            return True
+        print(f"Rate before request: {info['capture_rate']} ({info['effective_interval_ms']} ms)")
+        
+        started = time.time()
+        response = requests.get(f"{BASE_URL}/desktop-snapshot", timeout=10)
+        elapsed = time.time() - started
+        if response.status_code != 200:
+            print(f"✗ Snapshot returned status {response.status_code}")
+            return False
+        rate = response.headers.get('X-Snapshot-Capture-Rate')
+        print(f"Snapshot in {elapsed:.2f}s, rate {rate}, interval {response.headers.get('X-Snapshot-Interval-Ms')} ms, "
+              f"fresh {response.headers.get('X-Snapshot-Is-Fresh')}")
+        if response.headers.get('X-Snapshot-Is-Fresh') != 'true':
+            print("✗ A requested snapshot should be fresh")
+            return False
+        if rate not in ('demand', 'active'):
+            print(f"✗ Expected the engine to leave idle after a request, got {rate}")
+            return False
+        print("✓ Requested frame was fresh and the engine left idle")
+        return True
+    
+    except requests.exceptions.RequestException as e:
+        print(f"✗ Failed to test adaptive capture: {e}")
+        return False
+
+def test_displays():
+    """Test display listing and routing by path prefix and X-Display header"""
+    print("\n=== Testing Displays ===")
+    
+    try:
+        listing = requests.get(f"{BASE_URL}/displays", timeout=5).json()
+        print(f"✓ {listing['count']} display(s): " + ', '.join(
+            f"{d['id']} ({d['x_display']}, VNC {d['vnc_port']})" for d in listing['displays']))
+        
+        for display in listing['displays']:
+            by_prefix = requests.get(f"{BASE_URL}/displays/{display['id']}/desktop-snapshot?format=jpeg", timeout=10)
+            by_header = requests.get(f"{BASE_URL}/desktop-snapshot?format=jpeg",
+                                     headers={'X-Display': str(display['id'])}, timeout=10)
+            if by_prefix.status_code != 200 or by_header.status_code != 200:
+                print(f"✗ Display {display['id']}: prefix {by_prefix.status_code}, header {by_header.status_code}")
+                return False
+            if by_prefix.headers.get('X-Snapshot-Display') != str(display['id']):
+                print(f"✗ Display {display['id']} answered as {by_prefix.headers.get('X-Snapshot-Display')}")
+                return False
+            print(f"✓ Display {display['id']} reachable by prefix and header")
+        
+        response = requests.get(f"{BASE_URL}/displays/{listing['count']}/snapshot-info", timeout=5)
+        if response.status_code != 404:
+            print(f"✗ Unknown display returned {response.status_code}")
+            return False
+        print("✓ Unknown display rejected with 404")
+        return True
+    
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        print(f"✗ Failed to test displays: {e}")
+        return False
+
 def test_snapshot_service_health():
     """Test snapshot service health check endpoint"""
     print("\n=== Testing Snapshot Service Health ===")
     
     try:
-        print("Testing service health check (this may take a moment)...")
-        response = requests.get(f"{BASE_URL}/snapshot-info", timeout=15)
+        print("Testing service health check...")
+        response = requests.get(f"{BASE_URL}/snapshot-info", timeout=5)
         print(f"Health check status: {response.status_code}")
         
         if response.status_code in [200, 503]:  # Both are valid responses
             info = response.json()
             print(f"Service healthy: {info.get('service_healthy')}")
             print(f"Snapshot available: {info.get('snapshot_available')}")
-            print(f"File was updated during check: {info.get('file_was_updated_during_check')}")
+            print(f"Frame sequence: {info.get('sequence')}")
             print(f"Age: {info.get('age_seconds')} seconds")
             print(f"Is fresh: {info.get('is_fresh')}")
             print(f"Configured interval: {info.get('configured_interval_ms')}ms")
+            print(f"Capture mode: {info.get('capture_mode')}")
             
-            if 'check_details' in info:
-                details = info['check_details']
-                print("\n🔍 Check Details:")
-                print(f"  Initial age: {details.get('initial_age_seconds')}s")
-                print(f"  Waited: {details.get('waited_seconds')}s")
-                print(f"  Final age: {details.get('final_age_seconds')}s")
+            if 'frame' in info:
+                frame = info['frame']
+                print("\n🔍 Capture Engine:")
+                print(f"  Frames captured: {frame.get('frames_captured')}")
+                print(f"  Capture errors: {frame.get('capture_errors')}")
+                print(f"  Capture time: {frame.get('capture_ms')}ms (MIT-SHM: {frame.get('shm')})")
             
             return info.get('service_healthy', False)
         else:
@@ -298,10 +676,22 @@ if __name__ == "__main__":
     
     test_send_key()
     test_send_key_duration()
+    test_scheduled_key_holds()
     test_move_mouse()
     test_click_mouse()
     test_drag_mouse()
+    test_input_batch()
     test_desktop_snapshot()
+    test_desktop_snapshot_variants()
+    test_desktop_stream()
+    test_snapshot_long_poll()
+    test_metrics()
+    test_probes()
+    test_wait_for_change()
+    test_history()
+    test_ready()
+    test_adaptive_capture_rate()
+    test_displays()
     test_snapshot_service_health()
     test_multiple_instances()
     
@@ -0,0 +1,269 @@
+"""Test api_client.py against local fake instance APIs.
+
+Runs without Docker or X: FakeInstance serves the control endpoints the
+client wraps over HTTP/1.1 keep-alive, counts the TCP connections it
+accepts, and can be told to fail or stall requests.
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from api_client import ApiClient, ApiError, AsyncApiClient, AsyncMultiClient, MultiClient
+from checks import check, run_tests
+
+FRAME = bytes(range(24))  # 4x2 RGB
+
+
+class FakeInstance:
+    """In-process stand-in for api.py on a random localhost port"""
+
+    def __init__(self, instance_id=1):
+        self.instance_id = instance_id
+        self.received = []
+        self.connections = 0
+        self.fail_next = []  # statuses returned (in order) before answering normally
+        self.drop_next = 0  # requests read and then answered by closing the connection
+        self.delay = 0.0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        # Clients that time out close their connection mid-answer; that is expected here
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status, data):
+                self._send(status, json.dumps(data).encode(), {'Content-Type': 'application/json'})
+
+            def _fail(self):
+                with fake.lock:
+                    status = fake.fail_next.pop(0) if fake.fail_next else None
+                    drop = fake.drop_next > 0
+                    fake.drop_next -= drop
+                if drop:
+                    self.close_connection = True
+                    return 'dropped'
+                if status:
+                    self._json(status, {'error': f'injected {status}'})
+                if fake.delay:
+                    time.sleep(fake.delay)
+                return status
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                failed = self._fail()
+                if failed == 'dropped':
+                    fake.received.append((self.path, body))
+                if failed:
+                    return
+                fake.received.append((self.path, body))
+                if body.get('key') == 'unknown':
+                    self._json(400, {'error': 'Unknown key: unknown'})
+                else:
+                    self._json(200, dict(body, status='success', instance=fake.instance_id))
+
+            def do_GET(self):
+                if self._fail():
+                    return
+                url = urlparse(self.path)
+                if url.path == '/snapshot-info':
+                    self._json(503, {'service_healthy': False, 'sequence': 7, 'instance': fake.instance_id})
+                    return
+                query = parse_qs(url.query)
+                etag = f'"7-{query.get("format", ["png"])[0]}"'
+                headers = {'ETag': etag, 'X-Snapshot-Sequence': '7', 'X-Snapshot-Age-Seconds': '0.12',
+                           'X-Snapshot-Is-Fresh': 'true', 'X-Snapshot-Interval-Ms': '500',
+                           'X-Snapshot-Capture-Rate': 'demand', 'X-Snapshot-Display': '0'}
+                if self.headers.get('If-None-Match') == etag:
+                    self._send(304, headers=headers)
+                    return
+                headers.update({'Content-Type': 'application/octet-stream', 'X-Snapshot-Format': 'raw',
+                                'X-Snapshot-Width': '4', 'X-Snapshot-Height': '2'})
+                self._send(200, FRAME, headers)
+
+        return Handler
+
+
+def test_pooling_and_endpoints():
+    print("\n=== Testing Pooled Client ===")
+    fake = FakeInstance()
+    try:
+        with ApiClient(fake.url) as client:
+            for n in range(50):
+                client.send_key('w', duration_ms=20)
+            client.move_mouse(10, 20)
+            client.click_mouse(10, 20, button='right')
+            client.drag_mouse(0, 0, 50, 50, duration=0.1, wait=True)
+            check(fake.connections == 1, f"53 calls used {fake.connections} connection(s)")
+            check(fake.received[-1] == ('/drag-mouse', {'start_x': 0, 'start_y': 0, 'end_x': 50, 'end_y': 50,
+                                                        'duration': 0.1, 'wait': True}),
+                  f"Payload sent without unset fields: {fake.received[-1][1]}")
+            try:
+                client.send_key('unknown')
+                check(False, "Error answer raised no ApiError")
+            except ApiError as e:
+                check(e.status == 400 and 'Unknown key' in e.message, f"Error answer raised: {e}")
+    finally:
+        fake.stop()
+
+
+def test_snapshot():
+    print("\n=== Testing Snapshots ===")
+    fake = FakeInstance()
+    try:
+        client = ApiClient(fake.url)
+        snapshot = client.snapshot(format='raw')
+        pixels = snapshot.pixels()
+        check(pixels.shape == (2, 4, 3) and pixels[1, 3, 2] == 23 and snapshot.data.obj is not None
+              and not pixels.flags.owndata,
+              f"Raw frame viewed without a copy: {snapshot}")
+        check(snapshot.sequence == 7 and snapshot.is_fresh is True and snapshot.age_seconds == 0.12
+              and snapshot.capture_rate == 'demand' and snapshot.display == 0,
+              "X-Snapshot-* headers parsed")
+        again = client.snapshot(format='raw', if_none_match=snapshot.etag)
+        check(again.not_modified and len(again.data) == 0 and again.sequence == 7,
+              "If-None-Match answered with not_modified")
+        info = client.snapshot_info()
+        check(info['sequence'] == 7 and info['service_healthy'] is False,
+              "Unhealthy /snapshot-info (503) returned as a body")
+    finally:
+        fake.stop()
+
+
+def test_retries_and_timeouts():
+    print("\n=== Testing Retries and Timeouts ===")
+    fake = FakeInstance()
+    try:
+        client = ApiClient(fake.url, retries=2)
+        fake.fail_next = [502, 504]
+        snapshot = client.snapshot()
+        check(snapshot.sequence == 7 and not fake.fail_next, "GET retried through 502 and 504")
+
+        fake.fail_next = [502]
+        try:
+            client.send_key('w')
+            check(False, "POST answered 502 without an error")
+        except ApiError as e:
+            check(e.status == 502 and not fake.received, "POST not retried after a 502")
+
+        fake.drop_next = 1
+        try:
+            client.send_key('w')
+            check(False, "POST answered by a dropped connection raised no error")
+        except ApiError as e:
+            check(e.status is None and len(fake.received) == 1,
+                  f"POST not resent after the connection dropped: {e}", f"POST sent {len(fake.received)} times")
+        fake.drop_next = 1
+        check(client.snapshot_info()['sequence'] == 7 and not fake.drop_next,
+              "GET retried after the connection dropped")
+
+        async def async_dropped_post():
+            fake.received.clear()
+            fake.drop_next = 1
+            async with AsyncApiClient(fake.url, retries=2) as async_client:
+                try:
+                    await async_client.click_mouse(1, 1)
+                except ApiError as e:
+                    return e
+
+        error = asyncio.run(async_dropped_post())
+        check(error is not None and len(fake.received) == 1,
+              f"Async POST not resent after the connection dropped: {error}",
+              f"Async POST sent {len(fake.received)} times, error {error}")
+
+        fake.delay = 0.5
+        started = time.monotonic()
+        try:
+            client.snapshot_info(timeout=0.1, retries=0)
+            check(False, "Slow answer did not time out")
+        except ApiError as e:
+            elapsed = time.monotonic() - started
+            check(elapsed < 0.4, f"Per-call timeout honoured after {elapsed * 1000:.0f}ms: {e}")
+        fake.delay = 0.0
+
+        dead = ApiClient('http://127.0.0.1:9', retries=1)
+        try:
+            dead.move_mouse(1, 1)
+            check(False, "Refused connection raised no error")
+        except ApiError as e:
+            check(e.status is None, f"Refused connection reported: {e}")
+    finally:
+        fake.stop()
+
+
+def test_multi_instance():
+    print("\n=== Testing Multi-Instance Handles ===")
+    fakes = {i: FakeInstance(i) for i in (1, 2, 3)}
+    for fake in fakes.values():
+        fake.delay = 0.2
+    urls = {i: fake.url for i, fake in fakes.items()}
+    urls[4] = 'http://127.0.0.1:9'  # not running
+    try:
+        with MultiClient(urls, retries=0) as fleet:
+            started = time.monotonic()
+            results = fleet.call('send_key', 'space')
+            elapsed = time.monotonic() - started
+            answered = sorted(i for i, result in results.items() if isinstance(result, dict))
+            check(answered == [1, 2, 3] and isinstance(results[4], ApiError) and elapsed < 0.5,
+                  f"Broadcast to 3 slow instances in {elapsed * 1000:.0f}ms, instance 4 failed: {results[4]}")
+            results = fleet.call('snapshot', instances='2-3')
+            check(sorted(results) == [2, 3], "Subset selected by '2-3'")
+
+        async def run_async():
+            async with AsyncMultiClient(urls, retries=0) as fleet:
+                started = time.monotonic()
+                results = await fleet.call('click_mouse', 5, 5, instances=[1, 2, 3])
+                return results, time.monotonic() - started
+
+        results, elapsed = asyncio.run(run_async())
+        check([results[i]['instance'] for i in (1, 2, 3)] == [1, 2, 3] and elapsed < 0.5,
+              f"Async broadcast to 3 slow instances in {elapsed * 1000:.0f}ms")
+
+        async def run_single():
+            async with AsyncApiClient(fakes[1].url) as client:
+                return await client.snapshot(format='raw')
+
+        snapshot = asyncio.run(run_single())
+        check(snapshot.pixels().shape == (2, 4, 3), f"Async snapshot: {snapshot}")
+    finally:
+        for fake in fakes.values():
+            fake.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("API Client Test Script (fake instances)", [
+        test_pooling_and_endpoints,
+        test_snapshot,
+        test_retries_and_timeouts,
+        test_multi_instance,
+    ], 'client tests'))
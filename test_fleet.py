@@ -0,0 +1,411 @@
+"""Test fleet.py and fleet_status.py against a local fake Docker Engine API.
+
+Runs without Docker: FakeDockerAPI serves the handful of Engine API routes
+the fleet tools use and records every container operation, with a
+configurable delay per start/stop so parallelism is visible in the timings.
+"""
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from checks import check, run_tests
+from docker_api import DockerClient
+from fleet import FleetController, container_name
+from fleet_status import StatusCollector, format_table
+
+
+class FakeDockerAPI:
+    """In-memory Docker Engine API on a random localhost port"""
+
+    def __init__(self, operation_delay=0.2):
+        self.operation_delay = operation_delay
+        self.containers = {}  # name -> {'Id', 'State', 'Config'}
+        self.networks = set()
+        self.images = {'wow-client:latest'}
+        self.calls = []
+        self.stats_interval = 0.1
+        self.stats_streams = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'tcp://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats_sample(self, tick):
+        """Stats sample with 10% CPU (on 2 CPUs) and 200MiB memory in use"""
+        return {
+            'cpu_stats': {'cpu_usage': {'total_usage': tick * 10 ** 8}, 'system_cpu_usage': tick * 2 * 10 ** 9,
+                          'online_cpus': 2},
+            'precpu_stats': {'cpu_usage': {'total_usage': (tick - 1) * 10 ** 8},
+                             'system_cpu_usage': (tick - 1) * 2 * 10 ** 9 if tick > 1 else 0},
+            'memory_stats': {'usage': 300 * 2 ** 20, 'limit': 4 * 2 ** 30, 'stats': {'inactive_file': 100 * 2 ** 20}},
+        }
+
+    def _slow_operation(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.operation_delay)
+        with self.lock:
+            self.in_flight -= 1
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b''
+                self.send_response(status)
+                if body is not None:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self, method):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                path = unquote(url.path)
+                with fake.lock:
+                    fake.calls.append((method, path))
+
+                if method == 'GET' and path == '/containers/json':
+                    name_filter = json.loads(query.get('filters', ['{}'])[0]).get('name', [''])[0]
+                    with fake.lock:
+                        listing = [
+                            {'Id': c['Id'], 'Names': [f'/{name}'], 'State': c['State'], 'Status': c['State'],
+                             'Labels': c['Config'].get('Labels') or {}}
+                            for name, c in fake.containers.items() if name_filter in name
+                        ]
+                    return self._reply(200, listing)
+
+                if method == 'POST' and path == '/containers/create':
+                    name = query['name'][0]
+                    with fake.lock:
+                        if name in fake.containers:
+                            return self._reply(409, {'message': f'Conflict. The container name "/{name}" is already in use'})
+                        if body['Image'] not in fake.images:
+                            return self._reply(404, {'message': f"No such image: {body['Image']}"})
+                        fake.containers[name] = {'Id': f'id-{name}', 'State': 'created', 'Config': body}
+                    return self._reply(201, {'Id': f'id-{name}', 'Warnings': []})
+
+                match = re.fullmatch(r'/containers/([^/]+)/stats', path)
+                if method == 'GET' and match:
+                    return self._stats(match.group(1), query.get('stream') != ['0'])
+
+                match = re.fullmatch(r'/containers/([^/]+)(?:/(start|stop|json))?', path)
+                if match:
+                    name, action = match.groups()
+                    container = fake.containers.get(name)
+                    if container is None:
+                        return self._reply(404, {'message': f'No such container: {name}'})
+                    if method == 'POST' and action == 'start':
+                        if container['State'] == 'running':
+                            return self._reply(304)
+                        fake._slow_operation()
+                        container['State'] = 'running'
+                        return self._reply(204)
+                    if method == 'POST' and action == 'stop':
+                        if container['State'] != 'running':
+                            return self._reply(304)
+                        fake._slow_operation()
+                        container['State'] = 'exited'
+                        return self._reply(204)
+                    if method == 'DELETE' and action is None:
+                        if container['State'] == 'running' and query.get('force') != ['1']:
+                            return self._reply(409, {'message': 'container is running'})
+                        with fake.lock:
+                            del fake.containers[name]
+                        return self._reply(204)
+                    if method == 'GET' and action == 'json':
+                        return self._reply(200, container)
+
+                match = re.fullmatch(r'/images/(.+)/json', path)
+                if method == 'GET' and match:
+                    if match.group(1) in fake.images:
+                        return self._reply(200, {'Id': 'sha256:fake'})
+                    return self._reply(404, {'message': f'No such image: {match.group(1)}'})
+
+                match = re.fullmatch(r'/networks/([^/]+)', path)
+                if method == 'GET' and match and match.group(1) != 'create':
+                    if match.group(1) in fake.networks:
+                        return self._reply(200, {'Name': match.group(1)})
+                    return self._reply(404, {'message': 'network not found'})
+                if method == 'POST' and path == '/networks/create':
+                    fake.networks.add(body['Name'])
+                    return self._reply(201, {'Id': 'net'})
+
+                return self._reply(404, {'message': f'unsupported fake route {method} {path}'})
+
+            def _stats(self, name, stream):
+                container = fake.containers.get(name)
+                if container is None:
+                    return self._reply(404, {'message': f'No such container: {name}'})
+                with fake.lock:
+                    fake.stats_streams += 1 if stream else 0
+                if not stream:
+                    return self._reply(200, fake.stats_sample(1))
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                tick = 0
+                try:
+                    while container['State'] == 'running' and fake.containers.get(name) is container:
+                        tick += 1
+                        line = json.dumps(fake.stats_sample(tick)).encode() + b'\n'
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+                        self.wfile.flush()
+                        time.sleep(fake.stats_interval)
+                    self.wfile.write(b'0\r\n\r\n')
+                except OSError:
+                    pass  # client went away
+                self.close_connection = True
+
+            def do_GET(self):
+                self._route('GET')
+
+            def do_POST(self):
+                self._route('POST')
+
+            def do_DELETE(self):
+                self._route('DELETE')
+
+        return Handler
+
+
+def _controller(fake, concurrency=4):
+    return FleetController(client=DockerClient(fake.url), concurrency=concurrency, client_dir='/tmp/wow-client')
+
+
+def _actions(report):
+    return {result['instance']: result['action'] for result in report['results'] if result['ok']}
+
+
+def test_scale_up_in_parallel():
+    print("\n=== Testing Parallel Scale Up ===")
+    fake = FakeDockerAPI(operation_delay=0.2).start()
+    try:
+        report = _controller(fake, concurrency=4).reconcile(range(1, 9))
+        created = [i for i, action in _actions(report).items() if action == 'create']
+        serial_estimate = 8 * fake.operation_delay
+        check(created == list(range(1, 9)) and not report['failed'],
+              f"Created 8 instances in {report['seconds']:.2f}s (serial would take ~{serial_estimate:.1f}s)",
+              f"Unexpected scale-up result: {report}")
+        check(fake.max_in_flight <= 4,
+              f"Concurrency limit respected (max {fake.max_in_flight} operations in flight)",
+              f"{fake.max_in_flight} operations ran at once with a limit of 4")
+        config = fake.containers[container_name(3)]['Config']
+        check(config['HostConfig']['PortBindings']['5000/tcp'][0]['HostPort'] == '5002'
+              and 'INSTANCE_ID=3' in config['Env'],
+              "Instance 3 got API port 5002 and INSTANCE_ID=3",
+              f"Wrong container config for instance 3: {config}")
+    finally:
+        fake.stop()
+
+
+def test_reconcile_by_instance_id():
+    print("\n=== Testing Reconcile by Instance Id ===")
+    fake = FakeDockerAPI(operation_delay=0.01).start()
+    try:
+        controller = _controller(fake)
+        controller.reconcile(range(1, 6))
+        # A middle instance dies: scale must restart exactly that one, not create instance 6
+        fake.containers[container_name(3)]['State'] = 'exited'
+        fake.calls.clear()
+        report = controller.reconcile(range(1, 6))
+        check(_actions(report) == {3: 'start'} and ('POST', '/containers/create') not in fake.calls,
+              "Dead middle instance 3 restarted in place, its container reused",
+              f"Expected only instance 3 to start, got {_actions(report)}")
+
+        report = controller.reconcile(range(1, 3))
+        check(_actions(report) == {3: 'stop', 4: 'stop', 5: 'stop'} and len(fake.containers) == 5,
+              "Scale down stopped instances 3-5 and kept their containers",
+              f"Unexpected scale-down result: {_actions(report)}")
+
+        fake.calls.clear()
+        report = controller.reconcile(range(1, 5))
+        creates = [call for call in fake.calls if call == ('POST', '/containers/create')]
+        check(_actions(report) == {3: 'start', 4: 'start'} and not creates,
+              "Scale back up to 4 reused stopped containers 3 and 4",
+              f"Unexpected scale-up result: {_actions(report)}, creates={len(creates)}")
+
+        report = controller.reconcile(range(1, 3), remove=True)
+        check(sorted(fake.containers) == [container_name(1), container_name(2)],
+              f"--remove removed instances {sorted(_actions(report))}",
+              f"Containers left after remove: {sorted(fake.containers)}")
+
+        report = controller.reconcile(range(1, 3))
+        check(not report['results'], "Reconciling an up-to-date fleet does nothing",
+              f"Up-to-date fleet produced steps: {report['results']}")
+    finally:
+        fake.stop()
+
+
+def test_missing_image_reported():
+    print("\n=== Testing Missing Image ===")
+    fake = FakeDockerAPI(operation_delay=0.01).start()
+    fake.images.clear()
+    try:
+        report = _controller(fake).reconcile([1, 2])
+        errors = {result['error'] for result in report['results'] if not result['ok']}
+        check(report['failed'] == 2 and any('docker build' in error for error in errors),
+              f"Missing image reported per instance: {sorted(errors)[0] if errors else None}",
+              f"Unexpected report: {report}")
+    finally:
+        fake.stop()
+
+
+def test_multi_display_layout():
+    print("\n=== Testing Several Displays Per Instance ===")
+    fake = FakeDockerAPI(operation_delay=0.01).start()
+    try:
+        controller = FleetController(client=DockerClient(fake.url), client_dir='/tmp/wow-client', displays=3)
+        report = controller.reconcile([1, 2])
+        config = fake.containers[container_name(2)]['Config']
+        bindings = {port: binding[0]['HostPort'] for port, binding in config['HostConfig']['PortBindings'].items()}
+        expected = {'5900/tcp': '5903', '5901/tcp': '5904', '5902/tcp': '5905', '5000/tcp': '5001'}
+        check(bindings == expected, f"Instance 2 publishes displays on {sorted(bindings.values())}",
+              f"Unexpected port bindings: {bindings}")
+        check('DISPLAYS=3' in config['Env'] and any(':/root/Desktop/Clients' in bind
+                                                    for bind in config['HostConfig']['Binds']),
+              "DISPLAYS=3 passed and per-display client directories mounted",
+              f"Display count or client mount missing: {config['Env']}, {config['HostConfig']['Binds']}")
+        ports = report['results'][1]['ports']
+        check(ports.get('vnc_displays') == [5903, 5904, 5905], f"Reported ports: {ports}")
+    finally:
+        fake.stop()
+
+
+def test_mixed_display_counts_refused():
+    print("\n=== Testing Display Count Changes ===")
+    fake = FakeDockerAPI(operation_delay=0.01).start()
+    collector = None
+    try:
+        FleetController(client=DockerClient(fake.url), client_dir='/tmp/wow-client', displays=2).reconcile([1, 2])
+        controller = _controller(fake)
+        try:
+            steps = controller.plan([1, 2, 3, 4])
+            error = None
+        except ValueError as e:
+            steps, error = None, e
+        # Instance 3 would get VNC port 5902, which instance 2 already publishes
+        check(error is not None and '2 (2 displays)' in str(error), f"One-display scale refused: {error}",
+              f"Expected a refusal, got steps {steps}")
+        steps = controller.plan([1, 2, 3, 4], remove=True)
+        check(steps == [(1, 'recreate'), (2, 'recreate'), (3, 'create'), (4, 'create')],
+              "--remove recreates the two-display instances", f"Unexpected plan: {steps}")
+        check(controller.plan([1], remove=True) == [(1, 'recreate'), (2, 'remove')],
+              "Scaling down with --remove removes the leftover instance")
+
+        collector = StatusCollector(client=DockerClient(fake.url), ttl=1.0, health_url=lambda i: 'http://127.0.0.1:9')
+        ports = {entry['instance']: entry['ports'] for entry in collector.status()['instances']}
+        check(ports[2].get('vnc_displays') == [5902, 5903], f"Status reports instance 2 on VNC {ports[2]}",
+              f"Status ports ignore the display label: {ports}")
+    finally:
+        if collector is not None:
+            collector.close()
+        fake.stop()
+
+
+class _FakeInstanceAPI:
+    """Serves /snapshot-info like a healthy api.py"""
+
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                data = json.dumps({'service_healthy': True, 'age_seconds': 0.2, 'sequence': 42,
+                                   'capture_mode': 'memory'}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_status_collector():
+    print("\n=== Testing Cached Fleet Status ===")
+    fake = FakeDockerAPI(operation_delay=0.01).start()
+    instance_api = _FakeInstanceAPI()
+    collector = None
+    try:
+        _controller(fake).reconcile(range(1, 4))
+        fake.containers[container_name(3)]['State'] = 'exited'
+        # Instance 2's API is not reachable
+        health_url = lambda i: 'http://127.0.0.1:9' if i == 2 else instance_api.url
+        collector = StatusCollector(client=DockerClient(fake.url), ttl=1.0, health_url=health_url)
+        fake.calls.clear()
+
+        collector.status()
+        collector.wait_for_samples()
+        for _ in range(20):
+            collector.status()
+        lists = fake.calls.count(('GET', '/containers/json'))
+        check(lists == 1 and collector.refreshes == 1,
+              f"21 status calls within the TTL made {lists} Docker list query",
+              f"Expected one Docker list query, got {lists} ({collector.refreshes} refreshes)")
+        check(fake.stats_streams == 2, "One stats stream per running container, none for the stopped one",
+              f"Expected 2 stats streams, got {fake.stats_streams}")
+
+        status = collector.status(force=True)
+        entries = {entry['instance']: entry for entry in status['instances']}
+        check(entries[1].get('cpu_percent') == 10.0 and entries[1].get('memory_bytes') == 200 * 2 ** 20,
+              "CPU (10.0%) and memory (200MiB) taken from the stats stream",
+              f"Unexpected resource figures: {entries[1]}")
+        check(entries[1]['health']['healthy'] and not entries[2]['health']['reachable'] and 'health' not in entries[3],
+              "Health merged: 1 healthy, 2 unreachable, 3 stopped (not probed)",
+              f"Unexpected health merge: {[entries[i].get('health') for i in (1, 2, 3)]}")
+        table = format_table(status)
+        check('unreachable' in table and '10.0' in table, "Table output:", f"Unexpected table:\n{table}")
+        print('\n'.join('    ' + line for line in table.splitlines()))
+    finally:
+        if collector is not None:
+            collector.close()
+        instance_api.stop()
+        fake.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Fleet Controller Test Script (fake Docker Engine API)", [
+        test_scale_up_in_parallel,
+        test_reconcile_by_instance_id,
+        test_missing_image_reported,
+        test_multi_display_layout,
+        test_mixed_display_counts_refused,
+        test_status_collector,
+    ], 'fleet tests'))
@@ -0,0 +1,97 @@
+"""Test frame_analysis.py (pixel probes and template matching) offline.
+
+Runs without X: frames are random numpy arrays, and templates are crops of
+them, so every match has a known position.
+"""
+import sys
+
+import numpy as np
+
+from checks import check, run_tests
+from frame_analysis import Template, match_template, read_pixels
+
+HEIGHT, WIDTH = 120, 160
+
+
+def _image(seed=5):
+    return np.random.default_rng(seed).integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+
+
+def _template(pixels):
+    return Template(None, np.ascontiguousarray(pixels), 'test')
+
+
+def test_match_known_offset():
+    print("\n=== Testing Template Match At A Known Offset ===")
+    image = _image()
+    template = _template(image[22:37, 41:61])
+    result = match_template(image, template, (0, 0, WIDTH, HEIGHT), threshold=0.99)
+    best = result['best']
+    check((best['x'], best['y']) == (41, 22) and best['score'] > 0.999,
+          f"Crop found at its offset (41, 22) with score {best['score']}", f"Best match: {best}")
+    check(result['found'] and len(result['matches']) == 1, "One match above 0.99",
+          f"Matches: {result['matches']}")
+    result = match_template(image, template, (30, 10, 50, 40), threshold=0.99)
+    check((result['best']['x'], result['best']['y']) == (41, 22),
+          "Search region offset mapped back to frame coordinates", f"Best in region: {result['best']}")
+
+
+def test_non_maximum_suppression():
+    print("\n=== Testing Several Matches ===")
+    image = _image(6)
+    patch = image[0:12, 0:16].copy()
+    positions = [(100, 8), (20, 70), (130, 100)]
+    for x, y in positions:
+        image[y:y + 12, x:x + 16] = patch
+    positions.append((0, 0))
+    result = match_template(image, _template(patch), (0, 0, WIDTH, HEIGHT), threshold=0.95, max_matches=10)
+    found = sorted((match['x'], match['y']) for match in result['matches'])
+    check(found == sorted(positions), f"Exactly the {len(positions)} copies found, one match each",
+          f"Expected {sorted(positions)}, found {found}")
+    limited = match_template(image, _template(patch), (0, 0, WIDTH, HEIGHT), threshold=0.95, max_matches=2)
+    check(len(limited['matches']) == 2, "max_matches limits the result", f"Matches: {limited['matches']}")
+
+
+def test_template_validation():
+    print("\n=== Testing Template Validation ===")
+    image = _image()
+    for pixels, reason in ((np.full((8, 8, 3), 40, dtype=np.uint8), 'single colour'),
+                           (image[:1, :10], 'smaller than 2x2')):
+        try:
+            _template(pixels)
+            error = None
+        except ValueError as e:
+            error = e
+        check(error is not None, f"Template rejected ({reason}): {error}", f"Template accepted ({reason})")
+    try:
+        match_template(image, _template(image[:50, :50]), (0, 0, 40, 40))
+        error = None
+    except ValueError as e:
+        error = e
+    check(error is not None, f"Template larger than the region rejected: {error}")
+
+
+def test_read_pixels():
+    print("\n=== Testing Pixel Probes ===")
+    image = _image()
+    result = read_pixels(image, [[0, 0], [159, 119]], expect=[image[0, 0].tolist(), [0, 0, 0]], tolerance=0)
+    check(result['pixels'] == [image[0, 0].tolist(), image[119, 159].tolist()], "Pixels read at [x, y]",
+          f"Unexpected pixels: {result['pixels']}")
+    check(result['matches'][0] and result['all_match'] == all(result['matches']), "Expected colours compared",
+          f"Unexpected matches: {result}")
+    for points in ([[0.5, 1e30]], [[1.9, 2]], [[10 ** 30, 1]], [[True, 1]], [[160, 0]], [[1, 2, 3]], []):
+        try:
+            read_pixels(image, points)
+            error = None
+        except ValueError as e:
+            error = e
+        check(error is not None, f"{points} rejected: {error}", f"{points} accepted")
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Frame Analysis Test Script (random frames)", [
+        test_match_known_offset,
+        test_non_maximum_suppression,
+        test_template_validation,
+        test_read_pixels,
+    ], 'analysis tests'))
@@ -0,0 +1,126 @@
+"""Test frame_history.py with random frames under a small memory cap.
+
+Runs without X: frames are numpy arrays fed straight to append(). Every
+frame still listed by the history must read back exactly as recorded, in
+any order, while the byte cap forces wrap-around and keyframe eviction.
+"""
+import sys
+
+import numpy as np
+
+from capture import Frame
+from checks import check, run_tests
+from frame_history import FrameHistory
+
+HEIGHT, WIDTH = 40, 60
+FRAME_BYTES = HEIGHT * WIDTH * 3
+
+
+def _frames(count, seed=7):
+    """Frames that mostly change a band of rows, with some static and some full-noise frames"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    for seq in range(1, count + 1):
+        pixels = pixels.copy()
+        kind = rng.integers(0, 10)
+        if kind == 0:
+            pixels = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+        elif kind > 2:
+            first = int(rng.integers(0, HEIGHT - 1))
+            stop = int(rng.integers(first + 1, HEIGHT + 1))
+            pixels[first:stop] = rng.integers(0, 256, (stop - first, WIDTH, 3), dtype=np.uint8)
+        yield Frame(seq, 1000.0 + seq / 10.0, float(seq), pixels, 1.0)
+
+
+def _check_layout(history):
+    """Live blobs fit the buffer without overlapping, and the oldest entry can be decoded"""
+    entries = list(history._entries)
+    if not entries:
+        return None
+    spans = sorted((entry.offset, entry.offset + entry.length) for entry in entries)
+    if spans[-1][1] > history.max_bytes:
+        return f'blob ends at {spans[-1][1]}, past max_bytes {history.max_bytes}'
+    for (_, end), (start, _) in zip(spans, spans[1:]):
+        if start < end:
+            return f'blobs overlap: {spans}'
+    if not entries[0].keyframe:
+        return f'oldest entry {entries[0].seq} is a delta without its keyframe'
+    return None
+
+
+def _run(history, count, rng):
+    recorded = {}
+    mismatched, layout_errors = [], []
+    for frame in _frames(count):
+        history.append(frame)
+        recorded[frame.seq] = frame.pixels
+        error = _check_layout(history)
+        if error:
+            layout_errors.append(f'after frame {frame.seq}: {error}')
+        # Read back every live frame in random order, so decoding continues
+        # from the last rebuilt frame forwards, backwards and across keyframes
+        for seq in rng.permutation(history.sequences()):
+            read = history.get(int(seq))
+            if read is None or not np.array_equal(read.pixels, recorded[int(seq)]):
+                mismatched.append((frame.seq, int(seq)))
+    return mismatched, layout_errors
+
+
+def test_delta_ring_buffer():
+    print("\n=== Testing Delta Mode ===")
+    history = FrameHistory(max_frames=40, max_bytes=FRAME_BYTES * 6, compression='delta', keyframe_interval=5)
+    mismatched, layout_errors = _run(history, 300, np.random.default_rng(1))
+    stats = history.stats()
+    check(not layout_errors, f"Buffer layout consistent over 300 frames ({stats['frames']} live)",
+          f"Layout errors: {layout_errors[:3]}")
+    check(not mismatched, "Every live frame read back exactly after each append",
+          f"{len(mismatched)} mismatches (after frame, frame read): {mismatched[:5]}")
+    check(stats['frames'] < history.max_frames and stats['bytes_used'] <= history.max_bytes,
+          f"Byte cap evicted frames: {stats['frames']} frames in {stats['bytes_used']} bytes",
+          f"Byte cap not enforced: {stats}")
+    check(stats['newest_sequence'] == 300 and history.get(stats['oldest_sequence'] - 1) is None,
+          "Newest frame kept, evicted frames return None", f"Unexpected range: {stats}")
+
+
+def test_delta_frame_count_cap():
+    print("\n=== Testing Delta Mode Frame Cap ===")
+    history = FrameHistory(max_frames=12, max_bytes=FRAME_BYTES * 100, compression='delta', keyframe_interval=4)
+    mismatched, layout_errors = _run(history, 100, np.random.default_rng(2))
+    stats = history.stats()
+    check(not layout_errors and not mismatched, "Frames read back exactly with the frame cap binding",
+          f"Layout errors {layout_errors[:3]}, mismatches {mismatched[:5]}")
+    check(stats['frames'] <= 12 and stats['newest_sequence'] == 100, f"{stats['frames']} of at most 12 frames kept",
+          f"Frame cap not enforced: {stats}")
+
+
+def test_raw_ring_buffer():
+    print("\n=== Testing Raw Mode ===")
+    history = FrameHistory(max_frames=40, max_bytes=FRAME_BYTES * 5 + 100, compression='raw')
+    mismatched, layout_errors = _run(history, 60, np.random.default_rng(3))
+    check(not layout_errors and not mismatched, "Every live frame read back exactly after each append",
+          f"Layout errors {layout_errors[:3]}, mismatches {mismatched[:5]}")
+    check(history.sequences() == list(range(56, 61)), "Byte cap holds the last 5 frames",
+          f"Live frames: {history.sequences()}")
+
+
+def test_oversized_frame_skipped():
+    print("\n=== Testing Frame Larger Than The Buffer ===")
+    history = FrameHistory(max_frames=10, max_bytes=FRAME_BYTES // 4, compression='delta')
+    noise = np.random.default_rng(4).integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    history.append(Frame(1, 1000.0, 1.0, noise, 1.0))
+    check(history.frames_skipped == 1 and history.sequences() == [], "Incompressible frame skipped",
+          f"skipped={history.frames_skipped}, live={history.sequences()}")
+    flat = np.zeros_like(noise)
+    history.append(Frame(2, 1000.1, 2.0, flat, 1.0))
+    read = history.get(2)
+    check(read is not None and np.array_equal(read.pixels, flat), "Next frame recorded as a keyframe",
+          f"Frame 2 not readable: {history.stats()}")
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Frame History Test Script (random frames)", [
+        test_delta_ring_buffer,
+        test_delta_frame_count_cap,
+        test_raw_ring_buffer,
+        test_oversized_frame_skipped,
+    ], 'history tests'))
@@ -0,0 +1,97 @@
+"""Test the WebSocket delta encoding in frame_stream.py offline.
+
+Encodes the dirty rectangles between two frames, decodes the message the
+way a consumer would and re-applies the rectangles to the previous frame,
+which must then equal the new frame exactly (raw and PNG are lossless).
+"""
+import io
+import sys
+
+import numpy as np
+from PIL import Image
+
+from checks import check, run_tests
+from frame_stream import decode_delta, dirty_rects, encode_delta
+
+# Not a multiple of the tile size, so edge tiles are clipped
+WIDTH, HEIGHT, TILE = 150, 100, 16
+
+
+def _frames(seed=1):
+    rng = np.random.default_rng(seed)
+    previous = rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    current = previous.copy()
+    # Two horizontally adjacent tiles, a block spanning three tile rows, the
+    # bottom-right corner and a single pixel
+    current[5:20, 20:60] = 0
+    current[40:80, 100:110] = 255
+    current[95:, 140:] = 7
+    current[50, 3] ^= 1
+    return previous, current
+
+
+def _apply(previous, message):
+    header, rects = decode_delta(message)
+    result = previous.copy()
+    for x, y, w, h, encoding, payload in rects:
+        if encoding == 'raw':
+            region = np.frombuffer(payload, dtype=np.uint8).reshape(h, w, 3)
+        else:
+            region = np.asarray(Image.open(io.BytesIO(payload)).convert('RGB'))
+        result[y:y + h, x:x + w] = region
+    return header, rects, result
+
+
+def test_dirty_rects():
+    print("\n=== Testing Dirty Rectangles ===")
+    previous, current = _frames()
+    rects = dirty_rects(previous, current, TILE)
+    check(all(x + w <= WIDTH and y + h <= HEIGHT for x, y, w, h in rects), "Edge rects clipped to the frame",
+          f"Rects extend past {WIDTH}x{HEIGHT}: {rects}")
+    covered = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    for x, y, w, h in rects:
+        covered[y:y + h, x:x + w] = True
+    changed = np.any(previous != current, axis=2)
+    check(not (changed & ~covered).any(), f"{len(rects)} rects cover every changed pixel",
+          f"Changed pixels outside the rects: {np.argwhere(changed & ~covered)[:5].tolist()}")
+    check(covered.sum() < WIDTH * HEIGHT / 2, f"Rects cover {covered.sum()} of {WIDTH * HEIGHT} pixels")
+    check((16, 0, 48, 32) in rects, "Adjacent dirty tiles merged into one rect",
+          f"Expected (16, 0, 48, 32) in {rects}")
+    check((96, 32, 16, 48) in rects, "Same-span runs in consecutive tile rows merged",
+          f"Expected (96, 32, 16, 48) in {rects}")
+    check(dirty_rects(previous, previous.copy(), TILE) == [], "Unchanged frame has no rects")
+    check(dirty_rects(None, current, TILE) == [(0, 0, WIDTH, HEIGHT)], "No previous frame means the whole frame")
+
+
+def test_delta_round_trip():
+    print("\n=== Testing Delta Round Trip ===")
+    previous, current = _frames()
+    rects = dirty_rects(previous, current, TILE)
+    for encoding in ('raw', 'png'):
+        message = encode_delta(current, rects, 2 ** 32 + 5, 123.5, encoding=encoding)
+        header, decoded, result = _apply(previous, message)
+        check(header == {'version': 1, 'keyframe': False, 'seq': 5, 'timestamp': 123.5,
+                         'width': WIDTH, 'height': HEIGHT},
+              f"{encoding}: header decoded (seq wrapped to 32 bits)", f"{encoding}: unexpected header {header}")
+        check([rect[:4] for rect in decoded] == rects, f"{encoding}: {len(rects)} rects decoded in order",
+              f"{encoding}: decoded {[rect[:4] for rect in decoded]}, sent {rects}")
+        check(np.array_equal(result, current), f"{encoding}: previous frame + delta equals the new frame",
+              f"{encoding}: {int(np.any(result != current, axis=2).sum())} pixels differ")
+
+
+def test_keyframe():
+    print("\n=== Testing Keyframe ===")
+    _, current = _frames(seed=2)
+    message = encode_delta(current, dirty_rects(None, current, TILE), 1, 0.0, encoding='png', keyframe=True)
+    header, rects, result = _apply(np.zeros_like(current), message)
+    check(header['keyframe'] and len(rects) == 1, "Keyframe flag set with one full-frame rect",
+          f"Unexpected keyframe: {header}, {len(rects)} rects")
+    check(np.array_equal(result, current), "Keyframe alone reproduces the frame")
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Frame Stream Delta Test Script (offline)", [
+        test_dirty_rects,
+        test_delta_round_trip,
+        test_keyframe,
+    ], 'delta tests'))
@@ -0,0 +1,117 @@
+"""Test gateway.py fan-out against fake instance APIs.
+
+Starts a few in-process stand-ins for api.py (one of them deliberately slow)
+and checks broadcast, targeted input, gathers and per-instance timeouts.
+"""
+import asyncio
+import base64
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from checks import check, run_tests
+from gateway import InstanceRegistry, create_app
+
+SLOW_INSTANCE = 3
+
+
+def fake_instance_app(instance_id, received):
+    async def send_key(request):
+        body = await request.json()
+        received.append((instance_id, time.monotonic(), body))
+        if instance_id == SLOW_INSTANCE:
+            await asyncio.sleep(2)
+        return web.json_response({'status': 'success', 'key': body.get('key')})
+
+    async def snapshot_info(request):
+        return web.json_response({'service_healthy': True, 'sequence': instance_id * 10})
+
+    async def desktop_snapshot(request):
+        response = web.Response(body=f'frame-{instance_id}'.encode(), content_type='image/png')
+        response.headers['X-Snapshot-Sequence'] = str(instance_id * 10)
+        response.headers['X-Snapshot-Format'] = request.query.get('format', 'png')
+        return response
+
+    app = web.Application()
+    app.router.add_post('/send-key', send_key)
+    app.router.add_get('/snapshot-info', snapshot_info)
+    app.router.add_get('/desktop-snapshot', desktop_snapshot)
+    return app
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+async def _fan_out():
+    received = []
+    runners, urls = [], {}
+    for instance_id in range(1, 5):
+        runner, url = await _serve(fake_instance_app(instance_id, received))
+        runners.append(runner)
+        urls[instance_id] = url
+    gateway_runner, gateway_url = await _serve(create_app(InstanceRegistry(urls)))
+    runners.append(gateway_runner)
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            print("\n=== Testing Broadcast ===")
+            async with session.post(f'{gateway_url}/broadcast/send-key', params={'timeout': 0.5},
+                                    json={'key': 'space'}) as response:
+                summary = await response.json()
+            results = {result['instance']: result for result in summary['results']}
+            arrival = [t for _, t, _ in received]
+            spread_ms = (max(arrival) - min(arrival)) * 1000.0
+            check(summary['succeeded'] == 3 and 'timeout' in results[SLOW_INSTANCE].get('error', ''),
+                  f"3 instances answered, slow instance {SLOW_INSTANCE} timed out: "
+                  f"{results[SLOW_INSTANCE].get('error')}",
+                  f"Unexpected broadcast summary: {summary}")
+            check(len(received) == 4 and spread_ms < 100,
+                  f"All 4 instances received the key within {spread_ms:.1f}ms of each other",
+                  f"Received {len(received)} requests spread over {spread_ms:.1f}ms")
+
+            print("\n=== Testing Targeted Input ===")
+            received.clear()
+            async with session.post(f'{gateway_url}/instances/1,4/send-key', json={'key': 'w'}) as response:
+                summary = await response.json()
+            check(sorted(i for i, _, _ in received) == [1, 4] and summary['succeeded'] == 2,
+                  "Only instances 1 and 4 received the key",
+                  f"Targeted send reached {sorted(i for i, _, _ in received)}")
+            async with session.post(f'{gateway_url}/instances/9/send-key', json={'key': 'w'}) as response:
+                body = await response.json()
+            check(response.status == 400, f"Unknown instance rejected: {body.get('error')}",
+                  f"Unknown instance returned {response.status}")
+
+            print("\n=== Testing Gather ===")
+            async with session.get(f'{gateway_url}/gather/snapshot-info') as response:
+                summary = await response.json()
+            sequences = [result['response']['sequence'] for result in summary['results']]
+            check(sequences == [10, 20, 30, 40],
+                  f"Gathered snapshot-info from 4 instances in {summary['elapsed_ms']}ms",
+                  f"Unexpected snapshot-info gather: {summary}")
+            async with session.get(f'{gateway_url}/gather/desktop-snapshot',
+                                   params={'format': 'jpeg', 'instances': '2-3'}) as response:
+                summary = await response.json()
+            frames = [base64.b64decode(result['data']) for result in summary['results']]
+            formats = [result['headers']['X-Snapshot-Format'] for result in summary['results']]
+            check(frames == [b'frame-2', b'frame-3'] and formats == ['jpeg', 'jpeg'],
+                  "Gathered snapshots from instances 2-3 with query parameters passed through",
+                  f"Unexpected snapshot gather: {frames} {formats}")
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def test_fan_out():
+    asyncio.run(_fan_out())
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Fan-out Gateway Test Script (fake instances)", [test_fan_out], 'gateway tests'))
@@ -0,0 +1,132 @@
+"""Test input_scheduler.py against a recording fake input backend.
+
+Runs without X: the primitives handed to InputScheduler only record the
+events they would send, and can be told to fail on a given call.
+"""
+import sys
+import threading
+import time
+
+from checks import check, run_tests
+from input_scheduler import InputScheduler
+
+
+class FakeBackend:
+    """Records input events; fail[name] = n makes the nth call of name raise OSError"""
+
+    def __init__(self):
+        self.events = []
+        self.calls = {}
+        self.fail = {}
+        self.lock = threading.Lock()
+
+    def _record(self, name, *args):
+        with self.lock:
+            count = self.calls[name] = self.calls.get(name, 0) + 1
+            if self.fail.get(name) == count:
+                raise OSError(f'{name} failed')
+            self.events.append((name,) + args)
+
+    def scheduler(self):
+        return InputScheduler(
+            key_down=lambda key: self._record('down', key),
+            key_up=lambda key: self._record('up', key),
+            mouse_down=lambda button: self._record('mouse_down', button),
+            mouse_up=lambda button: self._record('mouse_up', button),
+            move_to=lambda x, y: self._record('move', x, y),
+        )
+
+
+def _wait(action, timeout=2.0):
+    return action.done.wait(timeout)
+
+
+def test_repeated_key_is_pressed_again():
+    print("\n=== Testing Repeated Key Presses ===")
+    backend = FakeBackend()
+    scheduler = backend.scheduler()
+    actions = [scheduler.hold_key(key, 100) for key in 'hello']
+    for action in actions:
+        _wait(action)
+    keys = [event for event in backend.events if event[0] in ('down', 'up')]
+    presses = ''.join(key for name, key in keys if name == 'down')
+    check(presses == 'hello', f"Every call pressed its key: downs {presses!r}",
+          f"Expected downs 'hello', got {presses!r} from {keys}")
+    check(keys[3:5] == [('up', 'l'), ('down', 'l')], "Second 'l' released and pressed the held key again",
+          f"Unexpected events around the second 'l': {keys}")
+    check(scheduler.status()['held_keys'] == [] and keys[-1][0] == 'up',
+          "Every key released after the last hold expired", f"Keys left held: {scheduler.status()}")
+
+
+def test_failed_key_up_stays_tracked():
+    print("\n=== Testing Failed Key Release ===")
+    backend = FakeBackend()
+    backend.fail['up'] = 1
+    scheduler = backend.scheduler()
+    action = scheduler.hold_key('w', 20)
+    _wait(action)
+    check(action.state == 'failed' and scheduler.status()['held_keys'] == ['w'],
+          "Key whose release failed is still listed as held",
+          f"state={action.state}, status={scheduler.status()}")
+    released = scheduler.release_all()
+    check(released['released_keys'] == ['w'] and backend.events[-1] == ('up', 'w')
+          and scheduler.status()['held_keys'] == [],
+          "/release-all released it", f"release_all: {released}, events: {backend.events}")
+
+
+def test_failed_drag_releases_button():
+    print("\n=== Testing Failed Drag ===")
+    backend = FakeBackend()
+    # The start move is call 1; call 4 is the third intermediate move
+    backend.fail['move'] = 4
+    scheduler = backend.scheduler()
+    action = scheduler.drag(0, 0, 100, 100, 0.2, 'left')
+    _wait(action)
+    time.sleep(0.05)
+    check(action.state == 'failed' and backend.events[-1] == ('mouse_up', 'left'),
+          f"Failed drag released the button: {action.to_dict().get('error')}",
+          f"state={action.state}, events={backend.events}")
+    check(scheduler.status()['held_buttons'] == [], "No button left held",
+          f"Still held: {scheduler.status()['held_buttons']}")
+    again = scheduler.drag(0, 0, 10, 10, 0.05, 'left')
+    check(_wait(again) and again.state == 'completed', "Next drag on the same button completes",
+          f"Next drag: {again.to_dict()}")
+
+
+def test_unplannable_drag_never_presses():
+    print("\n=== Testing Unplannable Drag ===")
+    backend = FakeBackend()
+    scheduler = backend.scheduler()
+    try:
+        scheduler.drag(0, 0, float('nan'), 10, 0.1, 'left')
+        raised = None
+    except ValueError as e:
+        raised = e
+    check(raised is not None and backend.events == [], f"Drag to NaN raised before any input: {raised}",
+          f"raised={raised!r}, events={backend.events}")
+    check(scheduler.status() == {'pending': [], 'held_keys': [], 'held_buttons': []},
+          "Nothing left pending or held", f"Status: {scheduler.status()}")
+
+
+def test_far_deadline_keeps_scheduler_running():
+    print("\n=== Testing Far-Future Deadline ===")
+    backend = FakeBackend()
+    scheduler = backend.scheduler()
+    # Past threading.TIMEOUT_MAX, so an unclamped wait() raises OverflowError
+    stuck = scheduler.hold_key('a', 1e300)
+    time.sleep(0.05)
+    action = scheduler.hold_key('w', 20)
+    check(_wait(action) and action.state == 'completed', "Later hold released on time",
+          f"Later hold: {action.to_dict()}")
+    check(stuck.state == 'pending', "Far-future hold still pending", f"Far-future hold: {stuck.to_dict()}")
+    scheduler.release_all()
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Input Scheduler Test Script (fake backend)", [
+        test_repeated_key_is_pressed_again,
+        test_failed_key_up_stays_tracked,
+        test_failed_drag_releases_button,
+        test_unplannable_drag_never_presses,
+        test_far_deadline_keeps_scheduler_running,
+    ], 'scheduler tests'))
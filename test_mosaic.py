@@ -0,0 +1,193 @@
+"""Test the fleet mosaic (mosaic.py, served by gateway.py) against fake instance APIs.
+
+Fake instances serve solid-colour raw frames with a sequence number the
+test moves forward, so it can check which instances the mosaic fetches
+again and what ends up in every tile.
+"""
+import asyncio
+import io
+import sys
+import time
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+from PIL import Image
+
+from checks import check, run_tests
+from gateway import MOSAIC_KEY, InstanceRegistry, create_app
+from mosaic import LABEL_HEIGHT, MosaicCanvas
+
+FRAME_SIZE = (640, 400)
+COLORS = {1: (200, 30, 30), 2: (30, 200, 30), 3: (30, 30, 200), 4: (200, 200, 30)}
+
+
+class FakeInstance:
+    def __init__(self, instance_id):
+        self.instance_id = instance_id
+        self.color = COLORS[instance_id]
+        self.sequence = 1
+        self.healthy = True
+        self.down = False
+        self.snapshots = []  # query of every /desktop-snapshot request
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/snapshot-info', self.snapshot_info)
+        app.router.add_get('/desktop-snapshot', self.desktop_snapshot)
+        return app
+
+    async def snapshot_info(self, request):
+        if self.down:
+            await asyncio.sleep(1)
+        width, height = FRAME_SIZE
+        return web.json_response({
+            'service_healthy': self.healthy, 'snapshot_available': True, 'sequence': self.sequence,
+            'age_seconds': 0.1 if self.healthy else 9.0, 'frame': {'width': width, 'height': height},
+        }, status=200 if self.healthy else 503)
+
+    async def desktop_snapshot(self, request):
+        self.snapshots.append(dict(request.query))
+        scale = float(request.query.get('scale', 1))
+        width, height = (max(1, round(size * scale)) for size in FRAME_SIZE)
+        etag = f'"{self.sequence}-raw-s{scale:g}"'
+        headers = {'ETag': etag, 'X-Snapshot-Sequence': str(self.sequence),
+                   'X-Snapshot-Width': str(width), 'X-Snapshot-Height': str(height)}
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers=headers)
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[:] = self.color
+        return web.Response(body=frame.tobytes(), content_type='application/octet-stream', headers=headers)
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f'http://127.0.0.1:{runner.addresses[0][1]}'
+
+
+def _tile_color(image, info, instance_id):
+    """Mean colour at the centre of an instance's frame area"""
+    tile = next(tile for tile in info['tiles'] if tile['instance'] == instance_id)
+    x, y, width, height = tile['cell']
+    centre_x, centre_y = x + width // 2, y + LABEL_HEIGHT + (height - LABEL_HEIGHT) // 2
+    return image[centre_y - 5:centre_y + 5, centre_x - 5:centre_x + 5].reshape(-1, 3).mean(axis=0)
+
+
+def _close(color, expected, tolerance=12):
+    return bool(np.all(np.abs(np.asarray(color) - expected) <= tolerance))
+
+
+def test_canvas():
+    print("\n=== Testing Mosaic Canvas ===")
+    canvas = MosaicCanvas(tile_width=100, tile_height=64, columns=0)
+    canvas.layout([1, 2, 3])
+    check((canvas.columns, canvas.rows) == (2, 2) and canvas.pixels.shape == (130, 202, 3),
+          f"3 instances laid out {canvas.columns}x{canvas.rows} on a {canvas.pixels.shape[1]}x{canvas.pixels.shape[0]} canvas")
+
+    frame = np.zeros((100, 200, 3), dtype=np.uint8)
+    frame[:, 100:] = 255  # right half white
+    canvas.draw_frame(2, frame)
+    x, y = canvas.origin(2)
+    area = canvas.pixels[y + LABEL_HEIGHT:y + 64, x:x + 100]
+    # 200x100 fitted into 100x50: full width, no letterbox; left half black, right half white
+    check(area[:, :50].max() == 0 and area[:, 50:].min() == 255,
+          "Frame resampled into its cell with the aspect ratio kept")
+
+    before = canvas.pixels
+    canvas.layout([2, 3])
+    x, y = canvas.origin(2)
+    moved = canvas.pixels[y + LABEL_HEIGHT:y + 64, x:x + 100]
+    check(canvas.pixels is not before and moved[:, 50:].min() == 255,
+          "Tile kept when the instance set changes")
+
+
+async def _mosaic():
+    fakes = {i: FakeInstance(i) for i in COLORS}
+    runners, urls = [], {}
+    for instance_id, fake in fakes.items():
+        runner, url = await _serve(fake.app())
+        runners.append(runner)
+        urls[instance_id] = url
+    # Long interval: the test drives refreshes itself
+    app = create_app(InstanceRegistry(urls), mosaic_options={
+        'canvas': MosaicCanvas(tile_width=160, tile_height=114), 'interval_ms': 60000, 'timeout': 0.3})
+    gateway_runner, gateway_url = await _serve(app)
+    runners.append(gateway_runner)
+    mosaic = app[MOSAIC_KEY]
+
+    async def fetch(session, etag=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        async with session.get(f'{gateway_url}/mosaic', headers=headers) as response:
+            body = await response.read()
+            image = np.asarray(Image.open(io.BytesIO(body)).convert('RGB')) if response.status == 200 else None
+            return response.status, response.headers.get('ETag'), image
+
+    async def info(session):
+        async with session.get(f'{gateway_url}/mosaic/info') as response:
+            return await response.json()
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            print("\n=== Testing Fleet Mosaic ===")
+            started = time.monotonic()
+            status, etag, image = await fetch(session)
+            elapsed_ms = (time.monotonic() - started) * 1000.0
+            state = await info(session)
+            colors_ok = all(_close(_tile_color(image, state, i), COLORS[i]) for i in COLORS)
+            check(status == 200 and image.shape == (state['height'], state['width'], 3) and colors_ok,
+                  f"First /mosaic: {state['width']}x{state['height']} JPEG of 4 tiles in {elapsed_ms:.0f}ms")
+            scales = {fake.snapshots[0]['scale'] for fake in fakes.values()}
+            check(scales == {'0.25'} and all(f.snapshots[0]['format'] == 'raw' for f in fakes.values()),
+                  f"Frames requested raw at the tile scale: {scales}")
+            labels = {tile['instance']: tile['status'] for tile in state['tiles']}
+            check(set(labels.values()) == {'healthy'}, f"Tiles labelled: {labels}")
+
+            await mosaic.refresh()
+            status, _, _ = await fetch(session, etag)
+            state = await info(session)
+            check(status == 304 and state['last_refresh']['requested'] == 0
+                  and all(len(fake.snapshots) == 1 for fake in fakes.values()),
+                  f"Unchanged fleet: nothing fetched, 304 for the same ETag ({state['last_refresh']})")
+
+            fakes[2].color = (250, 250, 250)
+            fakes[2].sequence += 1
+            fakes[3].healthy = False
+            await mosaic.refresh()
+            status, etag, image = await fetch(session, etag)
+            state = await info(session)
+            labels = {tile['instance']: tile['status'] for tile in state['tiles']}
+            check(status == 200 and state['last_refresh']['fetched'] == 1
+                  and [len(fake.snapshots) for fake in fakes.values()] == [1, 2, 1, 1]
+                  and _close(_tile_color(image, state, 2), (250, 250, 250)),
+                  f"Only the changed instance refetched and retiled ({state['last_refresh']})")
+            check(labels[3] == 'stale', f"Old frame on instance 3 labelled {labels[3]}")
+
+            fakes[4].down = True
+            await mosaic.refresh()
+            status, etag, image = await fetch(session, etag)
+            state = await info(session)
+            tile = next(tile for tile in state['tiles'] if tile['instance'] == 4)
+            dimmed = _tile_color(image, state, 4)
+            check(tile['status'] == 'down' and 'timeout' in tile['error']
+                  and np.all(dimmed < np.asarray(COLORS[4]) / 2 + 12),
+                  f"Unreachable instance 4 dimmed and labelled down: {tile['error']}")
+
+            fakes[4].down = False
+            await mosaic.refresh()
+            state = await info(session)
+            check(state['last_refresh']['fetched'] == 1 and len(fakes[4].snapshots) == 2,
+                  "Recovered instance fetched again")
+    finally:
+        for runner in reversed(runners):
+            await runner.cleanup()
+
+
+def test_mosaic():
+    asyncio.run(_mosaic())
+
+
+if __name__ == "__main__":
+    sys.exit(run_tests("Fleet Mosaic Test Script (fake instances)", [test_canvas, test_mosaic], 'mosaic tests'))
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""Golden Wine prefix templates shared by all instances.
+
+init-wine.sh builds the configured prefix (wineboot, Mono, Gecko, winecfg,
+registry import) once per set of inputs and stores it under
+WINE_TEMPLATE_DIR/<key>. The key is a hash of everything that shapes the
+prefix: the Wine version, the MSI packages, the registry settings, the
+build script itself and the prefix settings. When any of them changes the
+key changes, so the next container start builds a new template.
+
+New instance prefixes are cloned from the template in one process:
+
+  reflink    copy-on-write clones (FICLONE) where the filesystem supports
+             them, otherwise an in-kernel copy
+  hardlink   hard links for the Windows system files (DLLs are not modified
+             in place), reflink/copy for everything else; needs the template
+             and the prefix on the same mount
+  copy       plain copies
+
+Usage:
+  python3 wine_template.py key                      # print the current template key
+  python3 wine_template.py inputs                   # show the inputs behind the key
+  python3 wine_template.py clone TEMPLATE PREFIX [--method reflink]
+  python3 wine_template.py prune KEEP_KEY           # remove templates for other keys
+"""
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+TEMPLATE_DIR = os.environ.get('WINE_TEMPLATE_DIR', '/opt/wine-template')
+CLONE_METHOD = os.environ.get('WINE_TEMPLATE_CLONE', 'reflink')
+CLONE_METHODS = ('reflink', 'hardlink', 'copy')
+
+# Files whose contents shape the prefix
+MSI_PACKAGES = (
+    '/usr/share/wine/mono/wine-mono-7.4.0-x86.msi',
+    '/usr/share/wine/gecko/wine-gecko-2.47.3-x86.msi',
+    '/usr/share/wine/gecko/wine-gecko-2.47.3-x86_64.msi',
+)
+REGISTRY_FILE = os.environ.get('WINE_REGISTRY_FILE', '/opt/wine-prefix.reg')
+BUILD_SCRIPT = os.environ.get('WINE_BUILD_SCRIPT', '/opt/init-wine.sh')
+# Environment the build runs with
+PREFIX_SETTINGS = ('WINEARCH', 'WINEDLLOVERRIDES', 'WINE_WINDOWS_VERSION')
+
+# Marker written last, so a half-built template is never cloned
+COMPLETE_MARKER = '.template-complete'
+# Written into each cloned prefix to record which template it came from
+PREFIX_MARKER = '.template-key'
+
+# Relative paths that may be hard-linked in hardlink mode
+_HARDLINK_PREFIX = os.path.join('drive_c', 'windows') + os.sep
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def template_inputs():
+    """Everything the template depends on, as a JSON-serializable dict"""
+    try:
+        wine_version = subprocess.run(['wine', '--version'], capture_output=True, text=True,
+                                      check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        wine_version = None
+    files = {}
+    for path in MSI_PACKAGES + (REGISTRY_FILE, BUILD_SCRIPT):
+        files[path] = _file_digest(path) if os.path.exists(path) else None
+    return {
+        'wine_version': wine_version,
+        'files': files,
+        'settings': {name: os.environ.get(name) for name in PREFIX_SETTINGS},
+    }
+
+
+def template_key(inputs=None):
+    inputs = inputs or template_inputs()
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# Cloning ------------------------------------------------------------------
+
+class _Cloner:
+    def __init__(self, method):
+        if method not in CLONE_METHODS:
+            raise ValueError(f'clone method must be one of: {", ".join(CLONE_METHODS)}')
+        self.method = method
+        # Cleared after the first refusal so the rest of the tree skips the attempt
+        self.can_reflink = method in ('reflink', 'hardlink')
+        self.can_hardlink = method == 'hardlink'
+        self.counts = {'files': 0, 'bytes': 0, 'reflinked': 0, 'hardlinked': 0, 'copied': 0,
+                       'symlinks': 0, 'dirs': 0}
+
+    def _reflink(self, source, target):
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return True
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM):
+                    raise
+                self.can_reflink = False
+                return False
+
+    def file(self, source, target, rel, st):
+        self.counts['files'] += 1
+        self.counts['bytes'] += st.st_size
+        if self.can_hardlink and rel.startswith(_HARDLINK_PREFIX):
+            try:
+                os.link(source, target)
+                self.counts['hardlinked'] += 1
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+                self.can_hardlink = False
+        if self.can_reflink and self._reflink(source, target):
+            self.counts['reflinked'] += 1
+        else:
+            # copyfile uses sendfile/copy_file_range, so data stays in the kernel
+            shutil.copyfile(source, target)
+            self.counts['copied'] += 1
+        shutil.copystat(source, target)
+
+
+def clone(template, prefix, method=CLONE_METHOD):
+    """Copy the template tree into prefix (which may exist but should be empty)"""
+    started = time.monotonic()
+    cloner = _Cloner(method)
+    directories = []
+    for root, dirs, files in os.walk(template):
+        rel_root = os.path.relpath(root, template)
+        target_root = prefix if rel_root == '.' else os.path.join(prefix, rel_root)
+        os.makedirs(target_root, exist_ok=True)
+        directories.append((root, target_root))
+        cloner.counts['dirs'] += 1
+        for name in dirs + files:
+            if rel_root == '.' and name == COMPLETE_MARKER:
+                continue
+            source = os.path.join(root, name)
+            target = os.path.join(target_root, name)
+            rel = name if rel_root == '.' else os.path.join(rel_root, name)
+            st = os.lstat(source)
+            if os.path.islink(source):
+                # dosdevices/c: -> ../drive_c etc. stay relative
+                os.symlink(os.readlink(source), target)
+                cloner.counts['symlinks'] += 1
+                if name in dirs:
+                    dirs.remove(name)
+            elif name in files:
+                cloner.file(source, target, rel, st)
+    # Directory times last, after their contents were written
+    for source, target in reversed(directories):
+        shutil.copystat(source, target)
+    result = {'method': method, 'seconds': round(time.monotonic() - started, 3)}
+    result.update(cloner.counts)
+    return result
+
+
+def prune(template_dir, keep):
+    """Remove templates (and abandoned builds) other than keep"""
+    removed = []
+    for name in os.listdir(template_dir):
+        path = os.path.join(template_dir, name)
+        if name == keep or name.startswith('.') or not os.path.isdir(path):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('key', help='print the key of the template the current inputs produce')
+    subparsers.add_parser('inputs', help='print the inputs behind the key as JSON')
+    clone_parser = subparsers.add_parser('clone', help='clone a template into a prefix')
+    clone_parser.add_argument('template')
+    clone_parser.add_argument('prefix')
+    clone_parser.add_argument('--method', choices=CLONE_METHODS, default=CLONE_METHOD,
+                              help=f'WINE_TEMPLATE_CLONE (default: {CLONE_METHOD})')
+    prune_parser = subparsers.add_parser('prune', help='remove templates built for other inputs')
+    prune_parser.add_argument('keep')
+    prune_parser.add_argument('--template-dir', default=TEMPLATE_DIR)
+    args = parser.parse_args(argv)
+
+    if args.command == 'key':
+        print(template_key())
+    elif args.command == 'inputs':
+        inputs = template_inputs()
+        print(json.dumps({'key': template_key(inputs), 'inputs': inputs}, indent=2))
+    elif args.command == 'clone':
+        if not os.path.exists(os.path.join(args.template, COMPLETE_MARKER)):
+            sys.exit(f'ERROR: {args.template} is not a complete template')
+        result = clone(args.template, args.prefix, args.method)
+        with open(os.path.join(args.prefix, PREFIX_MARKER), 'w') as f:
+            f.write(os.path.basename(os.path.normpath(args.template)) + '\n')
+        print(f"Cloned {result['files']} files ({result['bytes'] / 1048576:.1f} MiB) in {result['seconds']:.2f}s: "
+              f"{result['reflinked']} reflinked, {result['hardlinked']} hard-linked, {result['copied']} copied")
+    elif args.command == 'prune':
+        for name in prune(args.template_dir, args.keep):
+            print(f"Removed outdated Wine template {name}")
+
+
+if __name__ == '__main__':
+    main()